@@ -0,0 +1,53 @@
+"""
+Comandos de manutenção executados fora do servidor web.
+
+Uso:
+  python -m app.cli backfill-reports --from 2026-01-01 --to 2026-03-31 [--instance 1] [--force] [--summarize]
+"""
+
+import argparse
+import json
+import logging
+import sys
+from datetime import date
+
+from app.core.database import create_tables, run_migrations
+
+
+def _backfill_reports(args: argparse.Namespace) -> int:
+    from app.services import report_service
+
+    result = report_service.backfill_reports(
+        start=args.start,
+        end=args.end,
+        instance_ids=[args.instance] if args.instance else None,
+        force=args.force,
+        summarize=args.summarize,
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    return 0 if result.get("status") == "ok" else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Comandos de manutenção do BeaZap")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backfill = sub.add_parser("backfill-reports", help="Reconstrói as agregações de relatório de um intervalo de datas")
+    backfill.add_argument("--from", dest="start", type=date.fromisoformat, required=True, help="data inicial (YYYY-MM-DD)")
+    backfill.add_argument("--to", dest="end", type=date.fromisoformat, default=date.today(), help="data final (YYYY-MM-DD, padrão: hoje)")
+    backfill.add_argument("--instance", type=int, default=None, help="id da instância (padrão: todas as ativas)")
+    backfill.add_argument("--force", action="store_true", help="reagrega mesmo semanas sem alteração na origem")
+    backfill.add_argument("--summarize", action="store_true", help="gera também os resumos LLM das semanas reagregadas")
+    backfill.set_defaults(func=_backfill_reports)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "start", None) and args.end < args.start:
+        parser.error("--to deve ser maior ou igual a --from")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    create_tables()
+    run_migrations()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
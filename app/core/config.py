@@ -14,12 +14,104 @@ class Settings(BaseSettings):
 
     EVOLUTION_API_URL: str = ""
     EVOLUTION_API_KEY: str = ""
+    EVOLUTION_TIMEOUT_SECONDS: float = 20  # timeout padrão das chamadas à Evolution API
+    EVOLUTION_CONNECT_TIMEOUT_SECONDS: float = 5
+    EVOLUTION_MAX_CONNECTIONS: int = 20  # conexões keep-alive por api_url
+    EVOLUTION_HTTP2: bool = True  # usa HTTP/2 se o pacote h2 estiver instalado
+    EVOLUTION_MAX_RETRIES: int = 2  # novas tentativas em erro de transporte/5xx (backoff com jitter)
+    EVOLUTION_RETRY_BACKOFF_SECONDS: float = 0.5
+    EVOLUTION_BREAKER_THRESHOLD: int = 5  # falhas seguidas que abrem o circuito da instância
+    EVOLUTION_BREAKER_RESET_SECONDS: int = 30  # tempo com o circuito aberto antes da chamada de teste
+    OUTBOUND_RATE_PER_MINUTE: float = 20  # envios por minuto por instância (token bucket; 0 = sem limite)
+    OUTBOUND_BURST: int = 5  # rajada máxima por instância
+    OUTBOUND_CONCURRENCY: int = 8  # envios simultâneos no processo (todas as instâncias)
+    OUTBOUND_MAX_ATTEMPTS: int = 5  # tentativas antes de marcar a mensagem como failed
+    OUTBOUND_RETRY_BACKOFF_SECONDS: float = 5  # base do backoff exponencial entre tentativas
+    OUTBOUND_POLL_SECONDS: float = 5  # varredura da fila (novas mensagens acordam o despachante na hora)
+    OUTBOUND_BATCH_SIZE: int = 50  # mensagens reivindicadas por varredura
+    OUTBOUND_CLAIM_TIMEOUT_SECONDS: int = 300  # mensagem presa em "sending" volta para a fila
+    OUTBOUND_DRAIN_SECONDS: int = 10  # espera pelos envios em curso no desligamento
+    OUTBOUND_SEND_WAIT_SECONDS: int = 30  # quanto o console aguarda a entrega antes de responder "na fila"
 
     ANTHROPIC_API_KEY: str = ""
     OPENAI_API_KEY: str = ""
     LLM_PROVIDER: str = "openai"  # "anthropic" ou "openai"
+    LLM_MAX_RETRIES: int = 2  # novas tentativas por chamada LLM (registradas em llm_calls)
+    LLM_CONCURRENCY_ANTHROPIC: int = 4  # chamadas simultâneas por provedor (todas as threads)
+    LLM_CONCURRENCY_OPENAI: int = 8
+    LLM_DAILY_TOKEN_BUDGET: int = 0  # tokens/dia por instância para trabalho de baixa prioridade (0 = sem limite)
+    ANALYSIS_INCREMENTAL: bool = True  # envia só resumo acumulado + mensagens novas
+    ANALYSIS_MAX_INPUT_TOKENS: int = 3000  # orçamento do transcript por chamada de análise
+    ANALYSIS_MAX_WORKERS: int = 2  # análises em background simultâneas (enqueue_analysis)
+    ANALYSIS_QUEUE_LIMIT: int = 500  # análises pendentes na fila; excedentes são descartadas
+
+    REPORT_MAX_WORKERS: int = 8  # resumos LLM de relatório gerados em paralelo
+    REPORT_WATERMARK_OVERLAP_SECONDS: int = 300  # releitura antes do watermark (transações que commitam atrasadas)
+
+    DATABRICKS_MAX_WORKERS: int = 4  # disparos de job vindos do webhook executados em paralelo
+    DATABRICKS_QUEUE_LIMIT: int = 100  # disparos pendentes; excedentes são descartados
+    DATABRICKS_TRIGGER_COOLDOWN_SECONDS: int = 300  # mesmo (telefone, código do cliente) ignorado nessa janela
+    DATABRICKS_DRAIN_SECONDS: int = 20  # espera pelos disparos em andamento no desligamento
+    DATABRICKS_POLLER_ENABLED: bool = True  # acompanha runs pending/running (com várias réplicas, ative em uma só)
+    DATABRICKS_POLL_MIN_SECONDS: float = 5  # intervalo logo após o disparo
+    DATABRICKS_POLL_MAX_SECONDS: float = 120  # teto do intervalo para runs longos
+    DATABRICKS_POLL_AGE_FACTOR: float = 0.1  # intervalo = idade do run x fator (entre mín. e máx.)
+    DATABRICKS_POLL_CONCURRENCY: int = 8  # consultas runs/get simultâneas
+    DATABRICKS_POLL_TIMEOUT_SECONDS: float = 15
+    DATABRICKS_POLL_RESYNC_SECONDS: int = 30  # releitura dos runs ativos no banco (novos disparos acordam na hora)
+    DATABRICKS_DELIVERY_CONCURRENCY: int = 2  # PDFs enviados ao WhatsApp ao mesmo tempo
+    DATABRICKS_DELIVERY_MAX_ATTEMPTS: int = 3  # tentativas de entrega antes de marcar failed
+    DATABRICKS_DELIVERY_MAX_MB: int = 64  # PDFs maiores não são enviados
+    DATABRICKS_DELIVERY_TIMEOUT_SECONDS: float = 120  # upload para a Evolution (sendMedia)
+    TRIGGER_ENGINE_RELOAD_SECONDS: int = 60  # releitura das regras de gatilho (alterações feitas por outro processo)
+
+    SLA_ALERT_MINUTES: int = 30  # prazo de primeira resposta que dispara o evento sla_breach
+    SLA_RESYNC_SECONDS: int = 300  # reconstrução periódica do monitor de SLA a partir do banco
+    SLA_LEADER_TTL_SECONDS: int = 30  # só a réplica líder publica sla_breach; outra assume se ela parar de renovar
+
+    ABANDON_AFTER_MINUTES: int = 1440  # conversa aberta sem mensagens há mais que isso vira abandonada (0 desativa)
+    ABANDON_SWEEP_CHUNK_SIZE: int = 500  # conversas atualizadas por UPDATE no sweeper
+
+    SCHEDULER_ENABLED: bool = True  # agendador interno (iniciado no lifespan)
+    SCHEDULER_TICK_SECONDS: int = 15
+    SCHEDULER_LOCK_TTL_SECONDS: int = 1800  # trava de líder expira se a réplica cair no meio do job
+    SCHEDULER_REPORTS_CRON: str = "0 6 * * 1"  # relatórios semanais (UTC; vazio desativa)
+    SCHEDULER_MAINTENANCE_CRON: str = "30 3 * * *"  # manutenção noturna (UTC; vazio desativa)
+    SCHEDULER_ABANDON_SWEEP_SECONDS: int = 300  # varredura de conversas abandonadas (0 desativa)
+    SCHEDULER_DEFERRED_ANALYSIS_SECONDS: int = 900  # retomada de análises adiadas pelo orçamento de tokens (0 desativa)
+    SCHEDULER_HISTORY_RETENTION_DAYS: int = 30
+    LLM_CALLS_RETENTION_DAYS: int = 90
+
+    EVENTS_QUEUE_SIZE: int = 100  # eventos pendentes por conexão SSE antes de forçar resync
+    EVENTS_REPLAY_BUFFER: int = 500  # eventos guardados por instância para retomada via Last-Event-ID
+    EVENTS_COALESCE_MS: int = 300  # janela de agrupamento de eventos idênticos (groups_updated)
+    EVENT_BUS_BACKEND: str = "memory"  # "memory" (processo único), "redis" ou "postgres" (vários workers)
+    EVENT_BUS_CHANNEL: str = "beazap_events"  # canal pub/sub / LISTEN
+    EVENT_BUS_REORDER_MS: int = 500  # espera por evento fora de ordem antes de declarar lacuna (resync)
+    EVENT_BUS_RECONNECT_MAX_SECONDS: int = 30  # teto do backoff de reconexão
+    EVENT_BUS_PAYLOAD_RETENTION_SECONDS: int = 300  # postgres: eventos maiores que o NOTIFY ficam em event_payloads por esse tempo
+    REDIS_URL: str = "redis://localhost:6381/0"  # porta publicada pelo docker-compose
+    CONSOLE_WS_HEARTBEAT_SECONDS: int = 25  # ping do console WebSocket; sem resposta em 2x o intervalo, fecha
+    CONSOLE_WS_SEND_TIMEOUT_SECONDS: int = 10  # cliente que não consome nesse prazo é desconectado
+    CONSOLE_WS_MAX_SUBSCRIPTIONS: int = 200  # conversas + instâncias por conexão
 
     WEBHOOK_SECRET: str = ""
+    WEBHOOK_DEDUP_MAX_PER_INSTANCE: int = 20000  # evolution_ids recentes em memória por instância
+    WEBHOOK_DEDUP_WARM_HOURS: int = 6  # janela carregada do banco no startup (0 desativa o aquecimento)
+    INGEST_SHARDS: int = 4  # threads de gravação; cada conversa sempre cai no mesmo shard
+    INGEST_SHARD_QUEUE_LIMIT: int = 200  # lotes pendentes por shard antes de responder 503
+    INGEST_DRAIN_SECONDS: int = 10  # espera pelos lotes em andamento no shutdown
+    INGEST_QUEUE_ENABLED: bool = False  # webhook só enfileira; processamento em python -m app.workers.ingest
+    INGEST_QUEUE_PARTITIONS: int = 64  # partições por instância (cada uma atendida por um único worker)
+    INGEST_QUEUE_MAX_ATTEMPTS: int = 5  # tentativas antes de marcar o webhook como failed
+    INGEST_QUEUE_RETRY_BACKOFF_SECONDS: float = 2  # base do backoff exponencial entre tentativas
+    INGEST_QUEUE_CLAIM_TIMEOUT_SECONDS: int = 300  # webhook preso em "processing" volta para a fila
+    INGEST_WORKERS: int = 0  # processos de ingestão (0 = um por núcleo)
+    INGEST_WORKER_BATCH_SIZE: int = 50  # webhooks reivindicados por varredura
+    INGEST_WORKER_POLL_SECONDS: float = 0.5  # espera com a fila vazia
+    INGEST_WORKER_METRICS_SECONDS: int = 10  # intervalo de publicação das métricas em ingest_workers
+    INGEST_WORKER_RESTART_BACKOFF_SECONDS: float = 1  # base do backoff exponencial ao reiniciar um worker que caiu
+    INGEST_WORKER_RESTART_MAX_SECONDS: float = 60  # teto do backoff; worker de pé por esse tempo zera a contagem
 
     CORS_ORIGINS: str = ""  # Origens extras separadas por virgula (ex: https://app.ngrok.io)
 
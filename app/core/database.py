@@ -33,7 +33,7 @@ def get_db():
 def create_tables():
     from app.models import instance, attendant, conversation, message, team  # noqa
     from app.models import quick_reply, conversation_note, report  # noqa
-    from app.models import databricks  # noqa
+    from app.models import databricks, llm_call, scheduler, event, outbound, ingest  # noqa
     Base.metadata.create_all(bind=engine)
 
 
@@ -80,6 +80,34 @@ def run_migrations():
         f"ALTER TABLE instances ADD COLUMN {if_not_exists} owner_email VARCHAR(255)",
         f"ALTER TABLE instances ADD COLUMN {if_not_exists} auto_message_enabled BOOLEAN DEFAULT FALSE",
         f"ALTER TABLE instances ADD COLUMN {if_not_exists} auto_message_text TEXT",
+        # Incremental analysis columns
+        f"ALTER TABLE conversations ADD COLUMN {if_not_exists} analysis_running_summary TEXT",
+        f"ALTER TABLE conversations ADD COLUMN {if_not_exists} analysis_last_message_id INTEGER",
+        f"ALTER TABLE conversations ADD COLUMN {if_not_exists} analysis_input_tokens INTEGER",
+        f"ALTER TABLE conversations ADD COLUMN {if_not_exists} analysis_output_tokens INTEGER",
+        f"ALTER TABLE conversations ADD COLUMN {if_not_exists} analysis_deferred_at TIMESTAMP",
+        f"ALTER TABLE instances ADD COLUMN {if_not_exists} llm_daily_token_budget INTEGER",
+        f"ALTER TABLE conversations ADD COLUMN {if_not_exists} updated_at TIMESTAMP",
+        "CREATE INDEX IF NOT EXISTS ix_conversations_instance_updated ON conversations (instance_id, updated_at)",
+        f"ALTER TABLE atendimento_raw ADD COLUMN {if_not_exists} source_updated_at TIMESTAMP",
+        f"ALTER TABLE instances ADD COLUMN {if_not_exists} abandon_after_minutes INTEGER",
+        # Índice parcial: o sweeper e as listas de abertas só percorrem o conjunto de conversas abertas
+        "CREATE INDEX IF NOT EXISTS ix_conversations_open_last_message ON conversations (instance_id, last_message_at) WHERE status = 'open'",
+        # Entrega do PDF gerado pelo Databricks
+        f"ALTER TABLE databricks_job_runs ADD COLUMN {if_not_exists} instance_id INTEGER REFERENCES instances(id)",
+        f"ALTER TABLE databricks_job_runs ADD COLUMN {if_not_exists} delivery_status VARCHAR(20)",
+        f"ALTER TABLE databricks_job_runs ADD COLUMN {if_not_exists} delivery_attempts INTEGER DEFAULT 0",
+        f"ALTER TABLE databricks_job_runs ADD COLUMN {if_not_exists} delivery_error TEXT",
+        f"ALTER TABLE databricks_job_runs ADD COLUMN {if_not_exists} delivered_at TIMESTAMP",
+        f"ALTER TABLE databricks_job_runs ADD COLUMN {if_not_exists} output_file VARCHAR(500)",
+        f"ALTER TABLE databricks_job_runs ADD COLUMN {if_not_exists} output_size BIGINT",
+        # Uma conversa aberta por contato: fecha duplicatas antigas (corridas entre entregas
+        # paralelas) e deixa o banco recusar a próxima — o pipeline refaz o lote e reaproveita a aberta
+        "UPDATE conversations SET status = 'resolved', resolved_at = COALESCE(last_message_at, opened_at), "
+        "updated_at = CURRENT_TIMESTAMP "
+        "WHERE status = 'open' AND id NOT IN "
+        "(SELECT MAX(id) FROM conversations WHERE status = 'open' GROUP BY instance_id, contact_phone)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_conversations_open_contact ON conversations (instance_id, contact_phone) WHERE status = 'open'",
     ]
     with engine.connect() as conn:
         for sql in migrations:
@@ -0,0 +1,318 @@
+"""
+Barramento de eventos entre processos (vários workers uvicorn / réplicas).
+
+Com um barramento ativo, app.core.events não entrega direto: cada evento é
+publicado no barramento e todos os processos (inclusive o de origem) o recebem e
+entregam aos seus assinantes SSE locais.
+
+Mensagem: "<seq>|<json>", onde seq é um contador por tópico (instância ou
+global) incrementado atomicamente junto com a publicação — a ordem de entrega
+no canal é a ordem do contador, e o receptor usa seq para descartar duplicatas
+e detectar perdas.
+
+- redis:    INCR + PUBLISH num script Lua (atômico).
+- postgres: UPSERT em event_sequences + pg_notify na mesma transação; a trava
+            da linha do tópico serializa os commits e, portanto, as notificações.
+            Eventos maiores que o limite do NOTIFY vão para event_payloads e o
+            NOTIFY leva "<seq>|@<id>"; o receptor lê o corpo antes de entregar.
+
+Os dois reconectam sozinhos com backoff exponencial e avisam via on_reconnect
+(eventos publicados durante a queda não são recuperáveis).
+"""
+
+import asyncio
+import logging
+import re
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.core import json_codec
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Limite de payload do NOTIFY é 8000 bytes
+_PG_MAX_PAYLOAD = 7900
+
+_REDIS_PUBLISH_LUA = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], seq .. '|' .. ARGV[2])
+return seq
+"""
+
+_PG_STORE_PAYLOAD_SQL = text("INSERT INTO event_payloads (body, created_at) VALUES (:body, :created_at) RETURNING id")
+_PG_LOAD_PAYLOAD_SQL = text("SELECT body FROM event_payloads WHERE id = :id")
+_PG_PRUNE_PAYLOADS_SQL = text("DELETE FROM event_payloads WHERE created_at < :cutoff")
+
+_PG_NEXT_SEQ_SQL = text("""
+    INSERT INTO event_sequences (topic, seq) VALUES (:topic, 1)
+    ON CONFLICT (topic) DO UPDATE SET seq = event_sequences.seq + 1
+    RETURNING seq
+""")
+
+
+def topic_key(instance_id: Optional[int]) -> str:
+    return "global" if instance_id is None else str(instance_id)
+
+
+def encode(instance_id: Optional[int], event_type: str, payload: str) -> str:
+    return json_codec.dumps({"i": instance_id, "t": event_type, "p": payload})
+
+
+def decode(raw: str) -> Tuple[int, Optional[int], str, str]:
+    """(seq, instance_id, tipo, payload json)"""
+    seq, _, body = raw.partition("|")
+    msg = json_codec.loads(body)
+    return int(seq), msg["i"], msg["t"], msg["p"]
+
+
+def store_payload(conn, body: str) -> str:
+    """Grava um corpo grande demais para o NOTIFY; retorna a referência "@<id>"."""
+    payload_id = conn.execute(_PG_STORE_PAYLOAD_SQL, {"body": body, "created_at": datetime.utcnow()}).scalar()
+    return f"@{payload_id}"
+
+
+def load_payload(conn, raw: str) -> Optional[str]:
+    """Mensagem recebida com o corpo resolvido; None se a referência já expirou."""
+    seq, _, body = raw.partition("|")
+    if not body.startswith("@"):
+        return raw
+    stored = conn.execute(_PG_LOAD_PAYLOAD_SQL, {"id": int(body[1:])}).scalar()
+    return None if stored is None else f"{seq}|{stored}"
+
+
+def prune_payloads(conn) -> int:
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.EVENT_BUS_PAYLOAD_RETENTION_SECONDS)
+    return conn.execute(_PG_PRUNE_PAYLOADS_SQL, {"cutoff": cutoff}).rowcount
+
+
+def _backoff(attempt: int) -> float:
+    return min(2 ** attempt, max(settings.EVENT_BUS_RECONNECT_MAX_SECONDS, 1))
+
+
+class EventBus:
+    """Interface dos backends. on_message/on_reconnect são chamados no event loop."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.connected = False
+        self.reconnects = 0
+        self._on_message: Optional[Callable[[str], None]] = None
+        self._on_reconnect: Optional[Callable[[], None]] = None
+
+    async def start(self, on_message: Callable[[str], None], on_reconnect: Callable[[], None]) -> None:
+        self._on_message = on_message
+        self._on_reconnect = on_reconnect
+
+    async def publish(self, instance_id: Optional[int], event_type: str, payload: str) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        self.connected = False
+
+
+# ─── Redis ────────────────────────────────────────────────────────────────────
+
+class RedisBus(EventBus):
+    name = "redis"
+
+    def __init__(self):
+        super().__init__()
+        import redis.asyncio as aioredis  # dependência opcional, só com EVENT_BUS_BACKEND=redis
+        self._client = aioredis.from_url(settings.REDIS_URL, decode_responses=True, health_check_interval=30)
+        self._script = self._client.register_script(_REDIS_PUBLISH_LUA)
+        self._channel = settings.EVENT_BUS_CHANNEL
+        self._task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def start(self, on_message, on_reconnect) -> None:
+        await super().start(on_message, on_reconnect)
+        self._task = asyncio.create_task(self._listen())
+        # Aguarda a inscrição para não perder os primeiros eventos publicados por este processo
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning("Barramento redis: inscrição ainda pendente; tentando em background")
+
+    async def _listen(self) -> None:
+        attempt = 0
+        first = True
+        while True:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self._channel)
+                self.connected = True
+                self._subscribed.set()
+                if not first:
+                    self.reconnects += 1
+                    logger.info("Barramento redis: reconectado")
+                    self._on_reconnect()
+                first, attempt = False, 0
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._on_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.connected = False
+                delay = _backoff(attempt)
+                attempt += 1
+                logger.warning("Barramento redis: conexão perdida (%s); nova tentativa em %.0fs", e, delay)
+                await asyncio.sleep(delay)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def publish(self, instance_id, event_type, payload) -> None:
+        key = f"{self._channel}:seq:{topic_key(instance_id)}"
+        await self._script(keys=[key], args=[self._channel, encode(instance_id, event_type, payload)])
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._client.aclose()
+        await super().stop()
+
+
+# ─── PostgreSQL ───────────────────────────────────────────────────────────────
+
+class PostgresBus(EventBus):
+    """LISTEN numa conexão psycopg2 dedicada (thread); NOTIFY pelo pool do SQLAlchemy."""
+
+    name = "postgres"
+
+    def __init__(self):
+        super().__init__()
+        from app.core.database import engine, _is_sqlite
+        if _is_sqlite:
+            raise RuntimeError("EVENT_BUS_BACKEND=postgres requer DATABASE_URL PostgreSQL")
+        if not re.fullmatch(r"[a-z_][a-z0-9_]*", settings.EVENT_BUS_CHANNEL):
+            raise ValueError(f"EVENT_BUS_CHANNEL inválido para LISTEN: {settings.EVENT_BUS_CHANNEL}")
+        self._engine = engine
+        self._channel = settings.EVENT_BUS_CHANNEL
+        self._connect_args = engine.url.translate_connect_args(username="user", database="dbname")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = threading.Event()
+        self._listening = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_prune = 0.0
+
+    async def start(self, on_message, on_reconnect) -> None:
+        await super().start(on_message, on_reconnect)
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._listen, name="event-bus-listen", daemon=True)
+        self._thread.start()
+        if not await asyncio.to_thread(self._listening.wait, 5):
+            logger.warning("Barramento postgres: LISTEN ainda pendente; tentando em background")
+
+    def _dispatch(self, callback, *args) -> None:
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _listen(self) -> None:
+        import psycopg2
+        import psycopg2.extensions
+
+        attempt = 0
+        first = True
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._connect_args)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {self._channel}")
+                self.connected = True
+                self._listening.set()
+                if not first:
+                    self.reconnects += 1
+                    logger.info("Barramento postgres: reconectado")
+                    self._dispatch(self._on_reconnect)
+                first, attempt = False, 0
+                idle = 0
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        idle += 1
+                        if idle >= 30:
+                            # Conexão ociosa: confirma que o socket ainda está vivo
+                            cur.execute("SELECT 1")
+                            idle = 0
+                        continue
+                    idle = 0
+                    conn.poll()
+                    while conn.notifies:
+                        self._receive(conn.notifies.pop(0).payload)
+            except Exception as e:
+                self.connected = False
+                delay = _backoff(attempt)
+                attempt += 1
+                logger.warning("Barramento postgres: conexão perdida (%s); nova tentativa em %.0fs", e, delay)
+                self._stopping.wait(delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _receive(self, raw: str) -> None:
+        if raw.partition("|")[2].startswith("@"):
+            try:
+                with self._engine.connect() as conn:
+                    resolved = load_payload(conn, raw)
+            except Exception as e:
+                resolved = None
+                logger.warning("Barramento postgres: erro ao ler evento grande (%s)", e)
+            if resolved is None:
+                # Sem o corpo a mensagem vira lacuna de seq: o receptor trata como perda (resync)
+                logger.warning("Barramento postgres: corpo do evento %s indisponível", raw)
+                return
+            raw = resolved
+        self._dispatch(self._on_message, raw)
+
+    def _notify(self, instance_id, event_type, payload) -> None:
+        body = encode(instance_id, event_type, payload)
+        with self._engine.begin() as conn:
+            if len(body.encode()) > _PG_MAX_PAYLOAD:
+                # Não cabe no NOTIFY: o corpo vai para event_payloads, gravado antes do NOTIFY sair
+                body = store_payload(conn, body)
+                if time.monotonic() - self._last_prune >= 60:
+                    self._last_prune = time.monotonic()
+                    prune_payloads(conn)
+            seq = conn.execute(_PG_NEXT_SEQ_SQL, {"topic": topic_key(instance_id)}).scalar()
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self._channel, "payload": f"{seq}|{body}"})
+
+    async def publish(self, instance_id, event_type, payload) -> None:
+        await asyncio.to_thread(self._notify, instance_id, event_type, payload)
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._thread:
+            await asyncio.to_thread(self._thread.join, 5)
+            self._thread = None
+        await super().stop()
+
+
+def create_bus() -> Optional[EventBus]:
+    """Backend configurado em EVENT_BUS_BACKEND; None = só em memória (processo único)."""
+    backend = (settings.EVENT_BUS_BACKEND or "memory").lower()
+    if backend == "memory":
+        return None
+    if backend == "redis":
+        return RedisBus()
+    if backend == "postgres":
+        return PostgresBus()
+    raise ValueError(f"EVENT_BUS_BACKEND desconhecido: {settings.EVENT_BUS_BACKEND}")
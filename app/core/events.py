@@ -1,25 +1,439 @@
+"""
+Broker de eventos SSE em processo.
+
+Tópicos por instance_id (eventos sem instance_id vão para o tópico global e
+chegam a todos). Cada assinante filtra por instâncias e tipos; o evento é
+serializado uma única vez e entregue só aos assinantes do tópico.
+
+- Cada evento recebe um id sequencial; um buffer circular por tópico permite
+  retomar a conexão via Last-Event-ID.
+- Rajadas de eventos idênticos (COALESCE_TYPES) dentro de EVENTS_COALESCE_MS
+  viram uma entrega imediata + uma entrega ao final da janela. Só sinais sem
+  conteúdo próprio ("recarregue"); deltas como o new_message v2 nunca se repetem
+  e precisam chegar todos.
+- Assinante lento não é descartado em silêncio: a fila é esvaziada e ele recebe
+  um marcador {"type": "resync"} para recarregar o estado.
+
+Com EVENT_BUS_BACKEND redis/postgres (vários workers), a publicação passa pelo
+barramento (app.core.event_bus) e cada processo entrega o que recebe. As
+mensagens trazem um seq por instância: fora de ordem ficam retidas até
+EVENT_BUS_REORDER_MS; se a lacuna não fechar, os assinantes da instância recebem
+resync. Ids SSE levam o token do processo — retomar em outro worker vira resync.
+
+Eventos de INTERNAL_TYPES são sinais entre processos (ex.: workers de ingestão →
+monitor de SLA e despachante do outbound do processo web): passam pelo mesmo
+barramento, mas vão para os callbacks de listen() em vez dos assinantes SSE.
+
+Todo o estado é acessado apenas no event loop; threads usam broadcast_threadsafe.
+"""
+
 import asyncio
-from typing import Set
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
 
-_subscribers: Set[asyncio.Queue] = set()
+from app.core.config import settings
+from app.core import event_bus, json_codec
 
+logger = logging.getLogger(__name__)
 
-def subscribe() -> asyncio.Queue:
-    q: asyncio.Queue = asyncio.Queue(maxsize=50)
-    _subscribers.add(q)
-    return q
+RESYNC_PAYLOAD = json_codec.dumps({"type": "resync"})
+COALESCE_TYPES = {"groups_updated"}
+INTERNAL_TYPES = frozenset({"ingest_committed"})
 
+# Item de fila/buffer: (id, tipo, json, instante da publicação em time.monotonic())
+Item = Tuple[int, str, str, float]
 
-def unsubscribe(q: asyncio.Queue) -> None:
-    _subscribers.discard(q)
 
+class Subscriber:
+    __slots__ = ("instance_ids", "types", "queue", "dropped", "delivered", "lag_ms", "max_lag_ms")
 
-async def broadcast(event: dict) -> None:
-    dead = set()
-    for q in _subscribers:
+    def __init__(self, instance_ids: Optional[Set[int]], types: Optional[Set[str]], maxsize: int):
+        self.instance_ids = instance_ids  # None = todas as instâncias
+        self.types = types                # None = todos os tipos
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.delivered = 0
+        self.lag_ms = 0.0                 # média móvel do atraso publicação → envio
+        self.max_lag_ms = 0.0
+
+    def wants(self, event_type: str) -> bool:
+        return self.types is None or event_type in self.types or event_type == "resync"
+
+    def offer(self, item: Item) -> None:
         try:
-            q.put_nowait(event)
+            self.queue.put_nowait(item)
         except asyncio.QueueFull:
-            dead.add(q)
-    for q in dead:
-        _subscribers.discard(q)
+            # Cliente lento: descarta o atrasado e pede resync em vez de perder eventos em silêncio
+            self.dropped += self.queue.qsize() + 1
+            _stats["dropped"] += self.queue.qsize() + 1
+            _stats["resyncs"] += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((item[0], "resync", RESYNC_PAYLOAD, item[3]))
+
+    async def get(self, timeout: float) -> Optional[Item]:
+        """Próximo item ou None após `timeout` segundos (heartbeat)."""
+        try:
+            item = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        lag = (time.monotonic() - item[3]) * 1000
+        self.lag_ms = lag if not self.delivered else self.lag_ms * 0.9 + lag * 0.1
+        self.max_lag_ms = max(self.max_lag_ms, lag)
+        self.delivered += 1
+        return item
+
+
+_seq = 0
+_wildcard: Set[Subscriber] = set()
+_by_instance: Dict[int, Set[Subscriber]] = {}
+_buffers: Dict[Optional[int], Deque[Item]] = {}
+_evicted_upto: Dict[Optional[int], int] = {}   # maior id já descartado de cada buffer
+_coalescing: Dict[Tuple[str, Optional[int], str], bool] = {}  # chave → houve repetição na janela
+_stats = {"published": 0, "delivered": 0, "dropped": 0, "coalesced": 0, "replayed": 0, "resyncs": 0}
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_listeners: Dict[str, List[Callable[[dict], None]]] = {}
+
+_token = uuid.uuid4().hex[:8]                  # prefixo dos ids SSE deste processo
+_bus: Optional[event_bus.EventBus] = None
+_outbox: Optional[asyncio.Queue] = None
+_sender: Optional[asyncio.Task] = None
+_expected: Dict[Optional[int], int] = {}                   # próximo seq esperado por tópico
+_held: Dict[Optional[int], Dict[int, Tuple[str, str]]] = {}  # fora de ordem aguardando a lacuna
+_gap_timers: Dict[Optional[int], asyncio.TimerHandle] = {}
+_bus_stats = {"sent": 0, "received": 0, "duplicates": 0, "reordered": 0, "gaps": 0, "publish_errors": 0}
+
+
+def bind_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Registra o event loop da aplicação (chamado no lifespan)."""
+    global _loop
+    _loop = loop
+
+
+# ─── Assinaturas ──────────────────────────────────────────────────────────────
+
+def _topics_of(sub: Subscriber) -> Optional[List[Optional[int]]]:
+    if sub.instance_ids is None:
+        return None  # todos os buffers
+    return [None, *sub.instance_ids]
+
+
+def format_event_id(seq: int) -> str:
+    return f"{_token}-{seq}"
+
+
+def _parse_event_id(value: str) -> Optional[int]:
+    """seq local do id SSE; None se for de outro processo (ou reinício) ou inválido."""
+    token, _, seq = value.rpartition("-")
+    if token != _token:
+        return None
+    try:
+        return int(seq)
+    except ValueError:
+        return None
+
+
+def _replay(sub: Subscriber, last_event_id: str) -> None:
+    """Reenfileira os eventos posteriores a last_event_id; se algum já saiu do buffer
+    (ou o id é de outro worker/execução), envia resync."""
+    topics = _topics_of(sub)
+    buffers = list(_buffers.items()) if topics is None else [(t, _buffers[t]) for t in topics if t in _buffers]
+    last_seq = _parse_event_id(last_event_id)
+    lost = last_seq is None or last_seq > _seq or any(_evicted_upto.get(t, 0) > last_seq for t, _ in buffers)
+    items: List[Item] = []
+    if not lost:
+        for _, buf in buffers:
+            items.extend(i for i in buf if i[0] > last_seq and sub.wants(i[1]))
+        items.sort(key=lambda i: i[0])
+        lost = len(items) >= sub.queue.maxsize
+    if lost:
+        _stats["resyncs"] += 1
+        sub.queue.put_nowait((_seq, "resync", RESYNC_PAYLOAD, time.monotonic()))
+        return
+    for item in items:
+        sub.queue.put_nowait(item)
+    _stats["replayed"] += len(items)
+
+
+def subscribe(
+    instance_ids: Optional[Iterable[int]] = None,
+    types: Optional[Iterable[str]] = None,
+    last_event_id: Optional[str] = None,
+) -> Subscriber:
+    sub = Subscriber(
+        set(instance_ids) if instance_ids is not None else None,
+        set(types) if types else None,
+        settings.EVENTS_QUEUE_SIZE,
+    )
+    if last_event_id is not None:
+        _replay(sub, last_event_id)
+    if sub.instance_ids is None:
+        _wildcard.add(sub)
+    else:
+        for instance_id in sub.instance_ids:
+            _by_instance.setdefault(instance_id, set()).add(sub)
+    return sub
+
+
+def resubscribe(sub: Subscriber, instance_ids: Iterable[int]) -> None:
+    """Troca as instâncias de um assinante mantendo a fila (console WebSocket)."""
+    unsubscribe(sub)
+    sub.instance_ids = set(instance_ids)
+    for instance_id in sub.instance_ids:
+        _by_instance.setdefault(instance_id, set()).add(sub)
+
+
+def unsubscribe(sub: Subscriber) -> None:
+    _wildcard.discard(sub)
+    for instance_id in sub.instance_ids or ():
+        subs = _by_instance.get(instance_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del _by_instance[instance_id]
+
+
+# ─── Sinais internos ──────────────────────────────────────────────────────────
+
+def listen(event_type: str, callback: Callable[[dict], None]) -> None:
+    """Registra um callback (no event loop) para um tipo de INTERNAL_TYPES."""
+    callbacks = _listeners.setdefault(event_type, [])
+    if callback not in callbacks:
+        callbacks.append(callback)
+
+
+def _notify_listeners(event_type: str, payload: str) -> None:
+    callbacks = _listeners.get(event_type)
+    if not callbacks:
+        return
+    event = json_codec.loads(payload)
+    for callback in callbacks:
+        try:
+            callback(event)
+        except Exception as e:
+            logger.error("Eventos: callback de %s falhou: %s", event_type, e)
+
+
+# ─── Publicação ───────────────────────────────────────────────────────────────
+
+def _deliver(event_type: str, instance_id: Optional[int], payload: str) -> None:
+    global _seq
+    if event_type in INTERNAL_TYPES:
+        _notify_listeners(event_type, payload)
+        return
+    _seq += 1
+    item: Item = (_seq, event_type, payload, time.monotonic())
+
+    buf = _buffers.get(instance_id)
+    if buf is None:
+        buf = _buffers[instance_id] = deque(maxlen=max(settings.EVENTS_REPLAY_BUFFER, 1))
+    if len(buf) == buf.maxlen:
+        _evicted_upto[instance_id] = buf[0][0]
+    buf.append(item)
+
+    if instance_id is None:
+        targets: Iterable[Subscriber] = list(_wildcard) + [s for subs in _by_instance.values() for s in subs]
+        seen: Set[int] = set()
+    else:
+        targets = list(_wildcard) + list(_by_instance.get(instance_id, ()))
+        seen = None
+    for sub in targets:
+        if seen is not None:
+            # Assinante de várias instâncias aparece uma vez por instância
+            if id(sub) in seen:
+                continue
+            seen.add(id(sub))
+        if sub.wants(event_type):
+            sub.offer(item)
+            _stats["delivered"] += 1
+    _stats["published"] += 1
+
+
+def _dispatch(event_type: str, instance_id: Optional[int], payload: str) -> None:
+    """Entrega local direta ou via barramento (a entrega local vem de _on_bus_message)."""
+    if _bus is None or _outbox is None:
+        _deliver(event_type, instance_id, payload)
+    else:
+        _outbox.put_nowait((event_type, instance_id, payload))
+
+
+def _end_coalesce_window(key: Tuple[str, Optional[int], str]) -> None:
+    if _coalescing.pop(key, False):
+        _dispatch(key[0], key[1], key[2])
+
+
+def publish(event: dict) -> None:
+    """Publica no tópico de event['instance_id'] (ausente = global). Só no event loop."""
+    event_type = event.get("type", "")
+    instance_id = event.get("instance_id")
+    payload = json_codec.dumps(event)
+
+    window = settings.EVENTS_COALESCE_MS / 1000
+    if event_type in COALESCE_TYPES and window > 0:
+        key = (event_type, instance_id, payload)
+        if key in _coalescing:
+            _coalescing[key] = True
+            _stats["coalesced"] += 1
+            return
+        _coalescing[key] = False
+        asyncio.get_running_loop().call_later(window, _end_coalesce_window, key)
+
+    _dispatch(event_type, instance_id, payload)
+
+
+async def broadcast(event: dict) -> None:
+    publish(event)
+
+
+def broadcast_threadsafe(event: dict) -> None:
+    """Agenda a publicação a partir de threads de background (jobs, executors)."""
+    if _loop is None or _loop.is_closed():
+        return
+    _loop.call_soon_threadsafe(publish, event)
+
+
+# ─── Barramento entre processos ───────────────────────────────────────────────
+
+async def _send_loop() -> None:
+    """Publica a fila local em ordem. Com o barramento fora, entrega só localmente
+    para não perder os eventos deste processo."""
+    while True:
+        event_type, instance_id, payload = await _outbox.get()
+        try:
+            await _bus.publish(instance_id, event_type, payload)
+            _bus_stats["sent"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _bus_stats["publish_errors"] += 1
+            logger.warning("Eventos: falha ao publicar no barramento %s (%s); entrega apenas local", _bus.name, e)
+            _deliver(event_type, instance_id, payload)
+
+
+def _release_held(topic: Optional[int]) -> None:
+    held = _held.get(topic)
+    while held and _expected[topic] in held:
+        event_type, payload = held.pop(_expected[topic])
+        _deliver(event_type, topic, payload)
+        _expected[topic] += 1
+    if not held:
+        _held.pop(topic, None)
+        timer = _gap_timers.pop(topic, None)
+        if timer:
+            timer.cancel()
+
+
+def _skip_gap(topic: Optional[int]) -> None:
+    """A lacuna não fechou a tempo: eventos perdidos → resync para a instância e segue."""
+    _gap_timers.pop(topic, None)
+    held = _held.pop(topic, None)
+    if not held:
+        return
+    _bus_stats["gaps"] += 1
+    logger.warning("Eventos: lacuna no tópico %s (esperado %d, recebido %d)", topic, _expected[topic], min(held))
+    _deliver("resync", topic, json_codec.dumps({"type": "resync", "instance_id": topic}))
+    for seq in sorted(held):
+        _deliver(held[seq][0], topic, held[seq][1])
+    _expected[topic] = max(held) + 1
+
+
+def _on_bus_message(raw: str) -> None:
+    try:
+        seq, topic, event_type, payload = event_bus.decode(raw)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning("Eventos: mensagem inválida no barramento: %s", e)
+        return
+    _bus_stats["received"] += 1
+    expected = _expected.get(topic)
+    if expected is None or seq == expected:
+        _deliver(event_type, topic, payload)
+        _expected[topic] = seq + 1
+        _release_held(topic)
+    elif seq < expected:
+        _bus_stats["duplicates"] += 1
+    else:
+        _bus_stats["reordered"] += 1
+        _held.setdefault(topic, {})[seq] = (event_type, payload)
+        if topic not in _gap_timers:
+            _gap_timers[topic] = asyncio.get_running_loop().call_later(
+                settings.EVENT_BUS_REORDER_MS / 1000, _skip_gap, topic
+            )
+
+
+def _on_bus_reconnect() -> None:
+    """Mensagens publicadas durante a queda se perderam: recomeça a numeração e pede resync."""
+    for timer in _gap_timers.values():
+        timer.cancel()
+    _gap_timers.clear()
+    _held.clear()
+    _expected.clear()
+    _deliver("resync", None, RESYNC_PAYLOAD)
+
+
+async def start_bus() -> None:
+    """Conecta ao barramento configurado (chamado no lifespan). Falha → só em memória."""
+    global _bus, _outbox, _sender
+    bind_loop(asyncio.get_running_loop())
+    try:
+        bus = event_bus.create_bus()
+        if bus is None:
+            return
+        await bus.start(_on_bus_message, _on_bus_reconnect)
+    except Exception as e:
+        logger.error("Eventos: barramento %s indisponível (%s); usando apenas memória", settings.EVENT_BUS_BACKEND, e)
+        return
+    _bus = bus
+    _outbox = asyncio.Queue()
+    _sender = asyncio.create_task(_send_loop())
+    logger.info("Eventos: barramento %s ativo", bus.name)
+
+
+def bus_active() -> bool:
+    """True quando os eventos atravessam processos (redis/postgres conectado no startup)."""
+    return _bus is not None
+
+
+async def stop_bus() -> None:
+    global _bus, _outbox, _sender
+    if _sender:
+        _sender.cancel()
+        try:
+            await _sender
+        except asyncio.CancelledError:
+            pass
+        _sender = None
+    if _bus:
+        await _bus.stop()
+    _bus = _outbox = None
+
+
+# ─── Métricas ─────────────────────────────────────────────────────────────────
+
+def get_metrics() -> dict:
+    subs: Set[Subscriber] = set(_wildcard)
+    for instance_subs in _by_instance.values():
+        subs.update(instance_subs)
+    depths = [s.queue.qsize() for s in subs]
+    lags = [s.lag_ms for s in subs if s.delivered]
+    return {
+        "subscribers": len(subs),
+        "subscribers_all_instances": len(_wildcard),
+        "subscribers_by_instance": {i: len(s) for i, s in _by_instance.items()},
+        "last_event_id": _seq,
+        "buffered_events": {str(t): len(b) for t, b in _buffers.items()},
+        **_stats,
+        "queue_depth_max": max(depths, default=0),
+        "lag_ms_avg": round(sum(lags) / len(lags), 1) if lags else 0.0,
+        "lag_ms_max": round(max((s.max_lag_ms for s in subs), default=0.0), 1),
+        "bus": {
+            "backend": _bus.name if _bus else "memory",
+            "connected": _bus.connected if _bus else True,
+            "reconnects": _bus.reconnects if _bus else 0,
+            "outbox": _outbox.qsize() if _outbox else 0,
+            "held": sum(len(h) for h in _held.values()),
+            **_bus_stats,
+        },
+    }
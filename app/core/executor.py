@@ -0,0 +1,103 @@
+"""
+Executor limitado para trabalho em background disparado por webhooks.
+
+Um ThreadPoolExecutor com teto de itens pendentes (submit() recusa o excedente em
+vez de acumular threads/conexões), deduplicação por chave dentro de uma janela de
+cooldown e encerramento gracioso: shutdown() para de aceitar, aguarda o que já foi
+aceito por até `timeout` segundos e cancela o resto.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, queue_limit: int, cooldown_seconds: float = 0):
+        self.name = name
+        self.max_workers = max(max_workers, 1)
+        self.queue_limit = max(queue_limit, 1)
+        self.cooldown_seconds = cooldown_seconds
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._futures: Set[Future] = set()
+        self._active = 0
+        self._recent: Dict[Hashable, float] = {}  # chave → último aceite (monotonic)
+        self._closed = False
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "deduplicated": 0}
+
+    def _run(self, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        with self._lock:
+            self._active += 1
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logger.error("%s: tarefa %s falhou: %s", self.name, getattr(fn, "__name__", fn), e)
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._active -= 1
+        with self._lock:
+            self._stats["completed"] += 1
+        return result
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def submit(self, fn: Callable, *args: Any, key: Optional[Hashable] = None, **kwargs: Any) -> Optional[Future]:
+        """Agenda fn(*args, **kwargs). Retorna None se a fila estiver cheia, o executor
+        encerrado ou a mesma `key` tiver sido aceita há menos de cooldown_seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if self._closed:
+                self._stats["rejected"] += 1
+                return None
+            if key is not None and self.cooldown_seconds > 0:
+                last = self._recent.get(key)
+                if last is not None and now - last < self.cooldown_seconds:
+                    self._stats["deduplicated"] += 1
+                    return None
+            if len(self._futures) >= self.queue_limit:
+                self._stats["rejected"] += 1
+                return None
+            if key is not None and self.cooldown_seconds > 0:
+                if len(self._recent) > self.queue_limit * 10:
+                    self._recent = {k: t for k, t in self._recent.items() if now - t < self.cooldown_seconds}
+                self._recent[key] = now
+            future = self._pool.submit(self._run, fn, args, kwargs)
+            self._futures.add(future)
+            self._stats["submitted"] += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def shutdown(self, timeout: float) -> int:
+        """Para de aceitar e aguarda as tarefas por até `timeout` s. Retorna quantas foram canceladas."""
+        with self._lock:
+            self._closed = True
+            pending = set(self._futures)
+        if pending:
+            logger.info("%s: aguardando %d tarefas em andamento", self.name, len(pending))
+            wait(pending, timeout=timeout)
+        cancelled = sum(1 for f in pending if not f.done() and f.cancel())
+        if cancelled:
+            logger.warning("%s: %d tarefas canceladas no encerramento", self.name, cancelled)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        return cancelled
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": len(self._futures) - self._active,
+                "max_workers": self.max_workers,
+                "queue_limit": self.queue_limit,
+                "closed": self._closed,
+                **self._stats,
+            }
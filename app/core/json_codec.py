@@ -0,0 +1,46 @@
+"""
+JSON rápido para o caminho quente (webhooks, eventos, respostas da API).
+
+Usa orjson quando instalado; sem ele, cai para o json da biblioteca padrão com
+o mesmo contrato:
+- loads(bytes | str) levanta ValueError em JSON inválido;
+- dumps(obj) devolve str (datetime/date em ISO 8601, demais tipos via str());
+- JSONResponse é a classe de resposta padrão do app (ORJSONResponse com orjson).
+"""
+
+import json
+from datetime import date, datetime
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse as _StdJSONResponse
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as JSONResponse
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+    JSONResponse = _StdJSONResponse
+
+ORJSON_AVAILABLE = orjson is not None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def loads(raw: Union[bytes, str]) -> Any:
+        return orjson.loads(raw)  # orjson.JSONDecodeError é ValueError
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+else:
+    def loads(raw: Union[bytes, str]) -> Any:
+        return json.loads(raw)
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,373 @@
+"""
+Agendador interno (asyncio) com especificações estilo cron.
+
+Cada disparo passa por uma trava de líder no banco (scheduler_locks): a réplica
+que conseguir gravar o horário agendado em last_fire_at executa; as demais pulam.
+Os jobs são funções síncronas executadas em thread; cada execução fica registrada
+em scheduler_job_runs com duração e resultado. Horários em UTC.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.scheduler import SchedulerLock, SchedulerJobRun
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+# ─── Cron ─────────────────────────────────────────────────────────────────────
+
+def _parse_field(field: str, low: int, high: int) -> set:
+    values: set = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step < 1:
+                raise ValueError(f"passo inválido: {step_str}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"fora do intervalo {low}-{high}: {part}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSpec:
+    """Especificação de 5 campos: minuto hora dia-do-mês mês dia-da-semana (0/7 = domingo)."""
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron deve ter 5 campos: '{expr}'")
+        self.expr = expr
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _parse_field(fields[4], 0, 7)}
+        # Semântica do cron: com dia-do-mês e dia-da-semana restritos, basta um dos dois
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return dow
+        if self._any_weekday:
+            return dom
+        return dom or dow
+
+    def next_after(self, dt: datetime) -> datetime:
+        """Primeiro horário agendado estritamente depois de dt."""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            if t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+                continue
+            return t
+        raise ValueError(f"cron sem próximo horário: '{self.expr}'")
+
+
+# ─── Jobs ─────────────────────────────────────────────────────────────────────
+
+class ScheduledJob:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Optional[dict]],
+        cron: Optional[str] = None,
+        interval_seconds: Optional[int] = None,
+        lock_ttl_seconds: Optional[int] = None,
+    ):
+        if bool(cron) == bool(interval_seconds):
+            raise ValueError(f"job '{name}': informe cron ou interval_seconds")
+        self.name = name
+        self.func = func
+        self.cron = CronSpec(cron) if cron else None
+        self.interval_seconds = interval_seconds
+        self.lock_ttl_seconds = lock_ttl_seconds or settings.SCHEDULER_LOCK_TTL_SECONDS
+        self.next_fire: Optional[datetime] = None
+
+    @property
+    def spec(self) -> str:
+        return self.cron.expr if self.cron else f"every {self.interval_seconds}s"
+
+    def next_after(self, dt: datetime) -> datetime:
+        if self.cron:
+            return self.cron.next_after(dt)
+        # Alinhado à época: todas as réplicas calculam os mesmos horários
+        elapsed = int((dt - _EPOCH).total_seconds())
+        return _EPOCH + timedelta(seconds=(elapsed // self.interval_seconds + 1) * self.interval_seconds)
+
+
+class Scheduler:
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._running: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def add_job(self, job: ScheduledJob) -> None:
+        self._jobs[job.name] = job
+
+    def get_job(self, name: str) -> Optional[ScheduledJob]:
+        return self._jobs.get(name)
+
+    def list_jobs(self) -> List[ScheduledJob]:
+        return list(self._jobs.values())
+
+    def is_running(self, name: str) -> bool:
+        return name in self._running
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # ── Ciclo de vida ──
+
+    def start(self) -> None:
+        now = datetime.utcnow()
+        for job in self._jobs.values():
+            job.next_fire = job.next_after(now)
+        self._task = asyncio.create_task(self._loop())
+        logger.info("Agendador iniciado (%s): %s", self.owner, ", ".join(f"{j.name}={j.spec}" for j in self._jobs.values()))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            now = datetime.utcnow()
+            for job in self._jobs.values():
+                if job.next_fire and job.next_fire <= now:
+                    slot = job.next_fire
+                    job.next_fire = job.next_after(now)
+                    self._spawn(job, slot, "schedule")
+            await asyncio.sleep(max(settings.SCHEDULER_TICK_SECONDS, 1))
+
+    def _spawn(self, job: ScheduledJob, slot: Optional[datetime], trigger: str) -> None:
+        if job.name in self._running:
+            logger.info("Agendador: %s ainda em execução nesta réplica — disparo pulado", job.name)
+            return
+        self._running.add(job.name)
+        task = asyncio.create_task(asyncio.to_thread(self._execute, job, slot, trigger))
+        task.add_done_callback(lambda _t, name=job.name: self._running.discard(name))
+
+    def run_now(self, name: str) -> bool:
+        """Dispara o job manualmente (ainda sujeito à trava). False se já estiver rodando aqui."""
+        job = self._jobs[name]
+        if job.name in self._running:
+            return False
+        self._spawn(job, None, "manual")
+        return True
+
+    # ── Trava de líder ──
+
+    def _acquire(self, db, job: ScheduledJob, slot: Optional[datetime]) -> bool:
+        now = datetime.utcnow()
+        values = {
+            SchedulerLock.owner: self.owner,
+            SchedulerLock.locked_until: now + timedelta(seconds=job.lock_ttl_seconds),
+        }
+        query = db.query(SchedulerLock).filter(
+            SchedulerLock.job_name == job.name,
+            or_(SchedulerLock.locked_until.is_(None), SchedulerLock.locked_until < now),
+        )
+        if slot is not None:
+            query = query.filter(or_(SchedulerLock.last_fire_at.is_(None), SchedulerLock.last_fire_at < slot))
+            values[SchedulerLock.last_fire_at] = slot
+        if query.update(values, synchronize_session=False):
+            db.commit()
+            return True
+        db.rollback()
+
+        if db.query(SchedulerLock.id).filter(SchedulerLock.job_name == job.name).first():
+            return False
+        try:
+            db.add(SchedulerLock(
+                job_name=job.name,
+                owner=self.owner,
+                locked_until=values[SchedulerLock.locked_until],
+                last_fire_at=slot,
+            ))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()  # outra réplica criou a trava primeiro
+            return False
+
+    def _release(self, db, job: ScheduledJob) -> None:
+        db.query(SchedulerLock).filter(
+            SchedulerLock.job_name == job.name,
+            SchedulerLock.owner == self.owner,
+        ).update({SchedulerLock.locked_until: None}, synchronize_session=False)
+        db.commit()
+
+    # ── Liderança contínua (monitores que rodam fora dos jobs) ──
+
+    def hold_lease(self, name: str, ttl_seconds: int) -> bool:
+        """Adquire ou renova a trava `name` para esta réplica (chamada de thread).
+        Com várias réplicas, só a que detém a trava age; se ela cair, outra assume após o TTL."""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            renewed = db.query(SchedulerLock).filter(
+                SchedulerLock.job_name == name,
+                or_(
+                    SchedulerLock.owner == self.owner,
+                    SchedulerLock.locked_until.is_(None),
+                    SchedulerLock.locked_until < now,
+                ),
+            ).update(
+                {SchedulerLock.owner: self.owner, SchedulerLock.locked_until: now + timedelta(seconds=ttl_seconds)},
+                synchronize_session=False,
+            )
+            if renewed:
+                db.commit()
+                return True
+            db.rollback()
+            if db.query(SchedulerLock.id).filter(SchedulerLock.job_name == name).first():
+                return False
+            try:
+                db.add(SchedulerLock(job_name=name, owner=self.owner, locked_until=now + timedelta(seconds=ttl_seconds)))
+                db.commit()
+                return True
+            except IntegrityError:
+                db.rollback()
+                return False
+        finally:
+            db.close()
+
+    def release_lease(self, name: str) -> None:
+        db = SessionLocal()
+        try:
+            db.query(SchedulerLock).filter(
+                SchedulerLock.job_name == name,
+                SchedulerLock.owner == self.owner,
+            ).update({SchedulerLock.locked_until: None}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    # ── Execução (thread) ──
+
+    def _execute(self, job: ScheduledJob, slot: Optional[datetime], trigger: str) -> None:
+        db = SessionLocal()
+        try:
+            if not self._acquire(db, job, slot):
+                logger.debug("Agendador: %s já executado/em execução por outra réplica", job.name)
+                return
+
+            run = SchedulerJobRun(job_name=job.name, owner=self.owner, trigger=trigger, scheduled_for=slot)
+            db.add(run)
+            db.commit()
+
+            started = datetime.utcnow()
+            status, result, error = "ok", None, None
+            try:
+                result = job.func()
+            except Exception as e:
+                status, error = "error", str(e)[:1000]
+                logger.error("Agendador: job %s falhou: %s", job.name, e)
+            finished = datetime.utcnow()
+
+            run.status = status
+            run.finished_at = finished
+            run.duration_ms = round((finished - started).total_seconds() * 1000, 1)
+            run.result = json.dumps(result, ensure_ascii=False, default=str)[:4000] if result is not None else None
+            run.error = error
+            db.commit()
+            self._release(db, job)
+            logger.info("Agendador: %s concluído (%s) em %.0f ms", job.name, status, run.duration_ms)
+        except Exception as e:
+            logger.error("Agendador: erro ao executar %s: %s", job.name, e)
+        finally:
+            db.close()
+
+
+# ─── Jobs padrão ──────────────────────────────────────────────────────────────
+
+def _weekly_reports_job() -> dict:
+    """Segunda de manhã: resume a semana que acabou de fechar, não a que começou há poucas horas."""
+    from app.services import report_service
+    job_id = report_service.create_job(None, 7)
+    return report_service.generate_reports(None, 7, job_id, period_week=report_service.previous_week_start())
+
+
+def _maintenance_job() -> dict:
+    from app.services import maintenance_service
+    return maintenance_service.run_nightly_maintenance()
+
+
+def _abandon_sweep_job() -> dict:
+    from app.services import sweeper_service
+    return sweeper_service.sweep_abandoned()
+
+
+def _deferred_analysis_job() -> dict:
+    from app.services import analysis_service
+    return analysis_service.enqueue_deferred()
+
+
+def build_scheduler() -> Scheduler:
+    sched = Scheduler()
+    if settings.SCHEDULER_REPORTS_CRON:
+        sched.add_job(ScheduledJob("weekly_reports", _weekly_reports_job, cron=settings.SCHEDULER_REPORTS_CRON))
+    if settings.SCHEDULER_MAINTENANCE_CRON:
+        sched.add_job(ScheduledJob("nightly_maintenance", _maintenance_job, cron=settings.SCHEDULER_MAINTENANCE_CRON))
+    if settings.SCHEDULER_ABANDON_SWEEP_SECONDS > 0:
+        sched.add_job(ScheduledJob(
+            "abandon_sweep",
+            _abandon_sweep_job,
+            interval_seconds=settings.SCHEDULER_ABANDON_SWEEP_SECONDS,
+            lock_ttl_seconds=max(settings.SCHEDULER_ABANDON_SWEEP_SECONDS * 5, 300),
+        ))
+    if settings.SCHEDULER_DEFERRED_ANALYSIS_SECONDS > 0:
+        sched.add_job(ScheduledJob(
+            "deferred_analysis",
+            _deferred_analysis_job,
+            interval_seconds=settings.SCHEDULER_DEFERRED_ANALYSIS_SECONDS,
+            lock_ttl_seconds=max(settings.SCHEDULER_DEFERRED_ANALYSIS_SECONDS * 5, 300),
+        ))
+    return sched
+
+
+scheduler = build_scheduler()
@@ -26,6 +26,8 @@ class Conversation(Base):
     first_response_at = Column(DateTime, nullable=True)
     resolved_at = Column(DateTime, nullable=True)
     last_message_at = Column(DateTime, nullable=True)
+    # Marca qualquer alteração na conversa (watermark do pipeline de relatórios)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
 
     # Tempo de primeira resposta em segundos
     first_response_time_seconds = Column(Float, nullable=True)
@@ -52,6 +54,13 @@ class Conversation(Base):
     analysis_summary = Column(Text, nullable=True)
     analysis_analyzed_at = Column(DateTime, nullable=True)
 
+    # Análise incremental: resumo acumulado + última mensagem já enviada ao LLM
+    analysis_running_summary = Column(Text, nullable=True)
+    analysis_last_message_id = Column(Integer, nullable=True)
+    analysis_input_tokens = Column(Integer, nullable=True)    # tokens da última chamada
+    analysis_output_tokens = Column(Integer, nullable=True)
+    analysis_deferred_at = Column(DateTime, nullable=True)    # orçamento esgotado: aguardando o agendador
+
     team = relationship("Team", back_populates="conversations")
     attendant = relationship(
         "Attendant",
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Text, ForeignKey
 from datetime import datetime
 from app.core.database import Base
 
@@ -51,3 +51,12 @@ class DatabricksJobRun(Base):
     # Extracted + sent parameters
     extracted_codigo_cliente = Column(String(50), nullable=True)
     notebook_params_json = Column(Text, nullable=True)  # JSON snapshot of params sent to Databricks
+
+    # Delivery of the output PDF back to the requesting phone
+    instance_id = Column(Integer, ForeignKey("instances.id"), nullable=True)  # instance that received the trigger
+    delivery_status = Column(String(20), nullable=True)  # pending, sending, delivered, failed (None = not applicable)
+    delivery_attempts = Column(Integer, default=0)
+    delivery_error = Column(Text, nullable=True)
+    delivered_at = Column(DateTime, nullable=True)
+    output_file = Column(String(500), nullable=True)  # DBFS path actually sent
+    output_size = Column(BigInteger, nullable=True)
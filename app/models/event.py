@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from sqlalchemy import Column, String, BigInteger, DateTime, Integer, Text
+from app.core.database import Base
+
+
+class EventSequence(Base):
+    """Contador de eventos por tópico do barramento PostgreSQL (LISTEN/NOTIFY)."""
+    __tablename__ = "event_sequences"
+
+    topic = Column(String(40), primary_key=True)   # instance_id ou "global"
+    seq = Column(BigInteger, nullable=False, default=0)
+
+
+class EventPayload(Base):
+    """Evento maior que o limite do NOTIFY: o corpo fica aqui e o NOTIFY leva só o id."""
+    __tablename__ = "event_payloads"
+
+    id = Column(Integer, primary_key=True)
+    body = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # apagado após EVENT_BUS_PAYLOAD_RETENTION_SECONDS
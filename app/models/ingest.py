@@ -0,0 +1,41 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
+from datetime import datetime
+from app.core.database import Base
+
+
+class IngestJob(Base):
+    """Webhook aguardando os workers de ingestão (app.services.ingest_queue)."""
+    __tablename__ = "ingest_queue"
+
+    id = Column(Integer, primary_key=True, index=True)
+    instance_name = Column(String(100), nullable=False)
+    partition = Column(Integer, nullable=False)         # crc32(instance_name) % INGEST_QUEUE_PARTITIONS
+    event = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)              # corpo do webhook (JSON)
+    status = Column(String(20), nullable=False, default="queued")  # queued, processing, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_ingest_queue_status_partition", "status", "partition", "id"),
+    )
+
+
+class IngestWorker(Base):
+    """Métricas publicadas periodicamente por cada worker de ingestão."""
+    __tablename__ = "ingest_workers"
+
+    worker = Column(String(150), primary_key=True)      # host:índice
+    pid = Column(Integer, nullable=True)
+    partitions = Column(String(200), nullable=True)     # partições atendidas, separadas por vírgula
+    status = Column(String(20), nullable=False, default="running")  # running, stopped
+    processed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    batches = Column(Integer, default=0)
+    avg_ms = Column(Integer, nullable=True)             # duração média por webhook
+    lag_seconds = Column(Integer, nullable=True)        # idade do webhook mais antigo do último lote
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
@@ -17,6 +17,8 @@ class Instance(Base):
     owner_email = Column(String(255), nullable=True)
     auto_message_enabled = Column(Boolean, default=False, nullable=False)
     auto_message_text = Column(Text, nullable=True)
+    llm_daily_token_budget = Column(Integer, nullable=True)  # None = usa LLM_DAILY_TOKEN_BUDGET
+    abandon_after_minutes = Column(Integer, nullable=True)  # None = usa ABANDON_AFTER_MINUTES; 0 = nunca abandona
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float
+from datetime import datetime
+from app.core.database import Base
+
+
+class LlmCall(Base):
+    """Uma linha por chamada LLM — telemetria de tokens, latência e resultado."""
+    __tablename__ = "llm_calls"
+
+    id = Column(Integer, primary_key=True, index=True)
+    service = Column(String(30), nullable=False, index=True)   # analysis, routing, suggestions, report
+    provider = Column(String(20), nullable=False)
+    model = Column(String(60), nullable=False)
+    instance_id = Column(Integer, nullable=True, index=True)
+    conversation_id = Column(Integer, nullable=True)
+
+    input_tokens = Column(Integer, default=0)
+    output_tokens = Column(Integer, default=0)
+    latency_ms = Column(Float, nullable=True)
+    retries = Column(Integer, default=0)
+    outcome = Column(String(20), nullable=False)  # ok, error, cancelled, budget_exceeded
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
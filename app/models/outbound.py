@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index
+from datetime import datetime
+from app.core.database import Base
+
+
+class OutboundMessage(Base):
+    """Mensagem de saída na fila de envio (app.services.outbound_service)."""
+    __tablename__ = "outbound_messages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    instance_id = Column(Integer, ForeignKey("instances.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True)
+    phone = Column(String(100), nullable=False)          # número ou JID de destino
+    text = Column(Text, nullable=False)
+    source = Column(String(30), nullable=False)          # console, auto_message, databricks
+    status = Column(String(20), nullable=False, default="queued")  # queued, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    evolution_id = Column(String(100), nullable=True)    # key.id devolvido pela Evolution
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)  # linha que o eco do webhook deduplica
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbound_messages_status_next", "status", "next_attempt_at"),
+    )
@@ -30,6 +30,7 @@ class AtendimentoRaw(Base):
     analysis_satisfaction = Column(Integer, nullable=True)
 
     period_week = Column(Date, nullable=True, index=True)  # segunda-feira da semana
+    source_updated_at = Column(DateTime, nullable=True)  # última alteração da conversa de origem
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
@@ -99,3 +100,36 @@ class AtendentRaw(Base):
     __table_args__ = (
         UniqueConstraint("attendant_id", "period_week", name="uq_atendente_week"),
     )
+
+
+class ReportWatermark(Base):
+    """Até onde cada etapa incremental do pipeline já processou, por instância."""
+    __tablename__ = "report_watermarks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    stage = Column(String(50), nullable=False)
+    instance_id = Column(Integer, nullable=False)
+    watermark = Column(DateTime, nullable=False)       # início da última execução bem-sucedida
+    covered_since = Column(DateTime, nullable=True)    # início da janela já coberta
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("stage", "instance_id", name="uq_report_watermark_stage"),
+    )
+
+
+class ReportWeekState(Base):
+    """Impressão digital de atendimento_raw por (instância × semana) na última agregação.
+    Semanas cuja origem não mudou são puladas nas etapas 2–3."""
+    __tablename__ = "report_week_states"
+
+    id = Column(Integer, primary_key=True, index=True)
+    instance_id = Column(Integer, nullable=False, index=True)
+    period_week = Column(Date, nullable=False)
+    source_count = Column(Integer, nullable=False, default=0)
+    source_max_updated_at = Column(DateTime, nullable=True)
+    aggregated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("instance_id", "period_week", name="uq_report_week_state"),
+    )
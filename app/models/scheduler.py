@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float
+from datetime import datetime
+from app.core.database import Base
+
+
+class SchedulerLock(Base):
+    """Trava de líder por job agendado — só uma réplica executa cada disparo."""
+    __tablename__ = "scheduler_locks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_name = Column(String(50), unique=True, nullable=False)
+    owner = Column(String(120), nullable=True)           # host:pid:id da réplica que detém a trava
+    locked_until = Column(DateTime, nullable=True)       # expira sozinha se a réplica morrer
+    last_fire_at = Column(DateTime, nullable=True)       # último horário agendado já executado
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SchedulerJobRun(Base):
+    """Histórico de execuções do agendador."""
+    __tablename__ = "scheduler_job_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_name = Column(String(50), nullable=False, index=True)
+    owner = Column(String(120), nullable=True)
+    trigger = Column(String(20), nullable=False, default="schedule")  # schedule | manual
+    status = Column(String(20), nullable=False, default="running")    # running | ok | error
+    scheduled_for = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, default=datetime.utcnow, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Float, nullable=True)
+    result = Column(Text, nullable=True)   # JSON retornado pelo job
+    error = Column(Text, nullable=True)
@@ -0,0 +1,223 @@
+"""
+Console do atendente via WebSocket (/api/ws/console).
+
+O cliente assina conversas e/ou instâncias e recebe só os eventos delas — o filtro
+é feito no servidor sobre o broker de app.core.events. Envio de mensagens usa o
+mesmo socket; cada envio roda em paralelo aos demais comandos e responde com
+ack/error levando o ref do pedido.
+
+Cliente → servidor (JSON):
+  {"op": "subscribe",   "conversation_ids": [..], "instance_ids": [..]}
+  {"op": "unsubscribe", "conversation_ids": [..], "instance_ids": [..]}
+  {"op": "send", "conversation_id": 1, "text": "...", "ref": "abc"}
+  {"op": "ping"} / {"op": "pong"}
+
+Servidor → cliente: os eventos do broker (new_message v2 recortado às conversas
+assinadas, message_deleted, new_call, note_added, note_deleted, sla_breach,
+resync), {"type": "subscribed"}, {"type": "ack"|"error", "ref": ...},
+{"type": "ping"} e {"type": "pong"}.
+
+Contrapressão: a fila do assinante é limitada (EVENTS_QUEUE_SIZE) e vira resync ao
+estourar; um cliente que não consome em CONSOLE_WS_SEND_TIMEOUT_SECONDS é desconectado.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Optional, Set
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.events import subscribe, resubscribe, unsubscribe
+from app.models.conversation import Conversation
+from app.services import metrics_service
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api", tags=["console"])
+
+
+def _conversation_instances(conversation_ids: Set[int]) -> dict:
+    db = SessionLocal()
+    try:
+        rows = db.query(Conversation.id, Conversation.instance_id).filter(Conversation.id.in_(conversation_ids)).all()
+        return {conv_id: instance_id for conv_id, instance_id in rows}
+    finally:
+        db.close()
+
+
+def _event_conversation_ids(event: dict) -> Set[int]:
+    ids = set(event.get("conversation_ids") or ())
+    if event.get("conversation_id") is not None:
+        ids.add(event["conversation_id"])
+    ids.update(m["conversation_id"] for m in event.get("messages") or ())
+    return ids
+
+
+class ConsoleConnection:
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self.instance_ids: Set[int] = set()
+        self.conversations: dict = {}  # conversation_id → instance_id
+        self.sub = subscribe(instance_ids=())
+        self.last_seen = time.monotonic()
+        self._write_lock = asyncio.Lock()
+        self.sends: Set[asyncio.Task] = set()  # envios aguardando a entrega
+
+    # ── Escrita ──
+
+    async def write(self, data) -> None:
+        text = data if isinstance(data, str) else json.dumps(data, default=str)
+        async with self._write_lock:
+            await asyncio.wait_for(self.ws.send_text(text), timeout=settings.CONSOLE_WS_SEND_TIMEOUT_SECONDS)
+
+    def _filter(self, event_type: str, payload: str) -> Optional[str]:
+        """Payload a enviar (recortado às conversas assinadas) ou None se não interessa."""
+        if event_type == "resync":
+            return payload
+        event = json.loads(payload)
+        if event.get("instance_id") in self.instance_ids:
+            return payload
+        wanted = _event_conversation_ids(event) & self.conversations.keys()
+        if not wanted:
+            return None
+        if event_type == "new_message" and "messages" in event:
+            # Só as conversas assinadas; contadores agregados da instância não se aplicam
+            event["messages"] = [m for m in event["messages"] if m["conversation_id"] in wanted]
+            event["conversations"] = [c for c in event.get("conversations") or () if c["id"] in wanted]
+            event.pop("counters", None)
+            return json.dumps(event, default=str)
+        if "conversation_ids" in event:
+            event["conversation_ids"] = sorted(wanted)
+            return json.dumps(event, default=str)
+        return payload
+
+    async def pump(self) -> None:
+        """Encaminha os eventos do broker; no silêncio envia ping e verifica o cliente."""
+        heartbeat = max(settings.CONSOLE_WS_HEARTBEAT_SECONDS, 1)
+        while True:
+            item = await self.sub.get(timeout=heartbeat)
+            if item is None:
+                if time.monotonic() - self.last_seen > heartbeat * 2:
+                    logger.info("Console WS: cliente sem resposta; encerrando")
+                    await self.ws.close(code=1001)
+                    return
+                await self.write({"type": "ping"})
+                continue
+            _, event_type, payload, _ = item
+            data = self._filter(event_type, payload)
+            if data is not None:
+                await self.write(data)
+
+    # ── Comandos ──
+
+    async def _resubscribe(self) -> None:
+        topics = self.instance_ids | set(self.conversations.values())
+        resubscribe(self.sub, topics)
+        await self.write({
+            "type": "subscribed",
+            "conversation_ids": sorted(self.conversations),
+            "instance_ids": sorted(self.instance_ids),
+        })
+
+    async def handle_subscribe(self, msg: dict) -> None:
+        conversation_ids = {int(i) for i in msg.get("conversation_ids") or ()}
+        instance_ids = {int(i) for i in msg.get("instance_ids") or ()}
+        new_ids = conversation_ids - self.conversations.keys()
+        total = len(self.conversations) + len(new_ids) + len(self.instance_ids | instance_ids)
+        if total > settings.CONSOLE_WS_MAX_SUBSCRIPTIONS:
+            await self.write({"type": "error", "ref": msg.get("ref"), "detail": "Limite de assinaturas excedido"})
+            return
+        if new_ids:
+            found = await run_in_threadpool(_conversation_instances, new_ids)
+            missing = sorted(new_ids - found.keys())
+            if missing:
+                await self.write({"type": "error", "ref": msg.get("ref"), "detail": "Conversa não encontrada", "conversation_ids": missing})
+            self.conversations.update(found)
+        self.instance_ids |= instance_ids
+        await self._resubscribe()
+
+    async def handle_unsubscribe(self, msg: dict) -> None:
+        for conv_id in msg.get("conversation_ids") or ():
+            self.conversations.pop(int(conv_id), None)
+        self.instance_ids -= {int(i) for i in msg.get("instance_ids") or ()}
+        await self._resubscribe()
+
+    async def handle_send(self, msg: dict) -> None:
+        """Roda em task própria: a espera pela entrega (até OUTBOUND_SEND_WAIT_SECONDS) não
+        segura o loop de leitura; o cliente correlaciona o ack pelo ref."""
+        ref = msg.get("ref")
+        text = (msg.get("text") or "").strip()
+        if not text:
+            await self.write({"type": "error", "ref": ref, "detail": "Texto da mensagem não pode ser vazio"})
+            return
+        db = SessionLocal()
+        try:
+            result = await metrics_service.send_message_to_conversation(db, int(msg["conversation_id"]), text)
+        except (ValueError, TypeError, KeyError) as e:
+            await self.write({"type": "error", "ref": ref, "detail": f"Mensagem inválida: {e}"})
+            return
+        finally:
+            db.close()
+        if "error" in result:
+            await self.write({"type": "error", "ref": ref, "detail": result["error"]})
+        else:
+            await self.write({"type": "ack", "ref": ref, "message": result})
+
+    def spawn_send(self, msg: dict) -> None:
+        task = asyncio.create_task(self.handle_send(msg))
+        self.sends.add(task)
+        task.add_done_callback(self._send_done)
+
+    def _send_done(self, task: asyncio.Task) -> None:
+        self.sends.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Console WS: envio falhou: %s", task.exception())
+
+    async def receive(self) -> None:
+        while True:
+            raw = await self.ws.receive_text()
+            self.last_seen = time.monotonic()
+            try:
+                msg = json.loads(raw)
+                op = msg.get("op")
+                if op == "ping":
+                    await self.write({"type": "pong"})
+                elif op == "pong":
+                    pass
+                elif op == "subscribe":
+                    await self.handle_subscribe(msg)
+                elif op == "unsubscribe":
+                    await self.handle_unsubscribe(msg)
+                elif op == "send":
+                    self.spawn_send(msg)
+                else:
+                    await self.write({"type": "error", "ref": msg.get("ref"), "detail": f"Operação desconhecida: {op}"})
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                await self.write({"type": "error", "detail": f"Mensagem inválida: {e}"})
+
+
+@router.websocket("/ws/console")
+async def console_socket(ws: WebSocket):
+    await ws.accept()
+    conn = ConsoleConnection(ws)
+    tasks = [asyncio.create_task(conn.pump()), asyncio.create_task(conn.receive())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            exc = task.exception()
+            if isinstance(exc, asyncio.TimeoutError):
+                logger.info("Console WS: cliente lento (envio > %ss); encerrando", settings.CONSOLE_WS_SEND_TIMEOUT_SECONDS)
+                await ws.close(code=1013)
+            elif exc and not isinstance(exc, WebSocketDisconnect):
+                logger.warning("Console WS: conexão encerrada com erro: %s", exc)
+    except Exception:
+        pass  # socket já fechado pelo cliente
+    finally:
+        for task in tasks + list(conn.sends):
+            task.cancel()
+        unsubscribe(conn.sub)
@@ -12,7 +12,7 @@ from app.schemas.databricks import (
     DatabricksValidateResponse,
     DatabricksJobRunResponse,
 )
-from app.services import databricks_service
+from app.services import databricks_service, trigger_engine
 
 router = APIRouter(prefix="/api/databricks", tags=["databricks"])
 
@@ -54,13 +54,58 @@ def save_config(data: DatabricksConfigCreate, db: Session = Depends(get_db)):
     return _config_to_response(config)
 
 
+@router.get("/configs", response_model=List[DatabricksConfigResponse])
+def list_configs(db: Session = Depends(get_db)):
+    return [_config_to_response(c) for c in databricks_service.list_configs(db)]
+
+
+@router.post("/configs", response_model=DatabricksConfigResponse)
+def create_config(data: DatabricksConfigCreate, db: Session = Depends(get_db)):
+    config = databricks_service.create_config(db, data.model_dump())
+    return _config_to_response(config)
+
+
+@router.put("/configs/{config_id}", response_model=DatabricksConfigResponse)
+def update_config(config_id: int, data: DatabricksConfigCreate, db: Session = Depends(get_db)):
+    config = databricks_service.get_config(db, config_id)
+    if not config:
+        raise HTTPException(status_code=404, detail="Configuração não encontrada")
+    config = databricks_service.update_config(db, config, data.model_dump())
+    return _config_to_response(config)
+
+
+@router.patch("/configs/{config_id}/active", response_model=DatabricksConfigResponse)
+def set_config_active(config_id: int, active: bool, db: Session = Depends(get_db)):
+    config = databricks_service.get_config(db, config_id)
+    if not config:
+        raise HTTPException(status_code=404, detail="Configuração não encontrada")
+    config = databricks_service.update_config(db, config, {"active": active})
+    return _config_to_response(config)
+
+
+@router.delete("/configs/{config_id}")
+def delete_config(config_id: int, db: Session = Depends(get_db)):
+    config = databricks_service.get_config(db, config_id)
+    if not config:
+        raise HTTPException(status_code=404, detail="Configuração não encontrada")
+    if not databricks_service.delete_config(db, config):
+        raise HTTPException(status_code=409, detail="Configuração com execuções em andamento")
+    return {"status": "deleted"}
+
+
+@router.get("/triggers/metrics")
+def trigger_metrics():
+    """Regras carregadas, estados do autômato, reconstruções e mensagens avaliadas."""
+    return trigger_engine.get_metrics()
+
+
 # ---------------------------------------------------------------------------
 # Validate (preview — no trigger)
 # ---------------------------------------------------------------------------
 
 @router.post("/validate", response_model=DatabricksValidateResponse)
 def validate_message(body: DatabricksValidateRequest, db: Session = Depends(get_db)):
-    config = databricks_service.get_config(db)
+    config = databricks_service.get_config(db, body.config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Nenhuma configuração Databricks encontrada")
     result = databricks_service.preview_validation(body.message, config)
@@ -73,7 +118,7 @@ def validate_message(body: DatabricksValidateRequest, db: Session = Depends(get_
 
 @router.post("/trigger", response_model=DatabricksJobRunResponse)
 def manual_trigger(body: DatabricksTriggerRequest, db: Session = Depends(get_db)):
-    config = databricks_service.get_config(db)
+    config = databricks_service.get_config(db, body.config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Nenhuma configuração Databricks encontrada")
 
@@ -125,8 +170,21 @@ def list_runs(limit: int = 50, db: Session = Depends(get_db)):
 
 
 @router.post("/runs/{run_id}/refresh", response_model=DatabricksJobRunResponse)
-def refresh_run(run_id: int, db: Session = Depends(get_db)):
-    run = databricks_service.refresh_run_status(db, run_id)
+async def refresh_run(run_id: int, db: Session = Depends(get_db)):
+    await databricks_service.poll_run_now(run_id)
+    run = db.query(DatabricksJobRun).filter(DatabricksJobRun.id == run_id).first()
     if not run:
         raise HTTPException(status_code=404, detail="Execução não encontrada")
     return run
+
+
+@router.get("/executor/metrics")
+def executor_metrics():
+    """Disparos em execução e na fila, recusados e deduplicados (cooldown)."""
+    return databricks_service.get_executor_metrics()
+
+
+@router.get("/poller/metrics")
+def poller_metrics():
+    """Runs acompanhados, consultas, erros e atualizações do poller de status."""
+    return databricks_service.get_poller_metrics()
@@ -12,7 +12,9 @@ from app.services.evolution_service import (
     get_webhook,
     normalize_qrcode_base64,
 )
+from app.services.evolution_client import evolution, CircuitOpenError
 from app.services.email_service import send_qrcode_email
+from app.services import sweeper_service
 import httpx
 
 router = APIRouter(prefix="/api", tags=["instances"])
@@ -191,10 +193,12 @@ async def check_instance_status(instance_id: int, db: Session = Depends(get_db))
     if not instance.api_url or not instance.api_key:
         return {"state": "unknown", "error": "Instância sem URL ou API Key configurada"}
 
-    url = f"{instance.api_url.rstrip('/')}/instance/connectionState/{instance.instance_name}"
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            resp = await client.get(url, headers={"apikey": instance.api_key})
+        # Sem novas tentativas: o status deve refletir a falha na hora
+        resp = await evolution.request(
+            "GET", instance.api_url, instance.api_key, f"/instance/connectionState/{instance.instance_name}",
+            instance=instance.instance_name, idempotent=False, timeout=10,
+        )
         if resp.status_code == 200:
             data = resp.json()
             # Evolution API v1: {"instance": {"state": "open"}}
@@ -206,6 +210,8 @@ async def check_instance_status(instance_id: int, db: Session = Depends(get_db))
             )
             return {"state": str(state).lower(), "instance_name": instance.instance_name, "api_url": instance.api_url}
         return {"state": "error", "error": f"HTTP {resp.status_code}", "api_url": instance.api_url}
+    except CircuitOpenError:
+        return {"state": "unreachable", "error": "Evolution API falhando repetidamente; nova verificação em instantes", "api_url": instance.api_url}
     except httpx.ConnectError:
         return {"state": "unreachable", "error": f"Não foi possível conectar em {instance.api_url}", "api_url": instance.api_url}
     except httpx.TimeoutException:
@@ -294,6 +300,39 @@ def set_auto_message(instance_id: int, payload: dict, db: Session = Depends(get_
     return {"enabled": instance.auto_message_enabled, "text": instance.auto_message_text or ""}
 
 
+@router.get("/instances/{instance_id}/abandonment")
+def get_abandonment(instance_id: int, db: Session = Depends(get_db)):
+    instance = db.query(Instance).filter(Instance.id == instance_id, Instance.active == True).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instância não encontrada")
+    return {
+        "abandon_after_minutes": instance.abandon_after_minutes,
+        "effective_minutes": sweeper_service.idle_threshold_minutes(instance),
+    }
+
+
+@router.put("/instances/{instance_id}/abandonment")
+def set_abandonment(instance_id: int, payload: dict, db: Session = Depends(get_db)):
+    """abandon_after_minutes: null = padrão global; 0 = nunca abandonar automaticamente."""
+    instance = db.query(Instance).filter(Instance.id == instance_id, Instance.active == True).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instância não encontrada")
+    minutes = payload.get("abandon_after_minutes")
+    if minutes is not None:
+        try:
+            minutes = int(minutes)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="abandon_after_minutes deve ser inteiro")
+        if minutes < 0:
+            raise HTTPException(status_code=400, detail="abandon_after_minutes não pode ser negativo")
+    instance.abandon_after_minutes = minutes
+    db.commit()
+    return {
+        "abandon_after_minutes": instance.abandon_after_minutes,
+        "effective_minutes": sweeper_service.idle_threshold_minutes(instance),
+    }
+
+
 @router.delete("/instances/{instance_id}")
 def delete_instance(instance_id: int, db: Session = Depends(get_db)):
     instance = db.query(Instance).filter(Instance.id == instance_id).first()
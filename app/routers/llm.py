@@ -0,0 +1,61 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.models.instance import Instance
+from app.services import llm_service
+
+router = APIRouter(prefix="/api/llm", tags=["llm"])
+
+
+class BudgetUpdate(BaseModel):
+    daily_token_budget: Optional[int] = None  # None = volta ao padrão global
+
+
+@router.get("/usage")
+def llm_usage(
+    group_by: str = Query(default="service", pattern="^(service|instance|day)$"),
+    days: int = Query(default=7, ge=1, le=90),
+    instance_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """Chamadas, tokens e latência p50/p95 por serviço, instância ou dia."""
+    return llm_service.get_usage(db, group_by, days, instance_id)
+
+
+@router.get("/budgets")
+def list_budgets(db: Session = Depends(get_db)):
+    instances = db.query(Instance).filter(Instance.active == True).all()
+    result = []
+    for inst in instances:
+        budget = llm_service.get_daily_budget(db, inst.id)
+        used = llm_service.tokens_used_today(db, inst.id)
+        result.append({
+            "instance_id": inst.id,
+            "instance_name": inst.instance_name,
+            "daily_token_budget": budget or None,
+            "is_default": inst.llm_daily_token_budget is None,
+            "used_today": used,
+            "remaining": max(budget - used, 0) if budget else None,
+            "exhausted": bool(budget) and used >= budget,
+        })
+    return result
+
+
+@router.put("/budgets/{instance_id}")
+def set_budget(instance_id: int, payload: BudgetUpdate, db: Session = Depends(get_db)):
+    instance = db.query(Instance).filter(Instance.id == instance_id, Instance.active == True).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instância não encontrada")
+    if payload.daily_token_budget is not None and payload.daily_token_budget < 0:
+        raise HTTPException(status_code=400, detail="Orçamento não pode ser negativo")
+    instance.llm_daily_token_budget = payload.daily_token_budget
+    db.commit()
+    return {
+        "instance_id": instance.id,
+        "daily_token_budget": instance.llm_daily_token_budget,
+        "default_budget": settings.LLM_DAILY_TOKEN_BUDGET,
+    }
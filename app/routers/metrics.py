@@ -1,11 +1,16 @@
+import json
 import logging
-from fastapi import APIRouter, Depends, Query, BackgroundTasks, HTTPException
+from fastapi import APIRouter, Depends, Query, BackgroundTasks, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 from pydantic import BaseModel
 from app.core.database import get_db
+from app.core.events import broadcast_threadsafe
 from app.services import metrics_service
 from app.services import analysis_service
+from app.services import sla_service
 
 
 class GroupConfigUpdate(BaseModel):
@@ -170,16 +175,59 @@ def get_suggestions(
     return {"suggestions": suggestions}
 
 
+@router.get("/conversations/{conversation_id}/suggestions/stream")
+async def stream_suggestions(
+    conversation_id: int,
+    request: Request,
+    company_tone: str = Query(default=""),
+):
+    """Sugestões via text/event-stream: cada sugestão é enviada assim que o LLM a completa."""
+    from app.services import suggestion_service
+    conversation_text, instance_id = await run_in_threadpool(
+        suggestion_service.load_conversation_context, conversation_id
+    )
+
+    async def generate():
+        suggestions = suggestion_service.stream_suggestions(
+            conversation_id, conversation_text, company_tone, instance_id
+        )
+        count = 0
+        try:
+            async for text in suggestions:
+                if await request.is_disconnected():
+                    break
+                yield f"data: {json.dumps({'type': 'suggestion', 'index': count, 'text': text})}\n\n"
+                count += 1
+            yield f"data: {json.dumps({'type': 'done', 'count': count})}\n\n"
+        except Exception as e:
+            logging.getLogger(__name__).error("stream_suggestions failed conv=%s: %s", conversation_id, e)
+            yield 'data: {"type":"error"}\n\n'
+        finally:
+            # Fecha o stream do provedor se o cliente desconectou no meio
+            await suggestions.aclose()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "Connection": "keep-alive",
+        },
+    )
+
+
 @router.post("/conversations/{conversation_id}/analyze")
 def analyze_conversation(
     conversation_id: int,
     background_tasks: BackgroundTasks,
+    full: bool = Query(default=False, description="Reenvia o transcript completo em vez do modo incremental"),
     db: Session = Depends(get_db),
 ):
     conv = metrics_service.get_conversation_detail(db, conversation_id)
     if not conv:
         raise HTTPException(status_code=404, detail="Conversa não encontrada")
-    background_tasks.add_task(analysis_service.analyze_conversation, conversation_id)
+    background_tasks.add_task(analysis_service.analyze_conversation, conversation_id, full)
     return {"status": "analyzing"}
 
 
@@ -233,6 +281,8 @@ def sla_alerts(
     threshold_minutes: int = Query(default=30, ge=1, le=1440),
     db: Session = Depends(get_db),
 ):
+    if sla_service.is_ready():
+        return sla_service.get_alerts(instance_id, threshold_minutes)
     return metrics_service.get_sla_alerts(db, instance_id, threshold_minutes)
 
 
@@ -289,16 +339,24 @@ def add_note(conversation_id: int, body: NoteCreate, db: Session = Depends(get_d
     db.add(note)
     db.commit()
     db.refresh(note)
-    return {
+    result = {
         "id": note.id,
         "author_name": note.author_name,
         "content": note.content,
         "created_at": note.created_at.isoformat(),
     }
+    broadcast_threadsafe({
+        "type": "note_added",
+        "instance_id": conv.instance_id,
+        "conversation_id": conversation_id,
+        "note": result,
+    })
+    return result
 
 
 @router.delete("/conversations/{conversation_id}/notes/{note_id}")
 def delete_note(conversation_id: int, note_id: int, db: Session = Depends(get_db)):
+    from app.models.conversation import Conversation
     from app.models.conversation_note import ConversationNote
     note = db.query(ConversationNote).filter(
         ConversationNote.id == note_id,
@@ -306,6 +364,13 @@ def delete_note(conversation_id: int, note_id: int, db: Session = Depends(get_db
     ).first()
     if not note:
         raise HTTPException(status_code=404, detail="Nota não encontrada")
+    instance_id = db.query(Conversation.instance_id).filter(Conversation.id == conversation_id).scalar()
     db.delete(note)
     db.commit()
+    broadcast_threadsafe({
+        "type": "note_deleted",
+        "instance_id": instance_id,
+        "conversation_id": conversation_id,
+        "note_id": note_id,
+    })
     return {"status": "deleted"}
@@ -0,0 +1,66 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.core.database import get_db
+from app.models.outbound import OutboundMessage
+from app.services import outbound_service
+
+router = APIRouter(prefix="/api/outbound", tags=["outbound"])
+
+
+def _outbound_out(out: OutboundMessage) -> dict:
+    return {
+        "id": out.id,
+        "instance_id": out.instance_id,
+        "conversation_id": out.conversation_id,
+        "phone": out.phone,
+        "text": out.text,
+        "source": out.source,
+        "status": out.status,
+        "attempts": out.attempts,
+        "next_attempt_at": out.next_attempt_at.isoformat() if out.next_attempt_at else None,
+        "last_error": out.last_error,
+        "evolution_id": out.evolution_id,
+        "message_id": out.message_id,
+        "created_at": out.created_at.isoformat() if out.created_at else None,
+        "sent_at": out.sent_at.isoformat() if out.sent_at else None,
+    }
+
+
+@router.get("/metrics")
+def outbound_metrics(db: Session = Depends(get_db)):
+    """Tamanho da fila, falhas, latência de entrega e tokens disponíveis por instância."""
+    return outbound_service.get_metrics(db)
+
+
+@router.get("")
+def list_outbound(
+    status: Optional[str] = None,
+    instance_id: Optional[int] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    query = db.query(OutboundMessage)
+    if status:
+        query = query.filter(OutboundMessage.status == status)
+    if instance_id:
+        query = query.filter(OutboundMessage.instance_id == instance_id)
+    return [_outbound_out(o) for o in query.order_by(OutboundMessage.id.desc()).limit(limit).all()]
+
+
+@router.post("/{outbound_id}/retry")
+def retry_outbound(outbound_id: int, db: Session = Depends(get_db)):
+    """Recoloca na fila uma mensagem que falhou."""
+    out = db.query(OutboundMessage).filter(OutboundMessage.id == outbound_id).first()
+    if not out:
+        raise HTTPException(status_code=404, detail="Mensagem não encontrada")
+    if out.status != "failed":
+        raise HTTPException(status_code=409, detail="Só mensagens com falha podem ser reenviadas")
+    out.status = "queued"
+    out.attempts = 0
+    out.next_attempt_at = datetime.utcnow()
+    db.commit()
+    outbound_service.wake()
+    return _outbound_out(out)
@@ -2,7 +2,7 @@ import json
 import logging
 from datetime import date
 from typing import Optional, List
-from fastapi import APIRouter, Depends, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException, Query
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
@@ -16,10 +16,18 @@ router = APIRouter(prefix="/api/reports", tags=["reports"])
 
 
 class GenerateRequest(BaseModel):
-    instance_id: int
+    instance_id: Optional[int] = None  # None = todas as instâncias ativas
     days: int = 7
 
 
+class BackfillRequest(BaseModel):
+    start: date
+    end: date
+    instance_id: Optional[int] = None  # None = todas as instâncias ativas
+    force: bool = False       # reagrega mesmo semanas sem alteração na origem
+    summarize: bool = False   # também gera os resumos LLM das semanas reagregadas
+
+
 class AttendantSummaryOut(BaseModel):
     attendant_id: int
     attendant_name: str
@@ -83,19 +91,72 @@ def generate_reports(
 ):
     """
     Inicia geração do relatório semanal por atendente em background.
-    O pipeline: agrega dados → chama LLM → salva resumo em atendente_raw.
+    O pipeline: agrega dados → chama LLM (em paralelo) → salva resumo em atendente_raw.
+    Sem instance_id, processa todas as instâncias ativas num único job.
+    Progresso: GET /api/reports/jobs/{job_id} ou eventos SSE 'report_progress'.
     """
+    instance_ids = [body.instance_id] if body.instance_id else None
+    job_id = report_service.create_job(instance_ids, body.days)
     background_tasks.add_task(
-        report_service.generate_all_reports,
-        body.instance_id,
+        report_service.generate_reports,
+        instance_ids,
         body.days,
+        job_id,
     )
     return {
         "status": "generating",
+        "job_id": job_id,
         "message": f"Relatório em processamento para os últimos {body.days} dias. Aguarde alguns segundos e recarregue.",
     }
 
 
+@router.post("/backfill")
+def backfill_reports(
+    body: BackfillRequest,
+    background_tasks: BackgroundTasks,
+):
+    """
+    Reconstrói em lote as agregações de todas as semanas entre start e end.
+    Semanas cuja origem não mudou desde a última agregação são puladas (exceto com force).
+    Progresso: GET /api/reports/jobs/{job_id} ou eventos SSE 'report_progress'.
+    """
+    if body.end < body.start:
+        raise HTTPException(status_code=400, detail="end deve ser maior ou igual a start")
+    instance_ids = [body.instance_id] if body.instance_id else None
+    job_id = report_service.create_job(
+        instance_ids, None, kind="backfill",
+        start=str(body.start), end=str(body.end), force=body.force, summarize=body.summarize,
+    )
+    background_tasks.add_task(
+        report_service.backfill_reports,
+        body.start,
+        body.end,
+        instance_ids,
+        body.force,
+        body.summarize,
+        job_id,
+    )
+    return {
+        "status": "generating",
+        "job_id": job_id,
+        "message": f"Backfill de {body.start:%d/%m/%Y} a {body.end:%d/%m/%Y} em processamento.",
+    }
+
+
+@router.get("/jobs")
+def list_report_jobs():
+    """Jobs de geração recentes (mantidos em memória neste processo)."""
+    return report_service.list_jobs()
+
+
+@router.get("/jobs/{job_id}")
+def get_report_job(job_id: str):
+    job = report_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+
 @router.get("/attendant-summaries", response_model=List[AttendantSummaryOut])
 def get_attendant_summaries(
     instance_id: Optional[int] = None,
@@ -0,0 +1,78 @@
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.core.database import get_db
+from app.core.scheduler import scheduler
+from app.models.scheduler import SchedulerLock, SchedulerJobRun
+
+router = APIRouter(prefix="/api/scheduler", tags=["scheduler"])
+
+
+def _run_out(run: SchedulerJobRun) -> dict:
+    try:
+        result = json.loads(run.result) if run.result else None
+    except ValueError:
+        result = run.result
+    return {
+        "id": run.id,
+        "job_name": run.job_name,
+        "owner": run.owner,
+        "trigger": run.trigger,
+        "status": run.status,
+        "scheduled_for": run.scheduled_for.isoformat() if run.scheduled_for else None,
+        "started_at": run.started_at.isoformat() if run.started_at else None,
+        "finished_at": run.finished_at.isoformat() if run.finished_at else None,
+        "duration_ms": run.duration_ms,
+        "result": result,
+        "error": run.error,
+    }
+
+
+@router.get("/jobs")
+def list_scheduled_jobs(db: Session = Depends(get_db)):
+    """Jobs registrados, próximo disparo nesta réplica, trava e última execução."""
+    locks = {lock.job_name: lock for lock in db.query(SchedulerLock).all()}
+    result = []
+    for job in scheduler.list_jobs():
+        lock = locks.get(job.name)
+        last = (
+            db.query(SchedulerJobRun)
+            .filter(SchedulerJobRun.job_name == job.name)
+            .order_by(SchedulerJobRun.started_at.desc())
+            .first()
+        )
+        result.append({
+            "name": job.name,
+            "spec": job.spec,
+            "next_run": job.next_fire.isoformat() if job.next_fire else None,
+            "running_here": scheduler.is_running(job.name),
+            "lock_owner": lock.owner if lock and lock.locked_until else None,
+            "locked_until": lock.locked_until.isoformat() if lock and lock.locked_until else None,
+            "last_run": _run_out(last) if last else None,
+        })
+    return {"enabled": scheduler.started, "owner": scheduler.owner, "jobs": result}
+
+
+@router.get("/history")
+def scheduler_history(
+    job_name: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    query = db.query(SchedulerJobRun)
+    if job_name:
+        query = query.filter(SchedulerJobRun.job_name == job_name)
+    runs = query.order_by(SchedulerJobRun.started_at.desc()).limit(limit).all()
+    return [_run_out(r) for r in runs]
+
+
+@router.post("/jobs/{job_name}/run")
+async def run_job_now(job_name: str):
+    """Executa o job imediatamente (respeita a trava: não roda se outra réplica o estiver executando)."""
+    if not scheduler.get_job(job_name):
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if not scheduler.run_now(job_name):
+        raise HTTPException(status_code=409, detail="Job já em execução")
+    return {"status": "started", "job_name": job_name}
@@ -1,29 +1,41 @@
 import asyncio
-import json
+from typing import List, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Query, Request
 from fastapi.responses import StreamingResponse
 
-from app.core.events import subscribe, unsubscribe
+from app.core.events import subscribe, unsubscribe, get_metrics, format_event_id
 
 router = APIRouter(prefix="/api", tags=["events"])
 
+HEARTBEAT_SECONDS = 30
+
 
 @router.get("/events")
-async def sse_stream():
+async def sse_stream(
+    request: Request,
+    instance_id: Optional[List[int]] = Query(default=None, description="Filtra por instância (repetível)"),
+    types: Optional[str] = Query(default=None, description="Tipos de evento separados por vírgula"),
+    last_event_id: Optional[str] = Query(default=None, description="Alternativa ao header Last-Event-ID"),
+):
+    """Stream SSE. Reconexões retomam a partir do header Last-Event-ID (enviado pelo EventSource)."""
+    resume_from = request.headers.get("last-event-id") or last_event_id or None
+    type_filter = [t.strip() for t in types.split(",") if t.strip()] if types else None
+
     async def generate():
-        q = subscribe()
+        sub = subscribe(instance_id, type_filter, resume_from)
         try:
             while True:
-                try:
-                    event = await asyncio.wait_for(q.get(), timeout=30)
-                    yield f"data: {json.dumps(event)}\n\n"
-                except asyncio.TimeoutError:
+                item = await sub.get(timeout=HEARTBEAT_SECONDS)
+                if item is None:
                     yield 'data: {"type":"heartbeat"}\n\n'
+                    continue
+                seq, _, payload, _ = item
+                yield f"id: {format_event_id(seq)}\ndata: {payload}\n\n"
         except asyncio.CancelledError:
             pass
         finally:
-            unsubscribe(q)
+            unsubscribe(sub)
 
     return StreamingResponse(
         generate(),
@@ -34,3 +46,9 @@ async def sse_stream():
             "Connection": "keep-alive",
         },
     )
+
+
+@router.get("/events/metrics")
+def sse_metrics():
+    """Assinantes, eventos publicados/entregues/descartados/agrupados e atraso de entrega."""
+    return get_metrics()
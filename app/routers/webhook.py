@@ -1,12 +1,9 @@
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from app.core.database import get_db
 from app.schemas.webhook import WebhookPayload
-from app.services import webhook_service
-from app.services.routing_service import route_conversation
-from app.services import databricks_service
-from app.core.events import broadcast
-from app.models.instance import Instance
+from app.services import ingest_dispatcher, ingest_pipeline, ingest_queue, webhook_decoder, webhook_dedup
 
 EVENT_PATH_TO_EVENT = {
     "presence-update": "presence.update",
@@ -52,46 +49,16 @@ async def _handle_webhook_body(
     background_tasks: BackgroundTasks,
     db: Session,
 ):
-    if event == "messages.upsert":
-        new_ids, auto_messages = webhook_service.process_message_upsert(db, instance_name, body.get("data"))
-        await broadcast({"type": "new_message", "instance": instance_name})
-        for cid in new_ids:
-            background_tasks.add_task(route_conversation, cid)
-        for api_url, api_key, inst_name, phone, text in auto_messages:
-            background_tasks.add_task(webhook_service.send_auto_message_task, api_url, api_key, inst_name, phone, text)
-
-        # Check inbound messages for Databricks keyword trigger
-        instance_obj = db.query(Instance).filter(Instance.instance_name == instance_name).first()
-        if instance_obj:
-            messages_data = body.get("data") or []
-            if not isinstance(messages_data, list):
-                messages_data = [messages_data]
-            for msg_data in messages_data:
-                key = msg_data.get("key", {})
-                if key.get("fromMe"):
-                    continue
-                remote_jid = key.get("remoteJid", "")
-                if "@g.us" in remote_jid:
-                    continue
-                message_content = msg_data.get("message") or {}
-                text = (
-                    message_content.get("conversation")
-                    or (message_content.get("extendedTextMessage") or {}).get("text")
-                )
-                if text:
-                    phone = remote_jid.split("@")[0].split(":")[0]
-                    databricks_service.check_and_trigger(db, instance_obj.id, phone, text)
-    elif event == "messages.update":
-        webhook_service.process_message_update(db, instance_name, body.get("data"))
-        await broadcast({"type": "message_updated", "instance": instance_name})
-    elif event in ("groups.upsert", "groups.update", "group.update", "group.participants.update"):
-        webhook_service.process_groups_upsert(db, instance_name, body.get("data"))
-        await broadcast({"type": "groups_updated", "instance": instance_name})
-    elif event == "call":
-        webhook_service.process_call_event(db, instance_name, body)
-        await broadcast({"type": "new_call", "instance": instance_name})
-    # presence.update, chats.update, contacts.update, connection.update, logout.instance, remove.instance - acknowledged
-
+    if settings.INGEST_QUEUE_ENABLED and event in ingest_queue.QUEUED_EVENTS:
+        # Modo fila: os workers (python -m app.workers.ingest) processam fora do processo web
+        ingest_queue.enqueue(db, instance_name, event, body)
+        db.commit()
+        return {"status": "queued", "event": event}
+    try:
+        await ingest_pipeline.handle_event(db, instance_name, event, body, background_tasks)
+    except ingest_dispatcher.IngestBusy:
+        # Shard da conversa saturado: a Evolution reentrega e o dedup descarta o que já foi gravado
+        raise HTTPException(status_code=503, detail="Ingest busy, retry later")
     return {"status": "ok", "event": event}
 
 
@@ -103,8 +70,8 @@ async def receive_webhook(
     db: Session = Depends(get_db),
 ):
     try:
-        body = await request.json()
-    except Exception:
+        body = webhook_decoder.decode_body(await request.body())
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
     instance_name = (
@@ -123,6 +90,19 @@ async def receive_webhook(
     return await _handle_webhook_body(body, event, instance_name, background_tasks, db)
 
 
+@router.get("/dedup/metrics")
+def dedup_metrics():
+    """Ids em memória, reentregas descartadas antes do banco e ids carregados no startup."""
+    return webhook_dedup.get_metrics()
+
+
+@router.get("/ingest/metrics")
+def ingest_metrics(db: Session = Depends(get_db)):
+    """Shards deste processo (fila, concluídos, recusados com 503) e, no modo fila,
+    profundidade da fila e métricas de cada worker."""
+    return {"shards": ingest_dispatcher.get_metrics(), "queue": ingest_queue.get_metrics(db)}
+
+
 root_router = APIRouter(tags=["webhook-events"])
 
 
@@ -133,8 +113,8 @@ def _make_event_handler(event_path: str):
         db: Session = Depends(get_db),
     ):
         try:
-            body = await request.json()
-        except Exception:
+            body = webhook_decoder.decode_body(await request.body())
+        except ValueError:
             raise HTTPException(status_code=400, detail="Invalid JSON payload")
         instance_name = body.get("instance") or body.get("instanceName") or ""
         if not instance_name:
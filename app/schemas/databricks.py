@@ -48,10 +48,12 @@ class DatabricksConfigResponse(BaseModel):
 class DatabricksTriggerRequest(BaseModel):
     message: str
     phone: Optional[str] = "teste_manual"
+    config_id: Optional[int] = None  # None = primeira config ativa
 
 
 class DatabricksValidateRequest(BaseModel):
     message: str
+    config_id: Optional[int] = None
 
 
 class DatabricksValidateResponse(BaseModel):
@@ -76,5 +78,12 @@ class DatabricksJobRunResponse(BaseModel):
     completed_at: Optional[datetime]
     extracted_codigo_cliente: Optional[str]
     notebook_params_json: Optional[str]
+    instance_id: Optional[int] = None
+    delivery_status: Optional[str] = None
+    delivery_attempts: Optional[int] = None
+    delivery_error: Optional[str] = None
+    delivered_at: Optional[datetime] = None
+    output_file: Optional[str] = None
+    output_size: Optional[int] = None
 
     model_config = {"from_attributes": True}
@@ -109,6 +109,8 @@ class ConversationDetail(BaseModel):
     analysis_satisfaction: Optional[int] = None
     analysis_summary: Optional[str] = None
     analysis_analyzed_at: Optional[datetime] = None
+    analysis_input_tokens: Optional[int] = None
+    analysis_output_tokens: Optional[int] = None
 
     # Equipe de triagem
     team_id: Optional[int] = None
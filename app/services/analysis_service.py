@@ -1,11 +1,17 @@
 import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.core.database import SessionLocal
 from app.models.conversation import Conversation
 from app.models.message import Message, MessageDirection
+from app.services import llm_service
 
 logger = logging.getLogger(__name__)
 
@@ -19,13 +25,12 @@ SYSTEM_PROMPT = """Você é um assistente especialista em análise de conversas
 Analise a conversa fornecida e retorne APENAS um objeto JSON válido, sem markdown, sem explicações.
 Não inclua nenhum texto fora do JSON."""
 
-USER_PROMPT_TEMPLATE = """Analise a seguinte conversa de atendimento ao cliente no WhatsApp.
-
-Retorne APENAS um JSON válido com os campos:
+_RESPONSE_FIELDS = """Retorne APENAS um JSON válido com os campos:
 - "category": uma das opções exatas: reclamacao, problema_tecnico, nova_contratacao, suporte, elogio, informacao, outro
 - "sentiment": "positivo", "neutro" ou "negativo"
 - "satisfaction": inteiro de 1 a 5 (1=muito insatisfeito, 5=muito satisfeito). Se não há como avaliar, use 3.
 - "summary": resumo em 1-2 frases em português descrevendo o atendimento e seu desfecho
+- "running_summary": resumo detalhado de toda a conversa até aqui (até 6 frases), usado como contexto nas próximas análises
 
 Categorias:
 - reclamacao: cliente reclamando de produto/serviço
@@ -34,51 +39,62 @@ Categorias:
 - suporte: dúvida ou pedido de ajuda geral
 - elogio: feedback positivo, agradecimento
 - informacao: pedido de informações sem reclamação
-- outro: não se encaixa nas anteriores
+- outro: não se encaixa nas anteriores"""
+
+USER_PROMPT_TEMPLATE = """Analise a seguinte conversa de atendimento ao cliente no WhatsApp.
+
+""" + _RESPONSE_FIELDS + """
 
 Conversa:
 {conversa}"""
 
+INCREMENTAL_PROMPT_TEMPLATE = """Atualize a análise de uma conversa de atendimento ao cliente no WhatsApp.
+Considere o resumo acumulado e as mensagens novas; a análise vale para a conversa inteira.
+
+""" + _RESPONSE_FIELDS + """
+
+Resumo acumulado até a última análise:
+{resumo}
+
+Mensagens novas:
+{conversa}"""
+
+# Estimativa grosseira usada no orçamento de tokens (~4 caracteres por token)
+CHARS_PER_TOKEN = 4
+# Mensagens iniciais mantidas quando o transcript precisa ser truncado
+HEAD_MESSAGES = 3
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
 
-def _build_conversation_text(messages: list) -> str:
+
+def _build_conversation_text(messages: list, max_tokens: Optional[int] = None) -> str:
+    """Monta o transcript. Se passar de max_tokens, mantém as primeiras mensagens
+    (contexto do pedido) e as mais recentes, omitindo o meio."""
     lines = []
     for m in messages:
         if not m.content:
             continue
         role = "Atendente" if m.direction == MessageDirection.outbound else "Cliente"
         lines.append(f"[{role}]: {m.content}")
-    return "\n".join(lines)
-
-
-def _call_anthropic(conversation_text: str) -> str:
-    import anthropic
-    client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-    response = client.messages.create(
-        model="claude-haiku-4-5-20251001",
-        max_tokens=512,
-        system=SYSTEM_PROMPT,
-        messages=[
-            {
-                "role": "user",
-                "content": USER_PROMPT_TEMPLATE.format(conversa=conversation_text),
-            }
-        ],
-    )
-    return response.content[0].text.strip()
-
-
-def _call_openai(conversation_text: str) -> str:
-    from openai import OpenAI
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        max_tokens=512,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": USER_PROMPT_TEMPLATE.format(conversa=conversation_text)},
-        ],
-    )
-    return response.choices[0].message.content.strip()
+
+    text = "\n".join(lines)
+    if max_tokens is None or _estimate_tokens(text) <= max_tokens:
+        return text
+
+    budget = max_tokens * CHARS_PER_TOKEN
+    head = lines[:HEAD_MESSAGES]
+    budget -= sum(len(line) + 1 for line in head)
+    tail: list = []
+    for line in reversed(lines[HEAD_MESSAGES:]):
+        if budget - (len(line) + 1) < 0:
+            break
+        tail.append(line)
+        budget -= len(line) + 1
+    tail.reverse()
+    omitted = len(lines) - len(head) - len(tail)
+    return "\n".join(head + [f"[... {omitted} mensagens omitidas ...]"] + tail)
 
 
 def _parse_result(raw: str) -> dict:
@@ -90,9 +106,13 @@ def _parse_result(raw: str) -> dict:
     return json.loads(raw)
 
 
-def analyze_conversation(conversation_id: int) -> None:
+def analyze_conversation(conversation_id: int, full: bool = False) -> None:
     """Analisa uma conversa com LLM e salva os resultados.
     Projetada para rodar em background (FastAPI BackgroundTasks).
+
+    Em modo incremental (padrão quando já existe resumo acumulado), envia apenas o
+    resumo + mensagens posteriores a analysis_last_message_id. full=True força
+    o reenvio do transcript completo.
     """
     provider = settings.LLM_PROVIDER.lower()
 
@@ -112,22 +132,54 @@ def analyze_conversation(conversation_id: int) -> None:
         if not conv:
             return
 
-        messages = (
-            db.query(Message)
-            .filter(Message.conversation_id == conversation_id, Message.is_deleted == False)
-            .order_by(Message.timestamp.asc())
-            .all()
+        incremental = (
+            settings.ANALYSIS_INCREMENTAL
+            and not full
+            and bool(conv.analysis_running_summary)
+            and conv.analysis_last_message_id is not None
         )
 
-        conversation_text = _build_conversation_text(messages)
+        query = db.query(Message).filter(
+            Message.conversation_id == conversation_id,
+            Message.is_deleted == False,
+        )
+        if incremental:
+            query = query.filter(Message.id > conv.analysis_last_message_id)
+        messages = query.order_by(Message.timestamp.asc()).all()
+
+        if incremental:
+            budget = max(settings.ANALYSIS_MAX_INPUT_TOKENS - _estimate_tokens(conv.analysis_running_summary), 200)
+        else:
+            budget = settings.ANALYSIS_MAX_INPUT_TOKENS
+        conversation_text = _build_conversation_text(messages, max_tokens=budget)
         if not conversation_text.strip():
-            logger.info(f"Conversa {conversation_id} sem texto — análise ignorada.")
+            if incremental:
+                logger.info(f"Conversa {conversation_id} sem mensagens novas — análise ignorada.")
+            else:
+                logger.info(f"Conversa {conversation_id} sem texto — análise ignorada.")
             return
 
-        if provider == "openai":
-            raw = _call_openai(conversation_text)
+        if incremental:
+            prompt = INCREMENTAL_PROMPT_TEMPLATE.format(
+                resumo=conv.analysis_running_summary,
+                conversa=conversation_text,
+            )
         else:
-            raw = _call_anthropic(conversation_text)
+            prompt = USER_PROMPT_TEMPLATE.format(conversa=conversation_text)
+
+        instance_id = conv.instance_id
+        last_message_id = max(m.id for m in messages) if messages else None
+        db.commit()  # devolve a conexão ao pool durante a chamada ao LLM (que também grava telemetria)
+
+        raw, input_tokens, output_tokens = llm_service.complete(
+            "analysis",
+            prompt,
+            system=SYSTEM_PROMPT,
+            max_tokens=512,
+            instance_id=instance_id,
+            conversation_id=conversation_id,
+            low_priority=True,
+        )
 
         data = _parse_result(raw)
 
@@ -146,22 +198,125 @@ def analyze_conversation(conversation_id: int) -> None:
             satisfaction = 3
 
         summary = str(data.get("summary", ""))[:500]
+        running_summary = str(data.get("running_summary") or summary)[:2000]
 
         conv.analysis_category = category
         conv.analysis_sentiment = sentiment
         conv.analysis_satisfaction = satisfaction
         conv.analysis_summary = summary
         conv.analysis_analyzed_at = datetime.utcnow()
+        conv.analysis_running_summary = running_summary
+        conv.analysis_input_tokens = input_tokens
+        conv.analysis_output_tokens = output_tokens
+        conv.analysis_deferred_at = None
+        if last_message_id is not None:
+            conv.analysis_last_message_id = last_message_id
         db.commit()
 
         logger.info(
-            f"Conversa {conversation_id} analisada via {provider}: "
+            f"Conversa {conversation_id} analisada via {provider} "
+            f"({'incremental' if incremental else 'completa'}, {len(messages)} msgs, "
+            f"tokens in={input_tokens} out={output_tokens}): "
             f"{category} / {sentiment} / {satisfaction}"
         )
 
+    except llm_service.LlmBudgetExceeded:
+        db.rollback()
+        mark_deferred(db, [conversation_id])
+        logger.info(
+            f"Conversa {conversation_id}: orçamento diário de tokens esgotado — "
+            f"análise pendente até o agendador retomá-la após o reset diário."
+        )
     except json.JSONDecodeError as e:
         logger.error(f"Erro ao parsear JSON da análise da conversa {conversation_id}: {e}")
     except Exception as e:
         logger.error(f"Erro ao analisar conversa {conversation_id}: {e}")
     finally:
         db.close()
+
+
+# ─── Análises adiadas pelo orçamento ───────────────────────────────────────────
+
+def mark_deferred(db: Session, conversation_ids: Iterable[int]) -> int:
+    """Marca as conversas como pendentes de análise (analysis_deferred_at).
+    O job deferred_analysis do agendador as enfileira quando o orçamento da instância libera."""
+    ids = list(conversation_ids)
+    if not ids:
+        return 0
+    db.query(Conversation).filter(Conversation.id.in_(ids)).update(
+        {"analysis_deferred_at": datetime.utcnow()}, synchronize_session=False
+    )
+    db.commit()
+    return len(ids)
+
+
+def enqueue_deferred() -> dict:
+    """Enfileira as análises adiadas das instâncias cujo orçamento diário já liberou.
+    A marca sai na hora de enfileirar; se o orçamento voltar a estourar, a análise marca de novo."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Conversation.id, Conversation.instance_id)
+            .filter(Conversation.analysis_deferred_at.isnot(None))
+            .order_by(Conversation.analysis_deferred_at)
+            .all()
+        )
+        by_instance: Dict[int, List[int]] = {}
+        for conversation_id, instance_id in rows:
+            by_instance.setdefault(instance_id, []).append(conversation_id)
+
+        with _pending_lock:
+            room = max(settings.ANALYSIS_QUEUE_LIMIT - len(_pending), 0)
+        ready: List[int] = []
+        for instance_id, ids in by_instance.items():
+            if not llm_service.budget_exhausted(instance_id, db):
+                ready.extend(ids)
+        ready = ready[:room]
+        if ready:
+            db.query(Conversation).filter(Conversation.id.in_(ready)).update(
+                {"analysis_deferred_at": None}, synchronize_session=False
+            )
+        db.commit()
+    finally:
+        db.close()
+
+    queued = enqueue_analysis(ready)
+    if ready:
+        logger.info(f"Análises adiadas: {queued} enfileiradas, {len(rows) - len(ready)} aguardando orçamento.")
+    return {"queued": queued, "waiting": len(rows) - len(ready)}
+
+
+# ─── Fila de análises em background ───────────────────────────────────────────
+
+_executor = ThreadPoolExecutor(max_workers=max(settings.ANALYSIS_MAX_WORKERS, 1), thread_name_prefix="analysis")
+_pending: set = set()
+_pending_lock = threading.Lock()
+
+
+def _run_queued(conversation_id: int) -> None:
+    try:
+        analyze_conversation(conversation_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(conversation_id)
+
+
+def enqueue_analysis(conversation_ids: Iterable[int]) -> int:
+    """Agenda análises num pool limitado (ANALYSIS_MAX_WORKERS).
+    Ignora conversas já na fila e descarta o excedente de ANALYSIS_QUEUE_LIMIT.
+    Retorna quantas foram enfileiradas."""
+    queued = 0
+    dropped = 0
+    for conversation_id in conversation_ids:
+        with _pending_lock:
+            if conversation_id in _pending:
+                continue
+            if len(_pending) >= settings.ANALYSIS_QUEUE_LIMIT:
+                dropped += 1
+                continue
+            _pending.add(conversation_id)
+        _executor.submit(_run_queued, conversation_id)
+        queued += 1
+    if dropped:
+        logger.warning(f"Fila de análise cheia — {dropped} conversas não enfileiradas.")
+    return queued
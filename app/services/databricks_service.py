@@ -1,47 +1,102 @@
+import asyncio
+import base64
 import logging
+import posixpath
 import re
-import threading
+import time
+import uuid
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import urllib.request
 import urllib.error
 import json
 
+import httpx
+from sqlalchemy import update as sa_update
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.database import SessionLocal
+from app.core.events import broadcast
+from app.core.executor import BoundedExecutor
 from app.models.databricks import DatabricksConfig, DatabricksJobRun
 from app.models.instance import Instance
+from app.services import outbound_service, trigger_engine
+from app.services.evolution_client import evolution
 
 logger = logging.getLogger(__name__)
 
+# Bounded pool for webhook-triggered runs: bursts of keyword messages queue here instead of spawning threads
+_executor = BoundedExecutor(
+    "databricks",
+    max_workers=settings.DATABRICKS_MAX_WORKERS,
+    queue_limit=settings.DATABRICKS_QUEUE_LIMIT,
+    cooldown_seconds=settings.DATABRICKS_TRIGGER_COOLDOWN_SECONDS,
+)
+
 
 # ---------------------------------------------------------------------------
 # Config helpers
 # ---------------------------------------------------------------------------
 
-def get_config(db: Session) -> Optional[DatabricksConfig]:
-    return db.query(DatabricksConfig).filter(DatabricksConfig.active == True).first()
+def get_config(db: Session, config_id: Optional[int] = None) -> Optional[DatabricksConfig]:
+    query = db.query(DatabricksConfig)
+    if config_id is not None:
+        return query.filter(DatabricksConfig.id == config_id).first()
+    return query.filter(DatabricksConfig.active == True).order_by(DatabricksConfig.id).first()
+
+
+def list_configs(db: Session) -> List[DatabricksConfig]:
+    return db.query(DatabricksConfig).order_by(DatabricksConfig.id).all()
 
 
 def save_config(db: Session, data: dict) -> DatabricksConfig:
-    existing = db.query(DatabricksConfig).first()
+    """Legacy single-config save: updates the first config or creates it."""
+    existing = db.query(DatabricksConfig).order_by(DatabricksConfig.id).first()
     if existing:
-        for key, value in data.items():
-            if key == "api_token" and not value:
-                continue  # empty token = keep existing
-            setattr(existing, key, value)
-        existing.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(existing)
-        return existing
+        return update_config(db, existing, data)
+    return create_config(db, data)
+
+
+def create_config(db: Session, data: dict) -> DatabricksConfig:
     config = DatabricksConfig(**data)
     db.add(config)
     db.commit()
     db.refresh(config)
+    trigger_engine.invalidate()
+    return config
+
+
+def update_config(db: Session, config: DatabricksConfig, data: dict) -> DatabricksConfig:
+    for key, value in data.items():
+        if key == "api_token" and not value:
+            continue  # empty token = keep existing
+        setattr(config, key, value)
+    config.updated_at = datetime.utcnow()
+    db.commit()
+    db.refresh(config)
+    trigger_engine.invalidate()
     return config
 
 
+def delete_config(db: Session, config: DatabricksConfig) -> bool:
+    """Delete a config, keeping its run history. Returns False while it still has active runs."""
+    active = (
+        db.query(DatabricksJobRun.id)
+        .filter(DatabricksJobRun.config_id == config.id, DatabricksJobRun.status.in_(ACTIVE_RUN_STATUSES))
+        .first()
+    )
+    if active:
+        return False
+    db.query(DatabricksJobRun).filter(DatabricksJobRun.config_id == config.id).update(
+        {"config_id": None}, synchronize_session=False
+    )
+    db.delete(config)
+    db.commit()
+    trigger_engine.invalidate()
+    return True
+
+
 def mask_token(token: str) -> str:
     if not token or len(token) < 8:
         return "****"
@@ -79,6 +134,58 @@ def build_notebook_params(config: DatabricksConfig, codigo_cliente: Optional[str
     }
 
 
+def compile_client_code_regex(pattern: Optional[str]) -> "re.Pattern":
+    try:
+        return re.compile(pattern or r"\d+")
+    except re.error:
+        logger.warning(f"Invalid client_code_regex {pattern!r}, falling back to \\d+")
+        return re.compile(r"\d+")
+
+
+class DatabricksRule(NamedTuple):
+    """Detached snapshot of an active DatabricksConfig, kept by the trigger engine.
+    Same attribute names as the model, so the validation/reply helpers accept either."""
+    id: int
+    instance_id: Optional[int]
+    job_id: str
+    trigger_keyword: str
+    client_code_pattern: "re.Pattern"
+    client_code_min_length: Optional[int]
+    client_code_max_length: Optional[int]
+    send_error_reply: bool
+    reply_example: Optional[str]
+    param_catalog: Optional[str]
+    param_schema_name: Optional[str]
+    param_modo: Optional[str]
+    param_output_path: Optional[str]
+
+
+def _load_trigger_rules(db: Session) -> List[trigger_engine.TriggerRule]:
+    rules = []
+    for config in db.query(DatabricksConfig).filter(DatabricksConfig.active == True).all():
+        rule = DatabricksRule(
+            id=config.id,
+            instance_id=config.instance_id,
+            job_id=config.job_id,
+            trigger_keyword=config.trigger_keyword,
+            client_code_pattern=compile_client_code_regex(config.client_code_regex),
+            client_code_min_length=config.client_code_min_length,
+            client_code_max_length=config.client_code_max_length,
+            send_error_reply=config.send_error_reply if config.send_error_reply is not None else True,
+            reply_example=config.reply_example,
+            param_catalog=config.param_catalog,
+            param_schema_name=config.param_schema_name,
+            param_modo=config.param_modo,
+            param_output_path=config.param_output_path,
+        )
+        rules.append(trigger_engine.TriggerRule("databricks", config.id, config.instance_id,
+                                                config.trigger_keyword or "", rule))
+    return rules
+
+
+trigger_engine.register("databricks", _load_trigger_rules)
+
+
 # ---------------------------------------------------------------------------
 # Validation
 # ---------------------------------------------------------------------------
@@ -140,46 +247,14 @@ def preview_validation(message: str, config: DatabricksConfig) -> dict:
 
 
 # ---------------------------------------------------------------------------
-# Evolution API — send WhatsApp reply
+# WhatsApp reply (outbound queue)
 # ---------------------------------------------------------------------------
 
-def _send_evolution_message(api_url: str, api_key: str, instance_name: str, phone: str, text: str):
-    """Send a text message via Evolution API."""
-    url = f"{api_url.rstrip('/')}/message/sendText/{instance_name}"
-    payload = json.dumps({
-        "number": phone,
-        "text": text,
-        "delay": 500,
-    }).encode("utf-8")
-    req = urllib.request.Request(
-        url,
-        data=payload,
-        headers={"apikey": api_key, "Content-Type": "application/json"},
-        method="POST",
-    )
-    with urllib.request.urlopen(req, timeout=15) as resp:
-        return json.loads(resp.read().decode("utf-8"))
-
-
-def _do_send_error_reply(instance_id: int, phone: str, text: str):
-    db = SessionLocal()
-    try:
-        instance = db.query(Instance).filter(Instance.id == instance_id).first()
-        if not instance:
-            logger.warning(f"Instance {instance_id} not found for error reply")
-            return
-        _send_evolution_message(instance.api_url, instance.api_key, instance.instance_name, phone, text)
-        logger.info(f"Error reply sent to {phone}")
-    except Exception as e:
-        logger.error(f"Failed to send WhatsApp error reply to {phone}: {e}")
-    finally:
-        db.close()
-
-
-def send_error_reply_async(instance_id: int, phone: str, text: str):
-    """Send WhatsApp error reply in a background thread (non-blocking)."""
-    t = threading.Thread(target=_do_send_error_reply, args=(instance_id, phone, text), daemon=True)
-    t.start()
+def queue_error_reply(db: Session, instance_id: int, phone: str, text: str):
+    """Queue the WhatsApp error reply on the outbound queue (rate limited, retried)."""
+    outbound_service.enqueue(db, instance_id, phone, text, "databricks")
+    db.commit()
+    outbound_service.wake()
 
 
 # ---------------------------------------------------------------------------
@@ -207,17 +282,6 @@ def _call_databricks_run_now(
         return json.loads(resp.read().decode("utf-8"))
 
 
-def _get_databricks_run_status(workspace_url: str, api_token: str, run_id: str) -> dict:
-    url = workspace_url.rstrip("/") + f"/api/2.1/jobs/runs/get?run_id={run_id}"
-    req = urllib.request.Request(
-        url,
-        headers={"Authorization": f"Bearer {api_token}"},
-        method="GET",
-    )
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        return json.loads(resp.read().decode("utf-8"))
-
-
 def _databricks_state_to_status(state: dict) -> str:
     life = state.get("life_cycle_state", "")
     result = state.get("result_state", "")
@@ -244,9 +308,11 @@ def _create_run_record(
     source: str,
     notebook_params: Optional[dict],
     extracted_codigo_cliente: Optional[str],
+    instance_id: Optional[int] = None,
 ) -> DatabricksJobRun:
     run = DatabricksJobRun(
         config_id=config_id,
+        instance_id=instance_id,
         triggered_by_phone=triggered_by_phone,
         triggered_by_message=triggered_by_message[:500] if triggered_by_message else None,
         trigger_source=source,
@@ -309,6 +375,7 @@ def trigger_job_sync(
 
     db.commit()
     db.refresh(run)
+    wake_poller()
     return run
 
 
@@ -319,8 +386,9 @@ def _do_trigger_async(
     source: str,
     notebook_params: Optional[dict],
     extracted_codigo_cliente: Optional[str],
+    instance_id: Optional[int] = None,
 ):
-    """Background thread version — used by the WhatsApp webhook (fire-and-forget)."""
+    """Executor version — used by the WhatsApp webhook (fire-and-forget)."""
     db = SessionLocal()
     try:
         config = db.query(DatabricksConfig).filter(DatabricksConfig.id == config_id).first()
@@ -329,7 +397,7 @@ def _do_trigger_async(
             return
 
         run = _create_run_record(db, config_id, triggered_by_phone, triggered_by_message,
-                                 source, notebook_params, extracted_codigo_cliente)
+                                 source, notebook_params, extracted_codigo_cliente, instance_id)
 
         try:
             result = _call_databricks_run_now(
@@ -354,6 +422,8 @@ def _do_trigger_async(
             logger.error(f"Databricks trigger error: {e}")
 
         db.commit()
+        if run.status == "running":
+            wake_poller()
     finally:
         db.close()
 
@@ -365,43 +435,540 @@ def trigger_job(
     source: str = "whatsapp",
     notebook_params: Optional[dict] = None,
     extracted_codigo_cliente: Optional[str] = None,
-):
-    """Async trigger (fire-and-forget) — used by WhatsApp webhook."""
-    t = threading.Thread(
-        target=_do_trigger_async,
-        args=(config_id, triggered_by_phone, triggered_by_message, source, notebook_params, extracted_codigo_cliente),
-        daemon=True,
+    instance_id: Optional[int] = None,
+) -> bool:
+    """Async trigger (fire-and-forget) — used by WhatsApp webhook.
+    Returns False when deduplicated (same config + phone + codigo_cliente within the cooldown) or the queue is full."""
+    future = _executor.submit(
+        _do_trigger_async,
+        config_id, triggered_by_phone, triggered_by_message, source, notebook_params, extracted_codigo_cliente,
+        instance_id,
+        key=(config_id, triggered_by_phone, extracted_codigo_cliente),
     )
-    t.start()
+    if future is None:
+        logger.warning(
+            f"Databricks trigger from {triggered_by_phone} (codigo_cliente={extracted_codigo_cliente}) "
+            f"not queued: duplicate within cooldown or executor full"
+        )
+        return False
+    return True
+
+
+async def stop():
+    """Stop accepting triggers and drain the executor (called from the lifespan)."""
+    await asyncio.to_thread(_executor.shutdown, settings.DATABRICKS_DRAIN_SECONDS)
+
+
+def get_executor_metrics() -> dict:
+    return _executor.get_metrics()
 
 
 # ---------------------------------------------------------------------------
-# Refresh run status from Databricks
+# Run status poller (async, started from the lifespan)
 # ---------------------------------------------------------------------------
 
-def refresh_run_status(db: Session, run_id: int) -> Optional[DatabricksJobRun]:
-    run = db.query(DatabricksJobRun).filter(DatabricksJobRun.id == run_id).first()
-    if not run or not run.databricks_run_id or not run.config_id:
-        return run
+ACTIVE_RUN_STATUSES = ("pending", "running")
+
+_poller_loop: Optional[asyncio.AbstractEventLoop] = None
+_poller_wakeup: Optional[asyncio.Event] = None
+_poller_task: Optional[asyncio.Task] = None
+_poller_client: Optional[httpx.AsyncClient] = None
+_poller_semaphore = asyncio.Semaphore(max(settings.DATABRICKS_POLL_CONCURRENCY, 1))
+_tracked: Dict[int, dict] = {}  # DatabricksJobRun.id → run/config snapshot + next check (monotonic)
+_poller_stats = {"checks": 0, "errors": 0, "updates": 0, "cycles": 0, "last_cycle_ms": 0.0}
+
+
+def _poll_interval(age_seconds: float) -> float:
+    """Fast right after the trigger, slower as the run gets older."""
+    interval = age_seconds * settings.DATABRICKS_POLL_AGE_FACTOR
+    return min(settings.DATABRICKS_POLL_MAX_SECONDS, max(settings.DATABRICKS_POLL_MIN_SECONDS, interval))
 
-    config = db.query(DatabricksConfig).filter(DatabricksConfig.id == run.config_id).first()
-    if not config:
-        return run
 
+def _load_active_runs() -> List[dict]:
+    db = SessionLocal()
     try:
-        data = _get_databricks_run_status(config.workspace_url, config.api_token, run.databricks_run_id)
-        state = data.get("state", {})
-        run.status = _databricks_state_to_status(state)
-        if run.status in ("success", "failed") and not run.completed_at:
-            run.completed_at = datetime.utcnow()
-        if run.status == "failed":
-            run.error_message = state.get("state_message", "")[:300] or run.error_message
+        rows = (
+            db.query(DatabricksJobRun, DatabricksConfig)
+            .join(DatabricksConfig, DatabricksConfig.id == DatabricksJobRun.config_id)
+            .filter(
+                DatabricksJobRun.status.in_(ACTIVE_RUN_STATUSES),
+                DatabricksJobRun.databricks_run_id.isnot(None),
+                DatabricksJobRun.databricks_run_id != "",
+            )
+            .all()
+        )
+        return [
+            {
+                "id": run.id,
+                "databricks_run_id": run.databricks_run_id,
+                "status": run.status,
+                "started_at": run.started_at or datetime.utcnow(),
+                "workspace_url": config.workspace_url.rstrip("/"),
+                "api_token": config.api_token,
+                "instance_id": run.instance_id or config.instance_id,
+                # WhatsApp-triggered runs get their output PDF sent back to the requester
+                "deliver": bool(
+                    run.trigger_source == "whatsapp" and run.triggered_by_phone
+                    and (run.instance_id or config.instance_id)
+                ),
+            }
+            for run, config in rows
+        ]
+    finally:
+        db.close()
+
+
+def _sync_tracked(rows: List[dict]) -> None:
+    """Replace the tracked set with the DB view, keeping the schedule of runs already known."""
+    now = time.monotonic()
+    fresh = {}
+    for row in rows:
+        known = _tracked.get(row["id"])
+        age = (datetime.utcnow() - row["started_at"]).total_seconds()
+        # New runs: first check MIN seconds after the trigger (runs found at startup: right away)
+        row["next_check"] = known["next_check"] if known else now + max(0.0, settings.DATABRICKS_POLL_MIN_SECONDS - age)
+        fresh[row["id"]] = row
+    _tracked.clear()
+    _tracked.update(fresh)
+
+
+async def _fetch_run_state(client: httpx.AsyncClient, run: dict) -> Optional[dict]:
+    async with _poller_semaphore:
+        try:
+            resp = await client.get(
+                f"{run['workspace_url']}/api/2.1/jobs/runs/get",
+                params={"run_id": run["databricks_run_id"]},
+                headers={"Authorization": f"Bearer {run['api_token']}"},
+            )
+            resp.raise_for_status()
+            _poller_stats["checks"] += 1
+            return resp.json()
+        except Exception as e:
+            _poller_stats["errors"] += 1
+            logger.warning(f"Could not poll Databricks run {run['databricks_run_id']}: {e}")
+            return None
+
+
+def _run_update(run: dict, data: dict) -> Optional[dict]:
+    """Row changes for a runs/get response, or None when the status is unchanged."""
+    state = data.get("state") or {}
+    status = _databricks_state_to_status(state)
+    if status == run["status"]:
+        return None
+    update = {"id": run["id"], "status": status}
+    if status not in ACTIVE_RUN_STATUSES:
+        end_time = data.get("end_time")
+        update["completed_at"] = datetime.utcfromtimestamp(end_time / 1000) if end_time else datetime.utcnow()
+    if status == "failed" and state.get("state_message"):
+        update["error_message"] = state["state_message"][:300]
+    if status == "success" and run.get("deliver"):
+        update["delivery_status"] = "pending"
+    return update
+
+
+def _apply_run_updates(updates: List[dict]) -> None:
+    """Bulk UPDATE by primary key (one executemany per distinct column set)."""
+    db = SessionLocal()
+    try:
+        db.execute(sa_update(DatabricksJobRun), updates)
         db.commit()
-        db.refresh(run)
-    except Exception as e:
-        logger.warning(f"Could not refresh Databricks run {run.databricks_run_id}: {e}")
+    finally:
+        db.close()
 
-    return run
+
+def _run_event(run: dict, previous_status: str, update: dict, data: dict) -> dict:
+    completed_at = update.get("completed_at")
+    return {
+        "type": "databricks_run_updated",
+        "instance_id": run["instance_id"],
+        "run_id": run["id"],
+        "databricks_run_id": run["databricks_run_id"],
+        "status": update["status"],
+        "previous_status": previous_status,
+        "delivery_status": update.get("delivery_status"),
+        "completed_at": completed_at.isoformat() if completed_at else None,
+        "error_message": update.get("error_message"),
+        "run_page_url": data.get("run_page_url"),
+    }
+
+
+async def _poll_runs(client: httpx.AsyncClient, runs: List[dict]) -> int:
+    """Query runs concurrently, persist the changes in one batch and broadcast them."""
+    results = await asyncio.gather(*(_fetch_run_state(client, run) for run in runs))
+    now = time.monotonic()
+    events = []
+    updates = []
+    for run, data in zip(runs, results):
+        update = _run_update(run, data) if data is not None else None
+        if update:
+            updates.append(update)
+            events.append(_run_event(run, run["status"], update, data))
+            run["status"] = update["status"]
+        if run["status"] in ACTIVE_RUN_STATUSES:
+            age = (datetime.utcnow() - run["started_at"]).total_seconds()
+            run["next_check"] = now + _poll_interval(age)
+        else:
+            _tracked.pop(run["id"], None)
+    if not updates:
+        return 0
+    await asyncio.to_thread(_apply_run_updates, updates)
+    _poller_stats["updates"] += len(updates)
+    for event in events:
+        await broadcast(event)
+    for update in updates:
+        if update.get("delivery_status") == "pending":
+            _schedule_delivery(update["id"])
+    return len(updates)
+
+
+async def _poller() -> None:
+    last_sync = 0.0
+    while True:
+        try:
+            if time.monotonic() - last_sync >= settings.DATABRICKS_POLL_RESYNC_SECONDS or _poller_wakeup.is_set():
+                _poller_wakeup.clear()
+                _sync_tracked(await asyncio.to_thread(_load_active_runs))
+                for run_id in await asyncio.to_thread(_load_pending_deliveries, last_sync == 0.0):
+                    _schedule_delivery(run_id)
+                last_sync = time.monotonic()
+            started = time.monotonic()
+            due = [run for run in _tracked.values() if run["next_check"] <= started]
+            if due:
+                await _poll_runs(_poller_client, due)
+                _poller_stats["cycles"] += 1
+                _poller_stats["last_cycle_ms"] = round((time.monotonic() - started) * 1000, 1)
+        except Exception as e:
+            logger.error(f"Databricks poller cycle failed: {e}")
+        now = time.monotonic()
+        timeout = settings.DATABRICKS_POLL_RESYNC_SECONDS - (now - last_sync)
+        if _tracked:
+            timeout = min(timeout, min(run["next_check"] for run in _tracked.values()) - now)
+        try:
+            await asyncio.wait_for(_poller_wakeup.wait(), timeout=max(timeout, 0.05))
+        except asyncio.TimeoutError:
+            pass
+
+
+def wake_poller() -> None:
+    """New run triggered: reload the tracked set now (callable from threads)."""
+    if _poller_loop is None or _poller_wakeup is None or _poller_loop.is_closed():
+        return
+    _poller_loop.call_soon_threadsafe(_poller_wakeup.set)
+
+
+async def poll_run_now(run_id: int) -> None:
+    """Check one run immediately (manual refresh). Does nothing for finished runs."""
+    run = next((r for r in await asyncio.to_thread(_load_active_runs) if r["id"] == run_id), None)
+    if run is None:
+        return
+    if _poller_client is not None:
+        await _poll_runs(_poller_client, [_tracked.get(run_id, run)])
+        return
+    async with httpx.AsyncClient(timeout=settings.DATABRICKS_POLL_TIMEOUT_SECONDS) as client:
+        await _poll_runs(client, [run])
+
+
+async def start_poller() -> None:
+    global _poller_loop, _poller_wakeup, _poller_task, _poller_client
+    if not settings.DATABRICKS_POLLER_ENABLED:
+        return
+    _poller_loop = asyncio.get_running_loop()
+    _poller_wakeup = asyncio.Event()
+    _poller_client = httpx.AsyncClient(timeout=settings.DATABRICKS_POLL_TIMEOUT_SECONDS)
+    _poller_task = asyncio.create_task(_poller())
+    logger.info("Databricks run poller started")
+
+
+async def stop_poller() -> None:
+    global _poller_task, _poller_client
+    if _poller_task:
+        _poller_task.cancel()
+        try:
+            await _poller_task
+        except asyncio.CancelledError:
+            pass
+        _poller_task = None
+    for task in list(_deliveries.values()):
+        task.cancel()
+    if _deliveries:
+        await asyncio.gather(*_deliveries.values(), return_exceptions=True)
+    if _poller_client:
+        await _poller_client.aclose()
+        _poller_client = None
+    _tracked.clear()
+
+
+def get_poller_metrics() -> dict:
+    now = time.monotonic()
+    return {
+        "enabled": _poller_task is not None,
+        "tracked_runs": len(_tracked),
+        "next_check_seconds": round(min((r["next_check"] for r in _tracked.values()), default=now) - now, 1),
+        **_poller_stats,
+        "deliveries_in_progress": len(_deliveries),
+        "delivery": dict(_delivery_stats),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Output delivery: DBFS → Evolution sendMedia, streamed chunk by chunk
+# ---------------------------------------------------------------------------
+
+DBFS_READ_CHUNK = 1024 * 1024  # dbfs/read returns at most 1 MB per call
+
+_deliveries: Dict[int, asyncio.Task] = {}
+_delivery_semaphore = asyncio.Semaphore(max(settings.DATABRICKS_DELIVERY_CONCURRENCY, 1))
+_delivery_stats = {"delivered": 0, "failed": 0, "retried": 0, "bytes": 0}
+
+
+class DeliveryError(Exception):
+    """Delivery cannot succeed by retrying (no output file, too large, instance gone)."""
+
+
+def _dbfs_api_path(output_path: str) -> str:
+    """/dbfs/FileStore/x.pdf (FUSE mount) or dbfs:/FileStore/x.pdf → /FileStore/x.pdf"""
+    path = output_path.strip()
+    if path.startswith("dbfs:"):
+        path = path[len("dbfs:"):]
+    if path.startswith("/dbfs/"):
+        path = path[len("/dbfs"):]
+    return path.rstrip("/") or "/"
+
+
+def _load_pending_deliveries(reset_sending: bool) -> List[int]:
+    db = SessionLocal()
+    try:
+        if reset_sending:
+            # Deliveries interrupted by a restart (single poller replica): try again
+            db.query(DatabricksJobRun).filter(DatabricksJobRun.delivery_status == "sending").update(
+                {"delivery_status": "pending"}, synchronize_session=False
+            )
+            db.commit()
+        return [
+            run_id for (run_id,) in db.query(DatabricksJobRun.id)
+            .filter(DatabricksJobRun.status == "success", DatabricksJobRun.delivery_status == "pending")
+            .all()
+        ]
+    finally:
+        db.close()
+
+
+def _claim_delivery(run_id: int) -> Optional[dict]:
+    """pending → sending; returns everything the upload needs, or None if someone else has it."""
+    db = SessionLocal()
+    try:
+        claimed = (
+            db.query(DatabricksJobRun)
+            .filter(DatabricksJobRun.id == run_id, DatabricksJobRun.delivery_status == "pending")
+            .update({"delivery_status": "sending"}, synchronize_session=False)
+        )
+        db.commit()
+        if not claimed:
+            return None
+        run = db.query(DatabricksJobRun).filter(DatabricksJobRun.id == run_id).first()
+        config = db.query(DatabricksConfig).filter(DatabricksConfig.id == run.config_id).first()
+        instance_id = run.instance_id or (config.instance_id if config else None)
+        instance = db.query(Instance).filter(Instance.id == instance_id).first() if instance_id else None
+        params = json.loads(run.notebook_params_json) if run.notebook_params_json else {}
+        return {
+            "run_id": run.id,
+            "instance_id": instance_id,
+            "phone": run.triggered_by_phone,
+            "codigo_cliente": run.extracted_codigo_cliente,
+            "started_at": run.started_at or datetime.utcnow(),
+            "attempts": run.delivery_attempts or 0,
+            "output_path": params.get("output_path") or (config.param_output_path if config else None),
+            "workspace_url": config.workspace_url.rstrip("/") if config else None,
+            "api_token": config.api_token if config else None,
+            "instance_name": instance.instance_name if instance else None,
+            "api_url": instance.api_url if instance else None,
+            "api_key": instance.api_key if instance else None,
+        }
+    finally:
+        db.close()
+
+
+def _finish_delivery(run_id: int, error: Optional[str], permanent: bool,
+                     output_file: Optional[str], output_size: Optional[int]) -> str:
+    """Record the outcome; transient failures go back to pending until the attempt limit."""
+    db = SessionLocal()
+    try:
+        run = db.query(DatabricksJobRun).filter(DatabricksJobRun.id == run_id).first()
+        run.delivery_attempts = (run.delivery_attempts or 0) + 1
+        run.output_file = output_file or run.output_file
+        run.output_size = output_size if output_size is not None else run.output_size
+        if error is None:
+            run.delivery_status = "delivered"
+            run.delivered_at = datetime.utcnow()
+            run.delivery_error = None
+        elif permanent or run.delivery_attempts >= settings.DATABRICKS_DELIVERY_MAX_ATTEMPTS:
+            run.delivery_status = "failed"
+            run.delivery_error = error[:500]
+        else:
+            run.delivery_status = "pending"  # picked up again on the next poller resync
+            run.delivery_error = error[:500]
+        db.commit()
+        return run.delivery_status
+    finally:
+        db.close()
+
+
+async def _dbfs_get(client: httpx.AsyncClient, job: dict, endpoint: str, **params) -> httpx.Response:
+    return await client.get(
+        f"{job['workspace_url']}/api/2.0/dbfs/{endpoint}",
+        params=params,
+        headers={"Authorization": f"Bearer {job['api_token']}"},
+    )
+
+
+async def _resolve_output(client: httpx.AsyncClient, job: dict) -> Tuple[str, int]:
+    """DBFS path + size of the PDF to send. A directory resolves to its newest PDF written by this run."""
+    if not job["output_path"]:
+        raise DeliveryError("output_path não configurado")
+    path = _dbfs_api_path(job["output_path"])
+    resp = await _dbfs_get(client, job, "get-status", path=path)
+    if resp.status_code == 404:
+        raise DeliveryError(f"arquivo não encontrado no DBFS: {path}")
+    resp.raise_for_status()
+    status = resp.json()
+    if not status.get("is_dir"):
+        return status.get("path") or path, int(status.get("file_size") or 0)
+
+    resp = await _dbfs_get(client, job, "list", path=path)
+    resp.raise_for_status()
+    not_before = (job["started_at"] - datetime(1970, 1, 1)).total_seconds() * 1000 - 60_000
+    candidates = [
+        f for f in resp.json().get("files") or []
+        if not f.get("is_dir") and f.get("path", "").lower().endswith(".pdf")
+        and (f.get("modification_time") or 0) >= not_before
+    ]
+    if not candidates:
+        raise DeliveryError(f"nenhum PDF gerado em {path} por este run")
+    newest = max(candidates, key=lambda f: f.get("modification_time") or 0)
+    return newest["path"], int(newest.get("file_size") or 0)
+
+
+async def _dbfs_chunks(client: httpx.AsyncClient, job: dict, path: str, size: int):
+    """Yield the file in DBFS_READ_CHUNK pieces; only one chunk is held in memory."""
+    offset = 0
+    while offset < size:
+        resp = await _dbfs_get(client, job, "read", path=path, offset=offset, length=DBFS_READ_CHUNK)
+        resp.raise_for_status()
+        data = resp.json()
+        chunk = base64.b64decode(data.get("data") or "")
+        if not chunk:
+            break
+        offset += len(chunk)
+        yield chunk
+    if offset != size:
+        # Content-Length was promised up front: abort the upload instead of sending a truncated file
+        raise RuntimeError(f"DBFS read ended at {offset} of {size} bytes")
+
+
+def _multipart_envelope(boundary: str, fields: dict, filename: str, mimetype: str) -> Tuple[bytes, bytes]:
+    """Multipart head (form fields + file part header) and tail around the streamed file bytes."""
+    head = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    )
+    head += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {mimetype}\r\n\r\n"
+    ).encode()
+    return head, f"\r\n--{boundary}--\r\n".encode()
+
+
+async def _upload_output(client: httpx.AsyncClient, job: dict, path: str, size: int) -> None:
+    filename = posixpath.basename(path) or "relatorio.pdf"
+    caption = f"📄 Relatório do cliente {job['codigo_cliente']}" if job["codigo_cliente"] else "📄 Seu relatório"
+    boundary = uuid.uuid4().hex
+    head, tail = _multipart_envelope(boundary, {
+        "number": job["phone"],
+        "mediatype": "document",
+        "mimetype": "application/pdf",
+        "fileName": filename,
+        "caption": caption,
+    }, filename, "application/pdf")
+
+    async def body():
+        yield head
+        async for chunk in _dbfs_chunks(client, job, path, size):
+            yield chunk
+        yield tail
+
+    resp = await evolution.request(
+        "POST", job["api_url"], job["api_key"], f"/message/sendMedia/{job['instance_name']}",
+        instance=job["instance_name"],
+        content=body(),
+        headers={
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(len(head) + size + len(tail)),
+        },
+        timeout=settings.DATABRICKS_DELIVERY_TIMEOUT_SECONDS,
+    )
+    if resp.status_code not in (200, 201):
+        message = f"Evolution API {resp.status_code}: {resp.text[:300]}"
+        if 400 <= resp.status_code < 500 and resp.status_code != 429:
+            raise DeliveryError(message)
+        raise RuntimeError(message)
+
+
+async def _deliver_output(run_id: int) -> None:
+    async with _delivery_semaphore:
+        job = await asyncio.to_thread(_claim_delivery, run_id)
+        if job is None:
+            return
+        error, permanent, path, size = None, False, None, None
+        try:
+            if not job["instance_name"] or not job["api_url"]:
+                raise DeliveryError("instância do WhatsApp não encontrada")
+            if not job["workspace_url"]:
+                raise DeliveryError("configuração Databricks não encontrada")
+            client = _poller_client or httpx.AsyncClient(timeout=settings.DATABRICKS_POLL_TIMEOUT_SECONDS)
+            try:
+                path, size = await _resolve_output(client, job)
+                if size > settings.DATABRICKS_DELIVERY_MAX_MB * 1024 * 1024:
+                    raise DeliveryError(f"arquivo grande demais ({size} bytes)")
+                await _upload_output(client, job, path, size)
+            finally:
+                if client is not _poller_client:
+                    await client.aclose()
+        except DeliveryError as e:
+            error, permanent = str(e), True
+        except asyncio.CancelledError:
+            await asyncio.to_thread(_finish_delivery, run_id, "interrompido no desligamento", False, path, size)
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+        delivery_status = await asyncio.to_thread(_finish_delivery, run_id, error, permanent, path, size)
+        if error is None:
+            _delivery_stats["delivered"] += 1
+            _delivery_stats["bytes"] += size
+            logger.info(f"Databricks run {run_id}: {path} ({size} bytes) delivered to {job['phone']}")
+        elif delivery_status == "failed":
+            _delivery_stats["failed"] += 1
+            logger.error(f"Databricks run {run_id}: delivery failed: {error}")
+        else:
+            _delivery_stats["retried"] += 1
+            logger.warning(f"Databricks run {run_id}: delivery attempt failed, will retry: {error}")
+        await broadcast({
+            "type": "databricks_run_updated",
+            "instance_id": job["instance_id"],
+            "run_id": run_id,
+            "status": "success",
+            "delivery_status": delivery_status,
+            "delivery_error": error,
+            "output_file": path,
+        })
+
+
+def _schedule_delivery(run_id: int) -> None:
+    if run_id in _deliveries:
+        return
+    task = asyncio.create_task(_deliver_output(run_id))
+    _deliveries[run_id] = task
+    task.add_done_callback(lambda _: _deliveries.pop(run_id, None))
 
 
 # ---------------------------------------------------------------------------
@@ -411,50 +978,42 @@ def refresh_run_status(db: Session, run_id: int) -> Optional[DatabricksJobRun]:
 def check_and_trigger(db: Session, instance_id: int, phone: str, message_text: str):
     """
     Called from the webhook handler.
-    1. Find active config for this instance.
-    2. Check if the message contains the trigger keyword.
-    3. Validate extracted parameters.
-    4. On validation error: send WhatsApp error reply (async).
-    5. On success: trigger Databricks job (async).
+    1. Match the message against every active config of this instance in one pass (trigger engine).
+    2. Validate the parameters extracted for each matched config.
+    3. Valid: queue the Databricks trigger on the bounded executor.
+    4. None valid: queue a single WhatsApp error reply (first config that wants one).
     """
-    config = (
-        db.query(DatabricksConfig)
-        .filter(
-            DatabricksConfig.active == True,
-            (DatabricksConfig.instance_id == instance_id) | (DatabricksConfig.instance_id == None),
-        )
-        .first()
-    )
-    if not config:
+    matched = trigger_engine.match(instance_id, message_text, kind="databricks", db=db)
+    if not matched:
         return
 
-    if not matches_keyword(message_text, config.trigger_keyword):
-        return
+    error_reply = None
+    triggered = False
+    for match in matched:
+        rule: DatabricksRule = match.data
+        codigo_cliente = extract_codigo_cliente(message_text, rule.client_code_pattern)
+        is_valid, error_reason = validate_params(codigo_cliente, rule)
 
-    # --- Extract ---
-    codigo_cliente = extract_codigo_cliente(message_text, config.client_code_regex or r"\d+")
+        if not is_valid:
+            logger.info(f"Databricks validation failed from {phone} (config {rule.id}): {error_reason}")
+            if rule.send_error_reply and error_reply is None:
+                error_reply = build_error_reply(rule, error_reason)
+            continue
 
-    # --- Validate ---
-    is_valid, error_reason = validate_params(codigo_cliente, config)
-
-    if not is_valid:
-        logger.info(f"Databricks validation failed from {phone}: {error_reason}")
-        if config.send_error_reply:
-            reply_text = build_error_reply(config, error_reason)
-            send_error_reply_async(instance_id, phone, reply_text)
-        return
+        logger.info(
+            f"Databricks keyword '{rule.trigger_keyword}' matched from {phone}. "
+            f"codigo_cliente={codigo_cliente}. Triggering job {rule.job_id} (config {rule.id})."
+        )
+        trigger_job(
+            config_id=rule.id,
+            triggered_by_phone=phone,
+            triggered_by_message=message_text,
+            source="whatsapp",
+            notebook_params=build_notebook_params(rule, codigo_cliente),
+            extracted_codigo_cliente=codigo_cliente,
+            instance_id=instance_id,
+        )
+        triggered = True
 
-    # --- Trigger ---
-    notebook_params = build_notebook_params(config, codigo_cliente)
-    logger.info(
-        f"Databricks keyword '{config.trigger_keyword}' matched from {phone}. "
-        f"codigo_cliente={codigo_cliente}. Triggering job {config.job_id}."
-    )
-    trigger_job(
-        config_id=config.id,
-        triggered_by_phone=phone,
-        triggered_by_message=message_text,
-        source="whatsapp",
-        notebook_params=notebook_params,
-        extracted_codigo_cliente=codigo_cliente,
-    )
+    if error_reply and not triggered:
+        queue_error_reply(db, instance_id, phone, error_reply)
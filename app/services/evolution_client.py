@@ -0,0 +1,281 @@
+"""
+Cliente HTTP da Evolution API compartilhado por toda a aplicação.
+
+- Um pool de conexões (keep-alive) por api_url, assíncrono e síncrono (threads);
+  HTTP/2 quando o pacote `h2` está instalado.
+- Timeouts unificados (EVOLUTION_*_TIMEOUT_SECONDS), com exceção pontual por chamada.
+- Novas tentativas com backoff exponencial + jitter em erros de transporte e 5xx.
+  Requisições não idempotentes (envio de mensagem) só são repetidas quando a
+  conexão nem chegou a ser aberta, para não duplicar envios.
+- Circuit breaker por instância: após EVOLUTION_BREAKER_THRESHOLD falhas seguidas
+  as chamadas falham na hora (CircuitOpenError) por EVOLUTION_BREAKER_RESET_SECONDS;
+  depois uma chamada de teste decide se o circuito fecha.
+
+Os transportes são injetáveis (ex.: httpx.MockTransport) para simular a Evolution.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {500, 502, 503, 504}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class CircuitOpenError(httpx.ConnectError):
+    """Instância com falhas seguidas: a chamada nem é feita (tratada como falha de conexão)."""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = max(threshold, 1)
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True  # só uma chamada de teste por vez
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class EvolutionClient:
+    def __init__(
+        self,
+        transport: Optional[httpx.BaseTransport] = None,
+        async_transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self._transport = transport
+        self._async_transport = async_transport
+        self._http2 = settings.EVOLUTION_HTTP2 and _http2_available()
+        self._sync: Dict[str, httpx.Client] = {}
+        self._async: Dict[Tuple[int, str], httpx.AsyncClient] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    # ── Pools ──
+
+    def _client_kwargs(self) -> dict:
+        return {
+            "timeout": httpx.Timeout(
+                settings.EVOLUTION_TIMEOUT_SECONDS, connect=settings.EVOLUTION_CONNECT_TIMEOUT_SECONDS
+            ),
+            "limits": httpx.Limits(
+                max_connections=settings.EVOLUTION_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.EVOLUTION_MAX_CONNECTIONS,
+                keepalive_expiry=30,
+            ),
+            "http2": self._http2,
+        }
+
+    def _sync_client(self, base_url: str) -> httpx.Client:
+        with self._lock:
+            client = self._sync.get(base_url)
+            if client is None:
+                client = self._sync[base_url] = httpx.Client(
+                    base_url=base_url, transport=self._transport, **self._client_kwargs()
+                )
+            return client
+
+    def _async_client(self, base_url: str) -> httpx.AsyncClient:
+        # AsyncClient fica preso ao event loop em que foi usado
+        key = (id(asyncio.get_running_loop()), base_url)
+        client = self._async.get(key)
+        if client is None:
+            client = self._async[key] = httpx.AsyncClient(
+                base_url=base_url, transport=self._async_transport, **self._client_kwargs()
+            )
+        return client
+
+    def breaker(self, instance: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(instance)
+            if breaker is None:
+                breaker = self._breakers[instance] = CircuitBreaker(
+                    settings.EVOLUTION_BREAKER_THRESHOLD, settings.EVOLUTION_BREAKER_RESET_SECONDS
+                )
+            return breaker
+
+    # ── Política de novas tentativas ──
+
+    @staticmethod
+    def _delay(attempt: int) -> float:
+        base = settings.EVOLUTION_RETRY_BACKOFF_SECONDS * (2 ** attempt)
+        return random.uniform(0, base)  # full jitter
+
+    @staticmethod
+    def _should_retry(error: Optional[Exception], response: Optional[httpx.Response], idempotent: bool) -> bool:
+        if error is not None:
+            # Sem conexão a requisição não saiu: seguro repetir mesmo se não idempotente
+            return idempotent or isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+        return idempotent and response is not None and response.status_code in RETRY_STATUSES
+
+    @staticmethod
+    def _is_failure(error: Optional[Exception], response: Optional[httpx.Response]) -> bool:
+        return error is not None or (response is not None and response.status_code >= 500)
+
+    def _prepare(self, method: str, api_url: str, api_key: str, path: str, timeout, kwargs) -> Tuple[str, dict]:
+        headers = {"apikey": api_key, **(kwargs.pop("headers", None) or {})}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return api_url.rstrip("/"), {"method": method, "url": path, "headers": headers, **kwargs}
+
+    async def request(
+        self,
+        method: str,
+        api_url: str,
+        api_key: str,
+        path: str,
+        *,
+        instance: str,
+        idempotent: Optional[bool] = None,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """Chamada assíncrona. Retorna a última resposta (inclusive 4xx/5xx) ou levanta o erro de transporte."""
+        if idempotent is None:
+            idempotent = method.upper() == "GET"
+        base_url, req = self._prepare(method, api_url, api_key, path, timeout, kwargs)
+        breaker = self.breaker(instance)
+        client = self._async_client(base_url)
+        for attempt in range(settings.EVOLUTION_MAX_RETRIES + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Evolution API indisponível para {instance} (circuito aberto)")
+            error, response = None, None
+            try:
+                response = await client.request(**req)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                breaker.record_failure()  # inclui cancelamento: libera a chamada de teste do half-open
+                raise
+            if self._is_failure(error, response):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+                return response
+            if attempt >= settings.EVOLUTION_MAX_RETRIES or not self._should_retry(error, response, idempotent):
+                break
+            delay = self._delay(attempt)
+            logger.info("Evolution %s %s (%s): %s — nova tentativa em %.2fs",
+                        method, path, instance, error or response.status_code, delay)
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    def request_sync(
+        self,
+        method: str,
+        api_url: str,
+        api_key: str,
+        path: str,
+        *,
+        instance: str,
+        idempotent: Optional[bool] = None,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """Mesma política de request(), para threads (jobs, executors, rotas síncronas)."""
+        if idempotent is None:
+            idempotent = method.upper() == "GET"
+        base_url, req = self._prepare(method, api_url, api_key, path, timeout, kwargs)
+        breaker = self.breaker(instance)
+        client = self._sync_client(base_url)
+        for attempt in range(settings.EVOLUTION_MAX_RETRIES + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Evolution API indisponível para {instance} (circuito aberto)")
+            error, response = None, None
+            try:
+                response = client.request(**req)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                breaker.record_failure()  # inclui cancelamento: libera a chamada de teste do half-open
+                raise
+            if self._is_failure(error, response):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+                return response
+            if attempt >= settings.EVOLUTION_MAX_RETRIES or not self._should_retry(error, response, idempotent):
+                break
+            delay = self._delay(attempt)
+            logger.info("Evolution %s %s (%s): %s — nova tentativa em %.2fs",
+                        method, path, instance, error or response.status_code, delay)
+            time.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    # ── Ciclo de vida / métricas ──
+
+    async def aclose(self) -> None:
+        with self._lock:
+            sync_clients, self._sync = list(self._sync.values()), {}
+        async_clients, self._async = list(self._async.values()), {}
+        for client in sync_clients:
+            client.close()
+        for client in async_clients:
+            try:
+                await client.aclose()
+            except RuntimeError:
+                pass  # cliente de outro event loop (já encerrado)
+
+    def get_metrics(self) -> dict:
+        return {
+            "http2": self._http2,
+            "pools": sorted({key for key in self._sync} | {key[1] for key in self._async}),
+            "breakers": {
+                name: {"state": b.state, "failures": b.failures}
+                for name, b in self._breakers.items()
+                if b.failures or b.opened_at is not None
+            },
+        }
+
+
+evolution = EvolutionClient()
@@ -5,6 +5,8 @@ import httpx
 import qrcode
 from typing import Optional
 
+from app.services.evolution_client import evolution
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,11 +15,11 @@ async def create_evolution_instance(api_url: str, api_key: str, instance_name: s
     If the instance already exists (4xx), returns an empty dict so the caller
     can fall through to get_qrcode() instead of raising.
     """
-    url = f"{api_url.rstrip('/')}/instance/create"
     payload = {"instanceName": instance_name, "integration": "WHATSAPP-BAILEYS", "qrcode": True}
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            resp = await client.post(url, json=payload, headers={"apikey": api_key})
+        resp = await evolution.request(
+            "POST", api_url, api_key, "/instance/create", instance=instance_name, json=payload, timeout=30
+        )
     except httpx.ConnectError as e:
         logger.warning("create_evolution_instance connect error api_url=%s: %s", api_url, e)
         raise
@@ -81,7 +83,6 @@ async def configure_webhook(
     events: Optional[list[str]] = None,
 ) -> dict:
     """Sets the webhook URL and events on the Evolution API instance (v2 format)."""
-    url = f"{api_url.rstrip('/')}/webhook/set/{instance_name}"
     evts = events if events is not None else WEBHOOK_EVENTS_DEFAULT
     payload = {
         "webhook": {
@@ -93,10 +94,13 @@ async def configure_webhook(
         }
     }
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            resp = await client.post(url, json=payload, headers={"apikey": api_key})
-            resp.raise_for_status()
-            return resp.json()
+        # Reconfigurar o webhook é idempotente: pode repetir em 5xx
+        resp = await evolution.request(
+            "POST", api_url, api_key, f"/webhook/set/{instance_name}",
+            instance=instance_name, json=payload, idempotent=True,
+        )
+        resp.raise_for_status()
+        return resp.json()
     except httpx.HTTPStatusError as e:
         body = e.response.text
         try:
@@ -115,29 +119,27 @@ async def configure_webhook(
 
 async def get_webhook(api_url: str, api_key: str, instance_name: str) -> Optional[dict]:
     """Fetches current webhook configuration from Evolution API."""
-    url = f"{api_url.rstrip('/')}/webhook/find/{instance_name}"
-    async with httpx.AsyncClient(timeout=10) as client:
-        resp = await client.get(url, headers={"apikey": api_key})
-        if resp.status_code == 200:
-            return resp.json()
+    resp = await evolution.request("GET", api_url, api_key, f"/webhook/find/{instance_name}", instance=instance_name)
+    if resp.status_code == 200:
+        return resp.json()
     return None
 
 
 def send_text_message(api_url: str, api_key: str, instance_name: str, phone: str, text: str) -> bool:
     """Sends a text message via Evolution API (synchronous). Returns True on success."""
-    url = f"{api_url.rstrip('/')}/message/sendText/{instance_name}"
     payload = {"number": phone, "text": text}
     try:
-        with httpx.Client(timeout=15) as client:
-            resp = client.post(url, json=payload, headers={"apikey": api_key})
-            if resp.status_code in (200, 201):
-                return True
-            body = resp.text[:500] if resp.text else ""
-            logger.warning(
-                "send_text_message HTTP %s instance=%s phone=%s: %s",
-                resp.status_code, instance_name, phone, body,
-            )
-            return False
+        resp = evolution.request_sync(
+            "POST", api_url, api_key, f"/message/sendText/{instance_name}", instance=instance_name, json=payload
+        )
+        if resp.status_code in (200, 201):
+            return True
+        body = resp.text[:500] if resp.text else ""
+        logger.warning(
+            "send_text_message HTTP %s instance=%s phone=%s: %s",
+            resp.status_code, instance_name, phone, body,
+        )
+        return False
     except Exception as e:
         logger.warning("send_text_message failed for %s → %s: %s", instance_name, phone, e)
         return False
@@ -172,10 +174,8 @@ def normalize_qrcode_base64(raw: str) -> str:
 
 async def get_qrcode(api_url: str, api_key: str, instance_name: str) -> Optional[str]:
     """Fetches QR code base64 from Evolution API connect endpoint."""
-    url = f"{api_url.rstrip('/')}/instance/connect/{instance_name}"
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            resp = await client.get(url, headers={"apikey": api_key})
+        resp = await evolution.request("GET", api_url, api_key, f"/instance/connect/{instance_name}", instance=instance_name)
     except httpx.ConnectError as e:
         logger.warning(
             "get_qrcode connect error instance=%s api_url=%s: %s",
@@ -0,0 +1,79 @@
+"""
+Despacho da ingestão em shards ordenados por conversa.
+
+Cada (instância, contato) é mapeado por hash estável para um shard fixo; cada
+shard é um executor de uma thread só. Eventos da mesma conversa são gravados
+em série, na ordem de chegada, enquanto conversas diferentes gravam em paralelo
+(o driver do banco libera o GIL durante o I/O).
+
+Shard com INGEST_SHARD_QUEUE_LIMIT lotes pendentes recusa novos (IngestBusy): o
+webhook responde 503 e a Evolution reentrega depois, em vez de acumular memória.
+"""
+
+import asyncio
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, TypeVar
+
+from app.core.config import settings
+from app.core.executor import BoundedExecutor
+
+T = TypeVar("T")
+
+_shards: List[BoundedExecutor] = []
+
+
+class IngestBusy(Exception):
+    """Fila do shard cheia: a entrega deve ser repetida mais tarde."""
+
+
+def _ensure_shards() -> List[BoundedExecutor]:
+    global _shards
+    if not _shards:
+        _shards = [
+            BoundedExecutor(f"ingest-{i}", max_workers=1, queue_limit=settings.INGEST_SHARD_QUEUE_LIMIT)
+            for i in range(max(settings.INGEST_SHARDS, 1))
+        ]
+    return _shards
+
+
+def shard_for(instance_name: str, contact_phone: str) -> int:
+    """Hash estável entre processos (hash() do Python muda a cada execução)."""
+    key = f"{instance_name}\x00{contact_phone}".encode()
+    return zlib.crc32(key) % len(_ensure_shards())
+
+
+def partition(instance_name: str, items: Iterable[T], phone: Callable[[T], str]) -> Dict[int, List[T]]:
+    """Agrupa os itens por shard, preservando a ordem dentro de cada grupo."""
+    groups: Dict[int, List[T]] = {}
+    for item in items:
+        groups.setdefault(shard_for(instance_name, phone(item)), []).append(item)
+    return groups
+
+
+async def run(shard: int, fn: Callable[..., T], *args: Any) -> T:
+    """Executa fn(*args) na thread do shard e aguarda o resultado."""
+    future = _ensure_shards()[shard].submit(fn, *args)
+    if future is None:
+        raise IngestBusy(f"shard {shard} da ingestão sem capacidade")
+    return await asyncio.wrap_future(future)
+
+
+async def stop() -> None:
+    """Aguarda os lotes em andamento (chamado no lifespan)."""
+    global _shards
+    shards, _shards = _shards, []
+    for executor in shards:
+        await asyncio.to_thread(executor.shutdown, settings.INGEST_DRAIN_SECONDS)
+
+
+def get_metrics() -> dict:
+    shards = [executor.get_metrics() for executor in _shards]
+    return {
+        "shards": len(shards),
+        "busy": sum(1 for s in shards if s["active"]),
+        "queued": sum(s["queued"] for s in shards),
+        "completed": sum(s["completed"] for s in shards),
+        "failed": sum(s["failed"] for s in shards),
+        "rejected": sum(s["rejected"] for s in shards),
+        "per_shard": [{"queued": s["queued"], "completed": s["completed"]} for s in shards],
+    }
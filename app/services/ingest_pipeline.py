@@ -0,0 +1,333 @@
+"""
+Pipeline de ingestão de messages.upsert: decodificar → gravar → hooks.
+
+Reentregas são descartadas pelo filtro em memória (app.services.webhook_dedup)
+antes de qualquer acesso ao banco. As mensagens restantes são divididas por
+conversa entre os shards do app.services.ingest_dispatcher: cada shard grava o
+seu lote em série, com sessão própria, e conversas diferentes gravam em paralelo.
+
+Os estágios compartilham um UpsertBatch por shard (instância resolvida uma vez,
+mensagens decodificadas uma vez, resultado da gravação). Hooks rodam uma vez
+por lote, na ordem de registro:
+- "persist": na thread do shard, na mesma transação, antes do commit (ex.:
+  mensagem automática, gravada atomicamente com a conversa nova). Síncronos;
+  erro aborta o lote.
+- "after_commit": no event loop, depois do commit (SLA, evento SSE, roteamento,
+  gatilhos). Síncronos ou assíncronos; erro é registrado no log e não impede
+  os demais hooks.
+
+Novas automações entram com register(stage, hook); o hook recebe o lote.
+
+Nos workers da fila (app.workers.ingest), enable_worker_mode() troca os hooks
+que dependem do estado do processo web (monitor de SLA, despachante do outbound)
+por um evento interno ingest_committed no barramento.
+"""
+
+import asyncio
+import inspect
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import BackgroundTasks
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.database import SessionLocal
+from app.core.events import broadcast
+from app.models.instance import Instance
+from app.models.message import MessageType
+from app.services import (
+    databricks_service, ingest_dispatcher, outbound_service, sla_service, webhook_decoder, webhook_dedup,
+    webhook_service,
+)
+from app.services.routing_service import route_conversation
+from app.services.webhook_decoder import UpsertMessage
+from app.services.webhook_service import UpsertResult
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("persist", "after_commit")
+
+
+class UpsertBatch:
+    """Estado de um lote de messages.upsert compartilhado pelos estágios."""
+
+    def __init__(self, db: Session, instance: Instance, messages: List[UpsertMessage],
+                 background_tasks: Optional[BackgroundTasks] = None):
+        self.db = db
+        self.instance = instance
+        self.instance_id: int = instance.id
+        self.instance_name: str = instance.instance_name
+        self.messages = messages
+        self.background_tasks = background_tasks
+        self.result = UpsertResult([], [], [], [], {}, {})
+        self.auto_messages: List[int] = []  # ids em outbound_messages enfileirados no lote
+
+
+_hooks: Dict[str, List[Callable[[UpsertBatch], Any]]] = {stage: [] for stage in STAGES}
+
+
+def register(stage: str, hook: Callable[[UpsertBatch], Any]) -> Callable[[UpsertBatch], Any]:
+    """Adiciona um hook ao estágio; pode ser usado como decorator via hook(stage)."""
+    if stage not in _hooks:
+        raise ValueError(f"Estágio inválido: {stage}")
+    _hooks[stage].append(hook)
+    return hook
+
+
+def hook(stage: str):
+    return lambda fn: register(stage, fn)
+
+
+async def _call(fn: Callable[[UpsertBatch], Any], batch: UpsertBatch) -> None:
+    result = fn(batch)
+    if inspect.isawaitable(result):
+        await result
+
+
+def _resolve_instance(db: Session, instance_name: str) -> Optional[Instance]:
+    return db.query(Instance).filter(Instance.instance_name == instance_name).first()
+
+
+def _empty_result() -> UpsertResult:
+    return UpsertResult([], [], [], [], {}, {})
+
+
+def _merge_results(results: List[UpsertResult]) -> UpsertResult:
+    if len(results) == 1:
+        return results[0]
+    merged = _empty_result()
+    for r in results:
+        merged.new_conversations.extend(r.new_conversations)
+        merged.answered_ids.extend(r.answered_ids)
+        merged.stored.extend(r.stored)
+        merged.messages.extend(r.messages)
+        merged.conversations.update(r.conversations)
+        for key, value in r.counters.items():
+            merged.counters[key] = merged.counters.get(key, 0) + value
+    return merged
+
+
+def _persist(instance_name: str, messages: List[UpsertMessage]) -> Optional[UpsertBatch]:
+    """Estágio de gravação, na thread do shard e com sessão própria."""
+    db = SessionLocal()
+    try:
+        for attempt in range(2):
+            instance = _resolve_instance(db, instance_name)
+            if instance is None:
+                return None
+            batch = UpsertBatch(db, instance, messages)
+            try:
+                batch.result = webhook_service.process_message_upsert(db, instance, messages)
+                for fn in _hooks["persist"]:
+                    fn(batch)
+                db.commit()
+                return batch
+            except IntegrityError:
+                # Entrega concorrente (outro processo) gravou os mesmos evolution_ids ou abriu
+                # a mesma conversa: a segunda passada enxerga o que já existe
+                db.rollback()
+                if attempt:
+                    raise
+    finally:
+        db.close()
+
+
+async def ingest_upsert(
+    db: Session, instance_name: str, data: Any, background_tasks: Optional[BackgroundTasks] = None
+) -> UpsertResult:
+    """Decodifica, descarta reentregas, grava por shard e roda os hooks de um messages.upsert.
+    `db` é a sessão usada pelos hooks after_commit. Levanta IngestBusy se um shard estiver cheio."""
+    messages = webhook_dedup.filter_new(instance_name, webhook_decoder.decode_upsert(data))
+    if not messages:
+        return _empty_result()  # tudo repetido: nenhum acesso ao banco
+
+    groups = ingest_dispatcher.partition(instance_name, messages, lambda m: m.contact_phone)
+    outcomes = await asyncio.gather(
+        *(ingest_dispatcher.run(shard, _persist, instance_name, group) for shard, group in groups.items()),
+        return_exceptions=True,
+    )
+
+    results: List[UpsertResult] = []
+    error: Optional[BaseException] = None
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            error = error or outcome
+            continue
+        if outcome is None:
+            continue
+        batch = outcome
+        batch.db = db
+        batch.background_tasks = background_tasks
+        webhook_dedup.remember(instance_name, [m.evolution_id for m in batch.messages])
+        for fn in _hooks["after_commit"]:
+            try:
+                await _call(fn, batch)
+            except Exception as e:
+                logger.error(f"Hook {getattr(fn, '__name__', fn)} falhou ({batch.instance_name}): {e}")
+        results.append(batch.result)
+    if error is not None:
+        raise error  # os shards que gravaram já rodaram seus hooks; a reentrega cobre o resto
+    return _merge_results(results) if results else _empty_result()
+
+
+def _persist_call(instance_name: str, body: Any) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        instance = _resolve_instance(db, instance_name)
+        if instance is None:
+            return None
+        instance_id = instance.id
+        call = webhook_service.process_call_event(db, instance, body)
+        return {"instance_id": instance_id, **call} if call else None
+    finally:
+        db.close()
+
+
+async def ingest_call(instance_name: str, body: Any) -> Optional[dict]:
+    """Evento 'call': gravado no shard da conversa, em ordem com as mensagens dela,
+    e publicado como new_call. Levanta IngestBusy se o shard estiver cheio."""
+    phone = webhook_decoder.call_contact_phone(body)
+    if not phone:
+        return None
+    call = await ingest_dispatcher.run(
+        ingest_dispatcher.shard_for(instance_name, phone), _persist_call, instance_name, body
+    )
+    if call:
+        await broadcast({
+            "type": "new_call",
+            "instance": instance_name,
+            "conversation_id": call["conversation"]["id"],
+            **call,
+        })
+    return call
+
+
+async def handle_event(
+    db: Session, instance_name: str, event: str, body: dict, background_tasks: Optional[BackgroundTasks] = None
+) -> None:
+    """Processa um webhook já decodificado — chamado pelo roteador ou pelos workers da fila."""
+    if event == "messages.upsert":
+        # Reentregas são descartadas antes de consultar o banco; a instância é resolvida no pipeline
+        await ingest_upsert(db, instance_name, body.get("data"), background_tasks)
+        return
+    if event == "call":
+        await ingest_call(instance_name, body)
+        return
+
+    # Instância resolvida uma única vez por webhook e repassada aos serviços
+    instance = _resolve_instance(db, instance_name)
+    instance_id = instance.id if instance else None
+
+    if event == "messages.update":
+        deleted = webhook_service.process_message_update(db, body.get("data"))
+        for conversation_id, message_ids in deleted.items():
+            await broadcast({
+                "type": "message_deleted",
+                "instance": instance_name,
+                "instance_id": instance_id,
+                "conversation_id": conversation_id,
+                "message_ids": message_ids,
+            })
+    elif event in ("groups.upsert", "groups.update", "group.update", "group.participants.update"):
+        if instance:
+            webhook_service.process_groups_upsert(db, instance, body.get("data"))
+        await broadcast({"type": "groups_updated", "instance": instance_name, "instance_id": instance_id})
+    # presence.update, chats.update, contacts.update, connection.update, logout.instance, remove.instance - acknowledged
+
+
+# ── Hooks padrão ──
+
+@hook("persist")
+def enqueue_auto_messages(batch: UpsertBatch) -> None:
+    """Mensagem automática para cada conversa nova, na mesma transação."""
+    instance = batch.instance
+    if not (instance.auto_message_enabled and instance.auto_message_text):
+        return
+    for conv in batch.result.new_conversations:
+        text = instance.auto_message_text.replace("{nome_atendente}", conv.attendant_name or "Atendente")
+        out = outbound_service.enqueue(
+            batch.db, instance.id, conv.contact_phone, text, "auto_message", conversation_id=conv.id
+        )
+        batch.auto_messages.append(out.id)
+
+
+@hook("after_commit")
+def update_sla(batch: UpsertBatch) -> None:
+    for conv in batch.result.new_conversations:
+        sla_service.track(conv.id, conv.instance_id, conv.opened_at, conv.contact_phone,
+                          conv.contact_name, conv.attendant_name)
+    sla_service.discard(batch.result.answered_ids)
+
+
+@hook("after_commit")
+def wake_outbound(batch: UpsertBatch) -> None:
+    if batch.auto_messages:
+        outbound_service.wake()
+
+
+@hook("after_commit")
+async def broadcast_messages(batch: UpsertBatch) -> None:
+    if batch.result.messages:
+        await broadcast(batch.result.event(batch.instance_name, batch.instance_id))
+
+
+@hook("after_commit")
+def route_new_conversations(batch: UpsertBatch) -> None:
+    for conv in batch.result.new_conversations:
+        if batch.background_tasks is not None:
+            batch.background_tasks.add_task(route_conversation, conv.id)
+        else:
+            asyncio.get_running_loop().run_in_executor(None, route_conversation, conv.id)
+
+
+def _check_databricks_triggers(instance_id: int, candidates: List[tuple]) -> None:
+    db = SessionLocal()
+    try:
+        for phone, text in candidates:
+            databricks_service.check_and_trigger(db, instance_id, phone, text)
+    finally:
+        db.close()
+
+
+@hook("after_commit")
+async def check_databricks_triggers(batch: UpsertBatch) -> None:
+    """Só mensagens gravadas neste lote: reentregas do webhook não disparam de novo.
+    Numa thread com sessão própria: recarregar as regras e enfileirar a resposta de erro
+    consultam e gravam no banco, o que bloquearia o event loop."""
+    candidates = [
+        (m.contact_phone, m.text) for m in batch.result.stored
+        if not (m.from_me or m.is_group or m.msg_type != MessageType.text or not m.text)
+    ]
+    if candidates:
+        await asyncio.to_thread(_check_databricks_triggers, batch.instance_id, candidates)
+
+
+# ── Modo worker ──
+
+COMMITTED_CHUNK = 20  # conversas por evento ingest_committed (limite de payload do NOTIFY)
+
+
+async def publish_committed(batch: UpsertBatch) -> None:
+    """Avisa o processo web: conversas novas para o SLA, respondidas e mensagens automáticas."""
+    result = batch.result
+    if not (result.new_conversations or result.answered_ids or batch.auto_messages):
+        return
+    conversations = [conv._asdict() for conv in result.new_conversations]
+    for i in range(0, max(len(conversations), 1), COMMITTED_CHUNK):
+        await broadcast({
+            "type": "ingest_committed",
+            "instance_id": batch.instance_id,
+            "new_conversations": conversations[i:i + COMMITTED_CHUNK],
+            "answered_ids": result.answered_ids if i == 0 else [],
+            "outbound": bool(batch.auto_messages) and i == 0,
+        })
+
+
+def enable_worker_mode() -> None:
+    """Hooks para processos sem monitor de SLA nem despachante do outbound."""
+    _hooks["after_commit"] = [
+        publish_committed if fn is update_sla else fn
+        for fn in _hooks["after_commit"]
+        if fn is not wake_outbound
+    ]
@@ -0,0 +1,227 @@
+"""
+Fila de ingestão compartilhada (tabela ingest_queue) para o modo com workers.
+
+Com INGEST_QUEUE_ENABLED o webhook só grava o corpo aqui e responde; os
+processos de `python -m app.workers.ingest` reivindicam as linhas e rodam o
+mesmo pipeline do processo web (app.services.ingest_pipeline).
+
+Cada linha recebe uma partição fixa por instância (crc32 % INGEST_QUEUE_PARTITIONS)
+e cada partição pertence a um único worker: os eventos de uma instância são
+processados em ordem, por um só processo, enquanto instâncias diferentes escalam
+com o número de workers. No PostgreSQL a reivindicação usa SELECT ... FOR UPDATE
+SKIP LOCKED (workers em hosts diferentes com o mesmo índice não disputam linhas);
+no SQLite, UPDATE condicional como o outbound_service. Linhas processadas são
+apagadas; as que falharam voltam com backoff até INGEST_QUEUE_MAX_ATTEMPTS e
+ficam como failed para inspeção. Enquanto um webhook aguarda nova tentativa, os
+seguintes da mesma instância não são reivindicados.
+"""
+
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, NamedTuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core import json_codec
+from app.core.config import settings
+from app.core.database import SessionLocal, _is_sqlite
+from app.models.ingest import IngestJob, IngestWorker
+
+# Eventos que mudam conversas e mensagens: vão todos pela fila para manter a ordem por instância
+QUEUED_EVENTS = frozenset({"messages.upsert", "messages.update", "call"})
+
+
+class QueuedWebhook(NamedTuple):
+    id: int
+    instance_name: str
+    event: str
+    body: Dict[str, Any]
+    created_at: datetime
+
+
+def partition_for(instance_name: str) -> int:
+    """Hash estável entre processos (hash() do Python muda a cada execução)."""
+    return zlib.crc32(instance_name.encode()) % max(settings.INGEST_QUEUE_PARTITIONS, 1)
+
+
+def partitions_for_worker(index: int, total: int) -> List[int]:
+    return [p for p in range(max(settings.INGEST_QUEUE_PARTITIONS, 1)) if p % total == index]
+
+
+def enqueue(db: Session, instance_name: str, event: str, body: Dict[str, Any]) -> IngestJob:
+    """Grava o webhook na sessão de quem chamou; o commit fica com ele."""
+    job = IngestJob(
+        instance_name=instance_name,
+        partition=partition_for(instance_name),
+        event=event,
+        payload=json_codec.dumps(body),
+    )
+    db.add(job)
+    return job
+
+
+def claim(partitions: List[int], limit: int) -> List[QueuedWebhook]:
+    """Reivindica até `limit` webhooks vencidos das partições, em ordem de chegada."""
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        # Instância com webhook aguardando nova tentativa fica parada até ele passar (ordem por instância)
+        retrying = (
+            db.query(IngestJob.instance_name)
+            .filter(
+                IngestJob.status == "queued",
+                IngestJob.partition.in_(partitions),
+                IngestJob.next_attempt_at > now,
+            )
+            .distinct()
+        )
+        query = (
+            db.query(IngestJob.id)
+            .filter(
+                IngestJob.status == "queued",
+                IngestJob.partition.in_(partitions),
+                IngestJob.next_attempt_at <= now,
+                ~IngestJob.instance_name.in_(retrying.scalar_subquery()),
+            )
+            .order_by(IngestJob.id)
+            .limit(limit)
+        )
+        if not _is_sqlite:
+            query = query.with_for_update(skip_locked=True)
+        ids = [job_id for (job_id,) in query.all()]
+        if not ids:
+            db.rollback()
+            return []
+        db.query(IngestJob).filter(IngestJob.id.in_(ids), IngestJob.status == "queued").update(
+            {"status": "processing", "claimed_at": now}, synchronize_session=False
+        )
+        db.commit()
+        rows = (
+            db.query(IngestJob.id, IngestJob.instance_name, IngestJob.event, IngestJob.payload, IngestJob.created_at)
+            .filter(IngestJob.id.in_(ids), IngestJob.status == "processing", IngestJob.claimed_at == now)
+            .order_by(IngestJob.id)
+            .all()
+        )
+        return [
+            QueuedWebhook(job_id, instance_name, event, json_codec.loads(payload), created_at)
+            for job_id, instance_name, event, payload, created_at in rows
+        ]
+    finally:
+        db.close()
+
+
+def complete(job_ids: Iterable[int]) -> None:
+    ids = list(job_ids)
+    if not ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(IngestJob).filter(IngestJob.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def fail(job_id: int, error: str) -> bool:
+    """Devolve à fila com backoff. Retorna False quando esgotou as tentativas (failed)."""
+    db = SessionLocal()
+    try:
+        job = db.get(IngestJob, job_id)
+        if job is None:
+            return False
+        job.attempts = (job.attempts or 0) + 1
+        job.last_error = error[:2000]
+        job.claimed_at = None
+        retry = job.attempts < settings.INGEST_QUEUE_MAX_ATTEMPTS
+        if retry:
+            job.status = "queued"
+            job.next_attempt_at = datetime.utcnow() + timedelta(
+                seconds=settings.INGEST_QUEUE_RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1)
+            )
+        else:
+            job.status = "failed"
+        db.commit()
+        return retry
+    finally:
+        db.close()
+
+
+def release(job_ids: Iterable[int]) -> None:
+    """Devolve à fila, sem contar tentativa, linhas reivindicadas e não processadas."""
+    ids = list(job_ids)
+    if not ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(IngestJob).filter(IngestJob.id.in_(ids), IngestJob.status == "processing").update(
+            {"status": "queued", "claimed_at": None}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def reclaim_stale(partitions: List[int]) -> int:
+    """Linhas presas em processing (worker morto no meio do lote) voltam para a fila."""
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.INGEST_QUEUE_CLAIM_TIMEOUT_SECONDS)
+    db = SessionLocal()
+    try:
+        count = (
+            db.query(IngestJob)
+            .filter(
+                IngestJob.status == "processing",
+                IngestJob.partition.in_(partitions),
+                IngestJob.claimed_at < cutoff,
+            )
+            .update({"status": "queued", "claimed_at": None}, synchronize_session=False)
+        )
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def report_worker(worker: str, **values: Any) -> None:
+    """Publica as métricas de um worker (uma linha por host:índice)."""
+    db = SessionLocal()
+    try:
+        row = db.get(IngestWorker, worker)
+        if row is None:
+            row = IngestWorker(worker=worker)
+            db.add(row)
+        for key, value in values.items():
+            setattr(row, key, value)
+        row.heartbeat_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+def get_metrics(db: Session) -> dict:
+    by_status = dict(db.query(IngestJob.status, func.count(IngestJob.id)).group_by(IngestJob.status).all())
+    oldest = db.query(func.min(IngestJob.created_at)).filter(IngestJob.status == "queued").scalar()
+    now = datetime.utcnow()
+    return {
+        "enabled": settings.INGEST_QUEUE_ENABLED,
+        "queued": by_status.get("queued", 0),
+        "processing": by_status.get("processing", 0),
+        "failed": by_status.get("failed", 0),
+        "oldest_queued_seconds": round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+        "workers": [
+            {
+                "worker": w.worker,
+                "pid": w.pid,
+                "partitions": w.partitions,
+                "status": w.status,
+                "processed": w.processed or 0,
+                "failed": w.failed or 0,
+                "batches": w.batches or 0,
+                "avg_ms": w.avg_ms,
+                "lag_seconds": w.lag_seconds,
+                "started_at": w.started_at.isoformat() if w.started_at else None,
+                "heartbeat_seconds": round((now - w.heartbeat_at).total_seconds(), 1) if w.heartbeat_at else None,
+            }
+            for w in db.query(IngestWorker).order_by(IngestWorker.worker)
+        ],
+    }
@@ -0,0 +1,377 @@
+"""
+llm_service.py — Ponto único de chamada aos provedores LLM.
+
+Toda chamada (análise, roteamento, sugestões, relatórios) passa por complete()
+ou stream(), que registram provedor, modelo, tokens, latência, tentativas e
+resultado em llm_calls. Trabalho de baixa prioridade respeita o orçamento
+diário de tokens por instância.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, NamedTuple, Optional
+
+import httpx
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal, _is_sqlite
+from app.models.instance import Instance
+from app.models.llm_call import LlmCall
+
+logger = logging.getLogger(__name__)
+
+MODELS = {
+    "anthropic": "claude-haiku-4-5-20251001",
+    "openai": "gpt-4o-mini",
+}
+
+
+# Limite de chamadas simultâneas por provedor, compartilhado por todas as threads
+_provider_slots = {
+    "anthropic": threading.BoundedSemaphore(max(settings.LLM_CONCURRENCY_ANTHROPIC, 1)),
+    "openai": threading.BoundedSemaphore(max(settings.LLM_CONCURRENCY_OPENAI, 1)),
+}
+
+
+# Respostas do provedor que valem nova tentativa (além de 5xx)
+RETRY_STATUSES = {408, 409, 429}
+
+
+class LlmResult(NamedTuple):
+    text: str
+    input_tokens: int
+    output_tokens: int
+
+
+class LlmBudgetExceeded(Exception):
+    """Orçamento diário de tokens da instância esgotado (trabalho de baixa prioridade)."""
+
+
+# ─── Orçamento ───────────────────────────────────────────────────────────────
+
+def tokens_used_today(db: Session, instance_id: int) -> int:
+    day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    used = (
+        db.query(func.coalesce(func.sum(LlmCall.input_tokens + LlmCall.output_tokens), 0))
+        .filter(LlmCall.instance_id == instance_id, LlmCall.created_at >= day_start)
+        .scalar()
+    )
+    return int(used or 0)
+
+
+def get_daily_budget(db: Session, instance_id: int) -> int:
+    """Orçamento diário da instância (0 = sem limite)."""
+    budget = (
+        db.query(Instance.llm_daily_token_budget)
+        .filter(Instance.id == instance_id)
+        .scalar()
+    )
+    return budget if budget is not None else settings.LLM_DAILY_TOKEN_BUDGET
+
+
+def budget_exhausted(instance_id: Optional[int], db: Optional[Session] = None) -> bool:
+    if not instance_id:
+        return False
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        budget = get_daily_budget(db, instance_id)
+        if not budget:
+            return False
+        return tokens_used_today(db, instance_id) >= budget
+    finally:
+        if own_session:
+            db.close()
+
+
+# ─── Registro ────────────────────────────────────────────────────────────────
+
+def record_call(
+    service: str,
+    provider: str,
+    model: str,
+    *,
+    instance_id: Optional[int] = None,
+    conversation_id: Optional[int] = None,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    latency_ms: Optional[float] = None,
+    retries: int = 0,
+    outcome: str = "ok",
+    error: Optional[str] = None,
+) -> None:
+    """Grava uma linha em llm_calls numa sessão própria (não interfere na transação do chamador)."""
+    db = SessionLocal()
+    try:
+        db.add(LlmCall(
+            service=service,
+            provider=provider,
+            model=model,
+            instance_id=instance_id,
+            conversation_id=conversation_id,
+            input_tokens=input_tokens or 0,
+            output_tokens=output_tokens or 0,
+            latency_ms=latency_ms,
+            retries=retries,
+            outcome=outcome,
+            error=error[:500] if error else None,
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning("Falha ao registrar chamada LLM (%s): %s", service, e)
+    finally:
+        db.close()
+
+
+# ─── Chamadas síncronas ──────────────────────────────────────────────────────
+
+def _call_anthropic(prompt: str, system: Optional[str], max_tokens: int) -> LlmResult:
+    import anthropic
+    client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY, max_retries=0)
+    kwargs = {"system": system} if system else {}
+    response = client.messages.create(
+        model=MODELS["anthropic"],
+        max_tokens=max_tokens,
+        messages=[{"role": "user", "content": prompt}],
+        **kwargs,
+    )
+    usage = response.usage
+    return LlmResult(response.content[0].text.strip(), usage.input_tokens, usage.output_tokens)
+
+
+def _call_openai(prompt: str, system: Optional[str], max_tokens: int) -> LlmResult:
+    from openai import OpenAI
+    client = OpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
+    response = client.chat.completions.create(
+        model=MODELS["openai"],
+        max_tokens=max_tokens,
+        messages=messages,
+    )
+    usage = response.usage
+    return LlmResult(response.choices[0].message.content.strip(), usage.prompt_tokens, usage.completion_tokens)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Rate limit, 5xx, conexão ou timeout. Erros de requisição (400, 401, modelo
+    inválido) e bugs locais falham na primeira tentativa."""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRY_STATUSES or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError)):
+        return True
+    # APIConnectionError/APITimeoutError dos SDKs anthropic e openai (importados sob demanda)
+    return any(cls.__name__ == "APIConnectionError" for cls in type(error).__mro__)
+
+
+def complete(
+    service: str,
+    prompt: str,
+    *,
+    system: Optional[str] = None,
+    max_tokens: int = 512,
+    instance_id: Optional[int] = None,
+    conversation_id: Optional[int] = None,
+    low_priority: bool = False,
+) -> LlmResult:
+    """Executa uma chamada LLM (novas tentativas só em erros transitórios) e registra a telemetria.
+
+    low_priority=True levanta LlmBudgetExceeded quando o orçamento diário da
+    instância já foi consumido (análise e relatórios); chamadas interativas
+    (sugestões, roteamento) não são bloqueadas.
+    """
+    provider = settings.LLM_PROVIDER.lower()
+    model = MODELS.get(provider, provider)
+
+    if low_priority and budget_exhausted(instance_id):
+        record_call(service, provider, model, instance_id=instance_id,
+                    conversation_id=conversation_id, outcome="budget_exceeded")
+        raise LlmBudgetExceeded(f"Orçamento diário de tokens esgotado (instance={instance_id})")
+
+    call = _call_openai if provider == "openai" else _call_anthropic
+    slots = _provider_slots.get(provider, _provider_slots["openai"])
+    retries = 0
+    start = time.monotonic()
+    while True:
+        try:
+            with slots:
+                result = call(prompt, system, max_tokens)
+            break
+        except Exception as e:
+            if retries >= settings.LLM_MAX_RETRIES or not _is_transient(e):
+                record_call(service, provider, model, instance_id=instance_id,
+                            conversation_id=conversation_id,
+                            latency_ms=(time.monotonic() - start) * 1000,
+                            retries=retries, outcome="error", error=str(e))
+                raise
+            retries += 1
+            logger.warning("Chamada LLM %s falhou (tentativa %d): %s", service, retries, e)
+            time.sleep(2 ** (retries - 1))
+
+    record_call(service, provider, model, instance_id=instance_id,
+                conversation_id=conversation_id,
+                input_tokens=result.input_tokens, output_tokens=result.output_tokens,
+                latency_ms=(time.monotonic() - start) * 1000, retries=retries)
+    return result
+
+
+# ─── Streaming ───────────────────────────────────────────────────────────────
+
+async def _stream_anthropic(prompt: str, system: Optional[str], max_tokens: int, usage: dict) -> AsyncIterator[str]:
+    import anthropic
+    client = anthropic.AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+    kwargs = {"system": system} if system else {}
+    async with client.messages.stream(
+        model=MODELS["anthropic"],
+        max_tokens=max_tokens,
+        messages=[{"role": "user", "content": prompt}],
+        **kwargs,
+    ) as stream:
+        async for text in stream.text_stream:
+            yield text
+        final = await stream.get_final_message()
+        usage["input"] = final.usage.input_tokens
+        usage["output"] = final.usage.output_tokens
+
+
+async def _stream_openai(prompt: str, system: Optional[str], max_tokens: int, usage: dict) -> AsyncIterator[str]:
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
+    stream = await client.chat.completions.create(
+        model=MODELS["openai"],
+        max_tokens=max_tokens,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    try:
+        async for chunk in stream:
+            if chunk.usage:
+                usage["input"] = chunk.usage.prompt_tokens
+                usage["output"] = chunk.usage.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Fecha a resposta HTTP — cancela a geração no provedor
+        await stream.close()
+
+
+async def stream(
+    service: str,
+    prompt: str,
+    *,
+    system: Optional[str] = None,
+    max_tokens: int = 512,
+    instance_id: Optional[int] = None,
+    conversation_id: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """Versão streaming de complete(). Fechar o gerador cancela a requisição upstream;
+    a chamada é registrada como 'cancelled' nesse caso."""
+    provider = settings.LLM_PROVIDER.lower()
+    model = MODELS.get(provider, provider)
+    usage: dict = {}
+    source = _stream_openai if provider == "openai" else _stream_anthropic
+    chunks = source(prompt, system, max_tokens, usage)
+    start = time.monotonic()
+    outcome, error = "cancelled", None
+    try:
+        async for chunk in chunks:
+            yield chunk
+        outcome = "ok"
+    except Exception as e:
+        outcome, error = "error", str(e)
+        raise
+    finally:
+        await chunks.aclose()
+        # INSERT fora do event loop
+        await asyncio.to_thread(
+            record_call, service, provider, model, instance_id=instance_id,
+            conversation_id=conversation_id,
+            input_tokens=usage.get("input", 0), output_tokens=usage.get("output", 0),
+            latency_ms=(time.monotonic() - start) * 1000,
+            outcome=outcome, error=error,
+        )
+
+
+# ─── Agregações ──────────────────────────────────────────────────────────────
+
+def _percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def get_usage(
+    db: Session,
+    group_by: str = "service",
+    days: int = 7,
+    instance_id: Optional[int] = None,
+) -> List[dict]:
+    """Chamadas, erros, tokens e latência p50/p95 agrupados por service, instance ou day."""
+    if group_by == "instance":
+        key = LlmCall.instance_id
+    elif group_by == "day":
+        key = func.date(LlmCall.created_at)
+    else:
+        key = LlmCall.service
+
+    since = datetime.utcnow() - timedelta(days=days)
+    filters = [LlmCall.created_at >= since]
+    if instance_id:
+        filters.append(LlmCall.instance_id == instance_id)
+
+    columns = [
+        key.label("key"),
+        func.count(LlmCall.id).label("calls"),
+        func.sum(func.coalesce(LlmCall.input_tokens, 0)).label("input_tokens"),
+        func.sum(func.coalesce(LlmCall.output_tokens, 0)).label("output_tokens"),
+        func.sum(LlmCall.retries).label("retries"),
+        func.count(LlmCall.id).filter(LlmCall.outcome != "ok").label("errors"),
+    ]
+    if not _is_sqlite:
+        columns += [
+            func.percentile_cont(0.5).within_group(LlmCall.latency_ms).label("p50"),
+            func.percentile_cont(0.95).within_group(LlmCall.latency_ms).label("p95"),
+        ]
+    rows = db.query(*columns).filter(*filters).group_by(key).order_by(key).all()
+
+    latencies: dict = {}
+    if _is_sqlite:
+        # SQLite não tem percentile_cont — calcula em Python
+        for k, latency in (
+            db.query(key, LlmCall.latency_ms)
+            .filter(*filters, LlmCall.latency_ms.isnot(None))
+            .order_by(LlmCall.latency_ms)
+        ):
+            latencies.setdefault(k, []).append(latency)
+
+    result = []
+    for r in rows:
+        if _is_sqlite:
+            p50 = _percentile(latencies.get(r.key, []), 0.5)
+            p95 = _percentile(latencies.get(r.key, []), 0.95)
+        else:
+            p50, p95 = r.p50, r.p95
+        result.append({
+            group_by: r.key if group_by == "instance" or r.key is None else str(r.key),
+            "calls": r.calls,
+            "errors": r.errors or 0,
+            "retries": int(r.retries or 0),
+            "input_tokens": int(r.input_tokens or 0),
+            "output_tokens": int(r.output_tokens or 0),
+            "p50_latency_ms": round(p50, 1) if p50 is not None else None,
+            "p95_latency_ms": round(p95, 1) if p95 is not None else None,
+        })
+    return result
@@ -0,0 +1,51 @@
+"""
+maintenance_service.py — Rotinas noturnas de manutenção (disparadas pelo agendador).
+
+  - reagrega as semanas recentes do relatório (semanas sem alteração são puladas)
+  - remove telemetria LLM e histórico do agendador além da retenção configurada
+"""
+
+import logging
+from datetime import date, datetime, timedelta
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.llm_call import LlmCall
+from app.models.scheduler import SchedulerJobRun
+from app.services import report_service
+
+logger = logging.getLogger(__name__)
+
+# Semanas recentes reagregadas toda noite (captura conversas alteradas após o fechamento da semana)
+REFRESH_DAYS = 14
+
+
+def prune_old_rows(days_llm_calls: int, days_job_runs: int) -> dict:
+    """Apaga linhas de llm_calls e scheduler_job_runs mais antigas que a retenção (0 = manter tudo)."""
+    now = datetime.utcnow()
+    deleted = {"llm_calls": 0, "scheduler_job_runs": 0}
+    db = SessionLocal()
+    try:
+        if days_llm_calls > 0:
+            deleted["llm_calls"] = db.query(LlmCall).filter(
+                LlmCall.created_at < now - timedelta(days=days_llm_calls),
+            ).delete(synchronize_session=False)
+        if days_job_runs > 0:
+            deleted["scheduler_job_runs"] = db.query(SchedulerJobRun).filter(
+                SchedulerJobRun.started_at < now - timedelta(days=days_job_runs),
+            ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    return deleted
+
+
+def run_nightly_maintenance() -> dict:
+    today = date.today()
+    refresh = report_service.backfill_reports(today - timedelta(days=REFRESH_DAYS), today)
+    if refresh.get("status") != "ok":
+        logger.warning("Manutenção: reagregação dos relatórios falhou: %s", refresh.get("error"))
+
+    deleted = prune_old_rows(settings.LLM_CALLS_RETENTION_DAYS, settings.SCHEDULER_HISTORY_RETENTION_DAYS)
+    logger.info("Manutenção noturna: %s", deleted)
+    return {"report_refresh": refresh.get("status"), "deleted": deleted}
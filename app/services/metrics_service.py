@@ -1,4 +1,6 @@
-from sqlalchemy.orm import Session
+import asyncio
+
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func, and_, or_, case
 from datetime import datetime, timedelta
 from typing import List, Optional
@@ -22,6 +24,10 @@ from app.schemas.metrics import (
     CategoryCount,
     GroupOverviewMetrics,
 )
+from app.services import sla_service
+from app.core.config import settings
+from app.services import outbound_service
+from app.services.evolution_client import evolution
 
 
 def get_overview_metrics(db: Session, instance_id: Optional[int] = None) -> OverviewMetrics:
@@ -530,6 +536,8 @@ def _to_conversation_detail(c: Conversation) -> ConversationDetail:
         analysis_satisfaction=c.analysis_satisfaction,
         analysis_summary=c.analysis_summary,
         analysis_analyzed_at=c.analysis_analyzed_at,
+        analysis_input_tokens=c.analysis_input_tokens,
+        analysis_output_tokens=c.analysis_output_tokens,
         team_id=c.team_id,
         team_name=c.team.name if c.team else None,
         responsible_id=c.responsible_id,
@@ -620,6 +628,7 @@ def resolve_conversation(db: Session, conversation_id: int) -> bool:
     conv.status = ConversationStatus.resolved
     conv.resolved_at = datetime.utcnow()
     db.commit()
+    sla_service.discard([conversation_id])
     return True
 
 
@@ -790,11 +799,14 @@ def sync_group_names(db: Session, instance_id: int) -> dict:
     if not instance:
         return {"updated": 0, "error": "Instância não encontrada"}
 
-    url = f"{instance.api_url.rstrip('/')}/group/fetchAllGroups/{instance.instance_name}?getParticipants=false"
-    logger.info(f"Sync grupos: GET {url}")
+    path = f"/group/fetchAllGroups/{instance.instance_name}"
+    logger.info(f"Sync grupos: GET {instance.api_url.rstrip('/')}{path}")
 
     try:
-        resp = httpx.get(url, headers={"apikey": instance.api_key}, timeout=60)
+        resp = evolution.request_sync(
+            "GET", instance.api_url, instance.api_key, path,
+            instance=instance.instance_name, params={"getParticipants": "false"}, timeout=60,
+        )
         logger.info(f"Sync grupos: status={resp.status_code} body={resp.text[:300]}")
         resp.raise_for_status()
         raw = resp.json()
@@ -921,20 +933,15 @@ def assign_conversation(
             return False
     conv.attendant_id = attendant_id
     db.commit()
+    sla_service.set_attendant(conversation_id, att.name if attendant_id is not None else None)
     return True
 
 
-async def send_message_to_conversation(db: Session, conversation_id: int, text: str) -> dict:
-    """Envia mensagem de texto via Evolution API e salva no banco local."""
-    import httpx
-    import uuid
-    import logging
-
-    logger = logging.getLogger(__name__)
-
-    conv = db.query(Conversation).options(
-        __import__('sqlalchemy.orm', fromlist=['joinedload']).joinedload(Conversation.instance)
-    ).filter(Conversation.id == conversation_id).first()
+def _enqueue_conversation_message(db: Session, conversation_id: int, text: str) -> dict:
+    """{"outbound_id": ...} da mensagem enfileirada ou {"error": ...}."""
+    conv = db.query(Conversation).options(joinedload(Conversation.instance)).filter(
+        Conversation.id == conversation_id
+    ).first()
 
     if not conv:
         return {"error": "Conversa não encontrada"}
@@ -947,99 +954,36 @@ async def send_message_to_conversation(db: Session, conversation_id: int, text:
     if not phone_raw:
         return {"error": "Número do contato inválido"}
     suffix = "@g.us" if conv.is_group else "@s.whatsapp.net"
-    phone_jid = f"{phone_raw}{suffix}"
 
-    url = f"{instance.api_url.rstrip('/')}/message/sendText/{instance.instance_name}"
-    headers = {"apikey": instance.api_key, "Content-Type": "application/json"}
-    payload = {"number": phone_jid, "text": text}
-    logger.info("send_message: url=%s payload=%s", url, payload)
+    outbound_id = outbound_service.enqueue(
+        db, instance.id, f"{phone_raw}{suffix}", text, "console", conversation_id=conv.id
+    ).id
+    db.commit()  # libera a conexão durante a espera
+    return {"outbound_id": outbound_id}
 
-    data = None
 
-    try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            resp = await client.post(url, headers=headers, json=payload)
-            if resp.status_code in (200, 201):
-                data = resp.json()
-            else:
-                try:
-                    body = resp.json()
-                except Exception:
-                    body = {}
-
-                body_dict = body if isinstance(body, dict) else {}
-                resp_data = body_dict.get("response")
-                resp_data = resp_data if isinstance(resp_data, dict) else {}
-                msg_list = resp_data.get("message", [])
-                if not isinstance(msg_list, list):
-                    msg_list = []
-
-                exists_false = (
-                    msg_list
-                    and isinstance(msg_list[0], dict)
-                    and msg_list[0].get("exists") is False
-                )
-                if exists_false:
-                    return {
-                        "error": (
-                            "O WhatsApp não conseguiu localizar este contato. "
-                            "Verifique se a instância está conectada (Settings → Instâncias) "
-                            "e tente novamente."
-                        )
-                    }
-
-                # Detecta instância desconectada do WhatsApp
-                resp_msg = resp_data.get("message", "")
-                if isinstance(resp_msg, str) and "connection closed" in resp_msg.lower():
-                    return {
-                        "error": (
-                            "A instância WhatsApp está desconectada. "
-                            "Acesse Configurações → Instâncias, reconecte o QR Code e tente novamente."
-                        )
-                    }
-
-                logger.warning("send_message Evolution API error: %s %s", resp.status_code, body)
-                return {"error": f"Evolution API retornou erro {resp.status_code}: {body}"}
-
-    except httpx.ConnectError:
-        return {"error": "Não foi possível conectar à Evolution API. Verifique a URL da instância."}
-    except httpx.ReadTimeout:
-        return {"error": "A Evolution API demorou para responder. Tente novamente."}
-    except Exception as e:
-        return {"error": str(e)}
-
-    # Salva a mensagem enviada no banco local
-    # Evolution API pode retornar dict ou list; extrai key.id
-    payload = data[0] if isinstance(data, list) and data else data
-    evo_id = None
-    if isinstance(payload, dict):
-        key = payload.get("key") or {}
-        evo_id = key.get("id") if isinstance(key, dict) else None
-    if not evo_id:
-        evo_id = f"sent_{uuid.uuid4().hex}"
-        logger.warning("send_message: Evolution API não retornou key.id — usando ID local %s", evo_id)
-    now = datetime.utcnow()
-    msg = Message(
-        evolution_id=evo_id,
-        conversation_id=conversation_id,
-        direction=MessageDirection.outbound,
-        msg_type=MessageType.text,
-        content=text,
-        timestamp=now,
-    )
-    db.add(msg)
-    conv.outbound_count = (conv.outbound_count or 0) + 1
-    conv.last_message_at = now
-    db.commit()
-    db.refresh(msg)
-
-    return {
-        "id": msg.id,
-        "content": text,
-        "direction": "outbound",
-        "msg_type": "text",
-        "timestamp": now.isoformat(),
-    }
+async def send_message_to_conversation(db: Session, conversation_id: int, text: str) -> dict:
+    """Enfileira a mensagem (outbound_service) e aguarda a entrega por até OUTBOUND_SEND_WAIT_SECONDS.
+    A consulta e a gravação rodam numa thread, fora do event loop."""
+    queued = await asyncio.to_thread(_enqueue_conversation_message, db, conversation_id, text)
+    if "error" in queued:
+        return queued
+    outbound_id = queued["outbound_id"]
+    outbound_service.wake()
+
+    result = await outbound_service.wait(outbound_id, settings.OUTBOUND_SEND_WAIT_SECONDS)
+    if result is None:
+        # Ainda na fila (limite de envio ou nova tentativa): o evento new_message avisa quando sair
+        return {
+            "id": None,
+            "outbound_id": outbound_id,
+            "queued": True,
+            "content": text,
+            "direction": "outbound",
+            "msg_type": "text",
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+    return result
 
 
 def get_team_metrics(
@@ -0,0 +1,579 @@
+"""
+outbound_service.py — Fila única de mensagens de saída (tabela outbound_messages).
+
+enqueue() grava a mensagem na transação de quem a gerou (webhook, console,
+Databricks); depois do commit, wake() acorda o despachante. O despachante
+reivindica as linhas vencidas com UPDATE condicional (seguro com várias réplicas)
+e as distribui numa fila por instância. Cada instância tem um token bucket
+(OUTBOUND_RATE_PER_MINUTE / OUTBOUND_BURST): rajadas de mensagens automáticas
+não estouram o limite do WhatsApp.
+
+Entregue a mensagem, a linha Message é gravada com o key.id devolvido pela
+Evolution — o eco do webhook é descartado como duplicado — e o evento
+new_message sai daqui. Falhas em que a mensagem certamente não saiu (circuito
+aberto, sem conexão, 429/502/503/504) voltam para a fila com backoff até
+OUTBOUND_MAX_ATTEMPTS; as demais falham na hora, para não duplicar envios.
+Linhas presas em "sending" (réplica caiu no meio) voltam para a fila após
+OUTBOUND_CLAIM_TIMEOUT_SECONDS.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.events import broadcast, listen
+from app.models.conversation import Conversation, ConversationStatus
+from app.models.instance import Instance
+from app.models.message import Message, MessageDirection, MessageType
+from app.models.outbound import OutboundMessage
+from app.services import sla_service, webhook_dedup
+from app.services.evolution_client import CircuitOpenError, evolution
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_STATUSES = {429, 502, 503, 504}
+MAX_RETRY_DELAY_SECONDS = 600
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+_task: Optional[asyncio.Task] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_lanes: Dict[int, asyncio.Queue] = {}           # instance_id → ids reivindicados aguardando token
+_lane_tasks: Dict[int, asyncio.Task] = {}
+_buckets: Dict[int, "TokenBucket"] = {}
+_waiters: Dict[int, List[asyncio.Future]] = {}  # outbound_id → quem aguarda o resultado (console)
+
+_stats_lock = threading.Lock()
+_stats = {"enqueued": 0, "sent": 0, "failed": 0, "retried": 0, "throttled": 0, "reclaimed": 0}
+_latencies: Deque[float] = deque(maxlen=500)    # segundos entre enfileirar e entregar
+
+
+def _count(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += n
+
+
+class TokenBucket:
+    """Limite de envio por instância. Só a fila da instância consome; sem trava."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """Consome um token, esperando se preciso. Retorna quanto esperou (s)."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return waited
+            delay = (1 - self.tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+
+# ─── Enfileiramento ───────────────────────────────────────────────────────────
+
+def enqueue(
+    db: Session,
+    instance_id: int,
+    phone: str,
+    text: str,
+    source: str,
+    conversation_id: Optional[int] = None,
+) -> OutboundMessage:
+    """Adiciona à sessão (sem commit). Sem conversation_id, usa a conversa aberta do contato.
+    Chame wake() após o commit."""
+    if conversation_id is None:
+        contact_phone = phone.split("@")[0].split(":")[0]
+        conversation_id = (
+            db.query(Conversation.id)
+            .filter(
+                Conversation.instance_id == instance_id,
+                Conversation.contact_phone == contact_phone,
+                Conversation.status == ConversationStatus.open,
+            )
+            .scalar()
+        )
+    out = OutboundMessage(
+        instance_id=instance_id,
+        conversation_id=conversation_id,
+        phone=phone,
+        text=text,
+        source=source,
+        status="queued",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(out)
+    db.flush()
+    _count("enqueued")
+    return out
+
+
+def wake() -> None:
+    """Acorda o despachante (pode ser chamado de threads)."""
+    if _loop is None or _wakeup is None or _loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _loop:
+        _wakeup.set()
+    else:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+async def wait(outbound_id: int, timeout: float) -> Optional[dict]:
+    """Resultado da entrega feita por este processo, ou None se não sair a tempo."""
+    if _loop is None:
+        return None
+    future = _loop.create_future()
+    _waiters.setdefault(outbound_id, []).append(future)
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        waiters = _waiters.get(outbound_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del _waiters[outbound_id]
+
+
+def _resolve(outbound_id: int, result: dict) -> None:
+    for future in _waiters.pop(outbound_id, []):
+        if not future.done():
+            future.set_result(result)
+
+
+# ─── Persistência (threads) ───────────────────────────────────────────────────
+
+def _reclaim_stale() -> int:
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.OUTBOUND_CLAIM_TIMEOUT_SECONDS)
+    db = SessionLocal()
+    try:
+        count = (
+            db.query(OutboundMessage)
+            .filter(OutboundMessage.status == "sending", OutboundMessage.claimed_at < cutoff)
+            .update({"status": "queued", "claimed_at": None}, synchronize_session=False)
+        )
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def _release(outbound_ids: Iterable[int]) -> None:
+    """Devolve à fila linhas reivindicadas que não chegaram a ser enviadas."""
+    db = SessionLocal()
+    try:
+        db.query(OutboundMessage).filter(
+            OutboundMessage.id.in_(list(outbound_ids)), OutboundMessage.status == "sending"
+        ).update({"status": "queued", "claimed_at": None}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _claim_due(busy_instances: Iterable[int], limit: int) -> Tuple[List[Tuple[int, int]], Optional[datetime]]:
+    """Reivindica até `limit` mensagens vencidas. Retorna ([(id, instance_id)], próximo vencimento)."""
+    now = datetime.utcnow()
+    busy = list(busy_instances)
+    db = SessionLocal()
+    try:
+        query = db.query(OutboundMessage.id, OutboundMessage.instance_id).filter(
+            OutboundMessage.status == "queued", OutboundMessage.next_attempt_at <= now
+        )
+        if busy:
+            query = query.filter(~OutboundMessage.instance_id.in_(busy))
+        claimed = []
+        for outbound_id, instance_id in query.order_by(OutboundMessage.id).limit(limit).all():
+            updated = (
+                db.query(OutboundMessage)
+                .filter(OutboundMessage.id == outbound_id, OutboundMessage.status == "queued")
+                .update({"status": "sending", "claimed_at": now}, synchronize_session=False)
+            )
+            if updated:
+                claimed.append((outbound_id, instance_id))
+        db.commit()
+        next_due = (
+            db.query(func.min(OutboundMessage.next_attempt_at))
+            .filter(OutboundMessage.status == "queued", OutboundMessage.next_attempt_at > now)
+            .scalar()
+        )
+        return claimed, next_due
+    finally:
+        db.close()
+
+
+def _load(outbound_id: int) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(OutboundMessage, Instance)
+            .join(Instance, Instance.id == OutboundMessage.instance_id)
+            .filter(OutboundMessage.id == outbound_id, OutboundMessage.status == "sending")
+            .first()
+        )
+        if not row:
+            return None
+        out, instance = row
+        return {
+            "api_url": instance.api_url,
+            "api_key": instance.api_key,
+            "instance_name": instance.instance_name,
+            "phone": out.phone,
+            "text": out.text,
+        }
+    finally:
+        db.close()
+
+
+def _evolution_id(data) -> str:
+    # Evolution API pode retornar dict ou list; extrai key.id
+    payload = data[0] if isinstance(data, list) and data else data
+    if isinstance(payload, dict):
+        key = payload.get("key") or {}
+        if isinstance(key, dict) and key.get("id"):
+            return key["id"]
+    evo_id = f"sent_{uuid.uuid4().hex}"
+    logger.warning("Outbound: Evolution API não retornou key.id — usando ID local %s", evo_id)
+    return evo_id
+
+
+def _mark_sent(outbound_id: int, data) -> Tuple[dict, Optional[dict]]:
+    """Grava a entrega e a linha Message. Retorna (resultado para quem aguarda, evento new_message)."""
+    from app.services.webhook_service import (
+        message_delta, conversation_delta, increment_counters, EVENT_SCHEMA_VERSION,
+    )
+
+    evo_id = _evolution_id(data)
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        out = db.get(OutboundMessage, outbound_id)
+        out.status = "sent"
+        out.sent_at = now
+        out.evolution_id = evo_id
+        out.attempts = (out.attempts or 0) + 1
+        out.last_error = None
+        latency = (now - out.created_at).total_seconds()
+        result = {"outbound_id": outbound_id, "id": None, "content": out.text, "direction": "outbound",
+                  "msg_type": "text", "timestamp": now.isoformat()}
+        event = None
+        answered = False
+        conv = db.get(Conversation, out.conversation_id) if out.conversation_id else None
+        if conv is not None:
+            msg = db.query(Message).filter(Message.evolution_id == evo_id).first()
+            if msg is None:
+                msg = Message(
+                    evolution_id=evo_id,
+                    conversation_id=conv.id,
+                    direction=MessageDirection.outbound,
+                    msg_type=MessageType.text,
+                    content=out.text,
+                    timestamp=now,
+                )
+                db.add(msg)
+                increment_counters(db, {conv.id: (conv, 0, 1)})
+                conv.last_message_at = now
+                # Mesma regra do eco do webhook, que agora é descartado como duplicado
+                if not conv.is_group and not conv.first_response_at:
+                    conv.first_response_at = now
+                    conv.first_response_time_seconds = (now - conv.opened_at).total_seconds()
+                    answered = True
+                db.flush()
+                event = {
+                    "type": "new_message",
+                    "v": EVENT_SCHEMA_VERSION,
+                    "instance": db.query(Instance.instance_name).filter(Instance.id == conv.instance_id).scalar(),
+                    "instance_id": conv.instance_id,
+                    "counters": {
+                        "messages": 1, "messages_today": 1, "inbound": 0, "outbound": 1,
+                        "new_conversations": 0, "answered": int(answered),
+                    },
+                    "messages": [message_delta(msg)],
+                    "conversations": [conversation_delta(conv, False, answered, None)],
+                }
+            out.message_id = msg.id
+            result["id"] = msg.id
+            result["timestamp"] = msg.timestamp.isoformat()
+        try:
+            db.commit()
+        except IntegrityError:
+            # Eco do webhook gravou a mesma mensagem entre a consulta e o commit
+            db.rollback()
+            out = db.get(OutboundMessage, outbound_id)
+            msg = db.query(Message).filter(Message.evolution_id == evo_id).first()
+            out.status, out.sent_at, out.evolution_id = "sent", now, evo_id
+            out.attempts = (out.attempts or 0) + 1
+            out.message_id = msg.id if msg else None
+            result["id"] = out.message_id
+            db.commit()
+            event, answered = None, False
+        if answered:
+            sla_service.discard([out.conversation_id])
+        if event:
+            webhook_dedup.remember(event["instance"], [evo_id])  # o eco do webhook é descartado sem ir ao banco
+    finally:
+        db.close()
+    _count("sent")
+    _latencies.append(latency)
+    return result, event
+
+
+def _mark_failed(outbound_id: int, error: str, transient: bool) -> bool:
+    """Registra a falha; transitória volta para a fila com backoff. Retorna True se for definitiva."""
+    db = SessionLocal()
+    try:
+        out = db.get(OutboundMessage, outbound_id)
+        out.attempts = (out.attempts or 0) + 1
+        out.last_error = error[:1000]
+        out.claimed_at = None
+        final = not transient or out.attempts >= settings.OUTBOUND_MAX_ATTEMPTS
+        if final:
+            out.status = "failed"
+        else:
+            base = settings.OUTBOUND_RETRY_BACKOFF_SECONDS * (2 ** (out.attempts - 1))
+            delay = min(base, MAX_RETRY_DELAY_SECONDS) * random.uniform(0.5, 1.0)
+            out.status = "queued"
+            out.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        db.commit()
+    finally:
+        db.close()
+    _count("failed" if final else "retried")
+    return final
+
+
+def describe_error(status_code: int, body) -> str:
+    """Mensagem legível para os erros conhecidos da Evolution API."""
+    body_dict = body if isinstance(body, dict) else {}
+    resp_data = body_dict.get("response")
+    resp_data = resp_data if isinstance(resp_data, dict) else {}
+    msg_list = resp_data.get("message", [])
+    if isinstance(msg_list, list) and msg_list and isinstance(msg_list[0], dict) and msg_list[0].get("exists") is False:
+        return (
+            "O WhatsApp não conseguiu localizar este contato. "
+            "Verifique se a instância está conectada (Settings → Instâncias) "
+            "e tente novamente."
+        )
+    # Detecta instância desconectada do WhatsApp
+    if isinstance(msg_list, str) and "connection closed" in msg_list.lower():
+        return (
+            "A instância WhatsApp está desconectada. "
+            "Acesse Configurações → Instâncias, reconecte o QR Code e tente novamente."
+        )
+    return f"Evolution API retornou erro {status_code}: {body}"
+
+
+# ─── Entrega ──────────────────────────────────────────────────────────────────
+
+async def _deliver(outbound_id: int) -> None:
+    job = await asyncio.to_thread(_load, outbound_id)
+    if job is None:
+        return
+    error, transient, data = None, False, None
+    try:
+        resp = await evolution.request(
+            "POST", job["api_url"], job["api_key"], f"/message/sendText/{job['instance_name']}",
+            instance=job["instance_name"], json={"number": job["phone"], "text": job["text"]}, timeout=30,
+        )
+        if resp.status_code in (200, 201):
+            try:
+                data = resp.json()
+            except ValueError:
+                data = None
+        else:
+            try:
+                body = resp.json()
+            except ValueError:
+                body = resp.text[:500]
+            error = describe_error(resp.status_code, body)
+            transient = resp.status_code in TRANSIENT_STATUSES
+    except CircuitOpenError:
+        error, transient = "A Evolution API está falhando para esta instância.", True
+    except (httpx.ConnectError, httpx.ConnectTimeout):
+        error, transient = "Não foi possível conectar à Evolution API. Verifique a URL da instância.", True
+    except httpx.TimeoutException:
+        error = "A Evolution API demorou para responder; entrega não confirmada."
+    except Exception as e:
+        error = str(e) or type(e).__name__
+
+    if error is None:
+        result, event = await asyncio.to_thread(_mark_sent, outbound_id, data)
+        if event is not None:
+            await broadcast(event)
+        _resolve(outbound_id, result)
+        return
+    final = await asyncio.to_thread(_mark_failed, outbound_id, error, transient)
+    if final:
+        logger.warning("Outbound %s (%s → %s) falhou: %s", outbound_id, job["instance_name"], job["phone"], error)
+        _resolve(outbound_id, {"error": error})
+    else:
+        logger.info("Outbound %s (%s): %s — nova tentativa agendada", outbound_id, job["instance_name"], error)
+        _wakeup.set()  # despachante recalcula o próximo vencimento
+
+
+async def _lane(instance_id: int) -> None:
+    queue = _lanes[instance_id]
+    bucket = _buckets[instance_id]
+    while True:
+        outbound_id = await queue.get()
+        if outbound_id is None:
+            return  # encerramento
+        if await bucket.acquire():
+            _count("throttled")
+        async with _semaphore:
+            try:
+                await _deliver(outbound_id)
+            except Exception as e:
+                logger.error("Outbound %s: erro inesperado na entrega: %s", outbound_id, e)
+
+
+def _dispatch(outbound_id: int, instance_id: int) -> None:
+    if instance_id not in _lanes:
+        _lanes[instance_id] = asyncio.Queue()
+        _buckets[instance_id] = TokenBucket(settings.OUTBOUND_RATE_PER_MINUTE, settings.OUTBOUND_BURST)
+        _lane_tasks[instance_id] = asyncio.create_task(_lane(instance_id))
+    _lanes[instance_id].put_nowait(outbound_id)
+
+
+async def _run() -> None:
+    last_reclaim = 0.0
+    while True:
+        timeout = settings.OUTBOUND_POLL_SECONDS
+        try:
+            if time.monotonic() - last_reclaim >= 60:
+                reclaimed = await asyncio.to_thread(_reclaim_stale)
+                if reclaimed:
+                    _count("reclaimed", reclaimed)
+                    logger.warning("Outbound: %d mensagens presas em envio voltaram para a fila", reclaimed)
+                last_reclaim = time.monotonic()
+            # Instâncias com fila local cheia não reivindicam mais (o resto fica para outras réplicas)
+            busy = [i for i, q in _lanes.items() if q.qsize() >= settings.OUTBOUND_BURST]
+            claimed, next_due = await asyncio.to_thread(_claim_due, busy, settings.OUTBOUND_BATCH_SIZE)
+            for outbound_id, instance_id in claimed:
+                _dispatch(outbound_id, instance_id)
+            if len(claimed) >= settings.OUTBOUND_BATCH_SIZE:
+                timeout = 0.2
+            elif next_due is not None:
+                timeout = min(timeout, (next_due - datetime.utcnow()).total_seconds())
+        except Exception as e:
+            logger.error("Outbound: falha no despachante: %s", e)
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=max(timeout, 0.05))
+        except asyncio.TimeoutError:
+            pass
+
+
+def _on_ingest_committed(event: dict) -> None:
+    """Mensagens automáticas enfileiradas pelos workers de ingestão."""
+    if event.get("outbound"):
+        wake()
+
+
+async def start() -> None:
+    """Inicia o despachante (chamado no lifespan)."""
+    global _loop, _wakeup, _task, _semaphore
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    listen("ingest_committed", _on_ingest_committed)
+    _semaphore = asyncio.Semaphore(max(settings.OUTBOUND_CONCURRENCY, 1))
+    _task = asyncio.create_task(_run())
+    logger.info(
+        "Outbound: fila iniciada (%s msg/min por instância, rajada %d)",
+        settings.OUTBOUND_RATE_PER_MINUTE, settings.OUTBOUND_BURST,
+    )
+
+
+async def stop() -> None:
+    """Para de reivindicar, devolve à fila o que não foi enviado e aguarda os envios em curso."""
+    global _task
+    if _task:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    pending = []
+    for queue in _lanes.values():
+        while not queue.empty():
+            pending.append(queue.get_nowait())
+        queue.put_nowait(None)
+    if pending:
+        await asyncio.to_thread(_release, pending)
+    tasks = list(_lane_tasks.values())
+    if tasks:
+        _, still_running = await asyncio.wait(tasks, timeout=settings.OUTBOUND_DRAIN_SECONDS)
+        for task in still_running:
+            task.cancel()
+    _lanes.clear()
+    _lane_tasks.clear()
+    _buckets.clear()
+
+
+# ─── Métricas ─────────────────────────────────────────────────────────────────
+
+def get_metrics(db: Session) -> dict:
+    by_status = dict(
+        db.query(OutboundMessage.status, func.count(OutboundMessage.id)).group_by(OutboundMessage.status).all()
+    )
+    oldest = (
+        db.query(func.min(OutboundMessage.created_at)).filter(OutboundMessage.status == "queued").scalar()
+    )
+    since = datetime.utcnow() - timedelta(hours=24)
+    failed_by_source = dict(
+        db.query(OutboundMessage.source, func.count(OutboundMessage.id))
+        .filter(OutboundMessage.status == "failed", OutboundMessage.created_at >= since)
+        .group_by(OutboundMessage.source)
+        .all()
+    )
+    latencies = sorted(_latencies)
+    with _stats_lock:
+        stats = dict(_stats)
+    return {
+        "queued": by_status.get("queued", 0),
+        "sending": by_status.get("sending", 0),
+        "sent_total": by_status.get("sent", 0),
+        "failed_total": by_status.get("failed", 0),
+        "failed_24h_by_source": failed_by_source,
+        "oldest_queued_seconds": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0.0,
+        "process": stats,
+        "latency_seconds": {
+            "avg": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else 0.0,
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+        "instances": {
+            instance_id: {"pending": _lanes[instance_id].qsize(), "tokens": round(bucket.tokens, 2)}
+            for instance_id, bucket in _buckets.items()
+        },
+    }
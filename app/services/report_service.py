@@ -7,22 +7,28 @@ Fluxo:
     → cliente_atend_raw (1 linha por cliente × atendente × semana)
     → atendente_raw     (1 linha por atendente × semana)
     → LLM → atendente_raw.llm_summary
+
+Backfill de semanas passadas: backfill_reports() / python -m app.cli backfill-reports.
 """
 
 import json
 import logging
-from collections import defaultdict, Counter
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, date, timedelta
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import Boolean, Date, DateTime, bindparam, func, text
 
 from app.core.config import settings
-from app.core.database import SessionLocal
-from app.models.conversation import Conversation, ConversationStatus
-from app.models.attendant import Attendant
-from app.models.report import AtendimentoRaw, ClienteAtendRaw, AtendentRaw
+from app.core.database import SessionLocal, _is_sqlite
+from app.core.events import broadcast_threadsafe
+from app.models.instance import Instance
+from app.models.report import AtendimentoRaw, AtendentRaw, ReportWatermark, ReportWeekState
+from app.services import llm_service
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +41,11 @@ def _get_week_start(ref: Optional[date] = None) -> date:
     return ref - timedelta(days=ref.weekday())
 
 
+def previous_week_start(ref: Optional[date] = None) -> date:
+    """Segunda-feira da semana anterior à de referência (a última semana fechada)."""
+    return _get_week_start(ref) - timedelta(days=7)
+
+
 def _format_seconds(secs: Optional[float]) -> str:
     if not secs:
         return "não disponível"
@@ -48,229 +59,320 @@ def _format_seconds(secs: Optional[float]) -> str:
 
 # ─── Etapa 1: populate atendimento_raw ───────────────────────────────────────
 
-def populate_atendimento_raw(db: Session, instance_id: int, days: int = 7) -> int:
-    """Busca conversas fechadas do período e faz UPSERT em atendimento_raw."""
-    since = datetime.utcnow() - timedelta(days=days)
-    week_start = _get_week_start()
+# Expressões dependentes de dialeto (semana = segunda-feira; duração em segundos)
+if _is_sqlite:
+    _WEEK_EXPR = "date(c.opened_at, 'weekday 0', '-6 days')"
+    _RESOLUTION_EXPR = "MAX(ROUND((julianday(c.resolved_at) - julianday(c.opened_at)) * 86400.0, 3), 0)"
+else:
+    _WEEK_EXPR = "CAST(date_trunc('week', c.opened_at) AS DATE)"
+    _RESOLUTION_EXPR = "GREATEST(EXTRACT(EPOCH FROM (c.resolved_at - c.opened_at)), 0)"
+
+_ATENDIMENTO_UPSERT_SQL = f"""
+INSERT INTO atendimento_raw (
+    conversation_id, attendant_id, attendant_name, instance_id,
+    contact_phone, contact_name, status, opened_at, resolved_at,
+    first_response_seconds, resolution_seconds, inbound_count, outbound_count,
+    analysis_category, analysis_sentiment, analysis_satisfaction,
+    period_week, source_updated_at, created_at
+)
+SELECT
+    c.id, c.attendant_id, a.name, c.instance_id,
+    c.contact_phone, c.contact_name, CAST(c.status AS VARCHAR(20)), c.opened_at, c.resolved_at,
+    c.first_response_time_seconds,
+    CASE WHEN c.resolved_at IS NOT NULL AND c.opened_at IS NOT NULL THEN {_RESOLUTION_EXPR} END,
+    COALESCE(c.inbound_count, 0), COALESCE(c.outbound_count, 0),
+    c.analysis_category, c.analysis_sentiment, c.analysis_satisfaction,
+    {_WEEK_EXPR}, COALESCE(c.updated_at, c.last_message_at, c.opened_at), :now
+FROM conversations c
+LEFT JOIN attendants a ON a.id = c.attendant_id
+WHERE c.instance_id = :instance_id
+  AND c.is_group = :is_group
+  AND c.opened_at >= :since
+  {{extra_filters}}
+ON CONFLICT (conversation_id) DO UPDATE SET
+    attendant_id = excluded.attendant_id,
+    attendant_name = excluded.attendant_name,
+    instance_id = excluded.instance_id,
+    contact_phone = excluded.contact_phone,
+    contact_name = excluded.contact_name,
+    status = excluded.status,
+    opened_at = excluded.opened_at,
+    resolved_at = excluded.resolved_at,
+    first_response_seconds = excluded.first_response_seconds,
+    resolution_seconds = excluded.resolution_seconds,
+    inbound_count = excluded.inbound_count,
+    outbound_count = excluded.outbound_count,
+    analysis_category = excluded.analysis_category,
+    analysis_sentiment = excluded.analysis_sentiment,
+    analysis_satisfaction = excluded.analysis_satisfaction,
+    period_week = excluded.period_week,
+    source_updated_at = excluded.source_updated_at
+"""
 
-    # Inclui TODOS os status (open, resolved, abandoned) para capturar a atividade completa da semana
-    convs = (
-        db.query(Conversation)
-        .filter(
-            Conversation.instance_id == instance_id,
-            Conversation.is_group == False,
-            Conversation.opened_at >= since,
-        )
-        .all()
-    )
-    logger.info("populate_atendimento_raw: encontradas %d conversas (instance=%s, days=%d)", len(convs), instance_id, days)
-
-    upserted = 0
-    for conv in convs:
-        # Calcular semana da conversa
-        conv_week = _get_week_start(conv.opened_at.date() if conv.opened_at else date.today())
-
-        resolution_secs = None
-        if conv.resolved_at and conv.opened_at:
-            delta = (conv.resolved_at - conv.opened_at).total_seconds()
-            resolution_secs = max(0.0, delta)
-
-        # Apaga registro anterior para a mesma conversa (UPSERT simples)
-        db.query(AtendimentoRaw).filter(
-            AtendimentoRaw.conversation_id == conv.id
-        ).delete(synchronize_session=False)
-
-        att_name = None
-        att_role = None
-        if conv.attendant_id:
-            att = db.query(Attendant).filter(Attendant.id == conv.attendant_id).first()
-            if att:
-                att_name = att.name
-                att_role = att.role.value if att.role else None
-
-        row = AtendimentoRaw(
-            conversation_id=conv.id,
-            attendant_id=conv.attendant_id,
-            attendant_name=att_name,
-            instance_id=instance_id,
-            contact_phone=conv.contact_phone,
-            contact_name=conv.contact_name,
-            status=conv.status.value,
-            opened_at=conv.opened_at,
-            resolved_at=conv.resolved_at,
-            first_response_seconds=conv.first_response_time_seconds,
-            resolution_seconds=resolution_secs,
-            inbound_count=conv.inbound_count or 0,
-            outbound_count=conv.outbound_count or 0,
-            analysis_category=conv.analysis_category,
-            analysis_sentiment=conv.analysis_sentiment,
-            analysis_satisfaction=conv.analysis_satisfaction,
-            period_week=conv_week,
-        )
-        db.add(row)
-        upserted += 1
+_WATERMARK_FILTER = "AND COALESCE(c.updated_at, c.last_message_at, c.opened_at) > :watermark"
+_UNTIL_FILTER = "AND c.opened_at < :until"
 
-    db.commit()
-    logger.info("populate_atendimento_raw: %d conversas processadas (instance=%s, days=%d)", upserted, instance_id, days)
-    return upserted
+STAGE_ATENDIMENTO = "atendimento_raw"
 
 
-# ─── Etapa 2: populate cliente_atend_raw ─────────────────────────────────────
+def _get_watermark(db: Session, stage: str, instance_id: int) -> Optional[ReportWatermark]:
+    return db.query(ReportWatermark).filter(
+        ReportWatermark.stage == stage,
+        ReportWatermark.instance_id == instance_id,
+    ).first()
 
-def populate_cliente_atend_raw(db: Session, instance_id: int, period_week: date) -> int:
-    """Agrega atendimento_raw por (cliente × atendente × semana)."""
-    rows = (
-        db.query(AtendimentoRaw)
-        .filter(
-            AtendimentoRaw.instance_id == instance_id,
-            AtendimentoRaw.period_week == period_week,
-            AtendimentoRaw.attendant_id.isnot(None),
-        )
-        .all()
+
+def populate_atendimento_raw(
+    db: Session,
+    instance_id: int,
+    days: int = 7,
+    full: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> int:
+    """UPSERT set-based das conversas do período em atendimento_raw (um único statement).
+
+    Incremental: só processa conversas alteradas desde a última execução (menos
+    REPORT_WATERMARK_OVERLAP_SECONDS), a menos que full=True ou a janela pedida
+    comece antes da já coberta.
+    since/until (backfill) substituem a janela de `days`; com `until` o watermark
+    não avança, pois conversas abertas depois do intervalo ficam de fora.
+    """
+    run_started = datetime.utcnow()
+    if since is None:
+        since = run_started - timedelta(days=days)
+
+    wm = _get_watermark(db, STAGE_ATENDIMENTO, instance_id)
+    incremental = (
+        not full
+        and wm is not None
+        and wm.covered_since is not None
+        and wm.covered_since <= since
     )
 
-    # Agrupa
-    groups: dict = defaultdict(list)
-    for r in rows:
-        groups[(r.contact_phone, r.attendant_id)].append(r)
-
-    # Remove linhas existentes para recomputar
-    db.query(ClienteAtendRaw).filter(
-        ClienteAtendRaw.instance_id == instance_id,
-        ClienteAtendRaw.period_week == period_week,
-    ).delete(synchronize_session=False)
-
-    upserted = 0
-    for (phone, att_id), items in groups.items():
-        resolved = sum(1 for i in items if i.status == "resolved")
-        abandoned = sum(1 for i in items if i.status == "abandoned")
-        responses = [i.first_response_seconds for i in items if i.first_response_seconds]
-        resolutions = [i.resolution_seconds for i in items if i.resolution_seconds]
-        satisfactions = [i.analysis_satisfaction for i in items if i.analysis_satisfaction]
-        categories = [i.analysis_category for i in items if i.analysis_category]
-        sentiments = [i.analysis_sentiment for i in items if i.analysis_sentiment]
-
-        dominant_cat = Counter(categories).most_common(1)[0][0] if categories else None
-        dominant_sent = Counter(sentiments).most_common(1)[0][0] if sentiments else None
-
-        db.add(ClienteAtendRaw(
-            contact_phone=phone,
-            attendant_id=att_id,
-            instance_id=instance_id,
-            period_week=period_week,
-            total_conversations=len(items),
-            resolved_conversations=resolved,
-            abandoned_conversations=abandoned,
-            avg_response_seconds=sum(responses) / len(responses) if responses else None,
-            avg_resolution_seconds=sum(resolutions) / len(resolutions) if resolutions else None,
-            total_messages_in=sum(i.inbound_count for i in items),
-            total_messages_out=sum(i.outbound_count for i in items),
-            avg_satisfaction=sum(satisfactions) / len(satisfactions) if satisfactions else None,
-            dominant_category=dominant_cat,
-            dominant_sentiment=dominant_sent,
-        ))
-        upserted += 1
+    # Inclui TODOS os status (open, resolved, abandoned) para capturar a atividade completa da semana
+    filters = []
+    if incremental:
+        filters.append(_WATERMARK_FILTER)
+    if until is not None:
+        filters.append(_UNTIL_FILTER)
+    sql = _ATENDIMENTO_UPSERT_SQL.format(extra_filters="\n  ".join(filters))
+    params = [
+        bindparam("now", run_started, type_=DateTime),
+        bindparam("since", since, type_=DateTime),
+        bindparam("instance_id", instance_id),
+        bindparam("is_group", False, type_=Boolean),
+    ]
+    if incremental:
+        # updated_at é gravado antes do commit: uma transação que o marcou antes de run_started e
+        # commitou depois do snapshot anterior só aparece agora. O UPSERT é idempotente, então
+        # reler a sobreposição custa pouco e não perde a linha.
+        overlap = timedelta(seconds=max(settings.REPORT_WATERMARK_OVERLAP_SECONDS, 0))
+        params.append(bindparam("watermark", wm.watermark - overlap, type_=DateTime))
+    if until is not None:
+        params.append(bindparam("until", until, type_=DateTime))
+    result = db.execute(text(sql).bindparams(*params))
+    upserted = result.rowcount or 0
+
+    if until is None:
+        if wm is None:
+            wm = ReportWatermark(stage=STAGE_ATENDIMENTO, instance_id=instance_id, watermark=run_started)
+            db.add(wm)
+        wm.watermark = run_started
+        if not incremental or wm.covered_since is None or since < wm.covered_since:
+            wm.covered_since = since
 
     db.commit()
-    logger.info("populate_cliente_atend_raw: %d pares cliente×atendente (instance=%s, week=%s)", upserted, instance_id, period_week)
+    logger.info(
+        "populate_atendimento_raw: %d conversas processadas (instance=%s, desde=%s, até=%s, %s)",
+        upserted, instance_id, since.date(), until.date() if until else "agora",
+        "incremental" if incremental else "completo",
+    )
     return upserted
 
 
-# ─── Etapa 3: populate atendente_raw ─────────────────────────────────────────
+# ─── Etapas 2 e 3: agregações em SQL ─────────────────────────────────────────
 
-def _sla_rate(items: list, threshold_secs: int) -> float:
-    valids = [i for i in items if i.first_response_seconds is not None]
-    if not valids:
-        return 0.0
-    within = sum(1 for i in valids if i.first_response_seconds <= threshold_secs)
-    return round(within / len(valids) * 100, 1)
+def _mode_expr(column: str, group_cols: tuple) -> str:
+    """Valor mais frequente (ignorando NULL) de `column` dentro do grupo de `r`."""
+    if not _is_sqlite:
+        return f"mode() WITHIN GROUP (ORDER BY r.{column})"
+    # SQLite não tem mode(): subquery correlacionada com o mesmo desempate (menor valor)
+    match = " AND ".join(f"x.{c} = r.{c}" for c in group_cols)
+    return (
+        f"(SELECT x.{column} FROM atendimento_raw x "
+        f"WHERE x.instance_id = r.instance_id AND x.period_week = r.period_week AND {match} "
+        f"AND x.{column} IS NOT NULL "
+        f"GROUP BY x.{column} ORDER BY COUNT(*) DESC, x.{column} LIMIT 1)"
+    )
 
 
-def populate_atendente_raw(db: Session, instance_id: int, period_week: date) -> int:
-    """Agrega atendimento_raw por (atendente × semana)."""
-    rows = (
-        db.query(AtendimentoRaw)
-        .filter(
-            AtendimentoRaw.instance_id == instance_id,
-            AtendimentoRaw.period_week == period_week,
-            AtendimentoRaw.attendant_id.isnot(None),
-        )
-        .all()
+def _counts_json_expr(column: str, limit: Optional[int] = None) -> str:
+    """Objeto JSON {valor: contagem} do atendente de `r`, em ordem decrescente."""
+    limit_sql = f" LIMIT {limit}" if limit else ""
+    counts = (
+        f"SELECT x.{column} AS value, COUNT(*) AS n FROM atendimento_raw x "
+        f"WHERE x.instance_id = r.instance_id AND x.period_week = r.period_week "
+        f"AND x.attendant_id = r.attendant_id AND x.{column} IS NOT NULL "
+        f"GROUP BY x.{column} ORDER BY n DESC, x.{column}{limit_sql}"
+    )
+    if _is_sqlite:
+        return f"COALESCE((SELECT json_group_object(t.value, t.n) FROM ({counts}) t), '{{}}')"
+    return (
+        f"COALESCE((SELECT CAST(json_object_agg(t.value, t.n ORDER BY t.n DESC, t.value) AS TEXT) "
+        f"FROM ({counts}) t), '{{}}')"
     )
 
-    groups: dict = defaultdict(list)
-    for r in rows:
-        groups[r.attendant_id].append(r)
 
-    upserted = 0
-    for att_id, items in groups.items():
-        att_name = items[0].attendant_name or f"Atendente #{att_id}"
+def _pct_expr(condition: str, denominator: str) -> str:
+    """Percentual (0–100, 1 casa) de linhas que satisfazem `condition`; 0 sem denominador."""
+    return (
+        f"COALESCE(ROUND(CAST(100.0 * COUNT(*) FILTER (WHERE {condition}) "
+        f"/ NULLIF({denominator}, 0) AS NUMERIC), 1), 0)"
+    )
 
-        # Busca role do atendente
-        att = db.query(Attendant).filter(Attendant.id == att_id).first()
-        role = att.role.value if att and att.role else "agent"
 
-        resolved = sum(1 for i in items if i.status == "resolved")
-        abandoned = sum(1 for i in items if i.status == "abandoned")
-        total = len(items)
-        resolution_rate = round(resolved / total * 100, 1) if total > 0 else 0.0
+# Médias ignoram zeros, como o cálculo original em Python (valores "falsy" eram descartados)
+_CLIENTE_ATEND_UPSERT_SQL = f"""
+INSERT INTO cliente_atend_raw (
+    contact_phone, attendant_id, instance_id, period_week,
+    total_conversations, resolved_conversations, abandoned_conversations,
+    avg_response_seconds, avg_resolution_seconds,
+    total_messages_in, total_messages_out, avg_satisfaction,
+    dominant_category, dominant_sentiment, last_updated
+)
+SELECT
+    r.contact_phone, r.attendant_id, r.instance_id, r.period_week,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE r.status = 'resolved'),
+    COUNT(*) FILTER (WHERE r.status = 'abandoned'),
+    AVG(NULLIF(r.first_response_seconds, 0)),
+    AVG(NULLIF(r.resolution_seconds, 0)),
+    COALESCE(SUM(r.inbound_count), 0),
+    COALESCE(SUM(r.outbound_count), 0),
+    AVG(NULLIF(r.analysis_satisfaction, 0)),
+    {_mode_expr("analysis_category", ("contact_phone", "attendant_id"))},
+    {_mode_expr("analysis_sentiment", ("contact_phone", "attendant_id"))},
+    :now
+FROM atendimento_raw r
+WHERE r.instance_id = :instance_id AND r.period_week = :period_week AND r.attendant_id IS NOT NULL
+GROUP BY r.contact_phone, r.attendant_id, r.instance_id, r.period_week
+ON CONFLICT (contact_phone, attendant_id, period_week) DO UPDATE SET
+    instance_id = excluded.instance_id,
+    total_conversations = excluded.total_conversations,
+    resolved_conversations = excluded.resolved_conversations,
+    abandoned_conversations = excluded.abandoned_conversations,
+    avg_response_seconds = excluded.avg_response_seconds,
+    avg_resolution_seconds = excluded.avg_resolution_seconds,
+    total_messages_in = excluded.total_messages_in,
+    total_messages_out = excluded.total_messages_out,
+    avg_satisfaction = excluded.avg_satisfaction,
+    dominant_category = excluded.dominant_category,
+    dominant_sentiment = excluded.dominant_sentiment,
+    last_updated = excluded.last_updated
+"""
 
-        responses = [i.first_response_seconds for i in items if i.first_response_seconds]
-        resolutions = [i.resolution_seconds for i in items if i.resolution_seconds]
-        satisfactions = [i.analysis_satisfaction for i in items if i.analysis_satisfaction]
+# Pares cliente×atendente que deixaram de existir na semana (ex.: conversa reatribuída)
+_CLIENTE_ATEND_STALE_SQL = """
+DELETE FROM cliente_atend_raw
+WHERE instance_id = :instance_id AND period_week = :period_week
+  AND NOT EXISTS (
+    SELECT 1 FROM atendimento_raw r
+    WHERE r.instance_id = cliente_atend_raw.instance_id
+      AND r.period_week = cliente_atend_raw.period_week
+      AND r.contact_phone = cliente_atend_raw.contact_phone
+      AND r.attendant_id = cliente_atend_raw.attendant_id
+  )
+"""
 
-        categories = [i.analysis_category for i in items if i.analysis_category]
-        sentiments = [i.analysis_sentiment for i in items if i.analysis_sentiment]
-        top_cats = dict(Counter(categories).most_common(5))
-        top_sents = dict(Counter(sentiments))
+# llm_summary/generated_at não aparecem no SET — são preservados entre execuções
+_ATENDENTE_UPSERT_SQL = f"""
+INSERT INTO atendente_raw (
+    attendant_id, attendant_name, role, instance_id, period_week,
+    total_conversations, resolved_conversations, abandoned_conversations, resolution_rate,
+    avg_first_response_seconds, avg_resolution_seconds,
+    total_messages_sent, total_messages_received, avg_satisfaction,
+    sla_5min_rate, sla_15min_rate, sla_30min_rate,
+    top_categories, top_sentiments, last_updated
+)
+SELECT
+    r.attendant_id,
+    COALESCE(MAX(r.attendant_name), 'Atendente #' || r.attendant_id),
+    COALESCE(CAST(MAX(a.role) AS VARCHAR(20)), 'agent'),
+    r.instance_id, r.period_week,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE r.status = 'resolved'),
+    COUNT(*) FILTER (WHERE r.status = 'abandoned'),
+    {_pct_expr("r.status = 'resolved'", "COUNT(*)")},
+    AVG(NULLIF(r.first_response_seconds, 0)),
+    AVG(NULLIF(r.resolution_seconds, 0)),
+    COALESCE(SUM(r.outbound_count), 0),
+    COALESCE(SUM(r.inbound_count), 0),
+    AVG(NULLIF(r.analysis_satisfaction, 0)),
+    {_pct_expr("r.first_response_seconds <= 300", "COUNT(r.first_response_seconds)")},
+    {_pct_expr("r.first_response_seconds <= 900", "COUNT(r.first_response_seconds)")},
+    {_pct_expr("r.first_response_seconds <= 1800", "COUNT(r.first_response_seconds)")},
+    {_counts_json_expr("analysis_category", limit=5)},
+    {_counts_json_expr("analysis_sentiment")},
+    :now
+FROM atendimento_raw r
+LEFT JOIN attendants a ON a.id = r.attendant_id
+WHERE r.instance_id = :instance_id AND r.period_week = :period_week AND r.attendant_id IS NOT NULL
+GROUP BY r.attendant_id, r.instance_id, r.period_week
+ON CONFLICT (attendant_id, period_week) DO UPDATE SET
+    attendant_name = excluded.attendant_name,
+    role = excluded.role,
+    instance_id = excluded.instance_id,
+    total_conversations = excluded.total_conversations,
+    resolved_conversations = excluded.resolved_conversations,
+    abandoned_conversations = excluded.abandoned_conversations,
+    resolution_rate = excluded.resolution_rate,
+    avg_first_response_seconds = excluded.avg_first_response_seconds,
+    avg_resolution_seconds = excluded.avg_resolution_seconds,
+    total_messages_sent = excluded.total_messages_sent,
+    total_messages_received = excluded.total_messages_received,
+    avg_satisfaction = excluded.avg_satisfaction,
+    sla_5min_rate = excluded.sla_5min_rate,
+    sla_15min_rate = excluded.sla_15min_rate,
+    sla_30min_rate = excluded.sla_30min_rate,
+    top_categories = excluded.top_categories,
+    top_sentiments = excluded.top_sentiments,
+    last_updated = excluded.last_updated
+"""
 
-        # Remove linha existente para atualizar
-        existing = db.query(AtendentRaw).filter(
-            AtendentRaw.attendant_id == att_id,
-            AtendentRaw.period_week == period_week,
-        ).first()
-        if existing:
-            # Preserva llm_summary/generated_at se já existe
-            existing.attendant_name = att_name
-            existing.role = role
-            existing.total_conversations = total
-            existing.resolved_conversations = resolved
-            existing.abandoned_conversations = abandoned
-            existing.resolution_rate = resolution_rate
-            existing.avg_first_response_seconds = sum(responses) / len(responses) if responses else None
-            existing.avg_resolution_seconds = sum(resolutions) / len(resolutions) if resolutions else None
-            existing.total_messages_sent = sum(i.outbound_count for i in items)
-            existing.total_messages_received = sum(i.inbound_count for i in items)
-            existing.avg_satisfaction = sum(satisfactions) / len(satisfactions) if satisfactions else None
-            existing.sla_5min_rate = _sla_rate(items, 300)
-            existing.sla_15min_rate = _sla_rate(items, 900)
-            existing.sla_30min_rate = _sla_rate(items, 1800)
-            existing.top_categories = json.dumps(top_cats, ensure_ascii=False)
-            existing.top_sentiments = json.dumps(top_sents, ensure_ascii=False)
-            existing.last_updated = datetime.utcnow()
-        else:
-            db.add(AtendentRaw(
-                attendant_id=att_id,
-                attendant_name=att_name,
-                role=role,
-                instance_id=instance_id,
-                period_week=period_week,
-                total_conversations=total,
-                resolved_conversations=resolved,
-                abandoned_conversations=abandoned,
-                resolution_rate=resolution_rate,
-                avg_first_response_seconds=sum(responses) / len(responses) if responses else None,
-                avg_resolution_seconds=sum(resolutions) / len(resolutions) if resolutions else None,
-                total_messages_sent=sum(i.outbound_count for i in items),
-                total_messages_received=sum(i.inbound_count for i in items),
-                avg_satisfaction=sum(satisfactions) / len(satisfactions) if satisfactions else None,
-                sla_5min_rate=_sla_rate(items, 300),
-                sla_15min_rate=_sla_rate(items, 900),
-                sla_30min_rate=_sla_rate(items, 1800),
-                top_categories=json.dumps(top_cats, ensure_ascii=False),
-                top_sentiments=json.dumps(top_sents, ensure_ascii=False),
-            ))
-        upserted += 1
+
+def _week_params(instance_id: int, period_week: date) -> list:
+    return [
+        bindparam("instance_id", instance_id),
+        bindparam("period_week", period_week, type_=Date),
+    ]
+
+
+def populate_cliente_atend_raw(db: Session, instance_id: int, period_week: date) -> int:
+    """Agrega atendimento_raw por (cliente × atendente × semana) com um UPSERT agrupado."""
+    params = _week_params(instance_id, period_week)
+    result = db.execute(
+        text(_CLIENTE_ATEND_UPSERT_SQL).bindparams(
+            *params, bindparam("now", datetime.utcnow(), type_=DateTime),
+        )
+    )
+    upserted = result.rowcount or 0
+    db.execute(text(_CLIENTE_ATEND_STALE_SQL).bindparams(*params))
+
+    db.commit()
+    logger.info("populate_cliente_atend_raw: %d pares cliente×atendente (instance=%s, week=%s)", upserted, instance_id, period_week)
+    return upserted
+
+
+def populate_atendente_raw(db: Session, instance_id: int, period_week: date) -> int:
+    """Agrega atendimento_raw por (atendente × semana) com um UPSERT agrupado."""
+    result = db.execute(
+        text(_ATENDENTE_UPSERT_SQL).bindparams(
+            *_week_params(instance_id, period_week),
+            bindparam("now", datetime.utcnow(), type_=DateTime),
+        )
+    )
+    upserted = result.rowcount or 0
 
     db.commit()
     logger.info("populate_atendente_raw: %d atendentes (instance=%s, week=%s)", upserted, instance_id, period_week)
@@ -343,85 +445,396 @@ def _build_report_prompt(row: AtendentRaw) -> str:
     )
 
 
-def _call_llm_text(prompt: str) -> str:
-    provider = settings.LLM_PROVIDER.lower()
-    if provider == "anthropic":
-        import anthropic
-        client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-        resp = client.messages.create(
-            model="claude-haiku-4-5-20251001",
-            max_tokens=700,
-            system=REPORT_SYSTEM_PROMPT,
-            messages=[{"role": "user", "content": prompt}],
+def _call_llm_text(prompt: str, instance_id: Optional[int] = None) -> str:
+    return llm_service.complete(
+        "report",
+        prompt,
+        system=REPORT_SYSTEM_PROMPT,
+        max_tokens=700,
+        instance_id=instance_id,
+        low_priority=True,
+    ).text
+
+
+# ─── Jobs de geração (progresso em memória + SSE) ─────────────────────────────
+
+_MAX_JOBS = 50
+_jobs: "OrderedDict[str, dict]" = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def create_job(instance_ids: Optional[List[int]], days: Optional[int], kind: str = "generate", **params) -> str:
+    job_id = uuid.uuid4().hex[:12]
+    with _jobs_lock:
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "instance_ids": instance_ids,
+            "days": days,
+            **params,
+            "weeks_rebuilt": 0,
+            "weeks_skipped": 0,
+            "total": 0,
+            "done": 0,
+            "failed": 0,
+            "deferred_instances": [],
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+        while len(_jobs) > _MAX_JOBS:
+            _jobs.popitem(last=False)
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def list_jobs() -> List[dict]:
+    with _jobs_lock:
+        return [dict(j) for j in reversed(_jobs.values())]
+
+
+def _update_job(job_id: Optional[str], increment: Optional[str] = None, **changes) -> None:
+    """Atualiza o job (increment soma 1 no contador indicado) e publica o progresso via SSE."""
+    if not job_id:
+        return
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if not job:
+            return
+        job.update(changes)
+        if increment:
+            job[increment] += 1
+        event = {k: job[k] for k in ("job_id", "status", "total", "done", "failed")}
+    broadcast_threadsafe({"type": "report_progress", **event})
+
+
+# ─── Orquestrador principal ───────────────────────────────────────────────────
+
+def _summarize_row(row_id: int) -> bool:
+    """Gera e grava o resumo LLM de uma linha de atendente_raw.
+    A conexão não fica presa durante a chamada ao LLM: lê, fecha, chama, grava."""
+    db = SessionLocal()
+    try:
+        row = db.query(AtendentRaw).filter(AtendentRaw.id == row_id).first()
+        if not row:
+            return False
+        prompt = _build_report_prompt(row)
+        instance_id, attendant_name, period_week = row.instance_id, row.attendant_name, row.period_week
+    finally:
+        db.close()
+
+    summary = _call_llm_text(prompt, instance_id)
+
+    db = SessionLocal()
+    try:
+        db.query(AtendentRaw).filter(AtendentRaw.id == row_id).update(
+            {"llm_summary": summary, "generated_at": datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+    logger.info("Relatório gerado para atendente=%s semana=%s", attendant_name, period_week)
+    return True
+
+
+def _weeks_between(start: date, end: date) -> List[date]:
+    """Segundas-feiras de todas as semanas tocadas pelo intervalo [start, end]."""
+    week = _get_week_start(start)
+    last = _get_week_start(end)
+    weeks = []
+    while week <= last:
+        weeks.append(week)
+        week += timedelta(days=7)
+    return weeks
+
+
+def _week_fingerprints(db: Session, instance_id: int, weeks: List[date]) -> dict:
+    """{semana: (linhas, max(source_updated_at))} de atendimento_raw, numa única consulta agrupada."""
+    rows = (
+        db.query(
+            AtendimentoRaw.period_week,
+            func.count(AtendimentoRaw.id),
+            func.max(AtendimentoRaw.source_updated_at),
+        )
+        .filter(
+            AtendimentoRaw.instance_id == instance_id,
+            AtendimentoRaw.period_week >= weeks[0],
+            AtendimentoRaw.period_week <= weeks[-1],
         )
-        return resp.content[0].text.strip()
-    else:
-        from openai import OpenAI
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            max_tokens=700,
-            messages=[
-                {"role": "system", "content": REPORT_SYSTEM_PROMPT},
-                {"role": "user", "content": prompt},
-            ],
+        .group_by(AtendimentoRaw.period_week)
+        .all()
+    )
+    return {week: (count, max_updated) for week, count, max_updated in rows}
+
+
+def _stale_weeks(db: Session, instance_id: int, weeks: List[date], force: bool = False) -> Tuple[List[Tuple[date, tuple]], int]:
+    """Semanas cuja origem mudou desde a última agregação (com a impressão digital atual)
+    e o total de semanas com dados no intervalo."""
+    if not weeks:
+        return [], 0
+    current = _week_fingerprints(db, instance_id, weeks)
+    saved = {
+        s.period_week: (s.source_count, s.source_max_updated_at)
+        for s in db.query(ReportWeekState).filter(
+            ReportWeekState.instance_id == instance_id,
+            ReportWeekState.period_week >= weeks[0],
+            ReportWeekState.period_week <= weeks[-1],
         )
-        return resp.choices[0].message.content.strip()
+    }
+    stale = [
+        (week, fp) for week, fp in sorted(current.items())
+        if force or saved.get(week) != fp
+    ]
+    return stale, len(current)
 
 
-def generate_llm_summary(row: AtendentRaw) -> str:
-    prompt = _build_report_prompt(row)
-    return _call_llm_text(prompt)
+def _aggregate_week(instance_id: int, period_week: date, fingerprint: tuple) -> None:
+    """Etapas 2–3 de uma semana (sessão própria — roda em thread) e grava a impressão digital."""
+    db = SessionLocal()
+    try:
+        populate_cliente_atend_raw(db, instance_id, period_week)
+        populate_atendente_raw(db, instance_id, period_week)
+        state = db.query(ReportWeekState).filter(
+            ReportWeekState.instance_id == instance_id,
+            ReportWeekState.period_week == period_week,
+        ).first()
+        if not state:
+            state = ReportWeekState(instance_id=instance_id, period_week=period_week)
+            db.add(state)
+        state.source_count, state.source_max_updated_at = fingerprint
+        state.aggregated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
 
 
-# ─── Orquestrador principal ───────────────────────────────────────────────────
+def _rebuild_weeks(
+    instance_ids: List[int],
+    since: datetime,
+    until: Optional[datetime] = None,
+    force: bool = False,
+    job_id: Optional[str] = None,
+) -> dict:
+    """Etapas 1–3 para todas as semanas tocadas por [since, until).
 
-def generate_all_reports(instance_id: int, days: int = 7) -> dict:
-    """
-    Pipeline completo: agrega dados + gera resumo LLM por atendente.
-    Projetado para rodar em background (BackgroundTasks do FastAPI).
+    A etapa 1 roda uma vez por instância para o intervalo inteiro; as semanas cuja
+    origem mudou (ou todas, com force) são agregadas em paralelo.
+    Retorna {instance_id: [semanas reagregadas]}.
     """
+    last_day = (until - timedelta(microseconds=1)).date() if until else date.today()
+    weeks = _weeks_between(since.date(), last_day)
+
+    tasks = []
+    skipped = 0
+    for instance_id in instance_ids:
+        db = SessionLocal()
+        try:
+            populate_atendimento_raw(db, instance_id, full=force, since=since, until=until)
+            stale, with_data = _stale_weeks(db, instance_id, weeks, force)
+        finally:
+            db.close()
+        tasks.extend((instance_id, week, fp) for week, fp in stale)
+        skipped += with_data - len(stale)
+
+    rebuilt: dict = {instance_id: [] for instance_id in instance_ids}
+    with ThreadPoolExecutor(max_workers=max(settings.REPORT_MAX_WORKERS, 1), thread_name_prefix="report-week") as pool:
+        futures = {pool.submit(_aggregate_week, *task): task for task in tasks}
+        for future in as_completed(futures):
+            instance_id, week, _ = futures[future]
+            future.result()
+            rebuilt[instance_id].append(week)
+    for instance_weeks in rebuilt.values():
+        instance_weeks.sort()
+
+    logger.info(
+        "_rebuild_weeks: %d semanas reagregadas, %d sem alteração (instâncias=%s, semanas=%s..%s)",
+        len(tasks), skipped, instance_ids, weeks[0], weeks[-1],
+    )
+    _update_job(job_id, weeks_rebuilt=len(tasks), weeks_skipped=skipped)
+    return rebuilt
+
+
+def _llm_config_error() -> Optional[str]:
     provider = settings.LLM_PROVIDER.lower()
     if provider == "openai" and not settings.OPENAI_API_KEY:
         logger.warning("OPENAI_API_KEY não configurada — relatório ignorado.")
-        return {"status": "error", "error": "LLM não configurado"}
+        return "LLM não configurado"
     if provider == "anthropic" and not settings.ANTHROPIC_API_KEY:
         logger.warning("ANTHROPIC_API_KEY não configurada — relatório ignorado.")
-        return {"status": "error", "error": "LLM não configurado"}
+        return "LLM não configurado"
+    return None
 
+
+def _active_instance_ids() -> List[int]:
     db = SessionLocal()
     try:
-        # Etapa 1
-        populate_atendimento_raw(db, instance_id, days)
+        return [i.id for i in db.query(Instance.id).filter(Instance.active == True)]
+    finally:
+        db.close()
 
-        # Etapa 2 e 3 — agrupa por semana coberta pelo período
-        period_week = _get_week_start()
-        populate_cliente_atend_raw(db, instance_id, period_week)
-        populate_atendente_raw(db, instance_id, period_week)
 
-        # Etapa 4 — LLM por atendente
-        rows = db.query(AtendentRaw).filter(
-            AtendentRaw.instance_id == instance_id,
-            AtendentRaw.period_week == period_week,
-        ).all()
+def _summary_row_ids(instance_ids: List[int], weeks_by_instance: dict, job_id: Optional[str]) -> Tuple[List[int], List[int]]:
+    """Ids de atendente_raw a resumir; instâncias sem orçamento de tokens ficam adiadas."""
+    row_ids: List[int] = []
+    deferred = []
+    db = SessionLocal()
+    try:
+        for instance_id in instance_ids:
+            weeks = weeks_by_instance.get(instance_id) or []
+            if not weeks:
+                continue
+            if llm_service.budget_exhausted(instance_id, db):
+                logger.info("Orçamento de tokens esgotado (instance=%s) — resumos LLM adiados", instance_id)
+                deferred.append(instance_id)
+                continue
+            row_ids.extend(
+                r.id for r in db.query(AtendentRaw.id).filter(
+                    AtendentRaw.instance_id == instance_id,
+                    AtendentRaw.period_week.in_(weeks),
+                )
+            )
+    finally:
+        db.close()
+    _update_job(job_id, total=len(row_ids), deferred_instances=deferred)
+    return row_ids, deferred
+
 
-        processed = 0
-        for row in rows:
+def _summarize_rows(row_ids: List[int], job_id: Optional[str]) -> Tuple[int, int]:
+    """Etapa 4 — LLM por atendente, em paralelo. Retorna (processados, falhas)."""
+    processed = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(settings.REPORT_MAX_WORKERS, 1), thread_name_prefix="report") as pool:
+        futures = {pool.submit(_summarize_row, row_id): row_id for row_id in row_ids}
+        for future in as_completed(futures):
             try:
-                summary = generate_llm_summary(row)
-                row.llm_summary = summary
-                row.generated_at = datetime.utcnow()
-                db.commit()
-                processed += 1
-                logger.info("Relatório gerado para atendente=%s semana=%s", row.attendant_name, period_week)
+                if future.result():
+                    processed += 1
+                    _update_job(job_id, increment="done")
+                    continue
+            except llm_service.LlmBudgetExceeded:
+                logger.info("Orçamento de tokens esgotado — resumo adiado (atendente_raw=%s)", futures[future])
             except Exception as e:
-                logger.error("Erro ao gerar relatório para atendente=%s: %s", row.attendant_id, e)
-                db.rollback()
+                logger.error("Erro ao gerar relatório para atendente_raw=%s: %s", futures[future], e)
+            failed += 1
+            _update_job(job_id, increment="failed")
+    return processed, failed
+
+
+def generate_reports(
+    instance_ids: Optional[List[int]] = None,
+    days: int = 7,
+    job_id: Optional[str] = None,
+    period_week: Optional[date] = None,
+) -> dict:
+    """
+    Pipeline completo para uma ou várias instâncias (None = todas as ativas).
+    Agrega todas as semanas tocadas pela janela de `days` e distribui os resumos
+    LLM de `period_week` (segunda-feira; padrão: semana atual) num pool limitado
+    (REPORT_MAX_WORKERS); o llm_service aplica o limite por provedor. Cada linha
+    é gravada de forma independente — uma falha não derruba as demais.
+    """
+    error = _llm_config_error()
+    if error:
+        _update_job(job_id, status="error", error=error)
+        return {"status": "error", "error": error}
 
-        return {"status": "ok", "attendants_processed": processed, "period_week": str(period_week)}
+    _update_job(job_id, status="running", started_at=datetime.utcnow().isoformat())
+    try:
+        if instance_ids is None:
+            instance_ids = _active_instance_ids()
+
+        # Etapas 1–3 — todas as semanas tocadas pela janela (completas desde a segunda-feira),
+        # puladas as que não mudaram
+        period_week = _get_week_start(period_week)
+        first_week = min(_get_week_start((datetime.utcnow() - timedelta(days=days)).date()), period_week)
+        _rebuild_weeks(instance_ids, since=datetime.combine(first_week, datetime.min.time()), job_id=job_id)
+
+        # Etapa 4 — resumos da semana pedida
+        row_ids, deferred = _summary_row_ids(
+            instance_ids, {instance_id: [period_week] for instance_id in instance_ids}, job_id,
+        )
+        processed, failed = _summarize_rows(row_ids, job_id)
+
+        _update_job(job_id, status="done", finished_at=datetime.utcnow().isoformat())
+        weeks = {instance_id: str(period_week) for instance_id in instance_ids}
+        result = {
+            "status": "ok",
+            "attendants_processed": processed,
+            "attendants_failed": failed,
+            "deferred_instances": deferred,
+            "period_weeks": weeks,
+        }
+        if len(instance_ids) == 1:
+            result["period_week"] = weeks.get(instance_ids[0])
+        return result
 
     except Exception as e:
-        logger.error("generate_all_reports error: %s", e)
+        logger.error("generate_reports error: %s", e)
+        _update_job(job_id, status="error", error=str(e), finished_at=datetime.utcnow().isoformat())
+        return {"status": "error", "error": str(e)}
+
+
+def generate_all_reports(instance_id: int, days: int = 7) -> dict:
+    """Pipeline completo de uma instância (mantido para chamadores existentes)."""
+    return generate_reports([instance_id], days)
+
+
+def backfill_reports(
+    start: date,
+    end: date,
+    instance_ids: Optional[List[int]] = None,
+    force: bool = False,
+    summarize: bool = False,
+    job_id: Optional[str] = None,
+) -> dict:
+    """
+    Reconstrói as agregações de todas as semanas entre start e end (inclusive) de uma vez.
+    Semanas sem alteração na origem são puladas, a menos que force=True.
+    summarize=True também gera os resumos LLM das semanas reagregadas.
+    """
+    if end < start:
+        raise ValueError("end deve ser maior ou igual a start")
+    if summarize:
+        error = _llm_config_error()
+        if error:
+            _update_job(job_id, status="error", error=error)
+            return {"status": "error", "error": error}
+
+    _update_job(job_id, status="running", started_at=datetime.utcnow().isoformat())
+    try:
+        if instance_ids is None:
+            instance_ids = _active_instance_ids()
+
+        since = datetime.combine(_get_week_start(start), datetime.min.time())
+        until = datetime.combine(_get_week_start(end) + timedelta(days=7), datetime.min.time())
+        if until > datetime.utcnow():
+            until = None  # intervalo chega até hoje: mesma janela aberta do pipeline normal
+
+        rebuilt = _rebuild_weeks(instance_ids, since=since, until=until, force=force, job_id=job_id)
+
+        processed = failed = 0
+        deferred: List[int] = []
+        if summarize:
+            row_ids, deferred = _summary_row_ids(instance_ids, rebuilt, job_id)
+            processed, failed = _summarize_rows(row_ids, job_id)
+
+        _update_job(job_id, status="done", finished_at=datetime.utcnow().isoformat())
+        return {
+            "status": "ok",
+            "weeks_rebuilt": {instance_id: [str(w) for w in weeks] for instance_id, weeks in rebuilt.items()},
+            "attendants_processed": processed,
+            "attendants_failed": failed,
+            "deferred_instances": deferred,
+        }
+
+    except Exception as e:
+        logger.error("backfill_reports error: %s", e)
+        _update_job(job_id, status="error", error=str(e), finished_at=datetime.utcnow().isoformat())
         return {"status": "error", "error": str(e)}
-    finally:
-        db.close()
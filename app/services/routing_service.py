@@ -6,6 +6,7 @@ from app.core.database import SessionLocal
 from app.models.conversation import Conversation
 from app.models.message import Message, MessageDirection
 from app.models.team import Team
+from app.services import llm_service
 
 logger = logging.getLogger(__name__)
 
@@ -24,28 +25,6 @@ def _build_routing_prompt(first_message: str, teams: list) -> str:
     )
 
 
-def _call_anthropic(prompt: str) -> str:
-    import anthropic
-    client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-    response = client.messages.create(
-        model="claude-haiku-4-5-20251001",
-        max_tokens=50,
-        messages=[{"role": "user", "content": prompt}],
-    )
-    return response.content[0].text.strip()
-
-
-def _call_openai(prompt: str) -> str:
-    from openai import OpenAI
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        max_tokens=50,
-        messages=[{"role": "user", "content": prompt}],
-    )
-    return response.choices[0].message.content.strip()
-
-
 def route_conversation(conversation_id: int) -> None:
     """Route a new conversation to the appropriate team using LLM.
     Designed to run in background (FastAPI BackgroundTasks).
@@ -62,15 +41,18 @@ def route_conversation(conversation_id: int) -> None:
         logger.warning(f"LLM_PROVIDER inválido: '{provider}'. Use 'anthropic' ou 'openai'.")
         return
 
+    # Leitura numa sessão fechada antes da chamada ao LLM: a conexão volta ao pool
+    # enquanto o provedor responde (record_call e o orçamento usam sessões próprias)
     db = SessionLocal()
     try:
         conv = db.query(Conversation).filter(Conversation.id == conversation_id).first()
         if not conv or conv.team_id is not None:
             return  # already routed or not found
+        instance_id = conv.instance_id
 
         teams = (
             db.query(Team)
-            .filter(Team.instance_id == conv.instance_id, Team.active == True)
+            .filter(Team.instance_id == instance_id, Team.active == True)
             .all()
         )
         if not teams:
@@ -93,29 +75,48 @@ def route_conversation(conversation_id: int) -> None:
             return
 
         prompt = _build_routing_prompt(first_text, teams)
+        team_names = [(t.id, t.name) for t in teams]
+    except Exception as e:
+        logger.error(f"Erro ao rotear conversa {conversation_id}: {e}")
+        return
+    finally:
+        db.close()
 
-        if provider == "openai":
-            raw = _call_openai(prompt)
-        else:
-            raw = _call_anthropic(prompt)
+    try:
+        raw = llm_service.complete(
+            "routing",
+            prompt,
+            max_tokens=50,
+            instance_id=instance_id,
+            conversation_id=conversation_id,
+        ).text
 
         raw_lower = raw.lower().strip()
-        matched_team: Optional[Team] = None
-        for t in teams:
-            if t.name.lower() in raw_lower or raw_lower in t.name.lower():
-                matched_team = t
+        matched: Optional[tuple] = None
+        for team_id, name in team_names:
+            if name.lower() in raw_lower or raw_lower in name.lower():
+                matched = (team_id, name)
                 break
 
-        if matched_team:
-            conv.team_id = matched_team.id
-            db.commit()
-            logger.info(f"Conversa {conversation_id} roteada para equipe '{matched_team.name}'")
-        else:
+        if not matched:
             logger.info(
                 f"Conversa {conversation_id}: nenhuma equipe correspondeu ao resultado '{raw}'"
             )
+            return
+
+        db = SessionLocal()
+        try:
+            # Só grava se ninguém roteou a conversa enquanto o LLM respondia
+            routed = (
+                db.query(Conversation)
+                .filter(Conversation.id == conversation_id, Conversation.team_id.is_(None))
+                .update({"team_id": matched[0]}, synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+        if routed:
+            logger.info(f"Conversa {conversation_id} roteada para equipe '{matched[1]}'")
 
     except Exception as e:
         logger.error(f"Erro ao rotear conversa {conversation_id}: {e}")
-    finally:
-        db.close()
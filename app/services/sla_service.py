@@ -0,0 +1,332 @@
+"""
+sla_service.py — Monitor de SLA de primeira resposta orientado a eventos.
+
+Mantém em memória as conversas abertas ainda sem resposta e um min-heap de
+(opened_at + SLA_ALERT_MINUTES, conversation_id). Uma task asyncio dorme até o
+próximo prazo e publica `sla_breach` assim que ele vence. O estado é reconstruído
+do banco na inicialização e periodicamente (SLA_RESYNC_SECONDS), o que cobre
+alterações feitas por outras réplicas. /sla-alerts é servido a partir da memória.
+
+Todas as réplicas mantêm o estado, mas só a líder (trava "sla_monitor" do
+agendador, renovada a cada SLA_LEADER_TTL_SECONDS / 3) publica sla_breach; as
+demais marcam os prazos vencidos em silêncio. Se a líder cair, outra assume após
+o TTL — alertas vencidos nesse intervalo não são reenviados.
+
+Os ganchos (track/answered/discard) são chamados de threads e do event loop;
+todo acesso ao estado passa por _lock. Ganchos que chegam durante um rebuild()
+ficam registrados e são reaplicados depois da troca do estado.
+"""
+
+import asyncio
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.events import broadcast, listen
+from app.core.scheduler import scheduler
+from app.models.attendant import Attendant
+from app.models.conversation import Conversation, ConversationStatus
+
+logger = logging.getLogger(__name__)
+
+MAX_ALERTS = 50
+
+_lock = threading.Lock()
+_waiting: Dict[int, dict] = {}                 # conversation_id → dados do alerta
+_heap: List[Tuple[datetime, int]] = []         # (prazo, conversation_id); remoção preguiçosa
+_breached: set = set()
+_ready = False
+_rebuild_log: Optional[List[Tuple[str, object]]] = None  # ganchos recebidos durante o rebuild em andamento
+_leader = False
+
+LEASE_NAME = "sla_monitor"
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+_task: Optional[asyncio.Task] = None
+
+
+def _threshold() -> timedelta:
+    return timedelta(minutes=settings.SLA_ALERT_MINUTES)
+
+
+def _notify() -> None:
+    """Acorda o monitor (prazo novo pode ser anterior ao que ele está aguardando)."""
+    if _loop is None or _wakeup is None or _loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _loop:
+        _wakeup.set()
+    else:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+# ─── Ganchos ──────────────────────────────────────────────────────────────────
+
+def track(
+    conversation_id: int,
+    instance_id: int,
+    opened_at: datetime,
+    contact_phone: str,
+    contact_name: Optional[str] = None,
+    attendant_name: Optional[str] = None,
+) -> None:
+    """Passa a monitorar uma conversa aberta sem primeira resposta."""
+    entry = {
+        "id": conversation_id,
+        "instance_id": instance_id,
+        "contact_name": contact_name,
+        "contact_phone": contact_phone,
+        "attendant_name": attendant_name,
+        "opened_at": opened_at,
+    }
+    with _lock:
+        if _rebuild_log is not None:
+            _rebuild_log.append(("track", entry))
+        _track_locked(entry)
+    _notify()
+
+
+def _track_locked(entry: dict) -> None:
+    if entry["id"] in _waiting:
+        return
+    _waiting[entry["id"]] = entry
+    heapq.heappush(_heap, (entry["opened_at"] + _threshold(), entry["id"]))
+
+
+def discard(conversation_ids: Iterable[int]) -> None:
+    """Conversa respondida, resolvida ou abandonada: sai do monitor."""
+    with _lock:
+        for conversation_id in conversation_ids:
+            if _rebuild_log is not None:
+                _rebuild_log.append(("discard", conversation_id))
+            _waiting.pop(conversation_id, None)
+            _breached.discard(conversation_id)
+
+
+def _on_ingest_committed(event: dict) -> None:
+    """Conversas gravadas pelos workers de ingestão (app.workers.ingest), via barramento."""
+    for conv in event.get("new_conversations") or ():
+        track(conv["id"], conv["instance_id"], datetime.fromisoformat(conv["opened_at"]),
+              conv["contact_phone"], conv.get("contact_name"), conv.get("attendant_name"))
+    discard(event.get("answered_ids") or ())
+
+
+def set_attendant(conversation_id: int, attendant_name: Optional[str]) -> None:
+    with _lock:
+        entry = _waiting.get(conversation_id)
+        if entry:
+            entry["attendant_name"] = attendant_name
+
+
+# ─── Estado ───────────────────────────────────────────────────────────────────
+
+def rebuild() -> int:
+    """Recarrega do banco as conversas abertas sem resposta. Prazos já vencidos
+    entram como violados sem gerar evento (não reenvia alertas a cada reinício)."""
+    global _ready, _rebuild_log
+    with _lock:
+        _rebuild_log = []
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(
+                Conversation.id,
+                Conversation.instance_id,
+                Conversation.contact_name,
+                Conversation.contact_phone,
+                Conversation.opened_at,
+                Attendant.name,
+            )
+            .outerjoin(Attendant, Attendant.id == Conversation.attendant_id)
+            .filter(
+                Conversation.status == ConversationStatus.open,
+                Conversation.first_response_at.is_(None),
+                Conversation.is_group == False,
+                Conversation.opened_at.isnot(None),
+            )
+            .all()
+        )
+    except BaseException:
+        with _lock:
+            _rebuild_log = None
+        raise
+    finally:
+        db.close()
+
+    now = datetime.utcnow()
+    threshold = _threshold()
+    with _lock:
+        previous_breached = _breached.copy()
+        _waiting.clear()
+        _heap.clear()
+        _breached.clear()
+        for conv_id, instance_id, contact_name, contact_phone, opened_at, attendant_name in rows:
+            _waiting[conv_id] = {
+                "id": conv_id,
+                "instance_id": instance_id,
+                "contact_name": contact_name,
+                "contact_phone": contact_phone,
+                "attendant_name": attendant_name,
+                "opened_at": opened_at,
+            }
+            deadline = opened_at + threshold
+            if deadline <= now and (not _ready or conv_id in previous_breached):
+                _breached.add(conv_id)
+            else:
+                _heap.append((deadline, conv_id))
+        heapq.heapify(_heap)
+        # A consulta pode ter lido o estado anterior a ganchos que chegaram enquanto ela rodava
+        log, _rebuild_log = _rebuild_log, None
+        for action, value in log:
+            if action == "track":
+                _track_locked(value)
+            else:
+                _waiting.pop(value, None)
+                _breached.discard(value)
+        _ready = True
+    _notify()
+    return len(rows)
+
+
+def _pop_due(now: datetime) -> Tuple[List[dict], Optional[datetime]]:
+    """Remove do heap os prazos vencidos; retorna (alertas novos, próximo prazo)."""
+    due = []
+    with _lock:
+        while _heap and _heap[0][0] <= now:
+            _, conv_id = heapq.heappop(_heap)
+            entry = _waiting.get(conv_id)
+            if not entry or conv_id in _breached:
+                continue
+            _breached.add(conv_id)
+            due.append(dict(entry))
+        next_deadline = _heap[0][0] if _heap else None
+    return due, next_deadline
+
+
+def is_ready() -> bool:
+    return _ready and _task is not None and not _task.done()
+
+
+def is_leader() -> bool:
+    return _leader
+
+
+def get_alerts(instance_id: Optional[int] = None, threshold_minutes: int = 30) -> dict:
+    """Mesmo formato de metrics_service.get_sla_alerts, sem consultar o banco."""
+    now = datetime.utcnow()
+    cutoff = now - timedelta(minutes=threshold_minutes)
+    with _lock:
+        entries = [
+            e for e in _waiting.values()
+            if e["opened_at"] <= cutoff and (not instance_id or e["instance_id"] == instance_id)
+        ]
+    entries.sort(key=lambda e: e["opened_at"])
+    alerts = [
+        {
+            "id": e["id"],
+            "contact_name": e["contact_name"],
+            "contact_phone": e["contact_phone"],
+            "attendant_name": e["attendant_name"],
+            "opened_at": e["opened_at"].isoformat(),
+            "wait_seconds": int((now - e["opened_at"]).total_seconds()),
+        }
+        for e in entries[:MAX_ALERTS]
+    ]
+    return {"alerts": alerts, "count": len(alerts), "threshold_minutes": threshold_minutes}
+
+
+# ─── Monitor ──────────────────────────────────────────────────────────────────
+
+async def _renew_leadership() -> None:
+    global _leader
+    try:
+        leader = await asyncio.to_thread(scheduler.hold_lease, LEASE_NAME, settings.SLA_LEADER_TTL_SECONDS)
+    except Exception as e:
+        logger.error("SLA: falha ao renovar a liderança: %s", e)
+        leader = False
+    if leader != _leader:
+        logger.info("SLA: esta réplica %s a publicação de sla_breach", "assumiu" if leader else "deixou")
+    _leader = leader
+
+
+async def _run() -> None:
+    last_sync = datetime.utcnow()
+    last_lease = None
+    lease_every = max(settings.SLA_LEADER_TTL_SECONDS / 3, 1)
+    while True:
+        now = datetime.utcnow()
+        if last_lease is None or (now - last_lease).total_seconds() >= lease_every:
+            await _renew_leadership()
+            last_lease = now
+        if (now - last_sync).total_seconds() >= settings.SLA_RESYNC_SECONDS:
+            try:
+                await asyncio.to_thread(rebuild)
+            except Exception as e:
+                logger.error("SLA: falha ao ressincronizar: %s", e)
+            last_sync = now = datetime.utcnow()
+
+        due, next_deadline = _pop_due(now)
+        if not _leader:
+            due = []  # outra réplica publica; aqui só marca como violado
+        for entry in due:
+            await broadcast({
+                "type": "sla_breach",
+                "conversation_id": entry["id"],
+                "instance_id": entry["instance_id"],
+                "contact_name": entry["contact_name"],
+                "contact_phone": entry["contact_phone"],
+                "attendant_name": entry["attendant_name"],
+                "opened_at": entry["opened_at"].isoformat(),
+                "wait_seconds": int((now - entry["opened_at"]).total_seconds()),
+                "threshold_minutes": settings.SLA_ALERT_MINUTES,
+            })
+        if due:
+            logger.info("SLA: %d conversas ultrapassaram %d min sem resposta", len(due), settings.SLA_ALERT_MINUTES)
+
+        timeout = min(
+            settings.SLA_RESYNC_SECONDS - (now - last_sync).total_seconds(),
+            lease_every - (now - last_lease).total_seconds(),
+        )
+        if next_deadline is not None:
+            timeout = min(timeout, (next_deadline - now).total_seconds())
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=max(timeout, 0.05))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start() -> None:
+    """Reconstrói o estado e inicia o monitor (chamado no lifespan)."""
+    global _loop, _wakeup, _task
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    listen("ingest_committed", _on_ingest_committed)
+    count = await asyncio.to_thread(rebuild)
+    _task = asyncio.create_task(_run())
+    logger.info("SLA: monitor iniciado com %d conversas aguardando resposta", count)
+
+
+async def stop() -> None:
+    global _task, _leader
+    if _task:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    if _leader:
+        _leader = False
+        try:
+            await asyncio.to_thread(scheduler.release_lease, LEASE_NAME)  # outra réplica assume sem esperar o TTL
+        except Exception as e:
+            logger.error("SLA: falha ao liberar a liderança: %s", e)
@@ -1,10 +1,12 @@
 import json
 import logging
+from typing import AsyncIterator, Optional, Tuple
 
 from app.core.config import settings
 from app.core.database import SessionLocal
 from app.models.conversation import Conversation
 from app.models.message import Message, MessageDirection
+from app.services import llm_service
 
 logger = logging.getLogger(__name__)
 
@@ -34,44 +36,54 @@ def _build_conversation_text(messages: list) -> str:
     return "\n".join(lines)
 
 
-def _call_anthropic(conversation_text: str, company_tone: str) -> str:
-    import anthropic
-    client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-    response = client.messages.create(
-        model="claude-haiku-4-5-20251001",
-        max_tokens=512,
-        system=SYSTEM_PROMPT,
-        messages=[
-            {
-                "role": "user",
-                "content": USER_PROMPT_TEMPLATE.format(
-                    company_tone=company_tone or "profissional e cordial",
-                    conversa=conversation_text,
-                ),
-            }
-        ],
-    )
-    return response.content[0].text.strip()
-
-
-def _call_openai(conversation_text: str, company_tone: str) -> str:
-    from openai import OpenAI
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        max_tokens=512,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": USER_PROMPT_TEMPLATE.format(
-                    company_tone=company_tone or "profissional e cordial",
-                    conversa=conversation_text,
-                ),
-            },
-        ],
-    )
-    return response.choices[0].message.content.strip()
+class _SuggestionStreamParser:
+    """Extrai cada string do array "suggestions" assim que ela fecha no JSON parcial."""
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._in_array = False
+        self._str_start: Optional[int] = None
+        self._escaped = False
+
+    def feed(self, chunk: str) -> list[str]:
+        self._buf += chunk
+        found = []
+        if not self._in_array:
+            key = self._buf.find('"suggestions"')
+            if key == -1:
+                return found
+            bracket = self._buf.find("[", key)
+            if bracket == -1:
+                return found
+            self._in_array = True
+            self._pos = bracket + 1
+
+        while self._pos < len(self._buf):
+            ch = self._buf[self._pos]
+            if self._str_start is None:
+                if ch == '"':
+                    self._str_start = self._pos
+                elif ch == "]":
+                    self._pos = len(self._buf)
+                    self._in_array = False
+                    self._buf = ""
+                    break
+            elif self._escaped:
+                self._escaped = False
+            elif ch == "\\":
+                self._escaped = True
+            elif ch == '"':
+                literal = self._buf[self._str_start:self._pos + 1]
+                self._str_start = None
+                try:
+                    value = json.loads(literal)
+                except json.JSONDecodeError:
+                    value = ""
+                if value:
+                    found.append(str(value))
+            self._pos += 1
+        return found
 
 
 def _parse_suggestions(raw: str) -> list[str]:
@@ -84,25 +96,36 @@ def _parse_suggestions(raw: str) -> list[str]:
     return [str(s) for s in suggestions if s][:3]
 
 
-def generate_suggestions(conversation_id: int, company_tone: str = "") -> list[str]:
-    """Gera sugestões de resposta para uma conversa usando LLM."""
+def _get_provider() -> Optional[str]:
+    """Retorna o provedor configurado ou None se não houver chave válida."""
     provider = settings.LLM_PROVIDER.lower()
 
     if provider == "openai" and not settings.OPENAI_API_KEY:
         logger.warning("OPENAI_API_KEY não configurada — sugestões ignoradas.")
-        return []
+        return None
     if provider == "anthropic" and not settings.ANTHROPIC_API_KEY:
         logger.warning("ANTHROPIC_API_KEY não configurada — sugestões ignoradas.")
-        return []
+        return None
     if provider not in ("anthropic", "openai"):
         logger.warning(f"LLM_PROVIDER inválido: '{provider}'. Use 'anthropic' ou 'openai'.")
-        return []
+        return None
+    return provider
+
 
+def _build_prompt(conversation_text: str, company_tone: str) -> str:
+    return USER_PROMPT_TEMPLATE.format(
+        company_tone=company_tone or "profissional e cordial",
+        conversa=conversation_text,
+    )
+
+
+def load_conversation_context(conversation_id: int) -> Tuple[str, Optional[int]]:
+    """(texto das últimas 10 mensagens, instance_id) — ('', None) se a conversa não existir."""
     db = SessionLocal()
     try:
         conv = db.query(Conversation).filter(Conversation.id == conversation_id).first()
         if not conv:
-            return []
+            return "", None
 
         messages = (
             db.query(Message)
@@ -111,15 +134,30 @@ def generate_suggestions(conversation_id: int, company_tone: str = "") -> list[s
             .limit(10)
             .all()
         )
+        return _build_conversation_text(messages[-10:]), conv.instance_id
+    finally:
+        db.close()
+
+
+def generate_suggestions(conversation_id: int, company_tone: str = "") -> list[str]:
+    """Gera sugestões de resposta para uma conversa usando LLM."""
+    provider = _get_provider()
+    if not provider:
+        return []
 
-        conversation_text = _build_conversation_text(messages[-10:])
+    try:
+        conversation_text, instance_id = load_conversation_context(conversation_id)
         if not conversation_text.strip():
             return []
 
-        if provider == "openai":
-            raw = _call_openai(conversation_text, company_tone)
-        else:
-            raw = _call_anthropic(conversation_text, company_tone)
+        raw = llm_service.complete(
+            "suggestions",
+            _build_prompt(conversation_text, company_tone),
+            system=SYSTEM_PROMPT,
+            max_tokens=512,
+            instance_id=instance_id,
+            conversation_id=conversation_id,
+        ).text
 
         return _parse_suggestions(raw)
 
@@ -129,5 +167,40 @@ def generate_suggestions(conversation_id: int, company_tone: str = "") -> list[s
     except Exception as e:
         logger.error(f"Erro ao gerar sugestões para conversa {conversation_id}: {e}")
         return []
+
+
+async def stream_suggestions(
+    conversation_id: int,
+    conversation_text: str,
+    company_tone: str = "",
+    instance_id: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """Versão streaming de generate_suggestions: emite cada sugestão assim que é parseada.
+
+    Fechar o gerador (ex.: cliente SSE desconectou) fecha o stream do provedor,
+    cancelando a requisição upstream.
+    """
+    provider = _get_provider()
+    if not provider or not conversation_text.strip():
+        return
+
+    chunks = llm_service.stream(
+        "suggestions",
+        _build_prompt(conversation_text, company_tone),
+        system=SYSTEM_PROMPT,
+        max_tokens=512,
+        instance_id=instance_id,
+        conversation_id=conversation_id,
+    )
+
+    parser = _SuggestionStreamParser()
+    emitted = 0
+    try:
+        async for chunk in chunks:
+            for suggestion in parser.feed(chunk):
+                yield suggestion
+                emitted += 1
+                if emitted >= 3:
+                    return
     finally:
-        db.close()
+        await chunks.aclose()
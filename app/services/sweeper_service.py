@@ -0,0 +1,118 @@
+"""
+sweeper_service.py — Marca como abandonadas as conversas abertas ociosas.
+
+Uma conversa individual (grupos ficam de fora) é abandonada quando a última
+mensagem é mais antiga que o limite da instância (Instance.abandon_after_minutes,
+ou ABANDON_AFTER_MINUTES). O UPDATE roda em lotes limitados por id; as conversas
+varridas vão para a fila de análise (ou ficam marcadas como adiadas, se o
+orçamento de tokens da instância já esgotou) e cada varredura publica um único
+evento SSE.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.events import broadcast_threadsafe
+from app.models.conversation import Conversation, ConversationStatus
+from app.models.instance import Instance
+from app.services import analysis_service, llm_service, sla_service
+
+logger = logging.getLogger(__name__)
+
+# Ids incluídos no evento SSE (o total vai sempre em "count")
+MAX_EVENT_IDS = 200
+
+
+def idle_threshold_minutes(instance: Instance) -> int:
+    if instance.abandon_after_minutes is not None:
+        return instance.abandon_after_minutes
+    return settings.ABANDON_AFTER_MINUTES
+
+
+def _sweep_instance(db: Session, instance_id: int, cutoff: datetime, now: datetime) -> List[int]:
+    last_activity = func.coalesce(Conversation.last_message_at, Conversation.opened_at)
+    stale = (
+        Conversation.instance_id == instance_id,
+        Conversation.status == ConversationStatus.open,
+        Conversation.is_group == False,
+        last_activity < cutoff,
+    )
+    chunk = max(settings.ABANDON_SWEEP_CHUNK_SIZE, 1)
+    swept: List[int] = []
+    while True:
+        ids = [
+            r.id for r in db.query(Conversation.id)
+            .filter(*stale)
+            .order_by(Conversation.id)
+            .limit(chunk)
+        ]
+        if not ids:
+            break
+        # Repete o filtro no UPDATE: conversa que recebeu mensagem entre o SELECT e o UPDATE fica aberta
+        updated = db.query(Conversation).filter(Conversation.id.in_(ids), *stale).update(
+            {Conversation.status: ConversationStatus.abandoned, Conversation.updated_at: now},
+            synchronize_session=False,
+        )
+        db.commit()
+        if updated == len(ids):
+            swept.extend(ids)
+        else:
+            swept.extend(
+                r.id for r in db.query(Conversation.id).filter(
+                    Conversation.id.in_(ids),
+                    Conversation.status == ConversationStatus.abandoned,
+                    Conversation.updated_at == now,
+                )
+            )
+        if len(ids) < chunk:
+            break
+    return swept
+
+
+def sweep_abandoned(now: Optional[datetime] = None) -> dict:
+    """Varre todas as instâncias ativas. Retorna o total e a contagem por instância."""
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        instances = db.query(Instance).filter(Instance.active == True).all()
+        by_instance: Dict[int, int] = {}
+        swept: List[int] = []
+        to_analyze: List[int] = []
+        deferred = 0
+        for inst in instances:
+            minutes = idle_threshold_minutes(inst)
+            if minutes <= 0:
+                continue
+            ids = _sweep_instance(db, inst.id, now - timedelta(minutes=minutes), now)
+            if ids:
+                by_instance[inst.id] = len(ids)
+                swept.extend(ids)
+                # Orçamento esgotado: nem passa pela fila, o agendador retoma depois do reset diário
+                if llm_service.budget_exhausted(inst.id, db):
+                    deferred += analysis_service.mark_deferred(db, ids)
+                else:
+                    to_analyze.extend(ids)
+    finally:
+        db.close()
+
+    if not swept:
+        return {"count": 0, "by_instance": {}, "analysis_queued": 0, "analysis_deferred": 0}
+
+    sla_service.discard(swept)
+
+    queued = analysis_service.enqueue_analysis(to_analyze)
+    broadcast_threadsafe({
+        "type": "conversations_abandoned",
+        "count": len(swept),
+        "by_instance": by_instance,
+        "conversation_ids": swept[:MAX_EVENT_IDS],
+    })
+    logger.info("Sweeper: %d conversas abandonadas %s (%d análises enfileiradas, %d adiadas pelo orçamento)",
+                len(swept), by_instance, queued, deferred)
+    return {"count": len(swept), "by_instance": by_instance, "analysis_queued": queued, "analysis_deferred": deferred}
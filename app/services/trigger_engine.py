@@ -0,0 +1,185 @@
+"""
+Motor de gatilhos por palavra-chave (Databricks e futuras automações).
+
+Cada fonte registra um loader que devolve as regras ativas (TriggerRule). O motor
+monta, por instância, um autômato Aho-Corasick com todas as palavras-chave — as
+regras globais (instance_id None) entram em todas — e cada mensagem é avaliada
+numa única passada, com custo proporcional ao texto e não ao número de gatilhos.
+
+As regras ficam em memória até invalidate() (chamado ao salvar/excluir configs)
+ou até TRIGGER_ENGINE_RELOAD_SECONDS, que cobre alterações feitas por outro processo.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerRule(NamedTuple):
+    kind: str                   # fonte que registrou a regra (ex.: "databricks")
+    rule_id: int
+    instance_id: Optional[int]  # None = vale para todas as instâncias
+    keyword: str
+    data: Any                   # snapshot próprio da fonte (sem objetos ORM)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick sobre texto em minúsculas: todas as ocorrências numa passada."""
+
+    def __init__(self, rules: Iterable[TriggerRule]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[TriggerRule]] = [[]]
+        for rule in rules:
+            self._add(rule.keyword.strip().lower(), rule)
+        self._link()
+
+    def _add(self, keyword: str, rule: TriggerRule) -> None:
+        if not keyword:
+            return
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(rule)
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    @property
+    def size(self) -> int:
+        return len(self._goto)
+
+    def search(self, text: str) -> List[TriggerRule]:
+        """Regras cujas palavras-chave aparecem no texto, sem repetição, na ordem em que terminam."""
+        found: Dict[tuple, TriggerRule] = {}
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for rule in out[state]:
+                found.setdefault((rule.kind, rule.rule_id), rule)
+        return list(found.values())
+
+
+_loaders: Dict[str, Callable[[Session], Iterable[TriggerRule]]] = {}
+_rules: Dict[str, List[TriggerRule]] = {}  # última carga bem-sucedida por fonte
+_automata: Dict[Optional[int], KeywordAutomaton] = {}
+_lock = threading.Lock()
+_version = 0
+_built_version = -1
+_built_at = 0.0
+_stats = {"rules": 0, "rebuilds": 0, "last_build_ms": 0.0, "matches": 0, "evaluated": 0}
+
+
+def register(kind: str, loader: Callable[[Session], Iterable[TriggerRule]]) -> None:
+    """Registra uma fonte de regras; loader(db) devolve as regras ativas."""
+    _loaders[kind] = loader
+    invalidate()
+
+
+def invalidate() -> None:
+    """Descarta os autômatos; o próximo match() reconstrói a partir do banco."""
+    global _version
+    with _lock:
+        _version += 1
+
+
+def _build(db: Optional[Session]) -> None:
+    global _automata, _built_version, _built_at
+    version = _version
+    started = time.perf_counter()
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        for kind, loader in _loaders.items():
+            try:
+                _rules[kind] = list(loader(db))
+            except Exception as e:
+                # Mantém as regras anteriores da fonte; nova tentativa na próxima releitura
+                logger.error(f"Gatilhos '{kind}': erro ao carregar regras: {e}")
+    finally:
+        if own_session:
+            db.close()
+
+    rules = [r for kind in _loaders for r in _rules.get(kind, [])]
+    global_rules = [r for r in rules if r.instance_id is None]
+    instance_ids = {r.instance_id for r in rules if r.instance_id is not None}
+    automata: Dict[Optional[int], KeywordAutomaton] = {None: KeywordAutomaton(global_rules)}
+    for instance_id in instance_ids:
+        automata[instance_id] = KeywordAutomaton(
+            [r for r in rules if r.instance_id == instance_id] + global_rules
+        )
+
+    _automata = automata
+    _built_version = version
+    _built_at = time.monotonic()
+    _stats["rules"] = len(rules)
+    _stats["rebuilds"] += 1
+    _stats["last_build_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def _ensure_fresh(db: Optional[Session]) -> None:
+    stale = time.monotonic() - _built_at > settings.TRIGGER_ENGINE_RELOAD_SECONDS
+    if _built_version == _version and not stale:
+        return
+    with _lock:
+        stale = time.monotonic() - _built_at > settings.TRIGGER_ENGINE_RELOAD_SECONDS
+        if _built_version != _version or stale:
+            _build(db)
+
+
+def match(
+    instance_id: Optional[int], text: Optional[str], kind: Optional[str] = None, db: Optional[Session] = None
+) -> List[TriggerRule]:
+    """Regras disparadas por uma mensagem recebida na instância (filtradas por fonte, se informada).
+    `db` é usado se as regras precisarem ser recarregadas (evita abrir outra conexão)."""
+    if not text:
+        return []
+    _ensure_fresh(db)
+    automaton = _automata.get(instance_id) or _automata.get(None)
+    _stats["evaluated"] += 1
+    if automaton is None:
+        return []
+    rules = automaton.search(text)
+    if kind is not None:
+        rules = [r for r in rules if r.kind == kind]
+    _stats["matches"] += len(rules)
+    return rules
+
+
+def get_metrics() -> dict:
+    return {
+        "sources": sorted(_loaders),
+        "instances": sorted(k for k in _automata if k is not None),
+        "states": sum(a.size for a in _automata.values()),
+        "fresh": _built_version == _version,
+        **_stats,
+    }
@@ -0,0 +1,184 @@
+"""
+Decodificação dos webhooks da Evolution API.
+
+O corpo bruto é lido uma única vez (app.core.json_codec) e cada item de
+messages.upsert vira um UpsertMessage com tipo, texto, dados da ligação e
+telefone já resolvidos — serviço e roteador consomem essas tuplas em vez de
+percorrer de novo os dicts aninhados do payload.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.core import json_codec
+from app.models.message import MessageType
+
+
+class CallInfo(NamedTuple):
+    outcome: Optional[str]
+    duration_secs: Optional[int]
+    is_video: Optional[bool]
+
+
+class UpsertMessage(NamedTuple):
+    evolution_id: Optional[str]
+    remote_jid: str
+    from_me: bool
+    is_group: bool
+    contact_phone: str                # telefone do contato ou id do grupo, sem sufixo
+    participant_phone: Optional[str]  # autor em grupos (mensagens recebidas)
+    push_name: Optional[str]
+    timestamp: datetime
+    msg_type: MessageType
+    text: Optional[str]               # texto da mensagem ou descrição da ligação
+    call: Optional[CallInfo]
+    content_keys: Tuple[str, ...]     # chaves de `message` (log de depuração)
+
+
+MEDIA_TYPES = (
+    ("imageMessage", MessageType.image),
+    ("videoMessage", MessageType.video),
+    ("audioMessage", MessageType.audio),
+    ("pttMessage", MessageType.audio),
+    ("documentMessage", MessageType.document),
+    ("stickerMessage", MessageType.sticker),
+    ("locationMessage", MessageType.location),
+)
+CALL_LOG_KEYS = ("callLogMessage", "callLogMesssage")  # a Evolution já enviou com a grafia errada
+
+CALL_OUTCOME_LABELS = {
+    "CONNECTED": "Atendida",
+    "MISSED": "Perdida",
+    "FAILED": "Falhou",
+    "REJECTED": "Rejeitada",
+    "ACCEPTED_ELSEWHERE": "Atendida em outro dispositivo",
+    "ONGOING": "Em andamento",
+    "SILENCED_BY_DND": "Silenciada (não perturbe)",
+    "SILENCED_UNKNOWN_CALLER": "Silenciada (desconhecido)",
+}
+
+
+def decode_body(raw: bytes) -> Dict[str, Any]:
+    """Corpo do webhook como dict; ValueError se não for um objeto JSON."""
+    body = json_codec.loads(raw)
+    if not isinstance(body, dict):
+        raise ValueError("webhook body must be a JSON object")
+    return body
+
+
+def normalize_phone(jid: str) -> str:
+    return jid.split("@")[0].split(":")[0]
+
+
+def normalize_webhook_data(data: Any) -> List[Dict[str, Any]]:
+    """Normaliza data do webhook: aceita lista, objeto único ou data.messages."""
+    if data is None:
+        return []
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        if "messages" in data:
+            msgs = data.get("messages") or []
+            return msgs if isinstance(msgs, list) else [msgs]
+        return [data]
+    return []
+
+
+def _find_call_log(content: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    for key in CALL_LOG_KEYS:
+        if key in content:
+            return content[key]
+    protocol = content.get("protocolMessage")
+    if isinstance(protocol, dict):
+        for key in CALL_LOG_KEYS:
+            if key in protocol:
+                return protocol[key]
+    return None
+
+
+def _classify(content: Dict[str, Any]) -> Tuple[MessageType, Optional[Dict[str, Any]]]:
+    """Tipo da mensagem e, se for ligação, o callLogMessage — numa só inspeção do conteúdo."""
+    if not content:
+        return MessageType.other, None
+    call_log = _find_call_log(content)
+    if call_log:
+        return MessageType.call, call_log
+    for key, msg_type in MEDIA_TYPES:
+        if key in content:
+            return msg_type, None
+    return MessageType.text, None
+
+
+def _extract_text(content: Dict[str, Any]) -> Optional[str]:
+    if "conversation" in content:
+        return content["conversation"]
+    if "extendedTextMessage" in content:
+        return content["extendedTextMessage"].get("text")
+    return None
+
+
+def _decode_call(call_log: Dict[str, Any]) -> CallInfo:
+    outcome = call_log.get("callOutcome")
+    duration = call_log.get("durationSecs")
+    if isinstance(duration, dict):
+        duration = duration.get("low") or duration.get("high") or 0
+    return CallInfo(
+        outcome=str(outcome) if outcome else None,
+        duration_secs=int(duration) if duration is not None else None,
+        is_video=call_log.get("isVideo"),
+    )
+
+
+def format_call_content(call: CallInfo, from_me: bool) -> str:
+    label = CALL_OUTCOME_LABELS.get(str(call.outcome), call.outcome or "Ligação")
+    parts = [label]
+    if call.duration_secs and call.duration_secs > 0:
+        parts.append(f"{call.duration_secs}s")
+    if call.is_video:
+        parts.append("(vídeo)")
+    direction = "Enviada" if from_me else "Recebida"
+    return f"{direction}: {' '.join(parts)}"
+
+
+def decode_message(msg_data: Dict[str, Any]) -> UpsertMessage:
+    key = msg_data.get("key") or {}
+    remote_jid = key.get("remoteJid") or ""
+    from_me = bool(key.get("fromMe", False))
+    is_group = "@g.us" in remote_jid
+    content = msg_data.get("message") or {}
+
+    msg_type, call_log = _classify(content)
+    call = _decode_call(call_log) if call_log else None
+    text = format_call_content(call, from_me) if call else (_extract_text(content) if content else None)
+
+    timestamp_raw = msg_data.get("messageTimestamp", 0)
+    participant = key.get("participant") if is_group and not from_me else None
+    return UpsertMessage(
+        evolution_id=key.get("id"),
+        remote_jid=remote_jid,
+        from_me=from_me,
+        is_group=is_group,
+        contact_phone=normalize_phone(remote_jid),
+        participant_phone=normalize_phone(participant) if participant else None,
+        push_name=msg_data.get("pushName"),
+        timestamp=datetime.utcfromtimestamp(int(timestamp_raw)) if timestamp_raw else datetime.utcnow(),
+        msg_type=msg_type,
+        text=text,
+        call=call,
+        content_keys=tuple(content) if content else (),
+    )
+
+
+def call_contact_phone(body: Any) -> str:
+    """Telefone do contato de um evento 'call' (mesmas chaves lidas por process_call_event)."""
+    if not isinstance(body, dict):
+        return ""
+    data = body.get("data") or body
+    if not isinstance(data, dict):
+        return ""
+    return normalize_phone(data.get("from") or data.get("chatId") or "")
+
+
+def decode_upsert(data: Any) -> List[UpsertMessage]:
+    """Itens de messages.upsert decodificados (lista, objeto único ou data.messages)."""
+    return [decode_message(m) for m in normalize_webhook_data(data) if isinstance(m, dict)]
@@ -0,0 +1,113 @@
+"""
+Filtro de reentregas de webhook (a Evolution repete o POST quando estoura o timeout).
+
+Um conjunto LRU limitado de evolution_ids recentes por instância é consultado
+antes de qualquer acesso ao banco: um lote só com ids conhecidos é descartado
+sem consultar instância nem mensagens. O filtro é só um atalho — ids fora da
+janela, de outro processo ou de um commit que falhou caem na verificação em
+lote do webhook_service, e a unicidade de messages.evolution_id no banco
+continua sendo a garantia.
+
+Aquecido no startup com as mensagens das últimas WEBHOOK_DEDUP_WARM_HOURS.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.conversation import Conversation
+from app.models.instance import Instance
+from app.models.message import Message
+from app.services.webhook_decoder import UpsertMessage
+
+logger = logging.getLogger(__name__)
+
+_recent: Dict[str, "OrderedDict[str, None]"] = {}  # instance_name → evolution_ids (mais recente no fim)
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "dropped_batches": 0, "warmed": 0}
+
+
+def _remember(ids: "OrderedDict[str, None]", evolution_id: str) -> None:
+    ids[evolution_id] = None
+    ids.move_to_end(evolution_id)
+    if len(ids) > settings.WEBHOOK_DEDUP_MAX_PER_INSTANCE:
+        ids.popitem(last=False)
+
+
+def filter_new(instance_name: str, messages: List[UpsertMessage]) -> List[UpsertMessage]:
+    """Remove mensagens já vistas nesta instância e repetidas dentro do próprio lote."""
+    if not messages:
+        return messages
+    with _lock:
+        ids = _recent.get(instance_name) or {}
+        fresh: List[UpsertMessage] = []
+        batch_ids = set()
+        for m in messages:
+            if m.evolution_id in ids or m.evolution_id in batch_ids:
+                _stats["hits"] += 1
+                continue
+            _stats["misses"] += 1
+            batch_ids.add(m.evolution_id)
+            fresh.append(m)
+        if not fresh:
+            _stats["dropped_batches"] += 1
+    return fresh
+
+
+def remember(instance_name: str, evolution_ids: Iterable[str]) -> None:
+    """Registra ids já gravados (chamar só depois do commit)."""
+    with _lock:
+        ids = _recent.setdefault(instance_name, OrderedDict())
+        for evolution_id in evolution_ids:
+            if evolution_id:
+                _remember(ids, evolution_id)
+
+
+def warm() -> int:
+    """Carrega os ids das últimas horas, do mais antigo ao mais recente."""
+    since = datetime.utcnow() - timedelta(hours=settings.WEBHOOK_DEDUP_WARM_HOURS)
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Instance.instance_name, Message.evolution_id)
+            .join(Conversation, Conversation.id == Message.conversation_id)
+            .join(Instance, Instance.id == Conversation.instance_id)
+            .filter(Message.created_at >= since)
+            .order_by(Message.id)
+            .yield_per(5000)
+        )
+        count = 0
+        with _lock:
+            for instance_name, evolution_id in rows:
+                _remember(_recent.setdefault(instance_name, OrderedDict()), evolution_id)
+                count += 1
+            _stats["warmed"] = count
+        return count
+    finally:
+        db.close()
+
+
+async def start() -> None:
+    """Aquece o filtro (chamado no lifespan)."""
+    if settings.WEBHOOK_DEDUP_WARM_HOURS <= 0:
+        return
+    try:
+        count = await asyncio.to_thread(warm)
+        logger.info("Dedup de webhooks: %d ids recentes carregados", count)
+    except Exception as e:
+        logger.error(f"Dedup de webhooks: erro ao aquecer o filtro: {e}")
+
+
+def get_metrics() -> dict:
+    with _lock:
+        return {
+            "instances": len(_recent),
+            "ids": sum(len(ids) for ids in _recent.values()),
+            "max_per_instance": settings.WEBHOOK_DEDUP_MAX_PER_INSTANCE,
+            **_stats,
+        }
@@ -1,7 +1,9 @@
 import logging
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 from app.core.config import get_settings
 
@@ -10,97 +12,7 @@ from app.models.conversation import Conversation, ConversationStatus
 from app.models.message import Message, MessageDirection, MessageType
 from app.models.attendant import Attendant
 from app.models.instance import Instance
-from app.services.evolution_service import send_text_message
-
-
-def _normalize_webhook_data(data: Any) -> List[Dict[str, Any]]:
-    """Normaliza data do webhook: aceita lista, objeto único ou data.messages."""
-    if data is None:
-        return []
-    if isinstance(data, list):
-        return data
-    if isinstance(data, dict):
-        if "messages" in data:
-            msgs = data.get("messages") or []
-            return msgs if isinstance(msgs, list) else [msgs]
-        return [data]
-    return []
-
-
-def _extract_text(message_content: Dict[str, Any]) -> Optional[str]:
-    if not message_content:
-        return None
-    if "conversation" in message_content:
-        return message_content["conversation"]
-    if "extendedTextMessage" in message_content:
-        return message_content["extendedTextMessage"].get("text")
-    return None
-
-
-def _get_call_log(message_content: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    if not message_content:
-        return None
-    if "callLogMessage" in message_content:
-        return message_content["callLogMessage"]
-    if "callLogMesssage" in message_content:
-        return message_content["callLogMesssage"]
-    protocol = message_content.get("protocolMessage", {})
-    if isinstance(protocol, dict):
-        if "callLogMessage" in protocol:
-            return protocol["callLogMessage"]
-        if "callLogMesssage" in protocol:
-            return protocol["callLogMesssage"]
-    return None
-
-
-def _format_call_content(call_log: Dict[str, Any], from_me: bool) -> str:
-    outcome = call_log.get("callOutcome")
-    duration = call_log.get("durationSecs")
-    is_video = call_log.get("isVideo", False)
-    if isinstance(duration, dict):
-        duration = duration.get("low") or duration.get("high") or 0
-    outcome_map = {
-        "CONNECTED": "Atendida",
-        "MISSED": "Perdida",
-        "FAILED": "Falhou",
-        "REJECTED": "Rejeitada",
-        "ACCEPTED_ELSEWHERE": "Atendida em outro dispositivo",
-        "ONGOING": "Em andamento",
-        "SILENCED_BY_DND": "Silenciada (não perturbe)",
-        "SILENCED_UNKNOWN_CALLER": "Silenciada (desconhecido)",
-    }
-    label = outcome_map.get(str(outcome), str(outcome) if outcome else "Ligação")
-    parts = [label]
-    if duration and int(duration) > 0:
-        parts.append(f"{int(duration)}s")
-    if is_video:
-        parts.append("(vídeo)")
-    direction = "Enviada" if from_me else "Recebida"
-    return f"{direction}: {' '.join(parts)}"
-
-
-def _get_message_type(message_content: Dict[str, Any]) -> MessageType:
-    if not message_content:
-        return MessageType.other
-    if _get_call_log(message_content):
-        return MessageType.call
-    if "imageMessage" in message_content:
-        return MessageType.image
-    if "videoMessage" in message_content:
-        return MessageType.video
-    if "audioMessage" in message_content or "pttMessage" in message_content:
-        return MessageType.audio
-    if "documentMessage" in message_content:
-        return MessageType.document
-    if "stickerMessage" in message_content:
-        return MessageType.sticker
-    if "locationMessage" in message_content:
-        return MessageType.location
-    return MessageType.text
-
-
-def _normalize_phone(jid: str) -> str:
-    return jid.split("@")[0].split(":")[0]
+from app.services.webhook_decoder import UpsertMessage, normalize_phone
 
 
 def _get_or_create_conversation(
@@ -147,66 +59,159 @@ def _get_or_create_conversation(
         return conv, False
 
 
-def process_message_upsert(db: Session, instance_name: str, data: Any) -> Tuple[List[int], List[Tuple[str, str, str, str, str]]]:
-    """Returns (new_conversation_ids, auto_messages_to_send).
-    auto_messages_to_send: [(api_url, api_key, instance_name, contact_phone, msg_text), ...]
-    """
-    instance = db.query(Instance).filter(Instance.instance_name == instance_name).first()
-    if not instance:
-        return [], []
+EVENT_SCHEMA_VERSION = 2
+MAX_EVENT_MESSAGES = 50        # lotes maiores (sincronização de histórico) vão sem delta
+MAX_EVENT_CONTENT_CHARS = 1000
+
+
+class NewConversation(NamedTuple):
+    id: int
+    instance_id: int
+    opened_at: datetime
+    contact_phone: str
+    contact_name: Optional[str]
+    attendant_name: Optional[str]
+
+
+class UpsertResult(NamedTuple):
+    new_conversations: List[NewConversation]  # conversas individuais abertas por mensagem recebida
+    answered_ids: List[int]               # conversas que receberam a primeira resposta
+    stored: List[UpsertMessage]           # mensagens decodificadas efetivamente gravadas (sem duplicatas)
+    messages: List[dict]                  # mensagens gravadas, no formato de /conversations/{id}/messages
+    conversations: Dict[int, dict]        # estado final de cada conversa tocada
+    counters: Dict[str, int]              # incrementos para os contadores agregados
+
+    def event(self, instance_name: str, instance_id: Optional[int]) -> dict:
+        """Evento new_message v2: o dashboard aplica o delta no estado local sem refazer requisições."""
+        event = {
+            "type": "new_message",
+            "v": EVENT_SCHEMA_VERSION,
+            "instance": instance_name,
+            "instance_id": instance_id,
+            "counters": self.counters,
+        }
+        if len(self.messages) > MAX_EVENT_MESSAGES:
+            event["truncated"] = True  # cliente recarrega
+        else:
+            event["messages"] = self.messages
+            event["conversations"] = list(self.conversations.values())
+        return event
+
+
+def message_delta(message: Message) -> dict:
+    content = message.content
+    truncated = content is not None and len(content) > MAX_EVENT_CONTENT_CHARS
+    return {
+        "id": message.id,
+        "conversation_id": message.conversation_id,
+        "direction": message.direction.value,
+        "msg_type": message.msg_type.value,
+        "content": content[:MAX_EVENT_CONTENT_CHARS] if truncated else content,
+        "content_truncated": truncated,
+        "timestamp": message.timestamp.isoformat(),
+        "sender_phone": message.sender_phone,
+        "sender_name": message.sender_name,
+    }
+
 
-    messages_data = _normalize_webhook_data(data)
-    if get_settings().DEBUG and messages_data:
-        logger = logging.getLogger(__name__)
-        for m in messages_data:
-            content = m.get("message") or {}
-            keys = list(content.keys()) if content else []
-            msg_type = "call" if _get_call_log(content) else (keys[0] if keys else "empty")
-            logger.debug(f"webhook messages.upsert: instance={instance_name} type={msg_type} keys={keys[:5]}")
-
-    new_conversation_ids: List[int] = []
-    auto_messages_to_send: List[Tuple[str, str, str, str, str]] = []
-    for msg_data in messages_data:
-        key = msg_data.get("key", {})
-        evolution_id = key.get("id")
-        remote_jid = key.get("remoteJid", "")
-        from_me = key.get("fromMe", False)
+def conversation_delta(conv: Conversation, created: bool, answered: bool, attendant_name: Optional[str]) -> dict:
+    return {
+        "id": conv.id,
+        "contact_phone": conv.contact_phone,
+        "contact_name": conv.contact_name,
+        "is_group": bool(conv.is_group),
+        "status": conv.status.value,
+        "attendant_id": conv.attendant_id,
+        "attendant_name": attendant_name,
+        "opened_at": conv.opened_at.isoformat() if conv.opened_at else None,
+        "last_message_at": conv.last_message_at.isoformat() if conv.last_message_at else None,
+        "first_response_time_seconds": conv.first_response_time_seconds,
+        "inbound_count": conv.inbound_count or 0,
+        "outbound_count": conv.outbound_count or 0,
+        "created": created,
+        "answered": answered,
+    }
 
-        is_group = "@g.us" in remote_jid
 
-        existing = db.query(Message).filter(Message.evolution_id == evolution_id).first()
-        if existing:
+def increment_counters(db: Session, counts: Dict[int, Tuple[Conversation, int, int]]) -> None:
+    """inbound_count/outbound_count += n direto no UPDATE: entregas paralelas da mesma
+    conversa (outro shard, outro processo, envio do outbound) não perdem incremento."""
+    now = datetime.utcnow()
+    for conv_id, (conv, inbound, outbound) in counts.items():
+        if not inbound and not outbound:
             continue
+        inbound_count, outbound_count = db.execute(
+            update(Conversation)
+            .where(Conversation.id == conv_id)
+            .values(
+                inbound_count=func.coalesce(Conversation.inbound_count, 0) + inbound,
+                outbound_count=func.coalesce(Conversation.outbound_count, 0) + outbound,
+                updated_at=now,
+            )
+            .returning(Conversation.inbound_count, Conversation.outbound_count)
+            .execution_options(synchronize_session=False)
+        ).one()
+        # Valores do banco no objeto, sem marcá-lo como alterado (o flush não os sobrescreve)
+        set_committed_value(conv, "inbound_count", inbound_count)
+        set_committed_value(conv, "outbound_count", outbound_count)
+
+
+EXISTING_IDS_CHUNK = 500
 
-        push_name = msg_data.get("pushName")
-        message_content = msg_data.get("message") or {}
-        timestamp_raw = msg_data.get("messageTimestamp", 0)
-        timestamp = datetime.utcfromtimestamp(int(timestamp_raw)) if timestamp_raw else datetime.utcnow()
 
+def _existing_evolution_ids(db: Session, evolution_ids: List[str]) -> set:
+    """Ids já gravados, numa consulta IN por bloco em vez de uma por mensagem."""
+    known: set = set()
+    for i in range(0, len(evolution_ids), EXISTING_IDS_CHUNK):
+        chunk = evolution_ids[i:i + EXISTING_IDS_CHUNK]
+        known.update(eid for (eid,) in db.query(Message.evolution_id).filter(Message.evolution_id.in_(chunk)))
+    return known
+
+
+def process_message_upsert(db: Session, instance: Instance, messages_data: List[UpsertMessage]) -> UpsertResult:
+    """Estágio de gravação do pipeline (app.services.ingest_pipeline): grava as mensagens
+    já decodificadas e monta o delta do evento SSE. Não faz commit — os hooks de
+    persistência ainda rodam na mesma transação."""
+    if get_settings().DEBUG and messages_data:
+        for m in messages_data:
+            msg_type = "call" if m.call else (m.content_keys[0] if m.content_keys else "empty")
+            logger.debug(f"webhook messages.upsert: instance={instance.instance_name} type={msg_type} keys={list(m.content_keys[:5])}")
+
+    new_conversations: List[NewConversation] = []
+    answered: List[int] = []         # conversas que receberam a primeira resposta
+    stored: List[Tuple[UpsertMessage, Message, Conversation, Optional[str]]] = []
+    created_ids: set = set()
+    counts: Dict[int, Tuple[Conversation, int, int]] = {}  # conversa → (recebidas, enviadas)
+    attendant_loaded = False
+    attendant: Optional[Attendant] = None
+    known = _existing_evolution_ids(db, [m.evolution_id for m in messages_data if m.evolution_id])
+    for m in messages_data:
+        if not m.evolution_id or m.evolution_id in known:
+            continue
+        known.add(m.evolution_id)  # repetida dentro do mesmo lote
+
+        from_me = m.from_me
+        is_group = m.is_group
+        timestamp = m.timestamp
+        msg_type = m.msg_type
         direction = MessageDirection.outbound if from_me else MessageDirection.inbound
-        msg_type = _get_message_type(message_content)
-        call_log = _get_call_log(message_content) if msg_type == MessageType.call else None
-        if call_log:
-            text = _format_call_content(call_log, from_me)
-        else:
-            text = _extract_text(message_content)
+        contact_phone = m.contact_phone
 
         if is_group:
-            contact_phone = _normalize_phone(remote_jid)
             contact_name = None
-            participant = key.get("participant", "")
-            sender_phone = _normalize_phone(participant) if participant and not from_me else None
-            sender_name = push_name if not from_me else None
+            sender_phone = m.participant_phone
+            sender_name = m.push_name if not from_me else None
             attendant_id = None
         else:
-            contact_phone = _normalize_phone(remote_jid)
-            contact_name = push_name if not from_me else None
+            contact_name = m.push_name if not from_me else None
             sender_phone = None
             sender_name = None
-            attendant = db.query(Attendant).filter(
-                Attendant.instance_id == instance.id,
-                Attendant.active == True,
-            ).first()
+            if not attendant_loaded:  # mesmo atendente para o lote inteiro
+                attendant = db.query(Attendant).filter(
+                    Attendant.instance_id == instance.id,
+                    Attendant.active == True,
+                ).first()
+                attendant_loaded = True
             attendant_id = attendant.id if attendant else None
 
         # Outbound messages from webhook never create a new conversation —
@@ -225,73 +230,69 @@ def process_message_upsert(db: Session, instance_name: str, data: Any) -> Tuple[
         if conv is None:
             # Outbound message with no matching open conversation — skip
             continue
+        if is_new:
+            created_ids.add(conv.id)
 
         if is_new and direction == MessageDirection.inbound and not is_group:
-            new_conversation_ids.append(conv.id)
-            if instance.auto_message_enabled and instance.auto_message_text:
-                attendant_name = attendant.name if attendant else "Atendente"
-                msg_text = instance.auto_message_text.replace("{nome_atendente}", attendant_name)
-                auto_messages_to_send.append((
-                    instance.api_url,
-                    instance.api_key,
-                    instance.instance_name,
-                    contact_phone,
-                    msg_text,
-                ))
-
-        call_outcome = None
-        call_duration_secs = None
-        is_video_call = None
-        if call_log:
-            call_outcome = str(call_log.get("callOutcome", "")) if call_log.get("callOutcome") else None
-            dur = call_log.get("durationSecs")
-            if dur is not None:
-                call_duration_secs = int(dur) if not isinstance(dur, dict) else int(dur.get("low") or dur.get("high") or 0)
-            is_video_call = call_log.get("isVideo")
+            new_conversations.append(NewConversation(
+                conv.id, instance.id, conv.opened_at, contact_phone, contact_name,
+                attendant.name if attendant else None,
+            ))
 
         message = Message(
-            evolution_id=evolution_id,
+            evolution_id=m.evolution_id,
             conversation_id=conv.id,
             direction=direction,
             msg_type=msg_type,
-            content=text,
+            content=m.text,
             timestamp=timestamp,
             sender_phone=sender_phone,
             sender_name=sender_name,
-            call_outcome=call_outcome,
-            call_duration_secs=call_duration_secs,
-            is_video_call=is_video_call,
+            call_outcome=m.call.outcome if m.call else None,
+            call_duration_secs=m.call.duration_secs if m.call else None,
+            is_video_call=m.call.is_video if m.call else None,
         )
         db.add(message)
+        # Nome só quando o atendente consultado é o da conversa (evita lazy-load por mensagem)
+        known_attendant = not is_group and attendant and attendant.id == conv.attendant_id
+        stored.append((m, message, conv, attendant.name if known_attendant else None))
 
+        _, inbound, outbound = counts.get(conv.id, (conv, 0, 0))
         if direction == MessageDirection.inbound:
-            conv.inbound_count = (conv.inbound_count or 0) + 1
+            counts[conv.id] = (conv, inbound + 1, outbound)
         else:
-            conv.outbound_count = (conv.outbound_count or 0) + 1
+            counts[conv.id] = (conv, inbound, outbound + 1)
             if not is_group and msg_type != MessageType.call and not conv.first_response_at:
                 conv.first_response_at = timestamp
                 delta = (timestamp - conv.opened_at).total_seconds()
                 conv.first_response_time_seconds = delta
-
-    db.commit()
-    return new_conversation_ids, auto_messages_to_send
-
-
-def send_auto_message_task(api_url: str, api_key: str, instance_name: str, contact_phone: str, msg_text: str) -> None:
-    """Envia mensagem automatica em background. Loga sucesso ou falha."""
-    ok = send_text_message(api_url, api_key, instance_name, contact_phone, msg_text)
-    if ok:
-        logger.info("Mensagem automatica enviada para %s (instance=%s)", contact_phone, instance_name)
-    else:
-        logger.warning("Falha ao enviar mensagem automatica para %s (instance=%s)", contact_phone, instance_name)
+                answered.append(conv.id)
+
+    # Monta o delta antes do commit (ids já atribuídos pelo flush; evita recarregar após expirar)
+    db.flush()
+    increment_counters(db, counts)
+    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    messages = [message_delta(msg) for _, msg, _, _ in stored]
+    conversations: Dict[int, dict] = {}
+    for _, _, conv, attendant_name in stored:
+        conversations[conv.id] = conversation_delta(
+            conv, conv.id in created_ids, conv.id in answered, attendant_name
+        )
+    counters = {
+        "messages": len(stored),
+        "messages_today": sum(1 for _, msg, _, _ in stored if msg.timestamp >= today_start),
+        "inbound": sum(1 for _, msg, _, _ in stored if msg.direction == MessageDirection.inbound),
+        "outbound": sum(1 for _, msg, _, _ in stored if msg.direction == MessageDirection.outbound),
+        "new_conversations": len(created_ids),
+        "answered": len(answered),
+    }
+    return UpsertResult(
+        new_conversations, answered, [m for m, _, _, _ in stored], messages, conversations, counters
+    )
 
 
-def process_groups_upsert(db: Session, instance_name: str, data: Any):
+def process_groups_upsert(db: Session, instance: Instance, data: Any):
     """Trata eventos groups.upsert e groups.update — salva/atualiza nome e imagem do grupo."""
-    instance = db.query(Instance).filter(Instance.instance_name == instance_name).first()
-    if not instance:
-        return
-
     groups_data = data if isinstance(data, list) else [data]
     for group_data in groups_data:
         group_id = group_data.get("id", "")
@@ -300,7 +301,7 @@ def process_groups_upsert(db: Session, instance_name: str, data: Any):
         subject = group_data.get("subject") or group_data.get("name")
         picture_url = group_data.get("pictureUrl") or group_data.get("picture")
 
-        contact_phone = _normalize_phone(group_id)
+        contact_phone = normalize_phone(group_id)
         conv = (
             db.query(Conversation)
             .filter(
@@ -355,18 +356,15 @@ def _format_call_event_content(status: str, is_video: bool, from_me: bool) -> st
     return label
 
 
-def process_call_event(db: Session, instance_name: str, body: Any):
-    """Trata evento 'call' da Evolution API (ligações em tempo real)."""
-    instance = db.query(Instance).filter(Instance.instance_name == instance_name).first()
-    if not instance:
-        return
-
+def process_call_event(db: Session, instance: Instance, body: Any) -> Optional[dict]:
+    """Trata evento 'call' da Evolution API (ligações em tempo real).
+    Retorna o delta para o evento new_call (conversa + mensagem da ligação) ou None."""
     if not body or not isinstance(body, dict):
-        return
+        return None
 
     data = body.get("data") or body
     if not data or not isinstance(data, dict):
-        return
+        return None
 
     from_me = data.get("fromMe", body.get("fromMe", False))
     is_incoming = data.get("isIncoming", body.get("isIncoming"))
@@ -379,21 +377,21 @@ def process_call_event(db: Session, instance_name: str, body: Any):
 
     call_id = data.get("id")
     if not call_id:
-        return
+        return None
 
     evolution_id = f"call_{call_id}"
     existing = db.query(Message).filter(Message.evolution_id == evolution_id).first()
 
     contact_jid = data.get("from") or data.get("chatId") or ""
-    contact_phone = _normalize_phone(contact_jid)
+    contact_phone = normalize_phone(contact_jid)
     if not contact_phone:
-        return
+        return None
 
     status = data.get("status", "")
     is_video = data.get("isVideo", False)
     is_group = data.get("isGroup", False)
     if is_group:
-        return
+        return None
 
     date_val = data.get("date")
     if isinstance(date_val, str):
@@ -415,7 +413,7 @@ def process_call_event(db: Session, instance_name: str, body: Any):
     ).first()
     attendant_id = attendant.id if attendant else None
 
-    conv, _ = _get_or_create_conversation(
+    conv, is_new = _get_or_create_conversation(
         db=db,
         contact_phone=contact_phone,
         contact_name=None,
@@ -431,6 +429,7 @@ def process_call_event(db: Session, instance_name: str, body: Any):
         existing.is_video_call = is_video
         existing.timestamp = timestamp
         existing.direction = direction
+        message = existing
     else:
         message = Message(
             evolution_id=evolution_id,
@@ -444,24 +443,33 @@ def process_call_event(db: Session, instance_name: str, body: Any):
             is_video_call=is_video,
         )
         db.add(message)
-        if direction == MessageDirection.inbound:
-            conv.inbound_count = (conv.inbound_count or 0) + 1
-        else:
-            conv.outbound_count = (conv.outbound_count or 0) + 1
 
+    db.flush()
+    if message is not existing:
+        inbound = direction == MessageDirection.inbound
+        increment_counters(db, {conv.id: (conv, int(inbound), int(not inbound))})
+    delta = {
+        "conversation": conversation_delta(conv, is_new, False, attendant.name if attendant and attendant.id == conv.attendant_id else None),
+        "message": message_delta(message),
+    }
     db.commit()
+    return delta
 
 
-def process_message_update(db: Session, instance_name: str, data: Any):
+def process_message_update(db: Session, data: Any) -> Dict[int, List[int]]:
+    """Marca mensagens apagadas. Retorna {conversation_id: [message_id, ...]} das que mudaram."""
     updates = data if isinstance(data, list) else [data]
-    for update in updates:
-        key = update.get("key", {})
+    deleted: Dict[int, List[int]] = {}
+    for item in updates:
+        key = item.get("key", {})
         evolution_id = key.get("id")
-        status = update.get("update", {}).get("status")
+        status = item.get("update", {}).get("status")
 
         if evolution_id and status == "DELETED":
             msg = db.query(Message).filter(Message.evolution_id == evolution_id).first()
-            if msg:
+            if msg and not msg.is_deleted:
                 msg.is_deleted = True
+                deleted.setdefault(msg.conversation_id, []).append(msg.id)
 
     db.commit()
+    return deleted
@@ -0,0 +1,280 @@
+"""
+Workers de ingestão: processam a fila ingest_queue fora do processo web.
+
+Uso:
+  python -m app.workers.ingest [--workers N] [--batch-size 50]
+
+Com INGEST_QUEUE_ENABLED o webhook só enfileira (app.services.ingest_queue). Este
+comando sobe N processos (padrão: INGEST_WORKERS ou um por núcleo), cada um com
+o seu GIL, sua sessão de banco e as partições p % N == índice — os eventos de
+uma instância são sempre processados pelo mesmo worker, em ordem de chegada.
+Dentro do lote, instâncias diferentes rodam em paralelo pelo mesmo pipeline do
+processo web (app.services.ingest_pipeline).
+
+Exige EVENT_BUS_BACKEND redis ou postgres: os eventos SSE e os sinais para o
+monitor de SLA e o despachante do outbound do processo web saem pelo barramento.
+
+SIGTERM/SIGINT: cada worker termina o lote em andamento, drena os shards e o
+executor do Databricks e publica o status final; o supervisor aguarda os
+processos e reinicia, com backoff exponencial por worker, qualquer um que saia
+antes disso. As métricas de cada worker vão
+para a tabela ingest_workers e aparecem em GET /webhook/ingest/metrics.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.core.database import create_tables, run_migrations
+
+logger = logging.getLogger(__name__)
+
+_LOG_FORMAT = "%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s"
+
+_stop: Optional[asyncio.Event] = None
+_stats = {"processed": 0, "failed": 0, "batches": 0, "busy_ms": 0.0, "lag_seconds": None}
+
+
+# ─── Worker ───────────────────────────────────────────────────────────────────
+
+async def _process_instance(jobs: list) -> List[int]:
+    """Webhooks de uma instância, em série. Retorna os ids concluídos."""
+    from app.core.database import SessionLocal
+    from app.services import ingest_dispatcher, ingest_pipeline, ingest_queue
+
+    done: List[int] = []
+    for i, job in enumerate(jobs):
+        db = SessionLocal()
+        try:
+            await ingest_pipeline.handle_event(db, job.instance_name, job.event, job.body)
+            done.append(job.id)
+            _stats["processed"] += 1
+        except ingest_dispatcher.IngestBusy:
+            # Shards saturados: o resto da instância volta para a fila sem contar tentativa, na mesma ordem
+            await asyncio.to_thread(ingest_queue.release, [j.id for j in jobs[i:]])
+            break
+        except Exception as e:
+            db.rollback()
+            _stats["failed"] += 1
+            retry = await asyncio.to_thread(ingest_queue.fail, job.id, str(e))
+            logger.error("Webhook %s (%s, %s) falhou%s: %s", job.id, job.instance_name, job.event,
+                         "" if retry else " definitivamente", e)
+            # Os seguintes da instância esperam a nova tentativa: nenhum evento passa à frente do que falhou
+            await asyncio.to_thread(ingest_queue.release, [j.id for j in jobs[i + 1:]])
+            break
+        finally:
+            db.close()
+    return done
+
+
+async def _run_batch(jobs: list) -> None:
+    from app.services import ingest_queue
+
+    groups: Dict[str, list] = {}
+    for job in jobs:
+        groups.setdefault(job.instance_name, []).append(job)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(_process_instance(group) for group in groups.values()))
+    await asyncio.to_thread(ingest_queue.complete, [job_id for done in results for job_id in done])
+    _stats["batches"] += 1
+    _stats["busy_ms"] += (time.perf_counter() - started) * 1000
+    _stats["lag_seconds"] = int((datetime.utcnow() - min(job.created_at for job in jobs)).total_seconds())
+
+
+def _report(name: str, **values) -> None:
+    from app.services import ingest_queue
+
+    processed = _stats["processed"]
+    try:
+        ingest_queue.report_worker(
+            name,
+            processed=processed,
+            failed=_stats["failed"],
+            batches=_stats["batches"],
+            avg_ms=int(_stats["busy_ms"] / processed) if processed else None,
+            lag_seconds=_stats["lag_seconds"],
+            **values,
+        )
+    except Exception as e:
+        logger.error("Worker %s: erro ao publicar métricas: %s", name, e)
+
+
+async def _run(index: int, total: int, batch_size: int) -> int:
+    global _stop
+    from app.core import events
+    from app.services import databricks_service, ingest_dispatcher, ingest_pipeline, ingest_queue, webhook_dedup
+
+    _stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, _stop.set)
+
+    partitions = ingest_queue.partitions_for_worker(index, total)
+    name = f"{socket.gethostname()}:{index}"
+    await events.start_bus()
+    if not events.bus_active():
+        # Sem barramento, eventos e sinais deste worker não chegam ao processo web
+        logger.error("Worker %s: barramento %s indisponível; saindo para nova tentativa", name, settings.EVENT_BUS_BACKEND)
+        return 1
+    ingest_pipeline.enable_worker_mode()
+    await webhook_dedup.start()
+    reclaimed = await asyncio.to_thread(ingest_queue.reclaim_stale, partitions)
+    await asyncio.to_thread(
+        _report, name, pid=os.getpid(), status="running", started_at=datetime.utcnow(),
+        partitions=",".join(map(str, partitions)),
+    )
+    logger.info("Worker %s: %d partições, %d webhooks recuperados", name, len(partitions), reclaimed)
+
+    last_report = time.monotonic()
+    try:
+        while not _stop.is_set():
+            jobs = await asyncio.to_thread(ingest_queue.claim, partitions, batch_size)
+            if jobs:
+                await _run_batch(jobs)
+            if time.monotonic() - last_report >= settings.INGEST_WORKER_METRICS_SECONDS:
+                await asyncio.to_thread(ingest_queue.reclaim_stale, partitions)
+                await asyncio.to_thread(_report, name, status="running")
+                last_report = time.monotonic()
+            if not jobs:
+                try:
+                    await asyncio.wait_for(_stop.wait(), timeout=settings.INGEST_WORKER_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        await ingest_dispatcher.stop()
+        await databricks_service.stop()
+        await asyncio.to_thread(_report, name, status="stopped")
+        await events.stop_bus()
+        logger.info("Worker %s encerrado: %d processados, %d falhas", name, _stats["processed"], _stats["failed"])
+    return 0
+
+
+def _worker_main(index: int, total: int, batch_size: int) -> None:
+    logging.basicConfig(level=logging.INFO, format=_LOG_FORMAT)
+    create_tables()  # registra todos os modelos neste processo (relacionamentos entre eles)
+    try:
+        sys.exit(asyncio.run(_run(index, total, batch_size)))
+    except KeyboardInterrupt:  # sinal antes de o loop instalar os handlers
+        pass
+
+
+# ─── Supervisor ───────────────────────────────────────────────────────────────
+
+class _RestartBackoff:
+    """Atraso antes de reiniciar cada worker: base, 2×base, 4×base... até o teto.
+    Um worker que ficou de pé pelo tempo do teto volta ao atraso base."""
+
+    def __init__(self):
+        self.failures: Dict[int, int] = {}
+        self.started_at: Dict[int, float] = {}
+        self.retry_at: Dict[int, float] = {}
+
+    def started(self, index: int, now: float) -> None:
+        self.started_at[index] = now
+
+    def pending(self, index: int) -> bool:
+        return index in self.retry_at
+
+    def schedule(self, index: int, now: float) -> float:
+        """Registra a saída do worker e retorna o atraso até a nova tentativa."""
+        if now - self.started_at.get(index, now) >= settings.INGEST_WORKER_RESTART_MAX_SECONDS:
+            self.failures[index] = 0
+        failures = self.failures.get(index, 0)
+        self.failures[index] = failures + 1
+        delay = min(settings.INGEST_WORKER_RESTART_BACKOFF_SECONDS * 2 ** failures,
+                    settings.INGEST_WORKER_RESTART_MAX_SECONDS)
+        self.retry_at[index] = now + delay
+        return delay
+
+    def due(self, index: int, now: float) -> bool:
+        if now < self.retry_at[index]:
+            return False
+        del self.retry_at[index]
+        return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.workers.ingest", description="Workers de ingestão de webhooks")
+    parser.add_argument("--workers", type=int, default=settings.INGEST_WORKERS or os.cpu_count() or 1,
+                        help="processos de ingestão (padrão: INGEST_WORKERS ou um por núcleo)")
+    parser.add_argument("--batch-size", type=int, default=settings.INGEST_WORKER_BATCH_SIZE,
+                        help="webhooks reivindicados por varredura")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.batch_size < 1:
+        parser.error("--workers e --batch-size devem ser positivos")
+
+    logging.basicConfig(level=logging.INFO, format=_LOG_FORMAT)
+    if settings.EVENT_BUS_BACKEND == "memory":
+        logger.error("EVENT_BUS_BACKEND=memory: eventos dos workers não chegariam aos dashboards nem ao "
+                     "monitor de SLA do processo web. Configure redis ou postgres.")
+        return 2
+    if not settings.INGEST_QUEUE_ENABLED:
+        logger.warning("INGEST_QUEUE_ENABLED desativado: o webhook não enfileira, os workers só drenam a fila existente")
+    total = args.workers
+    if total > settings.INGEST_QUEUE_PARTITIONS:
+        logger.warning("%d workers para %d partições: os excedentes ficam ociosos", total, settings.INGEST_QUEUE_PARTITIONS)
+    create_tables()
+    run_migrations()
+
+    # spawn: cada worker abre o próprio pool de conexões em vez de herdar o do supervisor
+    ctx = multiprocessing.get_context("spawn")
+
+    backoff = _RestartBackoff()
+
+    def _spawn(index: int) -> multiprocessing.Process:
+        process = ctx.Process(target=_worker_main, args=(index, total, args.batch_size), name=f"ingest-{index}")
+        process.start()
+        backoff.started(index, time.monotonic())
+        return process
+
+    processes = {index: _spawn(index) for index in range(total)}
+    stopping = False
+
+    def _shutdown(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        logger.info("Encerrando %d workers (sinal %d)", len(processes), signum)
+        for process in processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    while not stopping:
+        for index, process in list(processes.items()):
+            if stopping or process.exitcode is None:
+                continue
+            # Sem pedido de parada, qualquer saída (inclusive código 0) deixaria as partições sem worker
+            if not backoff.pending(index):
+                delay = backoff.schedule(index, time.monotonic())
+                logger.error("Worker %d saiu com código %s; reiniciando em %.0fs", index, process.exitcode, delay)
+            elif backoff.due(index, time.monotonic()):
+                processes[index] = _spawn(index)
+        time.sleep(1)
+
+    deadline = time.monotonic() + settings.INGEST_DRAIN_SECONDS + settings.DATABRICKS_DRAIN_SECONDS + 5
+    exit_code = 0
+    for index, process in processes.items():
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            logger.error("Worker %d não encerrou a tempo; finalizando", index)
+            process.kill()
+            process.join()
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,7 @@ import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import { useRef, useEffect, useState, useCallback } from 'react'
 import { metricsApi, attendantsApi, quickRepliesApi } from '@/lib/api'
 import { formatResponseTime, formatDate } from '@/lib/utils'
+import { useConsoleSocket } from '@/lib/use-console-socket'
 import { Button } from '@/components/ui/button'
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select'
 import {
@@ -56,11 +57,14 @@ export default function ConversationDetailPage() {
     enabled: !!id,
   })
 
+  // Com o console WebSocket conectado as mensagens chegam por push; polling só como fallback
+  const { connected: consoleConnected, send: consoleSend } = useConsoleSocket(id)
+
   const { data: messages = [], isLoading: loadingMsgs } = useQuery({
     queryKey: ['messages', id],
     queryFn: () => metricsApi.getMessages(id),
     enabled: !!id,
-    refetchInterval: conversation?.status === 'open' ? 5000 : false,
+    refetchInterval: conversation?.status === 'open' && !consoleConnected ? 5000 : false,
   })
 
   const { data: quickReplies = [] } = useQuery({
@@ -104,10 +108,13 @@ export default function ConversationDetailPage() {
   })
 
   const sendMutation = useMutation({
-    mutationFn: (t: string) => metricsApi.sendMessage(id, t),
+    mutationFn: (t: string) => (consoleConnected ? consoleSend(t) : metricsApi.sendMessage(id, t)),
     onSuccess: () => {
-      queryClient.invalidateQueries({ queryKey: ['messages', id] })
-      queryClient.invalidateQueries({ queryKey: ['conversation', id] })
+      if (!consoleConnected) {
+        // Pelo socket o evento new_message já atualiza mensagens e contadores
+        queryClient.invalidateQueries({ queryKey: ['messages', id] })
+        queryClient.invalidateQueries({ queryKey: ['conversation', id] })
+      }
       setText('')
       textareaRef.current?.focus()
     },
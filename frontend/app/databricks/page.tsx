@@ -423,7 +423,8 @@ function RunsTable() {
   const { data: runs = [], isLoading, refetch } = useQuery({
     queryKey: ['databricks-runs'],
     queryFn: () => databricksApi.getRuns(50),
-    refetchInterval: 8000,
+    // Status chega pelo SSE (databricks_run_updated); leitura periódica só como rede de segurança
+    refetchInterval: 60000,
   })
 
   const refresh = useMutation({
@@ -487,6 +488,14 @@ function RunsTable() {
                       {run.error_message && (
                         <p className="text-[10px] text-red-400 mt-0.5 max-w-[150px] truncate" title={run.error_message}>{run.error_message}</p>
                       )}
+                      {run.delivery_status && (
+                        <p
+                          className={`text-[10px] mt-0.5 max-w-[150px] truncate ${run.delivery_status === 'failed' ? 'text-red-400' : 'text-zinc-400'}`}
+                          title={run.delivery_error ?? run.output_file ?? undefined}
+                        >
+                          PDF: {{ pending: 'na fila', sending: 'enviando', delivered: 'enviado', failed: 'falhou' }[run.delivery_status]}
+                        </p>
+                      )}
                     </td>
                     <td className="px-3 py-3 text-xs text-zinc-500">{formatDuration(run)}</td>
                     <td className="px-3 py-3 text-xs text-zinc-500 whitespace-nowrap">{formatDate(run.started_at)}</td>
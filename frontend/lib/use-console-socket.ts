@@ -0,0 +1,136 @@
+'use client'
+
+import { useCallback, useEffect, useRef, useState } from 'react'
+import { useQueryClient } from '@tanstack/react-query'
+import {
+  applyMessageDeleted,
+  applyNewCall,
+  applyNewMessage,
+  applyNoteEvent,
+  type NewMessageEvent,
+} from '@/lib/use-sse'
+
+// Console do atendente (app/routers/console.py): eventos só das conversas assinadas e envio pelo mesmo socket
+
+function getWsUrl(): string {
+  if (typeof window !== 'undefined') {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
+    return `${protocol}//${window.location.hostname}:8000/api/ws/console`
+  }
+  return (process.env.NEXT_PUBLIC_API_URL ?? 'http://localhost:8000').replace(/^http/, 'ws') + '/api/ws/console'
+}
+
+interface SentMessage {
+  id: number
+  content: string
+  direction: string
+  msg_type: string
+  timestamp: string
+}
+
+interface Pending {
+  resolve: (msg: SentMessage) => void
+  reject: (err: Error) => void
+}
+
+export function useConsoleSocket(conversationId: number) {
+  const queryClient = useQueryClient()
+  const socketRef = useRef<WebSocket | null>(null)
+  const pendingRef = useRef(new Map<string, Pending>())
+  const [connected, setConnected] = useState(false)
+
+  useEffect(() => {
+    if (!conversationId) return
+    let closed = false
+    let retry = 0
+    let timer: ReturnType<typeof setTimeout> | undefined
+    const pending = pendingRef.current
+
+    function connect() {
+      const ws = new WebSocket(getWsUrl())
+      socketRef.current = ws
+
+      ws.onopen = () => {
+        retry = 0
+        ws.send(JSON.stringify({ op: 'subscribe', conversation_ids: [conversationId] }))
+      }
+
+      ws.onmessage = (e) => {
+        let event: { type: string; ref?: string; [key: string]: unknown }
+        try {
+          event = JSON.parse(e.data)
+        } catch {
+          return
+        }
+        switch (event.type) {
+          case 'ping':
+            ws.send(JSON.stringify({ op: 'pong' }))
+            break
+          case 'subscribed':
+            setConnected(true)
+            // Eventos anteriores à assinatura: uma leitura para alinhar
+            queryClient.invalidateQueries({ queryKey: ['messages', conversationId] })
+            break
+          case 'ack':
+          case 'error': {
+            const p = event.ref ? pending.get(event.ref) : undefined
+            if (!p) break
+            pending.delete(event.ref!)
+            if (event.type === 'ack') p.resolve(event.message as SentMessage)
+            else p.reject(new Error(String(event.detail)))
+            break
+          }
+          case 'resync':
+            queryClient.invalidateQueries({ queryKey: ['messages', conversationId] })
+            queryClient.invalidateQueries({ queryKey: ['conversation', conversationId] })
+            queryClient.invalidateQueries({ queryKey: ['notes', conversationId] })
+            break
+          case 'new_message':
+            applyNewMessage(queryClient, event as unknown as NewMessageEvent)
+            break
+          case 'message_deleted':
+            applyMessageDeleted(queryClient, event as unknown as Parameters<typeof applyMessageDeleted>[1])
+            break
+          case 'note_added':
+          case 'note_deleted':
+            applyNoteEvent(queryClient, event as unknown as Parameters<typeof applyNoteEvent>[1])
+            break
+          case 'new_call':
+            applyNewCall(queryClient, event as unknown as Parameters<typeof applyNewCall>[1])
+            break
+        }
+      }
+
+      ws.onclose = () => {
+        setConnected(false)
+        socketRef.current = null
+        for (const p of pending.values()) p.reject(new Error('Conexão encerrada'))
+        pending.clear()
+        if (closed) return
+        // Reconexão com backoff (máx. 30s)
+        timer = setTimeout(connect, Math.min(1000 * 2 ** retry++, 30000))
+      }
+    }
+
+    connect()
+    return () => {
+      closed = true
+      clearTimeout(timer)
+      socketRef.current?.close()
+    }
+  }, [conversationId, queryClient])
+
+  const send = useCallback((text: string): Promise<SentMessage> => {
+    const ws = socketRef.current
+    if (!ws || ws.readyState !== WebSocket.OPEN) {
+      return Promise.reject(new Error('Console desconectado'))
+    }
+    const ref = Math.random().toString(36).slice(2)
+    return new Promise<SentMessage>((resolve, reject) => {
+      pendingRef.current.set(ref, { resolve, reject })
+      ws.send(JSON.stringify({ op: 'send', conversation_id: conversationId, text, ref }))
+    })
+  }, [conversationId])
+
+  return { connected, send }
+}
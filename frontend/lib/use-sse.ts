@@ -1,7 +1,56 @@
 'use client'
 
 import { useEffect } from 'react'
-import { useQueryClient } from '@tanstack/react-query'
+import { useQueryClient, type QueryClient, type QueryKey } from '@tanstack/react-query'
+import type {
+  AttendantMetrics,
+  ConversationDetail,
+  ConversationMessage,
+  ConversationNote,
+  DatabricksJobRun,
+  OverviewComparison,
+  SlaAlertsResponse,
+} from '@/types'
+
+// Evento new_message v2 (app/services/webhook_service.py → UpsertResult.event)
+interface ConversationDelta {
+  id: number
+  contact_phone: string
+  contact_name: string | null
+  is_group: boolean
+  status: ConversationDetail['status']
+  attendant_id: number | null
+  attendant_name: string | null
+  opened_at: string | null
+  last_message_at: string | null
+  first_response_time_seconds: number | null
+  inbound_count: number
+  outbound_count: number
+  created: boolean
+  answered: boolean
+}
+
+interface MessageDelta extends ConversationMessage {
+  conversation_id: number
+  content_truncated: boolean
+}
+
+export interface NewMessageEvent {
+  type: 'new_message'
+  v?: number
+  instance_id: number | null
+  truncated?: boolean
+  messages?: MessageDelta[]
+  conversations?: ConversationDelta[]
+  counters?: {
+    messages: number
+    messages_today: number
+    inbound: number
+    outbound: number
+    new_conversations: number
+    answered: number
+  }
+}
 
 function getApiUrl(): string {
   if (typeof window !== 'undefined') {
@@ -10,6 +59,214 @@ function getApiUrl(): string {
   return process.env.NEXT_PUBLIC_API_URL ?? 'http://localhost:8000'
 }
 
+// Consulta filtrada por instância (key[1]) que deve receber o delta: sem filtro ou mesma instância
+function matchesInstance(key: QueryKey, instanceId: number | null): boolean {
+  const filter = key[1]
+  return filter === undefined || filter === null || filter === '' || instanceId === null || Number(filter) === instanceId
+}
+
+function invalidateMessageQueries(queryClient: QueryClient) {
+  queryClient.invalidateQueries({ queryKey: ['overview-comparison'] })
+  queryClient.invalidateQueries({ queryKey: ['conversations'] })
+  queryClient.invalidateQueries({ queryKey: ['conversations-recent'] })
+  queryClient.invalidateQueries({ queryKey: ['sla-alerts'] })
+  queryClient.invalidateQueries({ queryKey: ['extended-metrics'] })
+  queryClient.invalidateQueries({ queryKey: ['attendants-metrics'] })
+}
+
+function toMessage(msg: MessageDelta): ConversationMessage {
+  return {
+    id: msg.id,
+    direction: msg.direction,
+    msg_type: msg.msg_type,
+    content: msg.content,
+    timestamp: msg.timestamp,
+    sender_phone: msg.sender_phone,
+    sender_name: msg.sender_name,
+  }
+}
+
+function appendMessage(queryClient: QueryClient, msg: MessageDelta, isGroup: boolean) {
+  const key = [isGroup ? 'group-messages' : 'messages', msg.conversation_id]
+  if (msg.content_truncated) {
+    queryClient.invalidateQueries({ queryKey: key })
+    return
+  }
+  queryClient.setQueryData<ConversationMessage[]>(key, old => {
+    if (!old) return old
+    const idx = old.findIndex(m => m.id === msg.id)
+    // Ligação atualizada (mesma mensagem, novo status) substitui a existente
+    if (idx >= 0) return [...old.slice(0, idx), toMessage(msg), ...old.slice(idx + 1)]
+    return [...old, toMessage(msg)]
+  })
+}
+
+/** Aplica o delta no cache do react-query; só recarrega o que não dá para derivar do evento. */
+export function applyNewMessage(queryClient: QueryClient, event: NewMessageEvent) {
+  if (event.v !== 2 || event.truncated || !event.messages || !event.conversations || !event.counters) {
+    invalidateMessageQueries(queryClient)
+    return
+  }
+  const { counters, instance_id: instanceId } = event
+  const convs = new Map(event.conversations.map(c => [c.id, c]))
+
+  // Mensagens da conversa aberta na tela
+  for (const msg of event.messages) {
+    appendMessage(queryClient, msg, convs.get(msg.conversation_id)?.is_group ?? false)
+  }
+
+  // Detalhe e listas de conversas: contadores absolutos (idempotentes); conversa sobe para o topo
+  let hasNewConversation = false
+  for (const conv of convs.values()) {
+    const patch = {
+      status: conv.status,
+      inbound_count: conv.inbound_count,
+      outbound_count: conv.outbound_count,
+      first_response_time_seconds: conv.first_response_time_seconds,
+      ...(conv.contact_name ? { contact_name: conv.contact_name } : {}),
+      ...(conv.attendant_name ? { attendant_name: conv.attendant_name } : {}),
+    }
+    queryClient.setQueryData<ConversationDetail>(['conversation', conv.id], old => (old ? { ...old, ...patch } : old))
+    if (conv.is_group) continue
+    if (conv.created) {
+      hasNewConversation = true
+      continue
+    }
+    for (const listKey of ['conversations', 'conversations-recent']) {
+      queryClient.setQueriesData<ConversationDetail[]>({ queryKey: [listKey] }, old => {
+        const idx = old?.findIndex(c => c.id === conv.id) ?? -1
+        if (!old || idx < 0) return old
+        return [{ ...old[idx], ...patch }, ...old.slice(0, idx), ...old.slice(idx + 1)]
+      })
+    }
+  }
+  if (hasNewConversation) {
+    // Conversa nova precisa de campos que o evento não traz (equipe, filtros da lista)
+    queryClient.invalidateQueries({ queryKey: ['conversations'] })
+    queryClient.invalidateQueries({ queryKey: ['conversations-recent'] })
+  }
+
+  // Contadores agregados do dashboard
+  const queries = queryClient.getQueryCache().findAll({ queryKey: ['overview-comparison'] })
+  for (const query of queries) {
+    if (!matchesInstance(query.queryKey, instanceId)) continue
+    queryClient.setQueryData<OverviewComparison>(query.queryKey, old => {
+      if (!old) return old
+      const o = old.overview
+      const total = o.total_conversations + counters.new_conversations
+      return {
+        ...old,
+        overview: {
+          ...o,
+          total_conversations: total,
+          open_conversations: o.open_conversations + counters.new_conversations,
+          waiting_conversations: Math.max(o.waiting_conversations + counters.new_conversations - counters.answered, 0),
+          in_progress_conversations: o.in_progress_conversations + counters.answered,
+          total_messages_today: o.total_messages_today + counters.messages_today,
+          total_conversations_today: o.total_conversations_today + counters.new_conversations,
+          resolution_rate: total > 0 ? Math.round((o.resolved_conversations / total) * 1000) / 10 : 0,
+        },
+      }
+    })
+  }
+
+  for (const query of queryClient.getQueryCache().findAll({ queryKey: ['attendants-metrics'] })) {
+    if (!matchesInstance(query.queryKey, instanceId)) continue
+    queryClient.setQueryData<AttendantMetrics[]>(query.queryKey, old => {
+      if (!old) return old
+      return old.map(att => {
+        let { total_messages_sent: sent, total_messages_received: received } = att
+        let { total_conversations: total, open_conversations: open } = att
+        for (const msg of event.messages!) {
+          if (convs.get(msg.conversation_id)?.attendant_id !== att.attendant_id) continue
+          if (msg.direction === 'outbound') sent += 1
+          else received += 1
+        }
+        for (const conv of convs.values()) {
+          if (conv.created && conv.attendant_id === att.attendant_id) {
+            total += 1
+            open += 1
+          }
+        }
+        const resolution_rate = total > 0 ? Math.round((att.resolved_conversations / total) * 1000) / 10 : 0
+        return { ...att, total_messages_sent: sent, total_messages_received: received, total_conversations: total, open_conversations: open, resolution_rate }
+      })
+    })
+  }
+
+  // Primeira resposta: sai dos alertas de SLA e muda as taxas de SLA
+  const answered = [...convs.values()].filter(c => c.answered).map(c => c.id)
+  if (answered.length) {
+    queryClient.setQueriesData<SlaAlertsResponse>({ queryKey: ['sla-alerts'] }, old => {
+      if (!old) return old
+      const alerts = old.alerts.filter(a => !answered.includes(a.id))
+      return { ...old, alerts, count: alerts.length }
+    })
+    queryClient.invalidateQueries({ queryKey: ['extended-metrics'] })
+  }
+}
+
+export function applyMessageDeleted(queryClient: QueryClient, event: { conversation_id: number; message_ids: number[] }) {
+  for (const key of ['messages', 'group-messages']) {
+    queryClient.setQueryData<ConversationMessage[]>([key, event.conversation_id], old =>
+      old ? old.filter(m => !event.message_ids.includes(m.id)) : old
+    )
+  }
+}
+
+export function applyNoteEvent(
+  queryClient: QueryClient,
+  event: { type: string; conversation_id: number; note?: ConversationNote; note_id?: number },
+) {
+  queryClient.setQueryData<ConversationNote[]>(['notes', event.conversation_id], old => {
+    if (!old) return old
+    if (event.type === 'note_deleted') return old.filter(n => n.id !== event.note_id)
+    if (!event.note || old.some(n => n.id === event.note!.id)) return old
+    return [event.note, ...old]  // lista em ordem decrescente de criação
+  })
+}
+
+export function applyNewCall(queryClient: QueryClient, event: { message?: MessageDelta; conversation?: ConversationDelta }) {
+  if (event.message) appendMessage(queryClient, event.message, false)
+  if (event.conversation) {
+    const { inbound_count, outbound_count } = event.conversation
+    queryClient.setQueryData<ConversationDetail>(['conversation', event.conversation.id], old =>
+      old ? { ...old, inbound_count, outbound_count } : old
+    )
+  }
+  queryClient.invalidateQueries({ queryKey: ['calls'] })
+}
+
+// Poller de runs Databricks (app/services/databricks_service.py → _run_event)
+interface DatabricksRunEvent {
+  run_id: number
+  status: DatabricksJobRun['status']
+  completed_at?: string | null
+  error_message?: string | null
+  delivery_status?: DatabricksJobRun['delivery_status']
+  delivery_error?: string | null
+}
+
+export function applyDatabricksRun(queryClient: QueryClient, event: DatabricksRunEvent) {
+  let found = false
+  queryClient.setQueryData<DatabricksJobRun[]>(['databricks-runs'], old =>
+    old?.map(run => {
+      if (run.id !== event.run_id) return run
+      found = true
+      return {
+        ...run,
+        status: event.status,
+        completed_at: event.completed_at ?? run.completed_at,
+        error_message: event.error_message ?? run.error_message,
+        delivery_status: event.delivery_status ?? run.delivery_status,
+        delivery_error: event.delivery_error ?? run.delivery_error,
+      }
+    })
+  )
+  // Run disparado pelo WhatsApp ainda fora da lista
+  if (!found) queryClient.invalidateQueries({ queryKey: ['databricks-runs'] })
+}
+
 export function useSseEvents() {
   const queryClient = useQueryClient()
 
@@ -21,13 +278,32 @@ export function useSseEvents() {
         const event = JSON.parse(e.data) as { type: string }
         if (event.type === 'heartbeat') return
 
-        if (event.type === 'new_message' || event.type === 'message_updated') {
-          queryClient.invalidateQueries({ queryKey: ['overview-comparison'] })
+        // Eventos perdidos (reconexão longa ou conexão lenta): recarrega tudo
+        if (event.type === 'resync') {
+          queryClient.invalidateQueries()
+          return
+        }
+
+        if (event.type === 'new_message') {
+          applyNewMessage(queryClient, event as NewMessageEvent)
+        }
+
+        if (event.type === 'message_deleted') {
+          applyMessageDeleted(queryClient, event as unknown as Parameters<typeof applyMessageDeleted>[1])
+        }
+
+        if (event.type === 'note_added' || event.type === 'note_deleted') {
+          applyNoteEvent(queryClient, event as Parameters<typeof applyNoteEvent>[1])
+        }
+
+        if (event.type === 'sla_breach') {
+          queryClient.invalidateQueries({ queryKey: ['sla-alerts'] })
+        }
+
+        if (event.type === 'conversations_abandoned') {
           queryClient.invalidateQueries({ queryKey: ['conversations'] })
-          queryClient.invalidateQueries({ queryKey: ['conversations-recent'] })
           queryClient.invalidateQueries({ queryKey: ['sla-alerts'] })
-          queryClient.invalidateQueries({ queryKey: ['extended-metrics'] })
-          queryClient.invalidateQueries({ queryKey: ['attendants-metrics'] })
+          queryClient.invalidateQueries({ queryKey: ['overview-comparison'] })
         }
 
         if (event.type === 'groups_updated') {
@@ -35,8 +311,12 @@ export function useSseEvents() {
           queryClient.invalidateQueries({ queryKey: ['groups-overview'] })
         }
 
+        if (event.type === 'databricks_run_updated') {
+          applyDatabricksRun(queryClient, event as unknown as DatabricksRunEvent)
+        }
+
         if (event.type === 'new_call') {
-          queryClient.invalidateQueries({ queryKey: ['calls'] })
+          applyNewCall(queryClient, event as unknown as Parameters<typeof applyNewCall>[1])
         }
       } catch {
         // ignore JSON parse errors
@@ -271,6 +271,13 @@ export interface DatabricksJobRun {
   completed_at: string | null
   extracted_codigo_cliente: string | null
   notebook_params_json: string | null
+  instance_id: number | null
+  delivery_status: 'pending' | 'sending' | 'delivered' | 'failed' | null
+  delivery_attempts: number
+  delivery_error: string | null
+  delivered_at: string | null
+  output_file: string | null
+  output_size: number | null
 }
 
 export interface AttendantSummary {
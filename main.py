@@ -1,3 +1,4 @@
+import logging
 from pathlib import Path
 
 from fastapi import FastAPI
@@ -7,21 +8,51 @@ from contextlib import asynccontextmanager
 
 from app.core.config import settings
 from app.core.database import create_tables, run_migrations
+from app.core import events, json_codec
+from app.core.scheduler import scheduler
 from app.routers.webhook import router as webhook_router, root_router as webhook_root_router
-from app.routers import metrics, instances, dashboard, sse, teams, quick_replies, reports, databricks
+from app.routers import metrics, instances, dashboard, sse, teams, quick_replies, reports, databricks, llm
+from app.routers import scheduler as scheduler_router
+from app.routers import console, outbound
+from app.services import databricks_service, ingest_dispatcher, outbound_service, sla_service, webhook_dedup
+from app.services.evolution_client import evolution
+
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_tables()
     run_migrations()
+    await events.start_bus()
+    if settings.INGEST_QUEUE_ENABLED and not events.bus_active():
+        logger.error(
+            "INGEST_QUEUE_ENABLED sem barramento de eventos (EVENT_BUS_BACKEND=%s): mensagens gravadas "
+            "pelos workers de ingestão não aparecem nos dashboards e o SLA só as vê na ressincronização",
+            settings.EVENT_BUS_BACKEND,
+        )
+    await sla_service.start()
+    await webhook_dedup.start()
+    await outbound_service.start()
+    await databricks_service.start_poller()
+    if settings.SCHEDULER_ENABLED:
+        scheduler.start()
     yield
+    await scheduler.stop()
+    await ingest_dispatcher.stop()
+    await outbound_service.stop()
+    await databricks_service.stop()
+    await databricks_service.stop_poller()
+    await sla_service.stop()
+    await events.stop_bus()
+    await evolution.aclose()
 
 
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
     lifespan=lifespan,
+    default_response_class=json_codec.JSONResponse,  # ORJSONResponse quando orjson está instalado
 )
 
 _cors_origins = ["http://localhost:3000", "http://127.0.0.1:3000"]
@@ -45,10 +76,14 @@ app.include_router(webhook_root_router)
 app.include_router(metrics.router)
 app.include_router(instances.router)
 app.include_router(sse.router)
+app.include_router(console.router)
+app.include_router(outbound.router)
 app.include_router(teams.router)
 app.include_router(quick_replies.router)
 app.include_router(reports.router)
 app.include_router(databricks.router)
+app.include_router(llm.router)
+app.include_router(scheduler_router.router)
 
 
 if __name__ == "__main__":
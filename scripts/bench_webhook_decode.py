@@ -0,0 +1,185 @@
+"""
+Replay e micro-benchmark da decodificação de webhooks messages.upsert.
+
+Uso:
+  python scripts/bench_webhook_decode.py replay [--tree DIR] > linhas.json
+  python scripts/bench_webhook_decode.py bench [--tree DIR] [--iterations 2000]
+
+replay: envia um conjunto fixo de webhooks (texto, mídia, ligações, grupos,
+reentrega) pelo router num SQLite descartável e imprime, em JSON canônico, as
+mensagens e conversas gravadas e os disparos do Databricks.
+
+bench: mede o parse + extração de um webhook com 50 mensagens (µs por webhook).
+
+--tree roda contra outro checkout, para comparar antes e depois de uma mudança:
+  git worktree add /tmp/antes <commit>~1
+  python scripts/bench_webhook_decode.py replay --tree /tmp/antes > antes.json
+  python scripts/bench_webhook_decode.py replay > depois.json
+  diff antes.json depois.json
+Em árvores anteriores ao webhook_decoder o bench usa os helpers antigos do
+webhook_service (json.loads + extração, mais a releitura do payload que o
+router fazia para o Databricks).
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def _msg(i: int, jid: str = "5511@s.whatsapp.net", from_me: bool = False,
+         message: Any = None, participant: str = None) -> Dict[str, Any]:
+    data = {
+        "key": {"id": f"E{i}", "remoteJid": jid, "fromMe": from_me},
+        "pushName": "Ana",
+        "messageTimestamp": 1700000000 + i,
+        "message": {"conversation": f"oi {i}"} if message is None else message,
+    }
+    if participant:
+        data["key"]["participant"] = participant
+    return data
+
+
+def replay_payloads() -> List[Dict[str, Any]]:
+    upsert = lambda data: {"event": "messages.upsert", "instance": "i1", "data": data}  # noqa: E731
+    return [
+        upsert(_msg(1)),
+        upsert([
+            _msg(2, message={"extendedTextMessage": {"text": "gerar relatorio 123"}}),
+            _msg(3, from_me=True, message={"conversation": "resposta"}),
+        ]),
+        upsert({"messages": [
+            _msg(4, message={"imageMessage": {}}),
+            _msg(5, message={"protocolMessage": {"callLogMesssage": {
+                "callOutcome": "MISSED", "durationSecs": {"low": 12}, "isVideo": True}}}),
+        ]}),
+        upsert([
+            _msg(6, jid="1203@g.us", participant="5599:3@s.whatsapp.net", message={"conversation": "grupo"}),
+            _msg(7, jid="1203@g.us", from_me=True),
+            _msg(8, message={"pttMessage": {}}),
+            _msg(9, message={}),
+            _msg(1),  # reentrega
+        ]),
+        upsert([_msg(10, message={"callLogMessage": {"callOutcome": "CONNECTED", "durationSecs": 30}})]),
+    ]
+
+
+def bench_body(count: int = 50) -> bytes:
+    return json.dumps({"event": "messages.upsert", "instance": "i1", "data": [
+        _msg(i, message={"extendedTextMessage": {"text": "x" * 200, "contextInfo": {"a": [1, 2, 3] * 20}}})
+        for i in range(count)
+    ]}).encode()
+
+
+def replay() -> Dict[str, Any]:
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.core.database import SessionLocal, create_tables, run_migrations
+    from app.models.conversation import Conversation
+    from app.models.instance import Instance
+    from app.models.message import Message
+    from app.routers.webhook import router
+    from app.services import databricks_service
+
+    create_tables()
+    run_migrations()
+    triggers: List[Tuple[str, str]] = []
+    databricks_service.check_and_trigger = lambda db, instance_id, phone, text: triggers.append((phone, text))
+
+    db = SessionLocal()
+    db.add(Instance(name="i1", instance_name="i1", api_url="http://evo", api_key="k"))
+    db.commit()
+    db.close()
+
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    for payload in replay_payloads():
+        resp = client.post("/webhook/i1", content=json.dumps(payload))
+        if resp.status_code != 200:
+            raise SystemExit(f"webhook recusado ({resp.status_code}): {resp.text}")
+
+    db = SessionLocal()
+    try:
+        messages = [
+            (m.evolution_id, m.direction.value, m.msg_type.value, m.content, m.sender_phone, m.sender_name,
+             m.call_outcome, m.call_duration_secs, m.is_video_call, str(m.timestamp))
+            for m in db.query(Message).order_by(Message.evolution_id)
+        ]
+        conversations = [
+            (c.contact_phone, c.contact_name, c.is_group, c.inbound_count, c.outbound_count,
+             c.first_response_time_seconds)
+            for c in db.query(Conversation).order_by(Conversation.id)
+        ]
+    finally:
+        db.close()
+    return {"messages": messages, "conversations": conversations, "databricks_triggers": triggers}
+
+
+def _decoder() -> Tuple[str, Callable[[bytes], Any]]:
+    try:
+        from app.services import webhook_decoder
+    except ImportError:
+        from app.services import webhook_service as ws
+
+        def legacy(raw: bytes):
+            out = []
+            for m in ws._normalize_webhook_data(json.loads(raw)["data"]):
+                content = m.get("message") or {}
+                msg_type = ws._get_message_type(content)
+                if msg_type.value == "call":
+                    ws._get_call_log(content)
+                out.append((msg_type, ws._extract_text(content), ws._normalize_phone(m["key"]["remoteJid"])))
+                # o router relia o payload para o Databricks
+                key = m.get("key", {})
+                content.get("conversation") or (content.get("extendedTextMessage") or {}).get("text")
+                key.get("remoteJid", "").split("@")[0].split(":")[0]
+            return out
+
+        return "webhook_service (antigo)", legacy
+    return "webhook_decoder", lambda raw: webhook_decoder.decode_upsert(webhook_decoder.decode_body(raw)["data"])
+
+
+def bench(iterations: int) -> Dict[str, Any]:
+    label, decode = _decoder()
+    raw = bench_body()
+    decode(raw)  # aquecimento
+    started = time.perf_counter()
+    for _ in range(iterations):
+        decode(raw)
+    per_call = (time.perf_counter() - started) / iterations
+    codec = "json"
+    if label == "webhook_decoder":
+        try:
+            import orjson  # noqa: F401
+            codec = "orjson"
+        except ImportError:
+            pass
+    return {"decoder": label, "codec": codec, "messages": 50, "iterations": iterations,
+            "us_per_webhook": round(per_call * 1e6, 1)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python scripts/bench_webhook_decode.py", description=__doc__.split("\n\n")[0])
+    parser.add_argument("mode", choices=("replay", "bench"))
+    parser.add_argument("--tree", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="checkout a testar (padrão: este)")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    # Antes de importar o app: banco descartável e sem barramento externo
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='beazap-bench-'), 'bench.db')}"
+    os.environ["EVENT_BUS_BACKEND"] = "memory"
+    sys.path.insert(0, os.path.abspath(args.tree))
+
+    result = replay() if args.mode == "replay" else bench(args.iterations)
+    print(json.dumps(result, sort_keys=True, indent=1, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
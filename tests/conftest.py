@@ -0,0 +1,61 @@
+"""Fixtures compartilhadas: banco SQLite descartável por teste."""
+
+import os
+import tempfile
+
+# Antes de importar o app: settings e engine são criados no import
+_DB_DIR = tempfile.mkdtemp(prefix="beazap-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+os.environ.setdefault("EVENT_BUS_BACKEND", "memory")
+
+import pytest  # noqa: E402
+
+from app.core.database import Base, SessionLocal, create_tables, engine  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    create_tables()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def evolution_server():
+    from tests.fake_evolution import FakeEvolution
+
+    server = FakeEvolution()
+    try:
+        yield server
+    finally:
+        server.close()
+
+
+@pytest.fixture
+def databricks_api(monkeypatch):
+    """Databricks e Evolution falsos para o poller e a entrega de PDFs."""
+    import asyncio
+
+    import httpx
+
+    from app.core.config import settings
+    from app.services import databricks_service
+    from app.services.evolution_client import EvolutionClient
+    from tests.fake_databricks import FakeDatabricks
+
+    fake = FakeDatabricks()
+    monkeypatch.setattr(settings, "EVOLUTION_MAX_RETRIES", 0)
+    monkeypatch.setattr(databricks_service, "_poller_client", httpx.AsyncClient(transport=fake.transport()))
+    monkeypatch.setattr(databricks_service, "evolution", EvolutionClient(async_transport=fake.transport()))
+    # Semáforos novos: cada teste roda no seu próprio event loop
+    monkeypatch.setattr(databricks_service, "_poller_semaphore", asyncio.Semaphore(4))
+    monkeypatch.setattr(databricks_service, "_delivery_semaphore", asyncio.Semaphore(2))
+    try:
+        yield fake
+    finally:
+        databricks_service._tracked.clear()
+        databricks_service._deliveries.clear()
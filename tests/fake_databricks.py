@@ -0,0 +1,54 @@
+"""Databricks (jobs/runs/get + DBFS) e Evolution sendMedia simulados via httpx.MockTransport."""
+
+import base64
+import json
+from typing import Dict, List, Optional
+
+import httpx
+
+
+class FakeDatabricks:
+    def __init__(self):
+        self.runs: Dict[str, dict] = {}        # databricks_run_id → corpo do runs/get
+        self.files: Dict[str, bytes] = {}      # caminho DBFS → conteúdo
+        self.send_statuses: List[int] = []     # próximas respostas do sendMedia (depois: 201)
+        self.uploads: List[bytes] = []
+        self.requests: List[str] = []
+
+    def set_state(self, run_id: str, life: str, result: Optional[str] = None,
+                  message: Optional[str] = None, end_time: Optional[int] = None) -> None:
+        state = {"life_cycle_state": life}
+        if result:
+            state["result_state"] = result
+        if message:
+            state["state_message"] = message
+        self.runs[run_id] = {"run_id": int(run_id), "state": state, "end_time": end_time,
+                             "run_page_url": f"https://dbx/run/{run_id}"}
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        params = request.url.params
+        self.requests.append(path)
+        if path == "/api/2.1/jobs/runs/get":
+            run = self.runs.get(params["run_id"])
+            return httpx.Response(200, json=run) if run else httpx.Response(404, json={"error_code": "RESOURCE_DOES_NOT_EXIST"})
+        if path == "/api/2.0/dbfs/get-status":
+            data = self.files.get(params["path"])
+            if data is None:
+                return httpx.Response(404, json={"error_code": "RESOURCE_DOES_NOT_EXIST"})
+            return httpx.Response(200, json={"path": params["path"], "is_dir": False, "file_size": len(data)})
+        if path == "/api/2.0/dbfs/read":
+            data = self.files[params["path"]]
+            offset, length = int(params["offset"]), int(params["length"])
+            chunk = data[offset:offset + length]
+            return httpx.Response(200, json={"bytes_read": len(chunk), "data": base64.b64encode(chunk).decode()})
+        if path.startswith("/message/sendMedia/"):
+            body = await request.aread()
+            status = self.send_statuses.pop(0) if self.send_statuses else 201
+            if status < 300:
+                self.uploads.append(body)
+            return httpx.Response(status, content=json.dumps({"status": status}))
+        return httpx.Response(404)
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handler)
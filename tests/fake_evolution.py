@@ -0,0 +1,77 @@
+"""Servidor HTTP local que faz o papel da Evolution API nos testes.
+
+Respostas roteirizadas por caminho (status, atraso); registra cada requisição com
+a porta do cliente, o que permite contar as conexões TCP realmente abertas.
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, NamedTuple, Tuple
+
+
+class Hit(NamedTuple):
+    method: str
+    path: str
+    client_port: int
+    apikey: str
+
+
+class FakeEvolution:
+    def __init__(self):
+        self.hits: List[Hit] = []
+        self._script: Dict[str, Deque[Tuple[int, float]]] = defaultdict(deque)
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                with fake._lock:
+                    fake.hits.append(Hit(self.command, self.path, self.client_address[1], self.headers.get("apikey", "")))
+                    script = fake._script[self.path]
+                    status, delay = script.popleft() if script else (200, 0.0)
+                if delay:
+                    time.sleep(delay)
+                body = json.dumps({"status": status}).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # cliente desistiu (timeout)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def script(self, path: str, *responses: Tuple[int, float]) -> None:
+        """Próximas respostas de `path`, em ordem; depois delas, 200 imediato."""
+        with self._lock:
+            self._script[path].extend(responses)
+
+    def hits_for(self, path: str) -> List[Hit]:
+        return [hit for hit in self.hits if hit.path == path]
+
+    @property
+    def connections(self) -> int:
+        return len({hit.client_port for hit in self.hits})
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import settings
+from app.models.conversation import Conversation
+from app.models.instance import Instance
+from app.models.llm_call import LlmCall
+from app.models.message import Message, MessageDirection
+from app.services import analysis_service, sweeper_service
+
+
+@pytest.fixture
+def captured(monkeypatch):
+    ids = []
+    monkeypatch.setattr(analysis_service, "enqueue_analysis", lambda conversation_ids: ids.extend(conversation_ids) or len(ids))
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "anthropic")
+    monkeypatch.setattr(settings, "ANTHROPIC_API_KEY", "k")
+    return ids
+
+
+def _setup(db, used_at: datetime):
+    instance = Instance(name="i", instance_name="i", api_url="http://evo", api_key="k", llm_daily_token_budget=100)
+    db.add(instance)
+    db.flush()
+    conv = Conversation(contact_phone="5511", instance_id=instance.id, last_message_at=datetime.utcnow() - timedelta(days=1))
+    db.add(conv)
+    db.flush()
+    db.add(Message(evolution_id="m1", conversation_id=conv.id, direction=MessageDirection.inbound,
+                   content="oi", timestamp=datetime.utcnow() - timedelta(days=1)))
+    db.add(LlmCall(service="analysis", provider="anthropic", model="m", instance_id=instance.id,
+                   input_tokens=100, output_tokens=0, outcome="ok", created_at=used_at))
+    ids = instance.id, conv.id
+    db.commit()  # sem recarregar depois: a sessão do teste não pode segurar a única conexão do pool
+    return ids
+
+
+def test_budget_exceeded_marks_analysis_deferred(db, captured):
+    _, conv_id = _setup(db, datetime.utcnow())
+    analysis_service.analyze_conversation(conv_id)
+    db.expire_all()
+    conv = db.get(Conversation, conv_id)
+    assert conv.analysis_deferred_at is not None
+    assert conv.analysis_analyzed_at is None
+
+
+def test_scheduler_waits_for_budget_reset(db, captured):
+    _, conv_id = _setup(db, datetime.utcnow())
+    analysis_service.mark_deferred(db, [conv_id])
+
+    assert analysis_service.enqueue_deferred() == {"queued": 0, "waiting": 1}
+    assert captured == []
+
+    # Reset diário: o consumo fica no dia anterior
+    db.query(LlmCall).update({"created_at": datetime.utcnow() - timedelta(days=1)})
+    db.commit()
+    assert analysis_service.enqueue_deferred()["queued"] == 1
+    assert captured == [conv_id]
+    db.expire_all()
+    assert db.get(Conversation, conv_id).analysis_deferred_at is None
+
+
+def test_sweeper_defers_instead_of_enqueueing(db, captured):
+    _, conv_id = _setup(db, datetime.utcnow())
+    result = sweeper_service.sweep_abandoned()
+    assert result["count"] == 1
+    assert result["analysis_deferred"] == 1
+    assert captured == []
+    db.expire_all()
+    assert db.get(Conversation, conv_id).analysis_deferred_at is not None
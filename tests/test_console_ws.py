@@ -0,0 +1,32 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import console
+from app.services import metrics_service
+
+
+def test_send_does_not_block_other_commands(monkeypatch):
+    async def send_message_to_conversation(db, conversation_id, text):
+        await asyncio.sleep(0.5)  # mensagem presa no limite de envio do outbound
+        return {"id": None, "queued": True, "content": text}
+
+    monkeypatch.setattr(metrics_service, "send_message_to_conversation", send_message_to_conversation)
+    app = FastAPI()
+    app.include_router(console.router)
+    with TestClient(app).websocket_connect("/api/ws/console") as ws:
+        ws.send_json({"op": "send", "conversation_id": 1, "text": "oi", "ref": "a"})
+        ws.send_json({"op": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+        ack = ws.receive_json()
+        assert (ack["type"], ack["ref"], ack["message"]["content"]) == ("ack", "a", "oi")
+
+
+def test_invalid_send_is_answered_with_ref(monkeypatch):
+    app = FastAPI()
+    app.include_router(console.router)
+    with TestClient(app).websocket_connect("/api/ws/console") as ws:
+        ws.send_json({"op": "send", "conversation_id": "x", "text": "oi", "ref": "b"})
+        error = ws.receive_json()
+        assert (error["type"], error["ref"]) == ("error", "b")
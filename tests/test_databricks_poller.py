@@ -0,0 +1,144 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import settings
+from app.models.databricks import DatabricksConfig, DatabricksJobRun
+from app.models.instance import Instance
+from app.services import databricks_service
+
+OUTPUT = "/FileStore/relatorios/448427.pdf"
+PDF = b"%PDF-1.4 " + bytes(range(256)) * 40
+
+
+def _setup(db, *, source="whatsapp", status="running", delivery_status=None, attempts=0, started_ago=60):
+    instance = Instance(name="i", instance_name="i", api_url="http://evo.test", api_key="k")
+    db.add(instance)
+    db.flush()
+    config = DatabricksConfig(instance_id=instance.id, workspace_url="https://dbx.test/", api_token="t",
+                              job_id="1", trigger_keyword="relatorio")
+    db.add(config)
+    db.flush()
+    run = DatabricksJobRun(
+        config_id=config.id, instance_id=instance.id, databricks_run_id="77", triggered_by_phone="5511",
+        trigger_source=source, status=status, started_at=datetime.utcnow() - timedelta(seconds=started_ago),
+        extracted_codigo_cliente="448427", notebook_params_json=f'{{"output_path": "/dbfs{OUTPUT}"}}',
+        delivery_status=delivery_status, delivery_attempts=attempts,
+    )
+    db.add(run)
+    db.flush()
+    run_id = run.id
+    db.commit()
+    return run_id
+
+
+def _row(db, run_id) -> DatabricksJobRun:
+    db.expire_all()
+    row = db.get(DatabricksJobRun, run_id)
+    db.expunge(row)  # lido sem recarregar: a sessão do teste não segura a única conexão do pool (SQLite)
+    db.commit()
+    return row
+
+
+async def _poll_and_deliver() -> int:
+    runs = await asyncio.to_thread(databricks_service._load_active_runs)
+    updated = await databricks_service._poll_runs(databricks_service._poller_client, runs)
+    await asyncio.gather(*databricks_service._deliveries.values())
+    return updated
+
+
+@pytest.mark.parametrize("life, result, expected", [
+    ("TERMINATED", "FAILED", "failed"),
+    ("TERMINATED", "CANCELED", "failed"),
+    ("INTERNAL_ERROR", None, "failed"),
+    ("SKIPPED", None, "failed"),
+    ("TERMINATED", "SUCCESS", "success"),
+])
+def test_terminal_states_finish_the_run(db, databricks_api, life, result, expected):
+    run_id = _setup(db, source="manual")
+    databricks_api.set_state("77", life, result, message="boom", end_time=1_700_000_000_000)
+    assert asyncio.run(_poll_and_deliver()) == 1
+    row = _row(db, run_id)
+    assert row.status == expected
+    assert row.completed_at == datetime.utcfromtimestamp(1_700_000_000)
+    assert row.error_message == ("boom" if expected == "failed" else None)
+    assert row.delivery_status is None  # disparo manual: nada a entregar
+    assert run_id not in databricks_service._tracked
+
+
+@pytest.mark.parametrize("life, expected", [("PENDING", "pending"), ("RUNNING", "running")])
+def test_active_states_keep_polling(db, databricks_api, life, expected):
+    run_id = _setup(db, status="pending" if expected == "running" else "running")
+    databricks_api.set_state("77", life)
+    runs = databricks_service._load_active_runs()
+    databricks_service._sync_tracked(runs)
+    asyncio.run(databricks_service._poll_runs(databricks_service._poller_client, runs))
+    row = _row(db, run_id)
+    assert row.status == expected
+    assert row.completed_at is None
+    assert databricks_service._tracked[run_id]["next_check"] > time.monotonic()
+
+
+def test_success_streams_pdf_to_requester(db, databricks_api, monkeypatch):
+    monkeypatch.setattr(databricks_service, "DBFS_READ_CHUNK", 4096)  # o PDF sai em 3 leituras
+    run_id = _setup(db)
+    databricks_api.set_state("77", "TERMINATED", "SUCCESS")
+    databricks_api.files[OUTPUT] = PDF
+    asyncio.run(_poll_and_deliver())
+    row = _row(db, run_id)
+    assert (row.status, row.delivery_status, row.delivery_attempts) == ("success", "delivered", 1)
+    assert (row.output_file, row.output_size) == (OUTPUT, len(PDF))
+    assert databricks_api.requests.count("/api/2.0/dbfs/read") == 3
+    [upload] = databricks_api.uploads
+    assert PDF in upload and b'name="number"\r\n\r\n5511' in upload
+
+
+def test_transient_delivery_failures_stop_at_max_attempts(db, databricks_api, monkeypatch):
+    monkeypatch.setattr(settings, "DATABRICKS_DELIVERY_MAX_ATTEMPTS", 2)
+    run_id = _setup(db, status="success", delivery_status="pending")
+    databricks_api.files[OUTPUT] = PDF
+    databricks_api.send_statuses = [503, 503, 503]
+
+    asyncio.run(databricks_service._deliver_output(run_id))
+    row = _row(db, run_id)
+    assert (row.delivery_status, row.delivery_attempts) == ("pending", 1)
+
+    asyncio.run(databricks_service._deliver_output(run_id))
+    row = _row(db, run_id)
+    assert (row.delivery_status, row.delivery_attempts) == ("failed", 2)
+    assert "503" in row.delivery_error
+
+    # failed não volta para a fila
+    assert databricks_service._load_pending_deliveries(reset_sending=True) == []
+    asyncio.run(databricks_service._deliver_output(run_id))
+    assert _row(db, run_id).delivery_attempts == 2
+    assert databricks_api.uploads == []
+
+
+def test_permanent_delivery_error_fails_at_once(db, databricks_api):
+    run_id = _setup(db, status="success", delivery_status="pending")  # PDF ausente no DBFS
+    asyncio.run(databricks_service._deliver_output(run_id))
+    row = _row(db, run_id)
+    assert (row.delivery_status, row.delivery_attempts) == ("failed", 1)
+    assert "não encontrado" in row.delivery_error
+
+
+def test_restart_resumes_interrupted_delivery(db, databricks_api):
+    # Processo morreu no meio do upload: a linha ficou em sending
+    run_id = _setup(db, status="success", delivery_status="sending", attempts=1)
+    databricks_api.files[OUTPUT] = PDF
+    assert databricks_service._load_pending_deliveries(reset_sending=False) == []
+    assert databricks_service._load_pending_deliveries(reset_sending=True) == [run_id]
+
+    asyncio.run(databricks_service._deliver_output(run_id))
+    row = _row(db, run_id)
+    assert (row.delivery_status, row.delivery_attempts) == ("delivered", 2)
+    assert len(databricks_api.uploads) == 1
+
+
+def test_restart_polls_runs_found_at_startup_right_away(db, databricks_api):
+    old_id = _setup(db, started_ago=3600)
+    databricks_service._sync_tracked(databricks_service._load_active_runs())
+    assert databricks_service._tracked[old_id]["next_check"] <= time.monotonic()
@@ -0,0 +1,63 @@
+from app.core import event_bus
+
+
+def test_encode_decode_round_trip():
+    payload = '{"type":"new_message","texto":"olá"}'
+    raw = f"42|{event_bus.encode(7, 'new_message', payload)}"
+    assert event_bus.decode(raw) == (42, 7, "new_message", payload)
+
+
+def test_encode_global_topic():
+    raw = f"1|{event_bus.encode(None, 'resync', '{}')}"
+    seq, instance_id, event_type, payload = event_bus.decode(raw)
+    assert (seq, instance_id, event_type, payload) == (1, None, "resync", "{}")
+    assert event_bus.topic_key(instance_id) == "global"
+
+
+def test_oversized_payload_travels_by_reference(db, monkeypatch):
+
+    from app.core.config import settings
+    from app.core.database import engine
+
+    body = event_bus.encode(7, "ingest_committed", '{"ids":[' + ",".join(["1"] * 5000) + "]}")
+    assert len(body) > event_bus._PG_MAX_PAYLOAD
+    with engine.begin() as conn:
+        ref = event_bus.store_payload(conn, body)
+    assert ref.startswith("@")
+    with engine.connect() as conn:
+        assert event_bus.load_payload(conn, f"9|{ref}") == f"9|{body}"
+        assert event_bus.load_payload(conn, "3|{}") == "3|{}"  # sem referência: inalterado
+
+    # Expirada a retenção, a referência não resolve (o receptor trata como lacuna)
+    monkeypatch.setattr(settings, "EVENT_BUS_PAYLOAD_RETENTION_SECONDS", -1)
+    with engine.begin() as conn:
+        assert event_bus.prune_payloads(conn) == 1
+    with engine.connect() as conn:
+        assert event_bus.load_payload(conn, f"9|{ref}") is None
+
+
+def test_only_refresh_signals_are_coalesced(monkeypatch):
+    import asyncio
+
+    from app.core import events
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "EVENTS_COALESCE_MS", 50)
+
+    async def burst():
+        sub = events.subscribe(instance_ids=[7])
+        try:
+            for _ in range(3):
+                events.publish({"type": "new_message", "instance_id": 7, "messages": []})
+                events.publish({"type": "groups_updated", "instance_id": 7})
+            await asyncio.sleep(0.1)
+            items = []
+            while not sub.queue.empty():
+                items.append(sub.queue.get_nowait()[1])
+            return items
+        finally:
+            events.unsubscribe(sub)
+
+    items = asyncio.run(burst())
+    assert items.count("new_message") == 3  # deltas: todos entregues, mesmo com payload igual
+    assert items.count("groups_updated") == 2  # imediato + final da janela
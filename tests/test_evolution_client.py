@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services.evolution_client import CircuitOpenError, EvolutionClient
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "EVOLUTION_MAX_RETRIES", 2)
+    monkeypatch.setattr(settings, "EVOLUTION_RETRY_BACKOFF_SECONDS", 0.0)
+    monkeypatch.setattr(settings, "EVOLUTION_TIMEOUT_SECONDS", 5)
+    monkeypatch.setattr(settings, "EVOLUTION_BREAKER_THRESHOLD", 5)
+    evolution = EvolutionClient()
+    try:
+        yield evolution
+    finally:
+        asyncio.run(evolution.aclose())
+
+
+def test_get_retries_5xx_until_success(client, evolution_server):
+    evolution_server.script("/instance/connectionState/i", (503, 0), (502, 0))
+    response = client.request_sync("GET", evolution_server.url, "k", "/instance/connectionState/i", instance="i")
+    assert response.status_code == 200
+    assert len(evolution_server.hits_for("/instance/connectionState/i")) == 3
+    assert client.breaker("i").failures == 0
+
+
+def test_retry_gives_up_after_max_retries(client, evolution_server):
+    evolution_server.script("/chat/findChats/i", *[(500, 0)] * 5)
+    response = client.request_sync("GET", evolution_server.url, "k", "/chat/findChats/i", instance="i")
+    assert response.status_code == 500
+    assert len(evolution_server.hits_for("/chat/findChats/i")) == settings.EVOLUTION_MAX_RETRIES + 1
+
+
+def test_send_is_not_repeated_on_5xx(client, evolution_server):
+    # O envio pode ter saído: repetir duplicaria a mensagem
+    evolution_server.script("/message/sendText/i", (503, 0))
+    response = client.request_sync("POST", evolution_server.url, "k", "/message/sendText/i", instance="i",
+                                   json={"number": "5511", "text": "oi"})
+    assert response.status_code == 503
+    assert len(evolution_server.hits_for("/message/sendText/i")) == 1
+
+
+def test_send_is_retried_when_connection_never_opened(client, monkeypatch):
+    monkeypatch.setattr(settings, "EVOLUTION_CONNECT_TIMEOUT_SECONDS", 0.5)
+    with pytest.raises(httpx.ConnectError):
+        client.request_sync("POST", "http://127.0.0.1:9", "k", "/message/sendText/i", instance="i", json={})
+    assert client.breaker("i").failures == settings.EVOLUTION_MAX_RETRIES + 1
+
+
+def test_read_timeout_per_call(client, evolution_server):
+    evolution_server.script("/chat/findMessages/i", *[(200, 1.0)] * 3)
+    with pytest.raises(httpx.ReadTimeout):
+        client.request_sync("GET", evolution_server.url, "k", "/chat/findMessages/i", instance="i", timeout=0.2)
+    assert len(evolution_server.hits_for("/chat/findMessages/i")) == settings.EVOLUTION_MAX_RETRIES + 1
+
+
+def test_async_timeout_is_not_retried_for_send(client, evolution_server):
+    evolution_server.script("/message/sendText/i", (200, 1.0))
+
+    async def send():
+        await client.request("POST", evolution_server.url, "k", "/message/sendText/i", instance="i",
+                             json={}, timeout=0.2)
+
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(send())
+    assert len(evolution_server.hits_for("/message/sendText/i")) == 1
+
+
+def test_sync_requests_reuse_one_connection(client, evolution_server):
+    for _ in range(5):
+        assert client.request_sync("GET", evolution_server.url, "k", "/instance/fetchInstances",
+                                   instance="i").status_code == 200
+    assert len(evolution_server.hits) == 5
+    assert evolution_server.connections == 1
+    assert {hit.apikey for hit in evolution_server.hits} == {"k"}
+
+
+def test_async_requests_reuse_connections(client, evolution_server):
+    async def calls():
+        for _ in range(5):
+            response = await client.request("GET", evolution_server.url + "/", "k", "/instance/fetchInstances",
+                                            instance="i")
+            assert response.status_code == 200
+
+    asyncio.run(calls())
+    assert len(evolution_server.hits) == 5
+    assert evolution_server.connections == 1
+    assert client.get_metrics()["pools"] == [evolution_server.url]
+
+
+def test_breaker_opens_after_consecutive_failures(client, evolution_server, monkeypatch):
+    monkeypatch.setattr(settings, "EVOLUTION_MAX_RETRIES", 0)
+    evolution_server.script("/instance/connectionState/i", *[(500, 0)] * settings.EVOLUTION_BREAKER_THRESHOLD)
+    for _ in range(settings.EVOLUTION_BREAKER_THRESHOLD):
+        client.request_sync("GET", evolution_server.url, "k", "/instance/connectionState/i", instance="i")
+    with pytest.raises(CircuitOpenError):
+        client.request_sync("GET", evolution_server.url, "k", "/instance/connectionState/i", instance="i")
+    assert len(evolution_server.hits) == settings.EVOLUTION_BREAKER_THRESHOLD
+    # Outra instância na mesma api_url segue liberada
+    assert client.request_sync("GET", evolution_server.url, "k", "/instance/connectionState/j",
+                               instance="j").status_code == 200
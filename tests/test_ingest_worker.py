@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app.models.ingest import IngestJob
+from app.services import ingest_pipeline, ingest_queue
+from app.workers import ingest as worker
+
+
+def _enqueue(db, *events):
+    for event in events:
+        ingest_queue.enqueue(db, "inst", event, {"event": event, "instance": "inst"})
+    db.commit()
+    return ingest_queue.partition_for("inst")
+
+
+def test_failure_holds_later_jobs_of_the_instance(db, monkeypatch):
+    partition = _enqueue(db, "messages.upsert", "messages.update", "call")
+    handled = []
+
+    async def handle_event(session, instance_name, event, body, background_tasks=None):
+        if event == "messages.upsert":
+            raise RuntimeError("banco indisponível")
+        handled.append(event)
+
+    monkeypatch.setattr(ingest_pipeline, "handle_event", handle_event)
+    jobs = ingest_queue.claim([partition], 10)
+    assert [j.event for j in jobs] == ["messages.upsert", "messages.update", "call"]
+
+    done = asyncio.run(worker._process_instance(jobs))
+
+    assert done == [] and handled == []
+    assert ingest_queue.claim([partition], 10) == []  # os seguintes esperam a nova tentativa
+    statuses = {job.event: (job.status, job.attempts) for job in db.query(IngestJob)}
+    assert statuses == {
+        "messages.upsert": ("queued", 1),
+        "messages.update": ("queued", 0),
+        "call": ("queued", 0),
+    }
+
+    # Vencido o backoff, a fila volta na ordem original
+    db.query(IngestJob).update({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    assert [j.event for j in ingest_queue.claim([partition], 10)] == ["messages.upsert", "messages.update", "call"]
+
+
+def test_other_instances_keep_flowing(db):
+    partition = _enqueue(db, "messages.upsert")
+    ingest_queue.enqueue(db, "outra", "messages.upsert", {})
+    db.commit()
+    job = db.query(IngestJob).filter(IngestJob.instance_name == "inst").one()
+    job.next_attempt_at = datetime.utcnow() + timedelta(minutes=5)
+    db.commit()
+
+    claimed = ingest_queue.claim([partition, ingest_queue.partition_for("outra")], 10)
+    assert [j.instance_name for j in claimed] == ["outra"]
+
+
+def test_restart_backoff_grows_per_worker_and_resets(monkeypatch):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "INGEST_WORKER_RESTART_BACKOFF_SECONDS", 1)
+    monkeypatch.setattr(settings, "INGEST_WORKER_RESTART_MAX_SECONDS", 8)
+    backoff = worker._RestartBackoff()
+    backoff.started(0, 0)
+    backoff.started(1, 0)
+
+    delays = []
+    now = 0.0
+    for _ in range(5):  # worker 0 cai logo ao subir
+        delays.append(backoff.schedule(0, now))
+        assert not backoff.due(0, now + delays[-1] - 0.1)
+        now += delays[-1]
+        assert backoff.due(0, now)
+        backoff.started(0, now)
+    assert delays == [1, 2, 4, 8, 8]
+    assert not backoff.pending(0)
+
+    assert backoff.schedule(1, now) == 1  # contagem separada por worker
+
+    # De pé pelo tempo do teto: volta ao atraso base
+    backoff.started(0, now)
+    assert backoff.schedule(0, now + 8) == 1
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from datetime import datetime
+
+from app.core import events
+from app.models.message import MessageType
+from app.services import databricks_service, ingest_pipeline, sla_service
+from app.services.webhook_decoder import UpsertMessage
+from app.services.webhook_service import NewConversation
+
+
+class _Batch:
+    instance_id = 3
+    instance_name = "inst"
+    auto_messages = [10]
+
+    def __init__(self, result):
+        self.result = result
+
+
+def test_worker_mode_replaces_web_process_hooks(monkeypatch):
+    monkeypatch.setitem(ingest_pipeline._hooks, "after_commit", list(ingest_pipeline._hooks["after_commit"]))
+    ingest_pipeline.enable_worker_mode()
+    hooks = ingest_pipeline._hooks["after_commit"]
+    assert ingest_pipeline.update_sla not in hooks
+    assert ingest_pipeline.wake_outbound not in hooks
+    assert hooks[0] is ingest_pipeline.publish_committed
+    assert ingest_pipeline.broadcast_messages in hooks
+
+
+def test_internal_event_reaches_listeners_not_subscribers(monkeypatch):
+    received = []
+    monkeypatch.setattr(events, "_listeners", {})
+    events.listen("ingest_committed", received.append)
+    sub = events.subscribe()
+    try:
+        opened = datetime(2026, 1, 5, 9, 30)
+        result = ingest_pipeline.UpsertResult(
+            [NewConversation(7, 3, opened, "5511", "Ana", "Bia")], [4], [], [], {}, {}
+        )
+        asyncio.run(ingest_pipeline.publish_committed(_Batch(result)))
+    finally:
+        events.unsubscribe(sub)
+
+    assert sub.queue.empty()
+    assert len(received) == 1
+    event = received[0]
+    assert event["answered_ids"] == [4] and event["outbound"] is True
+    assert event["new_conversations"][0]["opened_at"] == opened.isoformat()
+
+
+def test_sla_tracks_conversations_from_workers(monkeypatch):
+    monkeypatch.setattr(sla_service, "_waiting", {})
+    monkeypatch.setattr(sla_service, "_heap", [])
+    monkeypatch.setattr(sla_service, "_breached", set())
+    sla_service._on_ingest_committed({
+        "new_conversations": [{
+            "id": 7, "instance_id": 3, "opened_at": "2026-01-05T09:30:00", "contact_phone": "5511",
+            "contact_name": "Ana", "attendant_name": None,
+        }],
+        "answered_ids": [],
+    })
+    assert sla_service._waiting[7]["opened_at"] == datetime(2026, 1, 5, 9, 30)
+
+    sla_service._on_ingest_committed({"new_conversations": [], "answered_ids": [7]})
+    assert 7 not in sla_service._waiting
+
+
+def _upsert(text, from_me=False, msg_type=MessageType.text):
+    return UpsertMessage("E1", "5511@s.whatsapp.net", from_me, False, "5511", None, "Ana",
+                         datetime(2026, 1, 5, 9, 30), msg_type, text, None, ())
+
+
+def test_databricks_triggers_run_off_the_event_loop(monkeypatch):
+    calls = []
+
+    def check_and_trigger(db, instance_id, phone, text):
+        calls.append((threading.current_thread(), db, instance_id, phone, text))
+
+    monkeypatch.setattr(databricks_service, "check_and_trigger", check_and_trigger)
+    result = ingest_pipeline.UpsertResult(
+        [], [], [_upsert("gerar relatorio 123"), _upsert("resposta", from_me=True), _upsert(None, msg_type=MessageType.image)],
+        [], {}, {},
+    )
+    batch = _Batch(result)
+    batch.db = object()  # sessão da requisição: não pode ser usada fora do event loop
+    asyncio.run(ingest_pipeline.check_databricks_triggers(batch))
+
+    [(thread, db, instance_id, phone, text)] = calls
+    assert thread is not threading.main_thread()
+    assert db is not batch.db
+    assert (instance_id, phone, text) == (3, "5511", "gerar relatorio 123")
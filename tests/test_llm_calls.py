@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from datetime import datetime
+
+import pytest
+
+from app.core.config import settings
+from app.models.conversation import Conversation
+from app.models.instance import Instance
+from app.models.llm_call import LlmCall
+from app.models.message import Message, MessageDirection
+from app.models.team import Team
+from app.services import llm_service, routing_service
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class APIConnectionError(Exception):
+    """Mesmo nome da exceção de conexão dos SDKs."""
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "anthropic")
+    monkeypatch.setattr(settings, "ANTHROPIC_API_KEY", "k")
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_service.time, "sleep", lambda s: None)
+    calls = []
+
+    def use(*outcomes):
+        def fake(prompt, system, max_tokens):
+            outcome = outcomes[len(calls)]
+            calls.append(prompt)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return llm_service.LlmResult(outcome, 10, 2)
+        monkeypatch.setattr(llm_service, "_call_anthropic", fake)
+        return calls
+    return use
+
+
+def _calls(db):
+    rows = [(c.service, c.outcome, c.retries) for c in db.query(LlmCall).order_by(LlmCall.id)]
+    db.commit()
+    return rows
+
+
+@pytest.mark.parametrize("error", [ProviderError(429), ProviderError(503), APIConnectionError("reset"), TimeoutError()])
+def test_transient_errors_are_retried(db, provider, error):
+    calls = provider(error, "ok")
+    assert llm_service.complete("routing", "p").text == "ok"
+    assert len(calls) == 2
+    assert _calls(db) == [("routing", "ok", 1)]
+
+
+@pytest.mark.parametrize("error", [ProviderError(400), ProviderError(401), ProviderError(404), ValueError("bug")])
+def test_request_errors_fail_at_once(db, provider, error):
+    calls = provider(error, "ok")
+    with pytest.raises(type(error)):
+        llm_service.complete("routing", "p")
+    assert len(calls) == 1
+    assert _calls(db) == [("routing", "error", 0)]
+
+
+def test_stream_records_call_off_the_event_loop(monkeypatch):
+    threads = []
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "anthropic")
+    monkeypatch.setattr(llm_service, "record_call", lambda *a, **k: threads.append(threading.current_thread()))
+
+    async def fake_stream(prompt, system, max_tokens, usage):
+        yield "olá"
+
+    monkeypatch.setattr(llm_service, "_stream_anthropic", fake_stream)
+
+    async def consume():
+        return [chunk async for chunk in llm_service.stream("suggestions", "p")]
+
+    assert asyncio.run(consume()) == ["olá"]
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+
+
+def test_routing_releases_connection_during_llm_call(db, provider):
+    instance = Instance(name="i", instance_name="i", api_url="http://evo", api_key="k")
+    db.add(instance)
+    db.flush()
+    db.add_all([Team(name="Financeiro", instance_id=instance.id), Team(name="Suporte", instance_id=instance.id)])
+    conv = Conversation(contact_phone="5511", instance_id=instance.id)
+    db.add(conv)
+    db.flush()
+    db.add(Message(evolution_id="m1", conversation_id=conv.id, direction=MessageDirection.inbound,
+                   content="minha internet caiu", timestamp=datetime.utcnow()))
+    conv_id = conv.id
+    db.commit()
+
+    provider("Suporte")
+    routing_service.route_conversation(conv_id)  # pool de 1 conexão no SQLite: travaria até o timeout
+
+    assert _calls(db) == [("routing", "ok", 0)]
+    team = db.query(Team.name).join(Conversation, Conversation.team_id == Team.id).filter(Conversation.id == conv_id).scalar()
+    assert team == "Suporte"
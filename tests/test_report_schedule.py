@@ -0,0 +1,42 @@
+from datetime import date, datetime
+
+from app.core import scheduler
+from app.services import report_service
+
+
+def test_previous_week_start():
+    assert report_service.previous_week_start(date(2026, 10, 19)) == date(2026, 10, 12)  # segunda
+    assert report_service.previous_week_start(date(2026, 10, 25)) == date(2026, 10, 12)  # domingo
+
+
+def _stub_pipeline(monkeypatch):
+    calls = {}
+    monkeypatch.setattr(report_service, "_llm_config_error", lambda: None)
+    monkeypatch.setattr(report_service, "_active_instance_ids", lambda: [1])
+    monkeypatch.setattr(
+        report_service, "_rebuild_weeks", lambda ids, since, job_id=None: calls.setdefault("since", since)
+    )
+
+    def summary_row_ids(instance_ids, weeks_by_instance, job_id):
+        calls["weeks"] = weeks_by_instance
+        return [], []
+
+    monkeypatch.setattr(report_service, "_summary_row_ids", summary_row_ids)
+    monkeypatch.setattr(report_service, "_summarize_rows", lambda row_ids, job_id: (0, 0))
+    return calls
+
+
+def test_generate_reports_summarizes_requested_week(monkeypatch):
+    calls = _stub_pipeline(monkeypatch)
+    week = date(2026, 9, 7)
+    result = report_service.generate_reports([1], 7, period_week=date(2026, 9, 9))  # quarta → segunda
+    assert result["period_week"] == str(week)
+    assert calls["weeks"] == {1: [week]}
+    assert calls["since"] <= datetime(2026, 9, 7)  # a semana pedida é reagregada antes do resumo
+
+
+def test_weekly_job_summarizes_the_week_that_closed(monkeypatch):
+    calls = _stub_pipeline(monkeypatch)
+    monkeypatch.setattr(report_service, "_get_week_start", lambda ref=None: ref or date(2026, 10, 19))
+    scheduler._weekly_reports_job()
+    assert calls["weeks"] == {1: [date(2026, 10, 12)]}
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from app.core.config import settings
+from app.models.conversation import Conversation
+from app.models.instance import Instance
+from app.models.report import AtendimentoRaw, ReportWatermark
+from app.services import report_service
+
+
+def _setup(db, updated_ago: timedelta):
+    now = datetime.utcnow()
+    instance = Instance(name="i", instance_name="i", api_url="http://evo", api_key="k")
+    db.add(instance)
+    db.flush()
+    conv = Conversation(contact_phone="5511", instance_id=instance.id, opened_at=now - timedelta(days=1))
+    db.add(conv)
+    db.flush()
+    conv.updated_at = now - updated_ago  # marcado antes da última execução, commit só depois dela
+    db.add(ReportWatermark(
+        stage=report_service.STAGE_ATENDIMENTO, instance_id=instance.id,
+        watermark=now, covered_since=now - timedelta(days=30),
+    ))
+    db.commit()
+    return instance.id
+
+
+def test_incremental_run_rereads_overlap(db, monkeypatch):
+    monkeypatch.setattr(settings, "REPORT_WATERMARK_OVERLAP_SECONDS", 300)
+    instance_id = _setup(db, timedelta(seconds=30))
+    assert report_service.populate_atendimento_raw(db, instance_id, days=7) == 1
+    assert db.query(AtendimentoRaw).count() == 1
+
+
+def test_incremental_run_skips_rows_older_than_overlap(db, monkeypatch):
+    monkeypatch.setattr(settings, "REPORT_WATERMARK_OVERLAP_SECONDS", 300)
+    instance_id = _setup(db, timedelta(minutes=10))
+    assert report_service.populate_atendimento_raw(db, instance_id, days=7) == 0
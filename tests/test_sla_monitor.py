@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app.core.database import engine
+from app.core.scheduler import Scheduler
+from app.models.conversation import Conversation
+from app.models.instance import Instance
+from app.services import sla_service
+
+
+@contextmanager
+def _during_query(hook):
+    """Executa hook uma vez, logo depois da primeira consulta (antes de o rebuild trocar o estado)."""
+    fired = []
+
+    def after(*args):
+        if not fired:
+            fired.append(True)
+            hook()
+
+    event.listen(engine, "after_cursor_execute", after)
+    try:
+        yield
+    finally:
+        event.remove(engine, "after_cursor_execute", after)
+    assert fired
+
+
+@pytest.fixture
+def sla_state(monkeypatch):
+    monkeypatch.setattr(sla_service, "_waiting", {})
+    monkeypatch.setattr(sla_service, "_heap", [])
+    monkeypatch.setattr(sla_service, "_breached", set())
+    monkeypatch.setattr(sla_service, "_ready", True)
+
+
+def test_only_one_replica_holds_the_lease(db):
+    a, b = Scheduler(), Scheduler()
+    assert a.hold_lease("sla_monitor", 30)
+    assert not b.hold_lease("sla_monitor", 30)
+    assert a.hold_lease("sla_monitor", 30)  # renovação
+    a.release_lease("sla_monitor")
+    assert b.hold_lease("sla_monitor", 30)
+    assert not a.hold_lease("sla_monitor", 30)
+
+
+def test_discard_during_rebuild_survives_the_swap(db, sla_state):
+    instance = Instance(name="i", instance_name="i", api_url="http://evo", api_key="k")
+    db.add(instance)
+    db.flush()
+    conv = Conversation(contact_phone="5511", instance_id=instance.id, opened_at=datetime.utcnow() - timedelta(minutes=5))
+    db.add(conv)
+    db.flush()
+    conv_id = conv.id
+    db.commit()
+
+    # Resposta chega enquanto a consulta do rebuild roda (já leu a conversa como aberta)
+    with _during_query(lambda: sla_service.discard([conv_id])):
+        assert sla_service.rebuild() == 1
+    assert conv_id not in sla_service._waiting
+
+
+def test_track_during_rebuild_survives_the_swap(db, sla_state):
+    with _during_query(lambda: sla_service.track(99, 1, datetime.utcnow(), "5599")):
+        assert sla_service.rebuild() == 0
+    assert 99 in sla_service._waiting